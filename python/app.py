@@ -529,34 +529,50 @@ if __name__ == '__main__':
 
 
 import os
-import io
-import zipfile
 import json
 import traceback # 导入 traceback 用于更详细的错误日志
-
-# 确保在导入依赖地理空间库之前设置 PROJ_LIB
-import pyproj
-os.environ['PROJ_LIB'] = pyproj.datadir.get_data_dir()
-
-# 其他 Flask 和地理空间库的导入
-from flask import Flask, request, jsonify, send_file
+import functools
+import hashlib
+import time
+import threading
+
+# Flask 与数据处理库的导入
+# 地理空间库 (pyproj、geopandas、libpysal、esda) 与 statsmodels 导入较慢，延迟到使用它们的接口中导入，
+# 地理空间库统一通过 dili.load_geopandas() 加载 (会先设置 PROJ_LIB)
+from flask import Flask, Blueprint, current_app, request, Response, send_file, g
 from flask_cors import CORS
-import fiona
-import geopandas as gpd
-from shapely.geometry import Point, mapping
+from urllib.parse import quote
 import pandas as pd # 用于热点分析和时间序列
-from libpysal.weights import DistanceBand # 用于热点分析
-from esda.getisord import G_Local # 用于热点分析
 import numpy as np # 用于热点分析
 
 # 导入您自己的模块
 from logging_config import logger
 import qingxi
 import xunlian
-
-app = Flask(__name__)
-# 统一 CORS 配置，指向前端地址
-CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}})
+import redian
+import daochu
+import renwu
+import moxing
+import cengji
+import jizhun
+import zhixing
+import xiangying
+import hebing
+import dili
+import yure
+import xianliu
+import zhibiao
+
+# 所有路由注册在蓝图上，由 create_app() 挂载到新建的 Flask 应用
+api = Blueprint('api', __name__)
+
+# create_app 的默认配置，可由 config 参数覆盖
+DEFAULT_APP_CONFIG = {
+    'CORS_ORIGINS': "http://localhost:5173", # 前端地址
+    # 未预热的进程收到第一个请求时，先同步运行就绪所需的预热阶段再处理请求；
+    # 为 False 时只在后台预热 (例如测试中使用合成数据，不加载真实的数据文件)
+    'WARM_UP_ON_FIRST_REQUEST': True,
+}
 
 # --- 全局配置和初始化 ---
 # 统一 BASE_DIR 的定义，确保它指向 app.py 所在的 src/python 目录
@@ -580,12 +596,80 @@ DEFAULT_MODEL_FILENAME = xunlian.DEFAULT_MODEL_FILENAME
 SHP_TEMP_DIR = os.path.join(os.getcwd(), 'temp_shp_downloads') # 使用当前工作目录作为基础，确保可写
 os.makedirs(SHP_TEMP_DIR, exist_ok=True)
 
+# 后台任务记录的共享目录：多个工作进程都能查询、下载和取消任一进程中的任务
+JOB_STATE_DIR = os.path.join(BASE_DIR, 'processed_data', 'job_state')
+
+# 批量训练任务: 同一时间只运行一个批量任务，任务内部按 CPU 核心数并行拟合
+batch_train_job_manager = renwu.JobManager('batch_train', max_workers=1, max_pending=2,
+                                           state_dir=os.path.join(JOB_STATE_DIR, 'batch_train'))
+
+# 单模型后台训练任务: 每个任务的拟合在独立子进程中运行 (可取消)，同时运行的任务数由工作线程数限制
+train_job_manager = renwu.JobManager(
+    'train',
+    max_workers=int(os.environ.get('TRAIN_JOB_WORKERS', 2)),
+    max_pending=int(os.environ.get('TRAIN_JOB_MAX_PENDING', 8)),
+    artifact_ttl_seconds=float(os.environ.get('TRAIN_JOB_TTL_SECONDS', 3600)),
+    state_dir=os.path.join(JOB_STATE_DIR, 'train')
+)
+
+# 按筛选条件导出的磁盘缓存目录
+EXPORT_CACHE_DIR = os.path.join(BASE_DIR, 'processed_data', 'export_cache')
+os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+
+# 后台导出任务: 工作线程数、等待队列上限，以及已完成产物的存活时间和总大小上限
+EXPORT_JOB_DIR = os.path.join(BASE_DIR, 'processed_data', 'export_jobs')
+os.makedirs(EXPORT_JOB_DIR, exist_ok=True)
+export_job_manager = renwu.JobManager(
+    'export',
+    max_workers=int(os.environ.get('EXPORT_JOB_WORKERS', 2)),
+    max_pending=int(os.environ.get('EXPORT_JOB_MAX_PENDING', 8)),
+    artifact_ttl_seconds=float(os.environ.get('EXPORT_JOB_TTL_SECONDS', 3600)),
+    max_artifact_bytes=int(os.environ.get('EXPORT_JOB_MAX_BYTES', 2 * 1024 ** 3)),
+    state_dir=os.path.join(JOB_STATE_DIR, 'export')
+)
+
+# 相同请求合并 (single-flight)：跨工作进程共享结果时使用的锁文件与结果文件目录
+SINGLE_FLIGHT_DIR = os.path.join(BASE_DIR, 'processed_data', 'single_flight')
+request_flight = hebing.SingleFlight('request', lock_dir=SINGLE_FLIGHT_DIR)
+
+# 重接口的准入控制：按接口类别限制同时执行的请求数，超出的请求在有界队列中等待，
+# 队列已满返回 429，预计或实际排队超时返回 503 (均附 Retry-After)。上限按单个工作进程计算，
+# 可通过环境变量 ADMISSION_<类别>_CONCURRENCY / _QUEUE / _MAX_WAIT_SECONDS 调整
+ADMISSION_DEFAULTS = {
+    'hotspot': (2, 8, 30),  # 热点分析与距离带扫描 (空间连接、权重、置换检验)
+    'training': (1, 4, 60), # 同步训练、增量更新、回测与分层预测 (模型拟合)
+    'export': (2, 4, 30),   # SHP 生成与按筛选条件导出 (复制主数据、构建 GeoDataFrame)
+}
+admission_controllers = {
+    endpoint_class: xianliu.AdmissionController(
+        endpoint_class,
+        max_concurrent=int(os.environ.get(f'ADMISSION_{endpoint_class.upper()}_CONCURRENCY', concurrency)),
+        max_queue=int(os.environ.get(f'ADMISSION_{endpoint_class.upper()}_QUEUE', queue)),
+        max_wait_seconds=float(os.environ.get(f'ADMISSION_{endpoint_class.upper()}_MAX_WAIT_SECONDS', max_wait)),
+    )
+    for endpoint_class, (concurrency, queue, max_wait) in ADMISSION_DEFAULTS.items()
+}
+
+# 按路由的请求指标 (与各阶段耗时、缓存命中一起由 GET /metrics 以 Prometheus 文本格式输出)。
+# 路由取 URL 规则 (如 /api/jobs/<job_id>) 而不是实际路径，标签取值有限；未匹配任何路由的请求记为 'unmatched'
+HTTP_REQUESTS = zhibiao.REGISTRY.register(zhibiao.Counter(
+    'http_requests_total', '按路由、方法和状态码统计的请求数。', ('route', 'method', 'status')))
+HTTP_REQUEST_DURATION = zhibiao.REGISTRY.register(zhibiao.Histogram(
+    'http_request_duration_seconds', '按路由和方法统计的请求处理时间 (秒)。', ('route', 'method')))
+HTTP_REQUESTS_IN_FLIGHT = zhibiao.REGISTRY.register(zhibiao.Gauge(
+    'http_requests_in_flight', '按路由统计的正在处理的请求数。', ('route',)))
+
 # 热点分析的社区边界数据
 COMMUNITY_BOUNDARIES_FILENAME = 'Neighborhood_Clusters.json'
 # 确保 COMMUNITY_BOUNDARIES_PATH 相对于 BASE_DIR 正确
 # 假设 Neighborhood_Clusters.json 也在 src/python 目录下
 COMMUNITY_BOUNDARIES_PATH = os.path.join(BASE_DIR, COMMUNITY_BOUNDARIES_FILENAME)
 community_gdf = None # 用于存储加载的社区地理数据框
+# 处理后 (投影、显示名称、几何体校验) 的社区边界的二进制缓存，按源文件内容哈希命名；
+# 处理步骤改变时递增 COMMUNITY_BOUNDARIES_CACHE_FORMAT，使旧缓存失效
+COMMUNITY_BOUNDARIES_CACHE_DIR = os.path.join(BASE_DIR, 'processed_data', 'boundary_cache')
+COMMUNITY_BOUNDARIES_CACHE_FORMAT = 1
+community_distance_pairs = None # 社区质心排序距离对的缓存 (用于距离带扫描)
 
 # 热点分析的目标投影坐标系
 TARGET_CRS = "EPSG:3857" # Web Mercator
@@ -598,79 +682,355 @@ def make_error_response(message, status_code, error_details=None, data=None):
     if data:
         response_payload["data"] = data
     logger.error(f"API 错误: {message} | 详细信息: {error_details} | 状态码: {status_code}")
-    return jsonify(response_payload), status_code
+    return xiangying.json_response(response_payload), status_code
 
 def make_success_response(message, data=None, status_code=200):
     response_payload = {"status": "success", "message": message}
     if data is not None:
         response_payload["data"] = data
     logger.info(f"API 成功: {message} | 状态码: {status_code}")
-    return jsonify(response_payload), status_code
+    # numpy 数组、pandas 时间等由 xiangying 直接序列化，较大的响应按 Accept-Encoding 压缩
+    return xiangying.json_response(response_payload), status_code
+
+# --- 条件请求：按数据版本生成 ETag ---
+def get_data_version() -> str:
+    """全局数据版本：主数据与社区边界文件版本的组合，重新导入任一文件后改变。"""
+    return xiangying.make_etag(qingxi.get_master_data_version(MASTER_CSV_PATH),
+                               qingxi.get_file_version(COMMUNITY_BOUNDARIES_PATH))
+
+def conditional_on_data_version(view):
+    """
+    视图装饰器：ETag 由数据版本和规范化请求 (查询参数、JSON 请求体) 的哈希组成。
+    If-None-Match 命中时在执行任何计算之前直接返回 304；成功 (200) 的响应附带 ETag。
+    只用于结果完全由请求参数和数据文件决定的接口。
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = xiangying.make_etag(get_data_version(), xiangying.request_fingerprint())
+        matched = xiangying.matching_etag(etag)
+        zhibiao.record_cache('etag', matched is not None)
+        if matched is not None:
+            logger.info(f"{request.path}: ETag 未变化，返回 304。")
+            return xiangying.not_modified_response(matched)
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            xiangying.set_response_etag(response, etag)
+        return response
+    return wrapper
+
+def admission_rejected_response(e: xianliu.AdmissionRejected):
+    """未被准入时的 429/503 响应，附 Retry-After。"""
+    response, status_code = make_error_response(str(e), e.status_code, data={
+        "endpoint_class": e.endpoint_class, "retry_after_seconds": e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, status_code
+
+def coalesce_identical_requests(endpoint_class: str):
+    """
+    视图装饰器：数据版本、请求内容和响应编码都相同的并发请求只执行一次视图，
+    其余请求 (包括本机其他工作进程中的请求) 等待并复用同一个响应。用于耗时的热点分析接口。
+    实际执行视图的请求在该类接口的准入名额内执行 (见 admission_controllers)，并且先取得名额再等待
+    其他工作进程的相同计算；被合并的相同请求共享一个名额，不重复排队。未被接纳时返回 429/503 与 Retry-After。
+    """
+    controller = admission_controllers[endpoint_class]
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = hebing.make_key(request.endpoint, get_data_version(), xiangying.request_fingerprint(),
+                                  xiangying.negotiate_encoding())
+
+            def render():
+                response = current_app.make_response(view(*args, **kwargs))
+                return response.get_data(), response.status_code, list(response.headers.items())
 
-# --- 应用程序启动时加载社区边界数据 (保持原样，因为它处理了路径和CRS) ---
-# 这个块必须在 app.py 初始化之后，并且在任何使用 community_gdf 的路由之前执行
-try:
-    if os.path.exists(COMMUNITY_BOUNDARIES_PATH):
-        community_gdf = gpd.read_file(COMMUNITY_BOUNDARIES_PATH)
-        print(f"原始社区边界 GeoJSON '{COMMUNITY_BOUNDARIES_PATH}' 加载成功！")
-        print(f"原始 community_gdf CRS: {community_gdf.crs}")
-
-        # 检查并统一 community_gdf 的 CRS 到目标投影 CRS
-        if community_gdf.crs is None:
-            print("警告: 社区边界 GeoJSON 未明确指定 CRS，尝试假设为 EPSG:4326 进行初始设置。")
-            community_gdf = community_gdf.set_crs("EPSG:4326", allow_override=True)
-        
-        if community_gdf.crs != TARGET_CRS:
             try:
-                community_gdf = community_gdf.to_crs(TARGET_CRS)
-                print(f"社区边界数据已成功投影到 {TARGET_CRS}。")
-            except Exception as e:
-                print(f"警告: 社区边界数据投影到 {TARGET_CRS} 失败: {e}")
-                print("将继续使用其原始CRS，这可能导致空间操作问题。")
-        
-        print(f"加载并处理后的 community_gdf CRS: {community_gdf.crs}")
-
-        # --- 创建一个用于前端显示的名称列 'name_for_display' ---
-        community_gdf['name_for_display'] = community_gdf.index.astype(str)
-        if 'NAME' in community_gdf.columns:
-            community_gdf['name_for_display'] = np.where(
-                community_gdf['NAME'].notna(), 
-                community_gdf['NAME'].astype(str), 
-                community_gdf['name_for_display']
-            )
-        if 'NBH_NAMES' in community_gdf.columns: # 检查是否有NBH_NAMES列
-            condition_for_nbh = (community_gdf['name_for_display'] == community_gdf.index.astype(str)) & community_gdf['NBH_NAMES'].notna()
-            community_gdf['name_for_display'] = np.where(
-                condition_for_nbh, 
-                community_gdf['NBH_NAMES'].astype(str), 
-                community_gdf['name_for_display']
-            )
-        community_gdf['name_for_display'] = community_gdf['name_for_display'].astype(str)
+                body, status_code, headers = request_flight.do(key, render, admit=controller.admit)
+            except xianliu.AdmissionRejected as e:
+                return admission_rejected_response(e)
+            return Response(body, status=status_code, headers=headers)
+        return wrapper
+    return decorator
+
+def admission_controlled(endpoint_class: str):
+    """
+    视图装饰器：在该类接口的准入名额内执行视图 (见 admission_controllers)；未被接纳时返回 429/503 与 Retry-After。
+    视图返回流式响应 (例如边压缩边发送的 /generate_shp) 时，名额保留到响应发送完毕或客户端断开
+    (response.call_on_close)，而不是视图返回时就归还。
+    需要合并相同请求的接口改用 coalesce_identical_requests(endpoint_class)，它同时负责准入。
+    """
+    controller = admission_controllers[endpoint_class]
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                controller.acquire()
+            except xianliu.AdmissionRejected as e:
+                return admission_rejected_response(e)
+            started = time.monotonic()
+            released = threading.Lock()
+
+            def release():
+                if released.acquire(blocking=False): # 只归还一次
+                    controller.release(time.monotonic() - started)
 
-        # 检查并过滤无效几何体（在 Gi* 分析前也会做，但提前处理更好）
-        initial_invalid_geoms = (~community_gdf.geometry.is_valid).sum()
-        initial_empty_geoms = community_gdf.geometry.is_empty.sum()
-        community_gdf = community_gdf[community_gdf.geometry.is_valid]
-        community_gdf = community_gdf[~community_gdf.geometry.is_empty]
-        if initial_invalid_geoms > 0 or initial_empty_geoms > 0:
-            print(f"已移除 {initial_invalid_geoms} 个无效几何体和 {initial_empty_geoms} 个空几何体。")
-        print(f"加载并处理后社区边界数量: {len(community_gdf)}")
+            try:
+                response = current_app.make_response(view(*args, **kwargs))
+            except BaseException:
+                release()
+                raise
+            # direct_passthrough 的响应 (send_file) 不经过 call_on_close，计算已经完成，直接归还
+            if response.is_streamed and not response.direct_passthrough:
+                response.call_on_close(release)
+            else:
+                release()
+            return response
+        return wrapper
+    return decorator
+
+# --- 社区边界数据加载 (处理路径和CRS) ---
+def community_boundaries_cache_path() -> str:
+    """社区边界缓存文件路径：由源文件内容的哈希、目标 CRS 与缓存格式版本确定。"""
+    digest = hashlib.sha1()
+    with open(COMMUNITY_BOUNDARIES_PATH, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    key = hashlib.sha1(f"{digest.hexdigest()}|{TARGET_CRS}|{COMMUNITY_BOUNDARIES_CACHE_FORMAT}".encode('utf-8')).hexdigest()[:16]
+    stem = os.path.splitext(COMMUNITY_BOUNDARIES_FILENAME)[0]
+    return os.path.join(COMMUNITY_BOUNDARIES_CACHE_DIR, f"{stem}_{key}.pkl")
+
+def save_community_boundaries_cache(gdf, cache_path: str):
+    """原子地写入社区边界缓存，并删除同一源文件的旧缓存；写入失败只记录警告。"""
+    try:
+        os.makedirs(COMMUNITY_BOUNDARIES_CACHE_DIR, exist_ok=True)
+        staged_path = f"{cache_path}.{os.getpid()}.tmp"
+        gdf.to_pickle(staged_path)
+        os.replace(staged_path, cache_path)
+        stem = os.path.splitext(COMMUNITY_BOUNDARIES_FILENAME)[0]
+        for entry in os.scandir(COMMUNITY_BOUNDARIES_CACHE_DIR):
+            if entry.name.startswith(f"{stem}_") and entry.name.endswith('.pkl') and entry.path != cache_path:
+                os.remove(entry.path)
+        logger.info(f"社区边界缓存已写入 '{cache_path}'。")
+    except Exception as e:
+        logger.warning(f"写入社区边界缓存失败: {e}")
+
+def load_community_boundaries():
+    """
+    读取社区边界 GeoJSON，统一投影到 TARGET_CRS 并生成显示名称列，结果保存在全局 community_gdf 中。
+    处理结果缓存为二进制文件 (pickle)；源文件未变化时直接读取缓存，跳过 GeoJSON 解析和重投影。
+    """
+    global community_gdf
+    try:
+        if os.path.exists(COMMUNITY_BOUNDARIES_PATH):
+            gpd = dili.load_geopandas()
+            cache_path = community_boundaries_cache_path()
+            if os.path.exists(cache_path):
+                try:
+                    with zhibiao.stage_timer('store_read'):
+                        community_gdf = pd.read_pickle(cache_path)
+                    zhibiao.record_cache('community_boundaries', True)
+                    logger.info(f"已从缓存 '{cache_path}' 加载 {len(community_gdf)} 个社区边界。")
+                    return community_gdf
+                except Exception as e:
+                    logger.warning(f"读取社区边界缓存失败，将重新处理 GeoJSON: {e}")
+            zhibiao.record_cache('community_boundaries', False)
+            community_gdf = gpd.read_file(COMMUNITY_BOUNDARIES_PATH)
+            print(f"原始社区边界 GeoJSON '{COMMUNITY_BOUNDARIES_PATH}' 加载成功！")
+            print(f"原始 community_gdf CRS: {community_gdf.crs}")
+
+            # 检查并统一 community_gdf 的 CRS 到目标投影 CRS
+            if community_gdf.crs is None:
+                print("警告: 社区边界 GeoJSON 未明确指定 CRS，尝试假设为 EPSG:4326 进行初始设置。")
+                community_gdf = community_gdf.set_crs("EPSG:4326", allow_override=True)
+        
+            if community_gdf.crs != TARGET_CRS:
+                try:
+                    community_gdf = community_gdf.to_crs(TARGET_CRS)
+                    print(f"社区边界数据已成功投影到 {TARGET_CRS}。")
+                except Exception as e:
+                    print(f"警告: 社区边界数据投影到 {TARGET_CRS} 失败: {e}")
+                    print("将继续使用其原始CRS，这可能导致空间操作问题。")
+        
+            print(f"加载并处理后的 community_gdf CRS: {community_gdf.crs}")
+
+            # --- 创建一个用于前端显示的名称列 'name_for_display' ---
+            community_gdf['name_for_display'] = community_gdf.index.astype(str)
+            if 'NAME' in community_gdf.columns:
+                community_gdf['name_for_display'] = np.where(
+                    community_gdf['NAME'].notna(), 
+                    community_gdf['NAME'].astype(str), 
+                    community_gdf['name_for_display']
+                )
+            if 'NBH_NAMES' in community_gdf.columns: # 检查是否有NBH_NAMES列
+                condition_for_nbh = (community_gdf['name_for_display'] == community_gdf.index.astype(str)) & community_gdf['NBH_NAMES'].notna()
+                community_gdf['name_for_display'] = np.where(
+                    condition_for_nbh, 
+                    community_gdf['NBH_NAMES'].astype(str), 
+                    community_gdf['name_for_display']
+                )
+            community_gdf['name_for_display'] = community_gdf['name_for_display'].astype(str)
+
+            # 检查并过滤无效几何体（在 Gi* 分析前也会做，但提前处理更好）
+            initial_invalid_geoms = (~community_gdf.geometry.is_valid).sum()
+            initial_empty_geoms = community_gdf.geometry.is_empty.sum()
+            community_gdf = community_gdf[community_gdf.geometry.is_valid]
+            community_gdf = community_gdf[~community_gdf.geometry.is_empty]
+            if initial_invalid_geoms > 0 or initial_empty_geoms > 0:
+                print(f"已移除 {initial_invalid_geoms} 个无效几何体和 {initial_empty_geoms} 个空几何体。")
+            print(f"加载并处理后社区边界数量: {len(community_gdf)}")
+            save_community_boundaries_cache(community_gdf, cache_path)
 
+        else:
+            print(f"错误: 社区边界文件 '{COMMUNITY_BOUNDARIES_PATH}' 不存在。请检查路径或文件位置。")
+    except Exception as e:
+        print(f"加载或处理社区边界 GeoJSON 文件失败: {e}")
+        traceback.print_exc()
+        community_gdf = None
+    return community_gdf
+
+def community_boundaries_for_join():
+    """
+    按社区分组时做空间连接使用的边界：优先使用已加载并投影的 community_gdf (不再重新读取和重投影 GeoJSON)；
+    尚未加载时调用 load_community_boundaries (通常直接读取二进制缓存)，仍失败时退回边界文件路径。
+    """
+    boundaries = community_gdf if community_gdf is not None else load_community_boundaries()
+    return boundaries if boundaries is not None and not boundaries.empty else COMMUNITY_BOUNDARIES_PATH
+
+# --- 分阶段预热 ---
+# 按优先级: 主数据 -> 筛选索引 -> 计数立方体 -> 社区边界与距离权重 -> 常用模型。
+# 前四个阶段是热点路径所依赖的，全部完成 (且与当前数据文件版本一致) 后 /api/ready 才返回 200；
+# 主数据或社区边界文件重新导入后，只有依赖它们的阶段会在后台重新运行。
+def warm_up_master_data():
+    df_master = qingxi.load_master_data(MASTER_CSV_PATH)
+    return {"records": len(df_master), "memory_bytes": int(df_master.memory_usage(deep=True).sum())}
+
+def warm_up_master_indexes():
+    indexes = qingxi.get_master_indexes(MASTER_CSV_PATH)
+    categories = indexes['offense_categories']
+    return {"offense_categories": len(categories) if categories is not None else 0,
+            "time_sorted": indexes['time_sorted'], "memory_bytes": indexes['memory_bytes']}
+
+def warm_up_count_cube():
+    cube = qingxi.get_master_count_cube(MASTER_CSV_PATH)
+    return {"days": int(cube['counts'].shape[0]), "columns": int(cube['counts'].shape[1]),
+            "memory_bytes": cube['memory_bytes']}
+
+def warm_up_community_weights():
+    global community_distance_pairs
+    if load_community_boundaries() is None or community_gdf.empty:
+        raise RuntimeError(f"社区边界文件 '{COMMUNITY_BOUNDARIES_PATH}' 未能加载或为空。")
+    community_distance_pairs = None # 边界文件可能已更新，按新边界重新计算
+    pairs = get_community_distance_pairs()
+    pair_bytes = sum(value.nbytes for value in pairs.values() if isinstance(value, np.ndarray))
+    return {"communities": len(community_gdf),
+            "memory_bytes": int(community_gdf.memory_usage(deep=True).sum()) + pair_bytes}
+
+def warm_up_models():
+    return xunlian.warm_model_cache(MODEL_STORAGE_DIRECTORY)
+
+def master_data_version():
+    return qingxi.get_master_data_version(MASTER_CSV_PATH)
+
+def community_boundaries_version():
+    return qingxi.get_file_version(COMMUNITY_BOUNDARIES_PATH)
+
+warm_up_scheduler = yure.WarmUpScheduler('warm_up')
+warm_up_scheduler.add_stage('master_data', warm_up_master_data, version_func=master_data_version)
+warm_up_scheduler.add_stage('master_indexes', warm_up_master_indexes, version_func=master_data_version,
+                            depends_on=('master_data',))
+warm_up_scheduler.add_stage('count_cube', warm_up_count_cube, version_func=master_data_version,
+                            depends_on=('master_indexes',))
+warm_up_scheduler.add_stage('community_weights', warm_up_community_weights, version_func=community_boundaries_version)
+warm_up_scheduler.add_stage('models', warm_up_models, required=False)
+
+# 这些接口不等待预热 (只在后台启动或继续预热)，负载均衡器的探测请求立即得到应答
+WARM_UP_NON_BLOCKING_ENDPOINTS = ('api.status', 'api.readiness', 'api.metrics')
+# 本进程是否已运行过就绪所需的预热阶段 (预热的数据是模块级的，由本进程中的所有应用实例共享)
+shared_data_warmed_up = False
+
+def warm_up_shared_data(include_optional: bool = True):
+    """
+    在当前线程中运行待运行的预热阶段 (见 warm_up_scheduler)；include_optional=False 时只运行就绪所需的阶段。
+    多进程部署时在 fork 工作进程之前调用 (见 wsgi.py)，各工作进程以写时复制方式共享这些对象，
+    不必各自重复加载。
+    """
+    global shared_data_warmed_up
+    warm_up_scheduler.run(required_only=not include_optional)
+    shared_data_warmed_up = True
+
+def metrics_route() -> str:
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    HTTP_REQUESTS_IN_FLIGHT.inc(route=metrics_route())
+    zhibiao.REGISTRY.schedule_flush() # 多进程模式下稍后写出本进程的指标，供其他工作进程的抓取汇总
+
+def record_request_metrics(response):
+    started = g.get('metrics_started')
+    if started is not None and not g.get('metrics_recorded'):
+        route, method = metrics_route(), request.method
+        HTTP_REQUESTS.inc(route=route, method=method, status=response.status_code)
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, route=route, method=method)
+        g.metrics_recorded = True
+    return response
+
+def finish_request_metrics(exc=None):
+    started = g.get('metrics_started')
+    if started is None:
+        return
+    route = metrics_route()
+    HTTP_REQUESTS_IN_FLIGHT.dec(route=route)
+    if not g.get('metrics_recorded'): # 未经过 after_request (处理响应时出错)
+        HTTP_REQUESTS.inc(route=route, method=request.method, status=500)
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, route=route, method=request.method)
+    zhibiao.REGISTRY.schedule_flush()
+
+def ensure_shared_data_loaded():
+    if request.endpoint in WARM_UP_NON_BLOCKING_ENDPOINTS:
+        warm_up_scheduler.start()
+    elif not shared_data_warmed_up and current_app.config['WARM_UP_ON_FIRST_REQUEST']:
+        # 未经 create_app(warm_up=True) 预热 (例如直接 import app 或 flask run) 时，在第一个请求前加载热点路径的数据，
+        # 常用模型等可选阶段在后台继续
+        warm_up_shared_data(include_optional=False)
+        warm_up_scheduler.start()
     else:
-        print(f"错误: 社区边界文件 '{COMMUNITY_BOUNDARIES_PATH}' 不存在。请检查路径或文件位置。")
-except Exception as e:
-    print(f"加载或处理社区边界 GeoJSON 文件失败: {e}")
-    traceback.print_exc()
-    community_gdf = None
+        # 数据文件重新导入后，过期的阶段在后台重建；请求本身按需加载新数据，不必等待
+        warm_up_scheduler.start()
+
 # --- 社区边界加载结束 ---
 
 
 # --- API 路由 (按逻辑分组) ---
 
 # --- 通用状态检查 ---
-@app.route('/api/status', methods=['GET'])
+@api.route('/api/status', methods=['GET'])
 def status():
     logger.info("API 状态检查请求。")
+    status_message, status_data = status_payload()
+    return make_success_response(status_message, status_data)
+
+# --- 就绪检查 (供负载均衡器使用) ---
+@api.route('/api/ready', methods=['GET'])
+def readiness():
+    ready, message, report = readiness_payload()
+    if ready:
+        return make_success_response(message, report)
+    response, status_code = make_error_response(message, 503, data=report)
+    response.headers['Retry-After'] = str(yure.READY_RETRY_AFTER_SECONDS)
+    return response, status_code
+
+def readiness_payload() -> tuple:
+    """(是否就绪, 消息, 预热报告)；不执行任何加载 (asgi.py 在事件循环中直接调用)。"""
+    report = warm_up_scheduler.report()
+    if report['ready']:
+        return True, "服务已就绪，热点路径的数据均已预热。", report
+    waiting = [stage['name'] for stage in report['stages'] if stage['required'] and stage['state'] != yure.STAGE_DONE]
+    return False, f"服务预热中，尚未完成的阶段: {', '.join(waiting)}。", report
+
+def status_payload() -> tuple:
+    """状态检查的 (消息, 数据)；只做文件存在性检查和内存统计，开销很小 (asgi.py 在事件循环中直接调用)。"""
     master_exists = os.path.exists(MASTER_CSV_PATH)
     status_message = "API 正在运行。"
     if not master_exists:
@@ -680,10 +1040,65 @@ def status():
     if community_gdf is None or community_gdf.empty:
         status_message += " 警告: 社区边界数据未加载或为空，热点分析功能可能无法使用。"
         logger.warning("状态检查期间社区边界数据未加载或为空。")
-    return make_success_response(status_message, {"master_data_found": master_exists, "community_boundaries_loaded": (community_gdf is not None and not community_gdf.empty)})
+    return status_message, {"master_data_found": master_exists, "community_boundaries_loaded": (community_gdf is not None and not community_gdf.empty),
+                            "model_cache": xunlian.get_model_cache_stats(),
+                            "offload_pools": zhixing.get_pool_stats(),
+                            "single_flight": hebing.get_stats(),
+                            "admission": {name: controller.stats() for name, controller in admission_controllers.items()},
+                            "warm_up": {stage['name']: stage['state'] for stage in warm_up_scheduler.report()['stages']}}
+
+# --- 监控指标 (Prometheus 文本格式) ---
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(zhibiao.REGISTRY.render(), content_type=zhibiao.CONTENT_TYPE)
+
+def collect_service_metrics() -> list:
+    """抓取 (多进程模式下还有写出) 时读取的服务内部统计: 准入控制、卸载池、请求合并、模型缓存与预热阶段 (均为本进程的值)。"""
+    admission = {name: controller.stats() for name, controller in admission_controllers.items()}
+    pools = zhixing.get_pool_stats()
+    flights = hebing.get_stats()
+    model_cache = xunlian.get_model_cache_stats()
+    warm_up = warm_up_scheduler.report()
+    rejected = [({'class': name, 'reason': reason}, stats[counter]) for name, stats in admission.items()
+                for reason, counter in (('queue_full', 'rejected_queue_full'),
+                                        ('wait_estimate', 'rejected_wait_estimate'), ('timed_out', 'timed_out'))]
+    return [
+        ('admission_running', 'gauge', '各类接口正在执行的请求数。',
+         [({'class': name}, stats['running']) for name, stats in admission.items()]),
+        ('admission_queued', 'gauge', '各类接口正在排队的请求数。',
+         [({'class': name}, stats['queued']) for name, stats in admission.items()]),
+        ('admission_admitted_total', 'counter', '各类接口被接纳的请求数。',
+         [({'class': name}, stats['admitted']) for name, stats in admission.items()]),
+        ('admission_rejected_total', 'counter', '各类接口被拒绝的请求数，按原因区分。', rejected),
+        ('admission_queue_wait_seconds_total', 'counter', '各类接口被接纳的请求累计排队时间 (秒)。',
+         [({'class': name}, stats['queue_wait_seconds_total']) for name, stats in admission.items()]),
+        ('offload_tasks_running', 'gauge', '各卸载池中进行中 (含排队) 的任务数。',
+         [({'pool': name}, stats['running']) for name, stats in pools.items()]),
+        ('offload_tasks_submitted_total', 'counter', '提交到各卸载池的任务数。',
+         [({'pool': name}, stats['submitted']) for name, stats in pools.items()]),
+        ('offload_tasks_failed_total', 'counter', '各卸载池中失败的任务数。',
+         [({'pool': name}, stats['failed']) for name, stats in pools.items()]),
+        ('single_flight_requests_total', 'counter', '相同请求合并的结果: 实际执行、进程内合并、跨进程复用、失败与等锁超时。',
+         [({'flight': name, 'result': result}, count) for name, stats in flights.items()
+          for result, count in stats.items() if result != 'in_flight']),
+        ('model_cache_entries', 'gauge', '模型缓存中的模型数。', [({}, model_cache['entries'])]),
+        ('model_cache_bytes', 'gauge', '模型缓存中模型的估计大小 (字节)。', [({}, model_cache['bytes'])]),
+        ('model_cache_evictions_total', 'counter', '模型缓存的淘汰次数。', [({}, model_cache['evictions'])]),
+        ('warm_up_ready', 'gauge', '热点路径所需的预热阶段是否均已完成 (1 为就绪)。', [({}, int(warm_up['ready']))]),
+        ('warm_up_stage_done', 'gauge', '各预热阶段是否已按当前数据版本完成 (1 为完成)。',
+         [({'stage': stage['name']}, int(stage['state'] == yure.STAGE_DONE)) for stage in warm_up['stages']]),
+        ('warm_up_stage_duration_seconds', 'gauge', '各预热阶段最近一次运行的耗时 (秒)。',
+         [({'stage': stage['name']}, stage['duration_ms'] / 1000 if stage['duration_ms'] is not None else None)
+          for stage in warm_up['stages']]),
+        ('warm_up_stage_consecutive_failures', 'gauge', '各预热阶段的连续失败次数 (成功后清零，失败后按指数退避重试)。',
+         [({'stage': stage['name']}, stage['consecutive_failures']) for stage in warm_up['stages']]),
+        ('process_resident_memory_bytes', 'gauge', '本工作进程的常驻内存 (字节)。', [({}, warm_up['rss_bytes'])]),
+    ]
+
+zhibiao.REGISTRY.register_collector(collect_service_metrics)
 
 # --- 数据处理与时间序列分析相关接口 ---
-@app.route('/api/prepare-filtered-data', methods=['POST'])
+@api.route('/api/prepare-filtered-data', methods=['POST'])
 def prepare_filtered_data_endpoint():
     logger.info("收到请求: 从主 CSV 准备已筛选数据")
     data = request.get_json()
@@ -733,7 +1148,8 @@ def prepare_filtered_data_endpoint():
         logger.error(f"/api/prepare-filtered-data 出错: {traceback.format_exc()}")
         return make_error_response("准备已筛选数据时服务器出错。", 500, error_details=str(e))
 
-@app.route('/api/get-processed-data-sample', methods=['GET'])
+@api.route('/api/get-processed-data-sample', methods=['GET'])
+@conditional_on_data_version
 def get_processed_data_sample_endpoint():
     logger.info("收到请求: 获取已处理数据样本")
     try:
@@ -779,12 +1195,13 @@ def get_processed_data_sample_endpoint():
         logger.error(f"/api/get-processed-data-sample 出错: {traceback.format_exc()}")
         return make_error_response("获取数据样本时服务器出错。", 500, error_details=str(e))
 
-@app.route('/api/train-model', methods=['POST'])
-def train_model_endpoint():
-    logger.info("收到请求: 训练模型")
-    data = request.get_json()
+def parse_train_model_request(data: dict) -> tuple:
+    """
+    校验训练请求 (/api/train-model 与 /api/train-jobs 共用)。
+    返回 (训练参数 spec, None)；参数无效时返回 (None, 错误响应)。
+    """
     if not data:
-        return make_error_response("请求体不能为空。", 400)
+        return None, make_error_response("请求体不能为空。", 400)
 
     start_year = data.get('start_year')
     end_year = data.get('end_year')
@@ -792,15 +1209,43 @@ def train_model_endpoint():
     resample_freq = data.get('resample_freq')
     arima_order_list = data.get('arima_order')
     model_filename_req = data.get('model_filename', DEFAULT_MODEL_FILENAME)
-
-    if not all([isinstance(year, int) for year in [start_year, end_year]]) or \
-       not resample_freq or not isinstance(arima_order_list, list) or len(arima_order_list) != 3:
-        return make_error_response("缺少或无效的参数: start_year, end_year, resample_freq, 或 arima_order。", 400)
-
+    model_type = data.get('model_type', 'arima') # 'arima' 或向量化基准方法 (seasonal_naive / moving_average / ses / holt_winters)
+    model_params = data.get('model_params') or {}
+    auto_order = isinstance(arima_order_list, str) and arima_order_list.lower() == 'auto'
+    auto_config = data.get('auto_config') or {}
+
+    if model_type not in xunlian.MODEL_TYPES:
+        return None, make_error_response(f"'model_type' 必须是以下之一: {', '.join(xunlian.MODEL_TYPES)}。", 400)
+    is_arima = model_type == 'arima'
+    # 时间范围用年份 (start_year/end_year) 或日期 (start_date/end_date) 指定，给出日期时年份可以省略
+    has_dates = bool(data.get('start_date') or data.get('end_date'))
+    if not (has_dates or all([isinstance(year, int) for year in [start_year, end_year]])) or not resample_freq or \
+       not (not is_arima or auto_order or (isinstance(arima_order_list, list) and len(arima_order_list) == 3)):
+        return None, make_error_response("缺少或无效的参数: start_year, end_year, resample_freq, 或 arima_order。", 400)
     try:
-        arima_order_tuple = tuple(map(int, arima_order_list))
-    except ValueError:
-        return make_error_response("ARIMA 阶数分量 (p,d,q) 必须是整数。", 400)
+        # 与其他接口相同的完整筛选条件 (日期、犯罪类型、bbox、polygon)
+        filter_spec = qingxi.normalize_filter_spec(data)
+    except ValueError as e:
+        return None, make_error_response(f"筛选条件无效: {e}", 400)
+    if not isinstance(auto_config, dict) or not isinstance(model_params, dict):
+        return None, make_error_response("'auto_config' 和 'model_params' 必须是 JSON 对象。", 400)
+    if is_arima and auto_order:
+        try:
+            xunlian.validate_auto_config(auto_config)
+        except ValueError as e:
+            return None, make_error_response(f"'auto_config' 无效: {e}", 400)
+    if not is_arima:
+        try:
+            jizhun.validate_baseline_params(model_params)
+        except ValueError as e:
+            return None, make_error_response(f"'model_params' 无效: {e}", 400)
+
+    arima_order_tuple = None
+    if is_arima and not auto_order:
+        try:
+            arima_order_tuple = tuple(map(int, arima_order_list))
+        except ValueError:
+            return None, make_error_response("ARIMA 阶数分量 (p,d,q) 必须是整数。", 400)
 
     if not model_filename_req.endswith(".joblib"):
         model_filename_req += ".joblib"
@@ -815,70 +1260,426 @@ def train_model_endpoint():
     expected_temp_filename = qingxi.generate_temp_filtered_data_filename(
         start_year, end_year, offenses_for_filename, suffix="for_processing"
     )
-    path_to_filtered_data = os.path.join(TEMP_DATA_DIR, expected_temp_filename)
-
-    if not os.path.exists(path_to_filtered_data):
-        msg = (f"未找到已筛选的数据文件 '{expected_temp_filename}'。 "
-               f"请确保首先使用匹配的条件 '准备已筛选数据'。")
+    if not os.path.exists(MASTER_CSV_PATH) and not os.path.exists(os.path.join(TEMP_DATA_DIR, expected_temp_filename)):
+        msg = (f"主数据文件与已筛选的数据文件 '{expected_temp_filename}' 均未找到。 "
+               f"请先运行初始数据处理脚本 (qingxi.py)。")
         logger.error(msg)
-        return make_error_response(msg, 404, data={"expected_temp_file": expected_temp_filename})
-
-    try:
+        return None, make_error_response(msg, 404, data={"expected_temp_file": expected_temp_filename})
+
+    return {
+        "start_year": start_year,
+        "end_year": end_year,
+        "offenses": offenses,
+        "offenses_for_filename": offenses_for_filename,
+        "filter_spec": filter_spec,
+        "resample_freq": resample_freq,
+        "model_type": model_type,
+        "order": arima_order_tuple, # 自动定阶或基准模型时为 None
+        "auto_config": auto_config,
+        "model_params": model_params,
+        "model_filename": model_filename_req,
+        "expected_temp_filename": expected_temp_filename,
+    }, None
+
+def run_train_model(spec: dict, progress=None, cancel_event=None) -> dict:
+    """
+    按 parse_train_model_request 得到的参数聚合序列、训练并保存模型，返回响应数据。
+    给出 cancel_event 时 (后台训练任务) 拟合在独立子进程中运行，取消时子进程被终止。
+    参数或数据问题抛出 ValueError / TypeError，训练失败抛出 RuntimeError。
+    """
+    report = progress or (lambda done, total=None, stage=None: None)
+    report(0, xunlian.FIT_PROGRESS_STEPS, 'aggregating')
+    resample_freq = spec['resample_freq']
+    if os.path.exists(MASTER_CSV_PATH):
+        # 直接在内存中从主数据筛选并聚合，无需先调用 "准备已筛选数据" 生成临时文件
+        logger.info(f"从主数据按条件聚合时间序列: {spec['filter_spec']}")
+        time_series_data = xunlian.aggregate_master_series(MASTER_CSV_PATH, spec['filter_spec'],
+                                                           resample_freq=resample_freq)
+        training_data_source = f"master:{qingxi.get_master_data_version(MASTER_CSV_PATH)}"
+    else:
+        # 兼容: 只有预先准备好的临时文件时仍从文件读取
+        path_to_filtered_data = os.path.join(TEMP_DATA_DIR, spec['expected_temp_filename'])
         logger.info(f"从以下位置加载时间序列数据: {path_to_filtered_data}")
         time_series_data = xunlian.load_and_prepare_data(
             file_path=path_to_filtered_data,
             time_column=TIME_COLUMN_NAME,
             resample_freq=resample_freq
         )
+        training_data_source = spec['expected_temp_filename']
+
+    if time_series_data is None or time_series_data.empty:
+        raise ValueError(f"筛选条件下没有数据，无法生成时间序列 ({spec['expected_temp_filename']})。")
+
+    # 记录在模型产物中 (规范化的筛选条件)，供之后 /api/update-model 按相同条件取新数据
+    data_source = {**spec['filter_spec'], "resample_freq": resample_freq}
+    fit_kwargs = dict(ts_data=time_series_data, model_type=spec['model_type'], model_filename=spec['model_filename'],
+                      model_save_dir=MODEL_STORAGE_DIRECTORY, order=spec['order'], auto_config=spec['auto_config'],
+                      model_params=spec['model_params'], data_source=data_source)
+    # 拟合在子进程中运行，其中的阶段计时留在子进程内，这里记录本进程等待拟合完成的时间；
+    # 基准模型单独计为 baseline_fit，不混入 ARIMA 拟合的耗时分布
+    with zhibiao.stage_timer('arima_fit' if spec['model_type'] == 'arima' else 'baseline_fit'):
+        if cancel_event is not None: # 后台任务: 子进程中的进度 (定阶、拟合、摘要) 转发到任务状态
+            fitted = renwu.run_in_subprocess(xunlian.fit_and_save_model, cancel_event=cancel_event,
+                                             progress=report, **fit_kwargs)
+        else: # 同步接口: 拟合放到进程池中，不占用本进程的 GIL
+            fitted = zhixing.run_offloaded(zhixing.POOL_CPU, xunlian.fit_and_save_model, **fit_kwargs)
+    report(xunlian.FIT_PROGRESS_STEPS, xunlian.FIT_PROGRESS_STEPS, 'done')
+
+    model_filename_req = spec['model_filename']
+    response_data = {
+        "model_filename_used": model_filename_req,
+        "model_type": spec['model_type'],
+        "model_path_on_server": os.path.join(MODEL_STORAGE_DIRECTORY, model_filename_req),
+        "model_summary_preview": fitted["model_summary_preview"],
+        "training_data_source": training_data_source,
+        "time_series_length": len(time_series_data),
+        "data_horizon": time_series_data.index[-1].isoformat()
+    }
+    auto_search = fitted["auto_search"]
+    if auto_search is not None:
+        response_data["selected_order"] = auto_search["best"]["order"]
+        response_data["selected_seasonal_order"] = auto_search["best"]["seasonal_order"]
+        response_data["auto_search"] = {
+            "criterion": auto_search["config"]["criterion"],
+            "candidates_fitted": len(auto_search["leaderboard"]),
+            "leaderboard": auto_search["leaderboard"]
+        }
+    return response_data
 
-        if time_series_data is None or time_series_data.empty:
-            return make_error_response(f"无法从 '{expected_temp_filename}' 加载或准备时间序列。结果序列为空。", 500)
+@api.route('/api/train-model', methods=['POST'])
+@admission_controlled('training')
+def train_model_endpoint():
+    logger.info("收到请求: 训练模型")
+    spec, error_response = parse_train_model_request(request.get_json())
+    if error_response is not None:
+        return error_response
 
-        logger.info(f"使用阶数 {arima_order_tuple} 训练 ARIMA 模型，文件名: {model_filename_req}")
-        trained_model = xunlian.train_arima_model(
-            ts_data=time_series_data,
-            order=arima_order_tuple,
-            model_filename=model_filename_req,
-            model_save_dir=MODEL_STORAGE_DIRECTORY
-        )
+    try:
+        response_data = run_train_model(spec)
+        return make_success_response(f"模型 '{spec['model_filename']}' 训练成功。", response_data)
+    except (ValueError, TypeError) as e:
+        return make_error_response(f"模型训练参数无效: {e}", 400)
+    except RuntimeError as e:
+        return make_error_response(str(e), 500)
+    except Exception as e:
+        logger.error(f"模型训练期间出错: {traceback.format_exc()}")
+        return make_error_response("模型训练期间服务器出错。", 500, error_details=str(e))
 
-        if trained_model is None:
-            return make_error_response("模型训练失败。请检查服务器日志以获取详细信息。", 500)
+def train_job_payload(job: dict) -> dict:
+    """训练任务状态的响应数据；成功时附带与 /api/train-model 相同的训练结果。"""
+    payload = {
+        "job_id": job['job_id'],
+        "status": job['status'],
+        "stage": job['progress']['stage'],
+        "progress": job['progress'],
+        "submissions": job['submissions'],
+        "cancel_requested": job['cancel_requested'],
+        "params": job['params'],
+        "error": job['error'],
+        "created_at": job['created_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at'],
+    }
+    if job['status'] == renwu.JOB_SUCCEEDED:
+        payload["result"] = job['result']
+    return payload
+
+@api.route('/api/train-jobs', methods=['POST'])
+def submit_train_job_endpoint():
+    """
+    提交后台训练任务 (请求体与 /api/train-model 相同)，立即返回 202 和任务 ID。
+    筛选条件、模型类型、阶数和频率都相同的等待中/运行中任务会被复用，而不是重复训练；
+    去重不看文件名，复用的任务按最先提交的文件名保存模型 (见响应中的 params.model_filename)。
+    """
+    logger.info("收到请求: 提交后台训练任务")
+    spec, error_response = parse_train_model_request(request.get_json())
+    if error_response is not None:
+        return error_response
+
+    job_params = {key: value for key, value in spec.items() if key not in ('offenses', 'expected_temp_filename')}
+    dedup_key = json.dumps({key: value for key, value in job_params.items() if key != 'model_filename'},
+                           sort_keys=True, default=str)
+    try:
+        job_id = train_job_manager.submit('train_model', run_train_model, spec, params=job_params,
+                                          dedup_key=dedup_key, cancellable=True)
+    except renwu.JobQueueFull as e:
+        response, status_code = make_error_response(str(e), 503)
+        response.headers['Retry-After'] = '30'
+        return response, status_code
+    job = train_job_manager.get(job_id)
+    payload = train_job_payload(job)
+    payload["deduplicated"] = job['submissions'] > 1
+    payload["status_url"] = f"/api/train-jobs/{job_id}"
+    if job['params']['model_filename'] != spec['model_filename']:
+        return make_success_response(f"已有相同训练条件的任务，模型将保存为 '{job['params']['model_filename']}'。",
+                                     payload, status_code=202)
+    return make_success_response("训练任务已提交。", payload, status_code=202)
+
+@api.route('/api/train-jobs/<job_id>', methods=['GET'])
+def train_job_status_endpoint(job_id):
+    train_job_manager.expire_artifacts()
+    job = train_job_manager.get(job_id)
+    if job is None:
+        return make_error_response(f"训练任务 '{job_id}' 不存在或已过期。", 404)
+    return make_success_response(f"训练任务状态: {job['status']}", train_job_payload(job))
+
+@api.route('/api/train-jobs/<job_id>/cancel', methods=['POST'])
+def cancel_train_job_endpoint(job_id):
+    job = train_job_manager.cancel(job_id)
+    if job is None:
+        return make_error_response(f"训练任务 '{job_id}' 不存在或已过期。", 404)
+    if job['status'] in renwu.FINISHED_JOB_STATES and job['status'] != renwu.JOB_CANCELLED:
+        return make_error_response(f"训练任务已结束 ({job['status']})，无法取消。", 409, data=train_job_payload(job))
+    if job['status'] == renwu.JOB_CANCELLED:
+        return make_success_response("训练任务已取消。", train_job_payload(job))
+    return make_success_response("已请求取消训练任务，正在终止。", train_job_payload(job), status_code=202)
+
+@api.route('/api/update-model', methods=['POST'])
+@admission_controlled('training')
+def update_model_endpoint():
+    logger.info("收到请求: 用新数据增量更新模型")
+    data = request.get_json()
+    if not data:
+        return make_error_response("请求体不能为空。", 400)
 
-        full_model_path = os.path.join(MODEL_STORAGE_DIRECTORY, model_filename_req)
-        summary_preview = "模型摘要不可用。"
-        if hasattr(trained_model, 'summary'):
-            try:
-                summary_preview = str(trained_model.summary())
-                if len(summary_preview) > 2000: summary_preview = summary_preview[:2000] + "\n... (摘要已截断)"
-            except Exception as e:
-                logger.warning(f"无法检索模型摘要: {e}")
+    model_filename = data.get('model_filename')
+    refit = data.get('refit', False)
+    if not model_filename or not isinstance(model_filename, str):
+        return make_error_response("'model_filename' 必须是有效的字符串。", 400)
+    if not isinstance(refit, bool):
+        return make_error_response("'refit' 必须是布尔值。", 400)
+    if not model_filename.endswith(".joblib"): model_filename += ".joblib"
+    if not os.path.exists(MASTER_CSV_PATH):
+        return make_error_response(f"主数据文件 '{MASTER_CSV_PATH}' 未找到。", 500)
+
+    loaded_model = xunlian.load_arima_model(model_filename, MODEL_STORAGE_DIRECTORY)
+    if loaded_model is None:
+        return make_error_response(f"未找到模型 '{model_filename}' 或加载失败。", 404)
+    horizon = moxing.model_data_horizon(loaded_model)
+    # 沿用训练时记录的筛选条件 (起始日期、犯罪类型、bbox、polygon)，截止日期默认取到最新数据；
+    # 较早训练的模型只记录了 start_year/end_year/offenses，此时从序列起点开始取数 (与训练起点之后的数据一致)
+    data_source = horizon.get('data_source') or {}
+    filter_spec = {"start_date": data_source.get('start_date'),
+                   "end_date": data.get('end_date'),
+                   "offenses": data.get('offenses', data_source.get('offenses')),
+                   "bbox": data_source.get('bbox'),
+                   "polygon": data_source.get('polygon')}
 
-        return make_success_response(
-            f"模型 '{model_filename_req}' 训练成功。",
-            {
-                "model_filename_used": model_filename_req,
-                "model_path_on_server": full_model_path,
-                "model_summary_preview": summary_preview,
-                "training_data_source": expected_temp_filename,
-                "time_series_length": len(time_series_data)
-            }
+    try:
+        ts_data = xunlian.aggregate_master_series(MASTER_CSV_PATH, filter_spec, resample_freq=horizon['freq'] or 'ME')
+        updated_model, info = xunlian.update_arima_model(model_filename, ts_data, MODEL_STORAGE_DIRECTORY, refit=refit)
+    except ValueError as e:
+        return make_error_response(f"无法更新模型: {e}", 400)
+    except Exception as e:
+        logger.error(f"更新模型期间出错: {traceback.format_exc()}")
+        return make_error_response("更新模型期间服务器出错。", 500, error_details=str(e))
+    if updated_model is None:
+        return make_error_response(f"未找到模型 '{model_filename}' 或加载失败。", 404)
+
+    info["model_filename_used"] = model_filename
+    info["data_horizon"] = moxing.model_data_horizon(updated_model)
+    return make_success_response(f"模型 '{model_filename}' 已更新至 {info['new_horizon'][:10]}。", info)
+
+@api.route('/api/backtest', methods=['POST'])
+@admission_controlled('training')
+def backtest_endpoint():
+    logger.info("收到请求: 滚动起点回测")
+    data = request.get_json()
+    if not data:
+        return make_error_response("请求体不能为空。", 400)
+
+    resample_freq = data.get('resample_freq', 'ME')
+    candidates_raw = data.get('candidates')
+    if candidates_raw is None and data.get('arima_order') is not None:
+        candidates_raw = [{"arima_order": data.get('arima_order'), "seasonal_order": data.get('seasonal_order', [0, 0, 0, 0])}]
+    if not isinstance(candidates_raw, list) or not candidates_raw:
+        return make_error_response("需要 'candidates' ([{arima_order, seasonal_order}]) 或 'arima_order'。", 400)
+    confidence_levels = data.get('confidence_levels', [80, 95]) # 与 /api/predict 一致使用百分比
+    if not isinstance(confidence_levels, list) or not all(
+            isinstance(level, (int, float)) and not isinstance(level, bool) and 0 < level < 100
+            for level in confidence_levels):
+        return make_error_response("'confidence_levels' 必须是 (0, 100) 范围内的数字列表。", 400)
+
+    try:
+        candidates = []
+        for candidate in candidates_raw:
+            order = candidate.get('arima_order')
+            seasonal_order = candidate.get('seasonal_order', [0, 0, 0, 0])
+            if not isinstance(order, list) or len(order) != 3 or not isinstance(seasonal_order, list) or len(seasonal_order) != 4:
+                raise ValueError("每个候选必须包含 arima_order [p,d,q]，可选 seasonal_order [P,D,Q,m]。")
+            candidates.append((tuple(map(int, order)), tuple(map(int, seasonal_order))))
+        config = {key: data[key] for key in ('window', 'window_size', 'num_folds', 'step', 'horizon', 'min_folds',
+                                             'max_workers') if key in data}
+        config['confidence_levels'] = [level / 100.0 for level in confidence_levels]
+        filter_spec = {key: data.get(key) for key in ('start_year', 'end_year', 'start_date', 'end_date', 'offenses')}
+        if not os.path.exists(MASTER_CSV_PATH):
+            return make_error_response(f"主数据文件 '{MASTER_CSV_PATH}' 未找到。", 500)
+        ts_data = xunlian.aggregate_master_series(MASTER_CSV_PATH, filter_spec, resample_freq=resample_freq)
+        backtest = xunlian.rolling_origin_backtest(ts_data, candidates, config)
+    except (ValueError, TypeError, AttributeError) as e:
+        return make_error_response(f"回测参数无效: {e}", 400)
+    except Exception as e:
+        logger.error(f"回测期间出错: {traceback.format_exc()}")
+        return make_error_response("回测期间服务器出错。", 500, error_details=str(e))
+
+    return make_success_response(
+        f"已完成 {len(candidates)} 个候选模型在 {len(backtest['folds'])} 个折上的回测。", backtest)
+
+@api.route('/api/hierarchical-forecast', methods=['POST'])
+@admission_controlled('training')
+def hierarchical_forecast_endpoint():
+    logger.info("收到请求: 层级预测 (全市/选区/社区)")
+    data = request.get_json()
+    if not data:
+        return make_error_response("请求体不能为空。", 400)
+
+    steps = data.get('steps', 12)
+    resample_freq = data.get('resample_freq', 'ME')
+    base_method = data.get('base_method', 'ses')
+    reconciliation = data.get('reconciliation', 'mint_shrink')
+    confidence_level_percentage = data.get('confidence_level', 95)
+    model_params = data.get('model_params') or {}
+    arima_order_list = data.get('arima_order')
+    seasonal_order_list = data.get('seasonal_order', [0, 0, 0, 0])
+
+    if not isinstance(steps, int) or steps <= 0:
+        return make_error_response("'steps' 必须是正整数。", 400)
+    if not isinstance(confidence_level_percentage, (int, float)) or isinstance(confidence_level_percentage, bool) or \
+       not (0 < confidence_level_percentage < 100):
+        return make_error_response("'confidence_level' 必须是 (0, 100) 范围内的数字。", 400)
+    max_workers = data.get('max_workers')
+    if max_workers is not None and (isinstance(max_workers, bool) or not isinstance(max_workers, int) or max_workers <= 0):
+        return make_error_response("'max_workers' 必须是正整数。", 400)
+    if reconciliation not in cengji.RECONCILIATION_METHODS:
+        return make_error_response(f"'reconciliation' 必须是以下之一: {', '.join(cengji.RECONCILIATION_METHODS)}。", 400)
+    if base_method not in xunlian.MODEL_TYPES:
+        return make_error_response(f"'base_method' 必须是以下之一: {', '.join(xunlian.MODEL_TYPES)}。", 400)
+    if community_gdf is None or community_gdf.empty:
+        return make_error_response("社区边界数据未加载，无法按社区汇总。", 500)
+
+    try:
+        order = tuple(map(int, arima_order_list)) if arima_order_list is not None else None
+        seasonal_order = tuple(map(int, seasonal_order_list))
+        filter_spec = qingxi.normalize_filter_spec(
+            {key: data.get(key) for key in ('start_year', 'end_year', 'start_date', 'end_date', 'offenses')})
+        df = qingxi.filter_master_data(qingxi.load_master_data(MASTER_CSV_PATH), filter_spec)
+        df = df.assign(**{qingxi.CLUSTER_COLUMN_NAME: qingxi.assign_neighborhood_clusters(df, community_gdf)})
+        bottom_matrix = cengji.bottom_level_matrix(df, resample_freq)
+        forecast = cengji.hierarchical_forecast(
+            bottom_matrix, steps, base_method=base_method, reconciliation=reconciliation,
+            confidence_level=confidence_level_percentage / 100.0, model_params=model_params,
+            order=order, seasonal_order=seasonal_order, max_workers=max_workers
         )
+    except FileNotFoundError:
+        return make_error_response(f"主数据文件 '{MASTER_CSV_PATH}' 未找到。", 500)
+    except (ValueError, TypeError) as e:
+        return make_error_response(f"层级预测参数无效: {e}", 400)
     except Exception as e:
-        logger.error(f"模型训练期间出错: {traceback.format_exc()}")
-        return make_error_response("模型训练期间服务器出错。", 500, error_details=str(e))
+        logger.error(f"层级预测期间出错: {traceback.format_exc()}")
+        return make_error_response("层级预测期间服务器出错。", 500, error_details=str(e))
 
-@app.route('/api/get-actual-aggregated-data', methods=['GET'])
+    return make_success_response(
+        f"已为 {forecast['num_nodes']} 个节点生成一致的 {steps} 步预测 (调和方法: {reconciliation})。", forecast)
+
+@api.route('/api/train-batch', methods=['POST'])
+def train_batch_endpoint():
+    logger.info("收到请求: 批量训练分组模型")
+    data = request.get_json()
+    if not data:
+        return make_error_response("请求体不能为空。", 400)
+
+    group_by = data.get('group_by')
+    resample_freq = data.get('resample_freq', 'ME')
+    model_type = data.get('model_type', 'arima')
+    model_params = data.get('model_params') or {}
+    arima_order_list = data.get('arima_order', [1, 1, 1] if model_type != 'arima' else None)
+    seasonal_order_list = data.get('seasonal_order', [0, 0, 0, 0])
+    filename_prefix = daochu.safe_file_stem(data.get('filename_prefix', 'batch'), default='batch')
+    max_workers = data.get('max_workers')
+
+    if group_by not in xunlian.BATCH_GROUP_COLUMNS:
+        return make_error_response(f"'group_by' 必须是以下之一: {', '.join(xunlian.BATCH_GROUP_COLUMNS)}。", 400)
+    if model_type not in xunlian.MODEL_TYPES or not isinstance(model_params, dict):
+        return make_error_response(f"'model_type' 必须是以下之一: {', '.join(xunlian.MODEL_TYPES)}，'model_params' 必须是 JSON 对象。", 400)
+    if not isinstance(arima_order_list, list) or len(arima_order_list) != 3 or \
+       not isinstance(seasonal_order_list, list) or len(seasonal_order_list) != 4:
+        return make_error_response("'arima_order' 必须是 [p,d,q]，'seasonal_order' 必须是 [P,D,Q,m]。", 400)
+    # 与 xunlian.resolve_max_workers 相同: JSON 的 true/false 不算整数
+    if max_workers is not None and (isinstance(max_workers, bool) or not isinstance(max_workers, int) or max_workers <= 0):
+        return make_error_response("'max_workers' 必须是正整数。", 400)
+    try:
+        arima_order_tuple = tuple(map(int, arima_order_list))
+        seasonal_order_tuple = tuple(map(int, seasonal_order_list))
+        if model_type != 'arima':
+            jizhun.validate_baseline_params(model_params) # 在提交任务前校验，而不是在后台任务中才失败
+        qingxi.normalize_filter_spec(data)
+    except (ValueError, TypeError) as e:
+        return make_error_response(f"参数无效: {e}", 400)
+    if not os.path.exists(MASTER_CSV_PATH):
+        return make_error_response(f"主数据文件 '{MASTER_CSV_PATH}' 未找到。", 500)
+
+    filter_spec = {key: data.get(key) for key in ('start_year', 'end_year', 'start_date', 'end_date',
+                                                   'offenses', 'bbox', 'polygon')}
+    try:
+        job_id = batch_train_job_manager.submit(
+            'batch_train',
+            xunlian.batch_train_from_master,
+            MASTER_CSV_PATH,
+            group_by,
+            arima_order_tuple,
+            filter_spec=filter_spec,
+            boundaries=community_boundaries_for_join(),
+            resample_freq=resample_freq,
+            seasonal_order=seasonal_order_tuple,
+            model_save_dir=MODEL_STORAGE_DIRECTORY,
+            filename_prefix=filename_prefix,
+            max_workers=max_workers,
+            model_type=model_type,
+            model_params=model_params,
+            params={'group_by': group_by, 'model_type': model_type, 'filename_prefix': filename_prefix}
+        )
+    except renwu.JobQueueFull as e:
+        response, status_code = make_error_response(str(e), 503)
+        response.headers['Retry-After'] = '60'
+        return response, status_code
+
+    return make_success_response(f"已提交批量训练任务 (分组: {group_by})。", {"job_id": job_id}, status_code=202)
+
+@api.route('/api/train-batch/<job_id>', methods=['GET'])
+def train_batch_status_endpoint(job_id):
+    job = batch_train_job_manager.get(job_id)
+    if job is None:
+        return make_error_response(f"批量训练任务 '{job_id}' 不存在。", 404)
+    payload = {
+        "job_id": job_id,
+        "status": job['status'],
+        "groups_done": job['progress']['done'],
+        "groups_total": job['progress']['total'],
+        "params": job['params'],
+        "error": job['error'],
+    }
+    if job['status'] == renwu.JOB_SUCCEEDED:
+        manifest = dict(job['result'])
+        manifest['manifest_filename'] = os.path.basename(manifest.pop('manifest_path'))
+        payload["manifest"] = manifest
+    return make_success_response(f"批量训练任务状态: {job['status']}", payload)
+
+@api.route('/api/get-actual-aggregated-data', methods=['GET'])
+@conditional_on_data_version
 def get_actual_aggregated_data_endpoint():
     logger.info("收到请求: 获取图表的实际聚合数据")
     try:
         start_year = request.args.get('start_year', type=int)
         end_year = request.args.get('end_year', type=int)
         offenses_raw = request.args.getlist('offenses')
-        resample_freq = request.args.get('resample_freq')
+        # resample_freq 可重复传入或以逗号分隔 (例如 "D,W,ME")，多个频率在一次扫描中同时聚合
+        resample_freqs = list(dict.fromkeys(
+            freq.strip() for raw in request.args.getlist('resample_freq') for freq in raw.split(',') if freq.strip()
+        ))
 
-        if not all([isinstance(year, int) for year in [start_year, end_year]]) or not resample_freq:
+        if not all([isinstance(year, int) for year in [start_year, end_year]]) or not resample_freqs:
             return make_error_response("start_year, end_year (整数) 和 resample_freq (字符串) 是必需的。", 400)
+        resample_freq = resample_freqs[0] if len(resample_freqs) == 1 else resample_freqs
 
         if not offenses_raw or offenses_raw == [None] or offenses_raw == [''] or offenses_raw == ['null']:
             offenses_for_filename = ["ALL"]
@@ -892,6 +1693,21 @@ def get_actual_aggregated_data_endpoint():
                 offenses_for_filename = sorted(list(set(temp_offenses)))
                 actual_offenses_for_filter = offenses_for_filename
 
+        if os.path.exists(MASTER_CSV_PATH):
+            # 直接从内存中的主数据筛选并聚合，不再为每次请求读取和解析临时 CSV
+            try:
+                aggregated = xunlian.aggregate_master_series(
+                    MASTER_CSV_PATH,
+                    {"start_year": start_year, "end_year": end_year, "offenses": actual_offenses_for_filter},
+                    resample_freq=resample_freqs
+                )
+            except ValueError as e:
+                return make_error_response(f"参数无效: {e}", 400)
+            columnar = xiangying.wants_columnar()
+            series_payload = {freq: xunlian.series_to_chart_payload(series, columnar) for freq, series in aggregated.items()}
+            aggregated_data = series_payload[resample_freq] if isinstance(resample_freq, str) else {"series": series_payload}
+            return make_success_response("已检索实际聚合历史数据。", aggregated_data)
+
         temp_filtered_filename = qingxi.generate_temp_filtered_data_filename(
             start_year, end_year, offenses_for_filename, suffix="for_processing"
         )
@@ -914,7 +1730,8 @@ def get_actual_aggregated_data_endpoint():
         aggregated_data = xunlian.aggregate_series_from_file(
             filepath=path_to_unaggregated_data,
             date_column=TIME_COLUMN_NAME,
-            resample_freq=resample_freq
+            resample_freq=resample_freq,
+            columnar=xiangying.wants_columnar()
         )
 
         if aggregated_data:
@@ -927,7 +1744,7 @@ def get_actual_aggregated_data_endpoint():
         return make_error_response("获取实际聚合数据时服务器出错。", 500, error_details=str(e))
 
 # MODIFIED /api/predict endpoint
-@app.route('/api/predict', methods=['POST'])
+@api.route('/api/predict', methods=['POST'])
 def predict_endpoint():
     logger.info("收到请求: 预测")
     data = request.get_json()
@@ -936,85 +1753,70 @@ def predict_endpoint():
 
     steps = data.get('steps')
     model_filename = data.get('model_filename', DEFAULT_MODEL_FILENAME)
-    confidence_level_percentage = data.get('confidence_level', 95) # 期望前端发送例如 90, 95, 99
+    # 期望前端发送例如 90, 95, 99；也可以发送列表 [80, 95] 一次获取多个置信区间
+    confidence_levels_raw = data.get('confidence_level', 95)
+    confidence_level_list = confidence_levels_raw if isinstance(confidence_levels_raw, list) else [confidence_levels_raw]
 
     if not isinstance(steps, int) or steps <= 0:
         return make_error_response("'steps' 必须是正整数。", 400)
     if not model_filename or not isinstance(model_filename, str):
         return make_error_response("'model_filename' 必须是有效的字符串。", 400)
-    if not isinstance(confidence_level_percentage, (int, float)) or not (0 < confidence_level_percentage < 100):
-        return make_error_response("'confidence_level' 必须是 (0, 100) 范围内的数字。", 400)
-
-    alpha = 1.0 - (confidence_level_percentage / 100.0) # 将百分比转换为 alpha值
+    if not confidence_level_list or not all(
+            isinstance(level, (int, float)) and not isinstance(level, bool) and 0 < level < 100
+            for level in confidence_level_list):
+        return make_error_response("'confidence_level' 必须是 (0, 100) 范围内的数字或此类数字的列表。", 400)
 
     if not model_filename.endswith(".joblib"): model_filename += ".joblib"
 
     try:
-        logger.info(f"从 '{MODEL_STORAGE_DIRECTORY}' 加载模型 '{model_filename}' 进行预测。")
-        loaded_model = xunlian.load_arima_model(
-            model_filename=model_filename,
+        logger.info(f"使用 '{MODEL_STORAGE_DIRECTORY}' 中的模型 '{model_filename}' 进行预测。")
+        forecast = xunlian.forecast_saved_model(
+            model_filename,
+            steps,
+            [level / 100.0 for level in confidence_level_list], # 将百分比转换为小数
             model_save_dir=MODEL_STORAGE_DIRECTORY
         )
-
-        if loaded_model is None:
+        if forecast is None:
             return make_error_response(f"未找到模型 '{model_filename}' 或加载失败。", 404)
 
-        predictions_series, lower_ci_series, upper_ci_series = xunlian.predict_with_model(
-            loaded_model,
-            steps=steps,
-            alpha=alpha # 传递 alpha
-        )
-
-        if predictions_series is None: # 如果预测失败，所有系列都将是 None
-            return make_error_response("预测失败或未返回结果。", 500)
-
-        results_list = []
-        # 假设 predict_with_model 总是返回 pd.Series (如果成功)
-        if isinstance(predictions_series, pd.Series):
-            timestamps_iso = [ts.isoformat() for ts in predictions_series.index.to_list()]
-            values_pred = predictions_series.values.tolist()
-            # 确保置信区间系列也存在且与预测系列长度一致
-            values_lower = lower_ci_series.values.tolist() if isinstance(lower_ci_series, pd.Series) else [None] * len(values_pred)
-            values_upper = upper_ci_series.values.tolist() if isinstance(upper_ci_series, pd.Series) else [None] * len(values_pred)
-
-            for i in range(len(timestamps_iso)):
-                results_list.append({
-                    "timestamp": timestamps_iso[i],
-                    "value": values_pred[i],
-                    "lower_ci": values_lower[i], # 新增置信区间下限
-                    "upper_ci": values_upper[i]  # 新增置信区间上限
-                })
-        # 如果 predict_with_model 可能返回 NumPy 数组 (尽管当前实现似乎总是 Series 或 None)
-        elif isinstance(predictions_series, np.ndarray):
-            logger.warning("预测返回了一个没有原生时间戳的 NumPy 数组。将使用占位符时间戳。")
-            timestamps_placeholder = [f"预测点_{i+1}" for i in range(len(predictions_series))]
-            values_pred = predictions_series.tolist()
-            values_lower = lower_ci_series.tolist() if isinstance(lower_ci_series, np.ndarray) else [None] * len(values_pred)
-            values_upper = upper_ci_series.tolist() if isinstance(upper_ci_series, np.ndarray) else [None] * len(values_pred)
-
-            for i in range(len(timestamps_placeholder)):
-                    results_list.append({
-                        "timestamp": timestamps_placeholder[i],
-                        "value": values_pred[i],
-                        "lower_ci": values_lower[i],
-                        "upper_ci": values_upper[i]
-                    })
+        columnar = xiangying.wants_columnar()
+        if isinstance(forecast['index'], pd.DatetimeIndex):
+            timestamps = xunlian.index_to_epoch_ms(forecast['index']) if columnar else xunlian.index_to_iso(forecast['index'])
         else:
-            return make_error_response("预测结果格式意外。", 500)
-
+            logger.warning("预测结果没有时间索引。将使用占位符时间戳。")
+            timestamps = [f"预测点_{i+1}" for i in range(len(forecast['mean']))]
+
+        # "predictions" 中的区间对应第一个置信水平，与单一置信水平时的旧格式保持一致
+        if columnar:
+            # 列式结果：每个字段一个数组，直接由 numpy 数组序列化
+            results_list = {"timestamps": timestamps, "values": forecast['mean'],
+                            "lower_ci": forecast['lower'][0], "upper_ci": forecast['upper'][0]}
+        else:
+            values_pred = forecast['mean'].tolist()
+            values_lower = forecast['lower'][0].tolist()
+            values_upper = forecast['upper'][0].tolist()
+            results_list = [
+                {"timestamp": timestamps[i], "value": values_pred[i],
+                 "lower_ci": values_lower[i], "upper_ci": values_upper[i]}
+                for i in range(len(timestamps))
+            ]
+        confidence_bands = [
+            {"confidence_level": level, "lower_ci": forecast['lower'][k], "upper_ci": forecast['upper'][k]}
+            for k, level in enumerate(confidence_level_list)
+        ]
 
+        levels_text = ", ".join(f"{level}%" for level in confidence_level_list)
         return make_success_response(
-            f"使用模型 '{model_filename}' 成功生成 {steps} 个预测步长 (置信水平: {confidence_level_percentage}%)。",
-            {"predictions": results_list, "model_used": model_filename} # "predictions" 结构已更新
+            f"使用模型 '{model_filename}' 成功生成 {steps} 个预测步长 (置信水平: {levels_text})。",
+            {"predictions": results_list, "confidence_bands": confidence_bands, "model_used": model_filename}
         )
-    except FileNotFoundError:
-        return make_error_response(f"在 {MODEL_STORAGE_DIRECTORY} 中未找到模型文件 '{model_filename}'。", 404)
     except Exception as e:
         logger.error(f"预测期间出错: {traceback.format_exc()}")
         return make_error_response("预测期间服务器出错。", 500, error_details=str(e))
 
 # NEW /api/get-area-aggregated-data endpoint
-@app.route('/api/get-area-aggregated-data', methods=['POST'])
+@api.route('/api/get-area-aggregated-data', methods=['POST'])
+@conditional_on_data_version
 def get_area_aggregated_data_endpoint():
     logger.info("收到请求: 根据地理区域聚合数据")
     data = request.get_json()
@@ -1079,8 +1881,9 @@ def get_area_aggregated_data_endpoint():
         if not os.path.exists(MASTER_CSV_PATH):
             return make_error_response(f"主数据文件 '{MASTER_CSV_PATH}' 未找到。", 500)
 
-        df_master = pd.read_csv(MASTER_CSV_PATH)
-        logger.info(f"从主数据文件加载了 {len(df_master)} 条记录。")
+        # 使用内存中缓存的主数据 (日期已解析、无效日期已删除，预热阶段已加载)，不再每次请求都读取并解析主CSV
+        df_master = qingxi.load_master_data(MASTER_CSV_PATH)
+        logger.info(f"使用内存中的主数据: {len(df_master)} 条记录。")
 
         # 确保关键列存在
         required_cols = [TIME_COLUMN_NAME, OFFENSE_COLUMN_NAME, 'latitude', 'longitude']
@@ -1088,26 +1891,16 @@ def get_area_aggregated_data_endpoint():
             if col not in df_master.columns:
                 return make_error_response(f"主数据文件中缺少必需的列: '{col}'。", 500)
 
-        # 转换时间列并处理错误
-        df_master[TIME_COLUMN_NAME] = pd.to_datetime(df_master[TIME_COLUMN_NAME], errors='coerce')
-        df_master.dropna(subset=[TIME_COLUMN_NAME, 'latitude', 'longitude'], inplace=True) # 删除无效日期或坐标的行
-
-        # 1. 按地理边界筛选
-        df_filtered = df_master[
-            (df_master['longitude'] >= min_lon) & (df_master['longitude'] <= max_lon) &
-            (df_master['latitude'] >= min_lat) & (df_master['latitude'] <= max_lat)
-        ].copy()
-        logger.info(f"地理筛选后剩余 {len(df_filtered)} 条记录。")
-
-        if df_filtered.empty:
-            return make_success_response("在指定区域和时间内没有找到匹配的数据。", {"timestamps": [], "values": []})
-
-        # 2. 按时间范围筛选 (包含 end_date 当天)
-        df_filtered = df_filtered[
-            (df_filtered[TIME_COLUMN_NAME] >= start_date) &
-            (df_filtered[TIME_COLUMN_NAME] < (end_date + pd.Timedelta(days=1))) # 小于结束日期的后一天
-        ]
-        logger.info(f"时间筛选后剩余 {len(df_filtered)} 条记录。")
+        # 1-2. 按地理边界和时间范围 (包含 end_date 当天) 筛选；时间范围由主数据的时间索引直接定位，
+        # 坐标缺失的记录不在任何边界内
+        area_spec = qingxi.normalize_filter_spec({
+            "start_date": start_date.strftime('%Y-%m-%d'),
+            "end_date": end_date.strftime('%Y-%m-%d'),
+            "bbox": [min_lon, min_lat, max_lon, max_lat],
+        })
+        with zhibiao.stage_timer('filter'):
+            df_filtered = qingxi.filter_master_data(df_master, area_spec)
+        logger.info(f"地理与时间筛选后剩余 {len(df_filtered)} 条记录。")
 
         if df_filtered.empty:
             return make_success_response("在指定区域和时间内没有找到匹配的数据。", {"timestamps": [], "values": []})
@@ -1121,17 +1914,14 @@ def get_area_aggregated_data_endpoint():
                     return make_success_response(f"在指定区域、时间和案件类型 ({offenses_req}) 下没有找到匹配的数据。", {"timestamps": [], "values": []})
 
 
-        # 4. 按指定频率聚合
-        df_filtered.set_index(TIME_COLUMN_NAME, inplace=True)
-        df_filtered.sort_index(inplace=True)
-        aggregated_series = df_filtered.resample(resample_freq).size().fillna(0.0)
-
-        timestamps_iso = [ts.isoformat() for ts in aggregated_series.index.to_list()]
-        values_agg = aggregated_series.values.tolist()
+        # 4. 按指定频率聚合 (只需要时间列；筛选结果是共享主数据的切片，不在其上原地修改)
+        with zhibiao.stage_timer('resample'):
+            event_times = pd.Series(1, index=pd.DatetimeIndex(df_filtered[TIME_COLUMN_NAME])).sort_index()
+            aggregated_series = event_times.resample(resample_freq).size().fillna(0.0)
 
         return make_success_response(
-            f"已成功聚合区域数据。聚合记录数: {len(values_agg)}",
-            {"timestamps": timestamps_iso, "values": values_agg, "filters_applied": {
+            f"已成功聚合区域数据。聚合记录数: {len(aggregated_series)}",
+            {**xunlian.series_to_chart_payload(aggregated_series, xiangying.wants_columnar()), "filters_applied": {
                 "bounds": [min_lon, min_lat, max_lon, max_lat],
                 "start_date": start_date_str,
                 "end_date": end_date_str,
@@ -1145,139 +1935,164 @@ def get_area_aggregated_data_endpoint():
         return make_error_response("聚合区域数据时服务器出错。", 500, error_details=str(e))
 
 # --- Shapefile 下载接口 ---
-@app.route('/generate_shp', methods=['POST'])
+@api.route('/generate_shp', methods=['POST'])
+@admission_controlled('export')
 def generate_shp():
     data = request.json
     if not data or 'features' not in data:
         return make_error_response("Invalid GeoJSON data provided.", 400)
 
     features_to_process = data['features']
-    filename_base = data.get('filename', 'crime_data') # 获取前端传入的文件名基础
-    print(f"Received request to generate SHP for {len(features_to_process)} features.")
+    filename_base = daochu.safe_file_stem(data.get('filename', 'crime_data')) # 获取前端传入的文件名基础
     logger.info(f"Received request to generate SHP for {len(features_to_process)} features.")
 
-    # 定义Shapefile的结构 (schema)
-    schema = {
-        'geometry': 'Point', # 假设你的数据是点数据
-        'properties': {} # 先初始化为空，然后动态填充
+    schema_properties = daochu.infer_shp_schema(features_to_process)
+
+    # 每个请求使用独占的临时目录，同名导出之间不会互相覆盖
+    temp_shp_dir = daochu.make_private_temp_dir(SHP_TEMP_DIR, prefix='shp_')
+    try:
+        export_gdf = daochu.features_to_geodataframe(features_to_process, schema_properties)
+        shp_file_path = os.path.join(temp_shp_dir, filename_base + '.shp')
+        zhixing.run_offloaded(zhixing.POOL_GEO, daochu.write_vector_file, export_gdf, shp_file_path,
+                              driver='ESRI Shapefile')
+        logger.info(f"Wrote {len(export_gdf)} features to {shp_file_path}, streaming {filename_base}.zip")
+    except Exception as e:
+        logger.error(f"Error generating SHP: {e}\n{traceback.format_exc()}") # 使用 logger 记录错误
+        daochu.remove_dir_quietly(temp_shp_dir)
+        return make_error_response(f"Failed to generate SHP file: {str(e)}", 500, error_details=traceback.format_exc())
+
+    # 边压缩边发送；生成器结束或客户端断开时都会清理临时目录
+    response = Response(
+        daochu.stream_zip_and_cleanup(temp_shp_dir),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f"attachment; filename*=UTF-8''{quote(filename_base)}.zip"}
+    )
+    response.call_on_close(lambda: daochu.remove_dir_quietly(temp_shp_dir))
+    return response
+
+# --- 异步 Shapefile 导出任务接口 ---
+def export_job_payload(job):
+    """将任务记录转换为返回给前端的状态结构 (不暴露服务器路径)。"""
+    done, total = job['progress']['done'], job['progress']['total']
+    payload = {
+        "job_id": job['job_id'],
+        "status": job['status'],
+        "rows_written": done,
+        "rows_total": total,
+        "progress": round(done / total, 4) if total else (1.0 if job['status'] == renwu.JOB_SUCCEEDED else 0.0),
+        "filename": job['params'].get('filename'),
+        "error": job['error'],
     }
+    if job['status'] == renwu.JOB_SUCCEEDED:
+        payload["download_url"] = f"/api/export-jobs/{job['job_id']}/download"
+    return payload
 
-    if features_to_process:
-        first_feature_props = features_to_process[0]['properties']
-        for key, value in first_feature_props.items():
-            if isinstance(value, str):
-                schema['properties'][key] = 'str:255' # 默认字符串长度，可根据实际数据调整
-            elif isinstance(value, int):
-                schema['properties'][key] = 'int'
-            elif isinstance(value, float):
-                schema['properties'][key] = 'float'
-            else:
-                schema['properties'][key] = 'str:255' # 默认转换为字符串，并指定长度
+@api.route('/api/export-jobs', methods=['POST'])
+def submit_export_job():
+    data = request.get_json()
+    if not data or not isinstance(data.get('features'), list):
+        return make_error_response("Invalid GeoJSON data provided.", 400)
 
-        print("Inferred schema properties:", schema['properties'])
-        logger.info(f"Inferred SHP schema properties: {schema['properties']}")
-    else:
-        schema['properties'] = {
-            'ID': 'str:20',
-            'Name': 'str:255'
-        }
-        print("No features provided, using default minimal schema.")
-        logger.warning("No features provided for SHP generation, using default minimal schema.")
+    features_to_process = data['features']
+    filename_base = daochu.safe_file_stem(data.get('filename', 'crime_data'))
+    try:
+        job_id = export_job_manager.submit(
+            'shp_export',
+            daochu.run_shp_export_job,
+            features_to_process,
+            filename_base,
+            output_dir=EXPORT_JOB_DIR,
+            work_base_dir=SHP_TEMP_DIR,
+            params={'filename': filename_base + '.zip', 'num_features': len(features_to_process)}
+        )
+    except renwu.JobQueueFull as e:
+        response, status_code = make_error_response(str(e), 503)
+        response.headers['Retry-After'] = '30'
+        return response, status_code
+
+    return make_success_response(
+        f"已提交 Shapefile 导出任务，共 {len(features_to_process)} 个要素。",
+        export_job_payload(export_job_manager.get(job_id)),
+        status_code=202
+    )
 
+@api.route('/api/export-jobs/<job_id>', methods=['GET'])
+def get_export_job_status(job_id):
+    export_job_manager.expire_artifacts()
+    job = export_job_manager.get(job_id)
+    if job is None:
+        return make_error_response(f"导出任务 '{job_id}' 不存在或已被清理。", 404)
+    return make_success_response(f"导出任务状态: {job['status']}", export_job_payload(job))
+
+@api.route('/api/export-jobs/<job_id>/download', methods=['GET'])
+def download_export_job(job_id):
+    export_job_manager.expire_artifacts()
+    job = export_job_manager.get(job_id)
+    if job is None:
+        return make_error_response(f"导出任务 '{job_id}' 不存在或已被清理。", 404)
+    if job['status'] == renwu.JOB_EXPIRED:
+        return make_error_response(f"导出任务 '{job_id}' 的结果已过期，请重新提交。", 410)
+    if job['status'] != renwu.JOB_SUCCEEDED:
+        return make_error_response(f"导出任务 '{job_id}' 尚未完成 (状态: {job['status']})。", 409,
+                                   data=export_job_payload(job))
+    # conditional=True: 支持 HTTP Range (206) 与 If-Range，可断点续传
+    return send_file(
+        job['result'],
+        mimetype='application/zip',
+        as_attachment=True,
+        download_name=job['params'].get('filename', 'crime_data.zip'),
+        conditional=True
+    )
 
-    zip_buffer = io.BytesIO()
+# --- 按筛选条件导出接口 (GeoPackage / FlatGeobuf / GeoParquet / Shapefile) ---
+@api.route('/api/export', methods=['POST'])
+@admission_controlled('export')
+def export_filtered_data_endpoint():
+    logger.info("收到请求: 按筛选条件导出数据")
+    data = request.get_json()
+    if not data:
+        return make_error_response("请求体不能为空。", 400)
 
     try:
-        shp_base_name = filename_base
-        # Fiona 在写入文件时需要一个实际的路径，不能直接写入 BytesIO
-        # 所以先写入临时文件，再打包成zip
-        temp_shp_dir = os.path.join(SHP_TEMP_DIR, shp_base_name + "_temp")
-        os.makedirs(temp_shp_dir, exist_ok=True)
-        
-        shp_file_path = os.path.join(temp_shp_dir, shp_base_name + '.shp')
-
-        with fiona.open(
-            shp_file_path,
-            'w',
-            driver='ESRI Shapefile',
-            crs='EPSG:4326', # WGS84 坐标系
-            schema=schema,
-            encoding='utf-8' # 使用UTF-8编码，支持中文属性
-        ) as collection:
-            for feature in features_to_process:
-                if feature['geometry']['type'] == 'Point':
-                    point = Point(feature['geometry']['coordinates'])
-                    properties = {}
-                    for prop_name, prop_type_str in schema['properties'].items():
-                        prop_value = feature['properties'].get(prop_name)
-                        target_type = prop_type_str.split(':')[0]
-
-                        if prop_value is None:
-                            if target_type == 'str':
-                                properties[prop_name] = ''
-                            elif target_type in ['int', 'float']:
-                                properties[prop_name] = 0
-                            else:
-                                properties[prop_name] = None
-                        else:
-                            try:
-                                if target_type == 'str':
-                                    properties[prop_name] = str(prop_value)
-                                elif target_type == 'int':
-                                    properties[prop_name] = int(prop_value)
-                                elif target_type == 'float':
-                                    properties[prop_name] = float(prop_value)
-                                else:
-                                    properties[prop_name] = prop_value
-                            except (ValueError, TypeError):
-                                logger.warning(f"Warning: Could not convert property '{prop_name}' value '{prop_value}' to type '{target_type}'. Setting to default/empty.")
-                                if target_type == 'str':
-                                    properties[prop_name] = str(prop_value) if prop_value is not None else ''
-                                else:
-                                    properties[prop_name] = None
-
-                    collection.write({
-                        'geometry': mapping(point),
-                        'properties': properties
-                    })
-                else:
-                    logger.warning(f"Skipping non-Point geometry: {feature['geometry']['type']} for feature with properties: {feature['properties'].get('OFFENSE', 'N/A')}")
-                    print(f"Skipping non-Point geometry: {feature['geometry']['type']} for feature with properties: {feature['properties'].get('OFFENSE', 'N/A')}")
-
-        # 将生成的Shapefile及其辅助文件打包成zip
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for file_name in os.listdir(temp_shp_dir):
-                file_path = os.path.join(temp_shp_dir, file_name)
-                zf.write(file_path, file_name) # 将文件添加到zip的根目录
-
-        zip_buffer.seek(0)
-
-        # 清理临时文件
-        for file_name in os.listdir(temp_shp_dir):
-            os.remove(os.path.join(temp_shp_dir, file_name))
-        os.rmdir(temp_shp_dir) # 移除临时目录
-        
-        logger.info(f"Successfully generated and zipped {filename_base}.zip")
-        return send_file(
-            zip_buffer,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f"{filename_base}.zip"
-        )
+        export_format = daochu.resolve_export_format(data.get('format', 'gpkg'))
+        normalized_spec = qingxi.normalize_filter_spec(data)
+    except ValueError as e:
+        return make_error_response(str(e), 400)
+    filename_base = daochu.safe_file_stem(data.get('filename', 'crime_data'))
 
-    except Exception as e:
-        logger.error(f"Error generating SHP: {e}\n{traceback.format_exc()}") # 使用 logger 记录错误
-        for file_name in os.listdir(SHP_TEMP_DIR): # 尝试清理可能遗留的文件
-            if file_name.startswith(shp_base_name):
-                try:
-                    os.remove(os.path.join(SHP_TEMP_DIR, file_name))
-                except OSError as clean_error:
-                    logger.error(f"Error cleaning up temp file {file_name}: {clean_error}")
+    data_version = qingxi.get_master_data_version(MASTER_CSV_PATH)
+    if data_version is None:
+        return make_error_response(f"主数据文件 '{MASTER_CSV_PATH}' 未找到。", 500)
 
-        return make_error_response(f"Failed to generate SHP file: {str(e)}", 500, error_details=traceback.format_exc())
+    try:
+        spec_hash = qingxi.filter_spec_hash(normalized_spec)
+        # 主数据只在缓存未命中时加载
+        export_path, cache_hit = daochu.get_or_create_filtered_export(
+            lambda: qingxi.load_master_data(MASTER_CSV_PATH),
+            normalized_spec, spec_hash, export_format, data_version, EXPORT_CACHE_DIR
+        )
+        zhibiao.record_cache('export', cache_hit)
+    except ValueError as e:
+        return make_error_response(str(e), 400)
+    except Exception as e:
+        logger.error(f"/api/export 出错: {traceback.format_exc()}")
+        return make_error_response("导出数据时服务器出错。", 500, error_details=str(e))
+
+    fmt_info = daochu.EXPORT_FORMATS[export_format]
+    response = send_file(
+        export_path,
+        mimetype=fmt_info['mimetype'],
+        as_attachment=True,
+        download_name=filename_base + fmt_info['extension'],
+        conditional=True
+    )
+    response.headers['X-Export-Cache'] = 'HIT' if cache_hit else 'MISS'
+    return response
 
 # --- 热点分析接口 ---
-@app.route('/api/hotspot-analysis', methods=['POST'])
+@api.route('/api/hotspot-analysis', methods=['POST'])
+@conditional_on_data_version
+@coalesce_identical_requests('hotspot')
 def hotspot_analysis():
     data = request.get_json()
     crime_data_points = data.get('crimeData')
@@ -1285,12 +2100,14 @@ def hotspot_analysis():
     if not crime_data_points:
         return make_error_response("未提供犯罪数据。请确保前端发送了正确的犯罪数据。", 400)
 
-    points = [Point(d['longitude'], d['latitude']) for d in crime_data_points]
+    gpd = dili.load_geopandas()
+    from libpysal.weights import DistanceBand # libpysal 导入约需 1 秒，只在热点分析时导入
+
+    # 一次性构建点几何 (points_from_xy)，避免逐点创建 Point 对象长时间占用 GIL
+    crime_df = pd.DataFrame(crime_data_points, columns=['longitude', 'latitude', 'offenseType'])
     crime_gdf = gpd.GeoDataFrame(
-        [{'longitude': d['longitude'], 'latitude': d['latitude'], 'offenseType': d['offenseType']}
-            for d in crime_data_points
-        ],
-        geometry=points,
+        crime_df,
+        geometry=gpd.points_from_xy(crime_df['longitude'], crime_df['latitude']),
         crs="EPSG:4326" # 犯罪点原始 CRS
     )
     logger.info(f"接收到 {len(crime_gdf)} 个犯罪点。")
@@ -1334,12 +2151,16 @@ def hotspot_analysis():
             logger.warning("空间连接前犯罪点数据为空或无效。这将导致所有社区犯罪计数为0。")
             # return make_success_response("没有有效的犯罪点数据进行空间连接。所有社区犯罪数量将为0。", data={'features': []}) # 也可以直接返回空结果或0
             
-        community_crime_counts_with_temp_id = gpd.sjoin(
-            analysis_gdf_for_sjoin, # 使用过滤后的边界
-            crime_gdf_proj_for_sjoin, # 使用过滤后的犯罪点
-            how="left",
-            predicate='intersects'
-        )
+        # sjoin 在 GEOS 中运行 (大部分时间释放 GIL)，放到有界线程池中执行
+        with zhibiao.stage_timer('sjoin'):
+            community_crime_counts_with_temp_id = zhixing.run_offloaded(
+                zhixing.POOL_GEO,
+                gpd.sjoin,
+                analysis_gdf_for_sjoin, # 使用过滤后的边界
+                crime_gdf_proj_for_sjoin, # 使用过滤后的犯罪点
+                how="left",
+                predicate='intersects'
+            )
         logger.info(f"gpd.sjoin 完成。结果 GeoDataFrame 形状: {community_crime_counts_with_temp_id.shape}")
         # logger.debug(f"sjoin 结果前5行 (检查 index_right 是否非空):\n{community_crime_counts_with_temp_id[['temp_analysis_id', 'index_right']].head()}") # 调试用
 
@@ -1390,20 +2211,16 @@ def hotspot_analysis():
         logger.info(f"前端传入的 max_distance (米): {max_distance:.2f}")
     else:
         if len(centroids_proj) > 1:
-            distances = []
             # 抽样计算距离，避免大数据量下的性能问题
             sample_size = min(200, len(centroids_proj))
             sample_indices = np.random.choice(len(centroids_proj), sample_size, replace=False)
-            
-            # 使用列表推导式提高效率
-            distances = [
-                centroids_proj.iloc[i].distance(centroids_proj.iloc[j])
-                for i in sample_indices
-                for j in sample_indices
-                if i != j
-            ]
-            
-            if distances:
+
+            # 质心两两距离一次性用数组计算 (不含自身)
+            sample_xy = np.column_stack([centroids_proj.x.values, centroids_proj.y.values])[sample_indices]
+            pairwise = np.hypot(sample_xy[:, None, 0] - sample_xy[None, :, 0], sample_xy[:, None, 1] - sample_xy[None, :, 1])
+            distances = pairwise[~np.eye(sample_size, dtype=bool)]
+
+            if distances.size:
                 max_distance = np.percentile(distances, 50) * 0.4
                 logger.info(f"动态计算的 max_distance (米): {max_distance:.2f}")
             else:
@@ -1419,8 +2236,9 @@ def hotspot_analysis():
 
     logger.info(f"使用 max_distance={max_distance:.2f} 米创建空间权重矩阵...")
     try:
-        W = DistanceBand.from_dataframe(analysis_gdf, threshold=max_distance, binary=True)
-        W.transform = 'R'
+        with zhibiao.stage_timer('weights_build'):
+            W = DistanceBand.from_dataframe(analysis_gdf, threshold=max_distance, binary=True)
+            W.transform = 'R'
         logger.info("空间权重矩阵创建完成。")
     except Exception as e:
         logger.error(f"创建空间权重矩阵失败: {e}\n{traceback.format_exc()}")
@@ -1437,8 +2255,9 @@ def hotspot_analysis():
         
         if len(analysis_gdf) > 1: # 移除孤立点后，确保仍有足够数据进行分析
             try:
-                W = DistanceBand.from_dataframe(analysis_gdf, threshold=max_distance, binary=True)
-                W.transform = 'R'
+                with zhibiao.stage_timer('weights_build'):
+                    W = DistanceBand.from_dataframe(analysis_gdf, threshold=max_distance, binary=True)
+                    W.transform = 'R'
                 logger.info(f"已移除孤立区域，并重新创建了空间权重矩阵。剩余 {len(analysis_gdf)} 个区域。")
             except Exception as e:
                 logger.error(f"移除孤立区域后重新创建空间权重矩阵失败: {e}\n{traceback.format_exc()}")
@@ -1469,14 +2288,16 @@ def hotspot_analysis():
                                      status_code=200)
 
     try:
-        gi_star = G_Local(z, W, star=True)
+        # 置换检验持有 GIL，放到进程池中计算，避免阻塞本进程的其他请求
+        with zhibiao.stage_timer('g_local'):
+            gi_star_values, gi_star_p_values = zhixing.run_offloaded(zhixing.POOL_CPU, redian.local_g_star, z, W)
         logger.info("Getis-Ord Gi* 计算完成。")
     except Exception as e:
         logger.error(f"执行 Getis-Ord Gi* 计算失败: {e}\n{traceback.format_exc()}")
         return make_error_response(f"执行热点分析计算失败: {e}", 500, error_details=traceback.format_exc())
 
-    analysis_gdf['gi_star'] = gi_star.Gs
-    analysis_gdf['p_value'] = gi_star.p_sim
+    analysis_gdf['gi_star'] = gi_star_values
+    analysis_gdf['p_value'] = gi_star_p_values
     logger.info("Gi* 值和 P 值已添加到 GeoDataFrame。")
     # logger.debug(f"前5个社区的犯罪数量、Gi* 和 P 值:\n{analysis_gdf[['name_for_display', 'crime_count', 'gi_star', 'p_value']].head()}") # 调试用
 
@@ -1495,29 +2316,161 @@ def hotspot_analysis():
     output_gdf.rename(columns={'name_for_display': 'name'}, inplace=True)
 
     logger.info("GeoJSON 数据准备完毕，返回给前端。")
-    # 使用 make_success_response 封装 GeoJSON 响应
-    # 注意：gpd.GeoDataFrame.to_json() 返回的是字符串，jsonify 会再次对其进行解析。
-    # 更好的做法是让 jsonify 直接处理 GeoDataFrame 的字典表示（通过 .__geo_interface__ 或 to_dict('records')）
-    # 但由于您的前端直接期望 to_json() 的输出，我们可以直接返回字符串，但确保 Content-Type 正确。
-    # Flask jsonify 会自动设置 Content-Type 为 application/json，所以直接传递 to_json() 的结果字符串即可。
-    return jsonify(json.loads(output_gdf.to_json())), 200 # 再次解析，确保返回的是Python字典而不是原始字符串
+    # 由 to_geo_dict() 直接序列化为 GeoJSON (按需压缩)，不再经过 to_json() 字符串解析后重新编码
+    return xiangying.json_response(output_gdf.to_geo_dict()), 200
+
+# --- 热点分析距离带扫描接口 ---
+def get_community_distance_pairs():
+    """返回基于社区质心的排序距离对结构；首次调用时计算并缓存。"""
+    global community_distance_pairs
+    cached = community_distance_pairs is not None and community_distance_pairs["n"] == len(community_gdf)
+    zhibiao.record_cache('community_distance_pairs', cached)
+    if not cached:
+        with zhibiao.stage_timer('weights_build'):
+            centroids = community_gdf.geometry.centroid
+            coords = np.column_stack([centroids.x.values, centroids.y.values])
+            community_distance_pairs = redian.build_sorted_distance_pairs(coords)
+        logger.info(f"已缓存 {len(community_gdf)} 个社区质心的排序距离对。")
+    return community_distance_pairs
+
+def count_crimes_per_community(crime_data_points):
+    """将犯罪点批量投影并与社区边界做空间连接，返回与 community_gdf 行顺序一致的计数数组。"""
+    crime_df = pd.DataFrame(crime_data_points, columns=['longitude', 'latitude'])
+    crime_df = crime_df.apply(pd.to_numeric, errors='coerce').dropna()
+    gpd = dili.load_geopandas()
+    crime_points = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(crime_df['longitude'], crime_df['latitude']),
+        crs="EPSG:4326"
+    ).to_crs(community_gdf.crs)
+    with zhibiao.stage_timer('sjoin'):
+        joined = gpd.sjoin(community_gdf[['geometry']], crime_points, how="inner", predicate='intersects')
+    counts = joined.index.value_counts().reindex(community_gdf.index, fill_value=0)
+    return counts.values.astype(float)
+
+@api.route('/api/hotspot-distance-sweep', methods=['POST'])
+@conditional_on_data_version
+@coalesce_identical_requests('hotspot')
+def hotspot_distance_sweep():
+    logger.info("收到请求: 热点分析距离带扫描")
+    data = request.get_json()
+    if not data:
+        return make_error_response("请求体不能为空。", 400)
+
+    crime_data_points = data.get('crimeData')
+    if not crime_data_points:
+        return make_error_response("未提供犯罪数据。请确保前端发送了正确的犯罪数据。", 400)
+    if community_gdf is None or community_gdf.empty:
+        return make_error_response("后端未加载有效的社区边界数据，无法进行距离带扫描。", 500)
+
+    thresholds_req = data.get('thresholds')
+    num_steps = data.get('numThresholds', redian.DEFAULT_SWEEP_STEPS)
+    min_distance = data.get('minDistance')
+    max_distance = data.get('maxDistance')
+
+    if thresholds_req is not None:
+        if not isinstance(thresholds_req, list) or not thresholds_req or \
+           not all(isinstance(t, (int, float)) and t > 0 for t in thresholds_req):
+            return make_error_response("'thresholds' 必须是正数列表 (米)。", 400)
+    if not isinstance(num_steps, int) or not (2 <= num_steps <= 500):
+        return make_error_response("'numThresholds' 必须是 2 到 500 之间的整数。", 400)
+    for name, value in (('minDistance', min_distance), ('maxDistance', max_distance)):
+        if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+            return make_error_response(f"'{name}' 必须是正数 (米)。", 400)
+
+    try:
+        pairs = get_community_distance_pairs()
+        values = count_crimes_per_community(crime_data_points)
+        logger.info(f"距离带扫描: {len(values)} 个社区，犯罪点总数 {values.sum():.0f}。")
+
+        if np.all(values == values[0]):
+            return make_error_response("所有区域的犯罪数量相同，无法计算空间自相关。", 400)
+
+        if thresholds_req is not None:
+            thresholds = np.sort(np.asarray(thresholds_req, dtype=float))
+        elif min_distance is not None or max_distance is not None:
+            default_range = redian.default_sweep_thresholds(pairs, num_steps)
+            start = float(min_distance) if min_distance is not None else float(default_range[0])
+            end = float(max_distance) if max_distance is not None else float(default_range[-1])
+            if start >= end:
+                return make_error_response("'minDistance' 必须小于 'maxDistance'。", 400)
+            thresholds = np.linspace(start, end, num_steps)
+        else:
+            thresholds = redian.default_sweep_thresholds(pairs, num_steps)
+
+        sweep = redian.distance_band_sweep(values, pairs, thresholds)
+    except ValueError as e:
+        return make_error_response(f"距离带扫描参数无效: {e}", 400)
+    except Exception as e:
+        logger.error(f"距离带扫描失败: {e}\n{traceback.format_exc()}")
+        return make_error_response(f"距离带扫描失败: {e}", 500, error_details=traceback.format_exc())
+
+    def to_list(arr):
+        return [None if np.isnan(v) else float(v) for v in np.asarray(arr, dtype=float)]
+
+    return make_success_response(
+        f"已完成 {len(thresholds)} 个距离阈值的空间自相关扫描。",
+        {
+            "distances": to_list(sweep["distances"]),
+            "moran_i": to_list(sweep["moran_i"]),
+            "moran_z": to_list(sweep["moran_z"]),
+            "general_g": to_list(sweep["general_g"]),
+            "general_g_z": to_list(sweep["general_g_z"]),
+            "mean_neighbors": to_list(sweep["mean_neighbors"]),
+            "isolated_regions": sweep["isolated_regions"].astype(int).tolist(),
+            "peak_distance": sweep["peak_distance"],
+            "first_peak_distance": sweep["first_peak_distance"],
+            "num_regions": int(pairs["n"]),
+        }
+    )
 
 # --- 主运行块 ---
+def create_app(config: dict = None, warm_up: bool = False) -> Flask:
+    """
+    应用工厂：新建 Flask 应用，应用 DEFAULT_APP_CONFIG 与 config 中的配置，配置 CORS，注册路由蓝图，
+    并挂载请求指标与预热钩子。warm_up=True 时先在当前线程中预加载共享数据 (见 warm_up_shared_data)。
+    预热的数据、任务管理器与准入控制等是模块级的，同一进程中的多个应用实例共用。
+    生产环境请通过 wsgi.py 以多进程方式运行 (gunicorn --preload)，而不是 app.run()。
+    """
+    flask_app = Flask(__name__)
+    flask_app.config.from_mapping(DEFAULT_APP_CONFIG)
+    flask_app.config.from_mapping(config or {})
+    # 前端需读取 ETag 以发送 If-None-Match
+    CORS(flask_app, resources={r"/*": {"origins": flask_app.config['CORS_ORIGINS']}}, expose_headers=["ETag"])
+    flask_app.register_blueprint(api)
+
+    # 指标钩子先于预热钩子：首个请求等待预热的时间也计入请求耗时
+    flask_app.before_request(start_request_metrics)
+    flask_app.before_request(ensure_shared_data_loaded)
+    flask_app.after_request(record_request_metrics)
+    flask_app.teardown_request(finish_request_metrics)
+
+    if warm_up and not shared_data_warmed_up:
+        warm_up_shared_data()
+    return flask_app
+
+# 默认应用实例 (flask run、python app.py 以及直接 import app 的脚本使用)
+app = create_app()
+
 if __name__ == '__main__':
-    logger.info(f"Flask 应用程序启动中...")
-    # 检查主数据文件是否存在
-    if not os.path.exists(MASTER_CSV_PATH):
-        logger.critical(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-        logger.critical(f"主数据文件 '{MASTER_CSV_PATH}' 未找到。")
-        logger.critical(f"请首先运行 'qingxi.py' 脚本以生成主数据文件。")
-        logger.critical(f"没有它，应用程序可能无法正常运行。")
-        logger.critical(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-    # 检查社区边界文件是否加载
-    if community_gdf is None or community_gdf.empty:
-        logger.critical(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-        logger.critical(f"社区边界文件 '{COMMUNITY_BOUNDARIES_PATH}' 未加载或为空。")
-        logger.critical(f"热点分析功能可能无法正常使用。")
-        logger.critical(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+    debug = True
+    # 调试模式下 Werkzeug 重载器在子进程中重新运行本模块并由子进程提供服务，
+    # 父进程只监视文件变化，不做预热和启动检查
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        logger.info(f"Flask 应用程序启动中...")
+        warm_up_shared_data()
+        # 检查主数据文件是否存在
+        if not os.path.exists(MASTER_CSV_PATH):
+            logger.critical(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+            logger.critical(f"主数据文件 '{MASTER_CSV_PATH}' 未找到。")
+            logger.critical(f"请首先运行 'qingxi.py' 脚本以生成主数据文件。")
+            logger.critical(f"没有它，应用程序可能无法正常运行。")
+            logger.critical(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+        # 检查社区边界文件是否加载
+        if community_gdf is None or community_gdf.empty:
+            logger.critical(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
+            logger.critical(f"社区边界文件 '{COMMUNITY_BOUNDARIES_PATH}' 未加载或为空。")
+            logger.critical(f"热点分析功能可能无法正常使用。")
+            logger.critical(f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
 
     # 确保 CORS 头部在所有路由中都正确设置
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=debug, host='0.0.0.0', port=5000)
@@ -0,0 +1,85 @@
+"""
+ASGI 入口：与 wsgi.py 提供相同的路由，适合用 uvicorn 等 ASGI 服务器运行。
+
+在 python/ 目录下运行，例如:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+
+GET /api/status、GET /api/ready (就绪检查) 与 GET /metrics (Prometheus 抓取) 直接在事件循环中应答，不经过线程池，重负载时依然即时返回；
+其余路由由 a2wsgi 的 WSGIMiddleware 在线程池中运行原有的 Flask 视图，每个请求占用池中的一个线程
+(asgiref 的 WsgiToAsgi 默认 thread_sensitive，所有请求串行地运行在同一个线程上，慢请求会挡住其他请求)。
+线程数默认取各类重接口的准入上限 (执行 + 排队) 之和再加 ASGI_LIGHT_THREADS，
+重接口全部占满时轻量请求仍有空闲线程，可通过 ASGI_WSGI_THREADS 直接指定。
+视图中的重计算 (sjoin、Gi* 置换检验、ARIMA 拟合、SHP 写出) 再由 zhixing 分派到有界的
+进程池/线程池 (并发上限见 OFFLOAD_CPU_WORKERS / OFFLOAD_GEO_WORKERS)，
+因此慢请求不会占满整个工作进程，轻量的状态和聚合请求的延迟保持平稳。
+"""
+import os
+from a2wsgi import WSGIMiddleware
+import app as backend
+import zhixing
+import xunlian
+import xiangying
+import yure
+import zhibiao
+
+# 重接口占满准入名额 (含排队) 后，留给聚合、预测等轻量请求的线程数
+ASGI_LIGHT_THREADS = int(os.environ.get('ASGI_LIGHT_THREADS', 8))
+WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', ASGI_LIGHT_THREADS + sum(
+    controller.max_concurrent + controller.max_queue for controller in backend.admission_controllers.values())))
+
+flask_application = backend.create_app(warm_up=True)
+# 直接应答的接口使用与 Flask 应用相同的 CORS 配置
+ALLOWED_ORIGIN = flask_application.config['CORS_ORIGINS']
+wsgi_application = WSGIMiddleware(flask_application, workers=WSGI_THREADS)
+
+
+async def _send_json(send, status_code: int, payload: dict, origin: bytes = None, extra_headers: list = None):
+    body = xiangying.dumps(payload)
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode('ascii'))]
+    headers += extra_headers or []
+    if origin == ALLOWED_ORIGIN.encode('ascii'):
+        headers += [(b'access-control-allow-origin', origin), (b'vary', b'Origin')]
+    await send({'type': 'http.response.start', 'status': status_code, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            zhixing.shutdown_pools(wait=False)
+            xunlian.shutdown_fit_pool()
+            wsgi_application.executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/api/status':
+        origin = dict(scope.get('headers') or []).get(b'origin')
+        status_message, status_data = backend.status_payload()
+        await _send_json(send, 200, {"status": "success", "message": status_message, "data": status_data}, origin)
+        return
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/api/ready':
+        origin = dict(scope.get('headers') or []).get(b'origin')
+        ready, message, report = backend.readiness_payload()
+        if ready:
+            await _send_json(send, 200, {"status": "success", "message": message, "data": report}, origin)
+        else:
+            backend.warm_up_scheduler.start() # 在后台继续 (或重新开始) 预热，不阻塞事件循环
+            await _send_json(send, 503, {"status": "error", "message": message, "data": report}, origin,
+                             [(b'retry-after', str(yure.READY_RETRY_AFTER_SECONDS).encode('ascii'))])
+        return
+    if scope['type'] == 'http' and scope['method'] == 'GET' and scope['path'] == '/metrics':
+        body = zhibiao.REGISTRY.render().encode('utf-8')
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', zhibiao.CONTENT_TYPE.encode('ascii')),
+                                (b'content-length', str(len(body)).encode('ascii'))]})
+        await send({'type': 'http.response.body', 'body': body})
+        return
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,319 @@
+"""
+性能基准脚本 (手动运行，不属于测试)。
+
+用法:
+    python benchmarks.py model-artifacts [--model-dir trained_models] [--repeat 20]
+    python benchmarks.py serve-scaling [--workers 1 2 4] [--concurrency 16] [--duration 10]  (需要 gunicorn)
+    python benchmarks.py mixed-load --url http://127.0.0.1:5000 [--heavy-concurrency 4] [--duration 20]
+    python benchmarks.py startup [--repeat 5] [--master-csv processed_data/master_crime_data_2014-2024.csv]
+"""
+import os
+import sys
+import time
+import glob
+import shutil
+import argparse
+import json
+import tempfile
+import threading
+import statistics
+import subprocess
+import multiprocessing
+import urllib.request
+import joblib
+import moxing
+
+
+def _time_call(func, repeat: int) -> float:
+    """返回 func 多次调用耗时的中位数 (毫秒)。"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def bench_model_artifacts(args) -> int:
+    """对比完整 joblib 模型与精简产物的文件大小、加载耗时和加载+预测耗时。"""
+    paths = sorted(glob.glob(os.path.join(args.model_dir, '*.joblib')))
+    work_dir = tempfile.mkdtemp(prefix='bench_models_')
+    rows = []
+    try:
+        for path in paths:
+            full_model = joblib.load(path)
+            if not hasattr(full_model, 'filter_results'):
+                continue # 已经是精简格式或不是 ARIMA 结果
+            artifact = moxing.build_slim_artifact(full_model)
+            if artifact is None:
+                continue
+            slim_path = os.path.join(work_dir, os.path.basename(path))
+            joblib.dump(artifact, slim_path)
+
+            full_load = _time_call(lambda: joblib.load(path), args.repeat)
+            slim_load = _time_call(lambda: moxing.restore_model(joblib.load(slim_path)), args.repeat)
+            full_forecast = _time_call(lambda: joblib.load(path).get_forecast(args.steps), args.repeat)
+            slim_forecast = _time_call(lambda: moxing.restore_model(joblib.load(slim_path)).get_forecast(args.steps),
+                                       args.repeat)
+            rows.append((os.path.basename(path), os.path.getsize(path), os.path.getsize(slim_path),
+                         full_load, slim_load, full_forecast, slim_forecast))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not rows:
+        print(f"'{args.model_dir}' 中没有可对比的完整格式 ARIMA 模型。")
+        return 1
+    print(f"{'模型':<48}{'完整字节':>12}{'精简字节':>10}{'完整加载ms':>12}{'精简加载ms':>12}"
+          f"{'完整加载+预测ms':>16}{'精简加载+预测ms':>16}")
+    for name, full_size, slim_size, full_load, slim_load, full_fc, slim_fc in rows:
+        print(f"{name:<48}{full_size:>12}{slim_size:>10}{full_load:>12.2f}{slim_load:>12.2f}{full_fc:>16.2f}{slim_fc:>16.2f}")
+    total_full = sum(r[1] for r in rows)
+    total_slim = sum(r[2] for r in rows)
+    print(f"合计: {len(rows)} 个模型，{total_full} -> {total_slim} 字节 ({total_slim / total_full:.1%})；"
+          f"加载耗时中位数 {statistics.median(r[3] for r in rows):.2f} -> {statistics.median(r[4] for r in rows):.2f} ms")
+    return 0
+
+
+def _load_client(url: str, duration: float, start_barrier, results) -> None:
+    """压测客户端进程：所有客户端就绪后同时开始，在 duration 秒内循环请求 url，汇报 (成功数, 失败数)。"""
+    start_barrier.wait()
+    deadline = time.time() + duration
+    succeeded = failed = 0
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response:
+                response.read()
+            succeeded += 1
+        except Exception:
+            failed += 1
+    results.put((succeeded, failed))
+
+
+def _wait_for_server(base_url: str, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/api/ready', timeout=5): # 预热未完成时返回 503 (抛出 HTTPError)
+                return True
+        except Exception:
+            time.sleep(0.5)
+    return False
+
+
+def bench_serve_scaling(args) -> int:
+    """用 gunicorn --preload 分别以不同工作进程数启动 wsgi:application，测量同一请求的吞吐量 (请求/秒)。"""
+    if shutil.which('gunicorn') is None:
+        print("未找到 gunicorn，请先安装后再运行该基准。")
+        return 1
+    base_url = f"http://127.0.0.1:{args.port}"
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for workers in args.workers:
+        server = subprocess.Popen(
+            ['gunicorn', '--preload', '--workers', str(workers), '--bind', f"127.0.0.1:{args.port}", 'wsgi:application'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            if not _wait_for_server(base_url, args.startup_timeout):
+                print(f"{workers} 个工作进程: 服务在 {args.startup_timeout} 秒内未就绪。")
+                return 1
+            started = time.perf_counter()
+            with urllib.request.urlopen(base_url + args.path, timeout=120) as response: # 先请求一次，排除首次计算
+                response.read()
+            first_request_ms = (time.perf_counter() - started) * 1000
+
+            results = context.Queue()
+            start_barrier = context.Barrier(args.concurrency)
+            clients = [context.Process(target=_load_client,
+                                       args=(base_url + args.path, args.duration, start_barrier, results))
+                       for _ in range(args.concurrency)]
+            for client in clients:
+                client.start()
+            counts = [results.get() for _ in clients]
+            for client in clients:
+                client.join()
+            succeeded = sum(c[0] for c in counts)
+            failed = sum(c[1] for c in counts)
+            rows.append((workers, succeeded / args.duration, failed, first_request_ms))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    print(f"请求: {args.path}  并发客户端: {args.concurrency}  每轮时长: {args.duration}s")
+    print(f"{'工作进程':>8}{'请求/秒':>12}{'相对1个进程':>14}{'失败':>8}{'首个请求ms':>14}")
+    for workers, rps, failed, first_ms in rows:
+        print(f"{workers:>8}{rps:>12.1f}{rps / rows[0][1] if rows[0][1] else 0:>14.2f}{failed:>8}{first_ms:>14.1f}")
+    return 0
+
+
+def _timed_request(url: str, body: bytes = None, timeout: float = 300) -> float:
+    """发送一次请求并返回耗时 (毫秒)；body 不为空时以 JSON POST 发送。"""
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'} if body else {})
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+    return (time.perf_counter() - started) * 1000
+
+
+def _probe_latencies(base_url: str, paths: list, duration: float, interval: float) -> dict:
+    """在 duration 秒内轮流请求各个轻量接口，返回 {路径: 耗时列表}。"""
+    latencies = {path: [] for path in paths}
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        for path in paths:
+            latencies[path].append(_timed_request(base_url + path))
+        time.sleep(interval)
+    return latencies
+
+
+def _percentile_row(values: list) -> str:
+    if len(values) < 2:
+        return f"{'-':>10}{'-':>10}{'-':>10}"
+    cut_points = statistics.quantiles(values, n=100, method='inclusive')
+    p50, p95, p99 = cut_points[49], cut_points[94], cut_points[98]
+    return f"{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}"
+
+
+def bench_mixed_load(args) -> int:
+    """
+    对运行中的服务 (wsgi 或 asgi) 测量轻量接口在有/无重负载 (并发热点分析) 时的延迟分位数，
+    用于检查重计算卸载后 /api/status 与聚合接口的 p99 是否保持平稳。
+    """
+    import pandas as pd
+    points = pd.read_csv(args.master_csv, usecols=['longitude', 'latitude']).dropna()
+    points = points.sample(n=min(args.points, len(points)), random_state=0)
+    heavy_body = json.dumps({'crimeData': [
+        {'longitude': float(lon), 'latitude': float(lat), 'offenseType': 'ALL'}
+        for lon, lat in zip(points['longitude'], points['latitude'])
+    ]}).encode('utf-8')
+    probe_paths = ['/api/status', args.aggregate_path]
+    for path in probe_paths: # 预热
+        _timed_request(args.url + path)
+
+    idle = _probe_latencies(args.url, probe_paths, args.duration / 2, args.probe_interval)
+
+    stop = threading.Event()
+    heavy_latencies = []
+
+    def heavy_client():
+        while not stop.is_set():
+            try:
+                heavy_latencies.append(_timed_request(args.url + '/api/hotspot-analysis', heavy_body))
+            except Exception as e:
+                print(f"重负载请求失败: {e}")
+                return
+
+    heavy_threads = [threading.Thread(target=heavy_client, daemon=True) for _ in range(args.heavy_concurrency)]
+    for thread in heavy_threads:
+        thread.start()
+    loaded = _probe_latencies(args.url, probe_paths, args.duration, args.probe_interval)
+    stop.set()
+    for thread in heavy_threads:
+        thread.join()
+
+    print(f"服务: {args.url}  重负载: {args.heavy_concurrency} 个并发热点分析 ({len(points)} 个点)")
+    print(f"{'接口':<60}{'负载':>6}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}")
+    for path in probe_paths:
+        print(f"{path[:58]:<60}{'空闲':>6}{_percentile_row(idle[path])}")
+        print(f"{'':<60}{'重负载':>6}{_percentile_row(loaded[path])}")
+    print(f"{'/api/hotspot-analysis':<60}{'重负载':>6}{_percentile_row(heavy_latencies)}  (完成 {len(heavy_latencies)} 次)")
+    return 0
+
+
+# 在全新的解释器中运行：分别计时 import app、就绪所需的预热阶段与第一个 /api/ready (就绪检查) 请求
+_STARTUP_PROBE = '''
+import os, json, sys, time, shutil
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+if sys.argv[1]:
+    app.MASTER_CSV_PATH = sys.argv[1]
+if sys.argv[2] == 'cold': # 删除社区边界与主数据的二进制缓存
+    shutil.rmtree(app.COMMUNITY_BOUNDARIES_CACHE_DIR, ignore_errors=True)
+    shutil.rmtree(os.path.dirname(app.qingxi.master_data_binary_cache_path(app.MASTER_CSV_PATH, '')), ignore_errors=True)
+cleared = time.perf_counter()
+app.warm_up_shared_data(include_optional=False) # 就绪所需的阶段；常用模型在就绪后于后台加载
+warmed = time.perf_counter()
+status_code = app.app.test_client().get('/api/ready').status_code
+ready = time.perf_counter()
+heavy = [name for name in ('geopandas', 'libpysal', 'esda', 'statsmodels', 'scipy.stats') if name in sys.modules]
+with open(sys.argv[3], 'w') as f: # 结果写入文件: 就绪后后台预热线程的输出可能与标准输出交错
+    json.dump({'import_ms': (imported - started) * 1000, 'warm_up_ms': (warmed - cleared) * 1000,
+               'first_request_ms': (ready - warmed) * 1000, 'status_code': status_code, 'heavy_modules': heavy}, f)
+'''
+
+
+def bench_startup(args) -> int:
+    """
+    测量 API 冷启动到就绪的耗时：在新进程中导入 app、运行就绪所需的预热阶段 (主数据、索引、计数立方体、
+    社区边界与距离权重) 并应答第一个 /api/ready (就绪时为 200)。
+    cold 在预热前删除社区边界与主数据的二进制缓存，warm 使用已有缓存；总耗时含解释器启动，目标是 warm 低于 --target-ms。
+    """
+    rows = []
+    result_path = os.path.join(tempfile.mkdtemp(prefix='startup_bench_'), 'result.json')
+    for mode in ('cold', 'warm'):
+        samples = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', _STARTUP_PROBE, args.master_csv or '', mode, result_path],
+                           cwd=os.path.dirname(os.path.abspath(__file__)),
+                           capture_output=True, text=True, check=True)
+            total_ms = (time.perf_counter() - started) * 1000
+            with open(result_path) as f:
+                result = json.load(f)
+            samples.append({**result, 'total_ms': total_ms})
+        rows.append((mode, samples))
+    shutil.rmtree(os.path.dirname(result_path), ignore_errors=True)
+
+    print(f"每种模式运行 {args.repeat} 次，取中位数 (毫秒)")
+    print(f"{'模式':<6}{'import':>10}{'预热':>10}{'首个请求':>10}{'总计':>10}  已加载的重型模块")
+    for mode, samples in rows:
+        medians = [statistics.median(s[key] for s in samples) for key in ('import_ms', 'warm_up_ms', 'first_request_ms', 'total_ms')]
+        heavy = ', '.join(samples[-1]['heavy_modules']) or '-'
+        print(f"{mode:<6}" + ''.join(f"{value:>10.1f}" for value in medians) + f"  {heavy}")
+    warm_total = statistics.median(s['total_ms'] for s in rows[-1][1])
+    print(f"warm 总计 {warm_total:.0f} ms，目标 {args.target_ms:.0f} ms: {'达到' if warm_total <= args.target_ms else '未达到'}")
+    return 0
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description='后端性能基准')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    artifacts = subparsers.add_parser('model-artifacts', help='完整模型与精简产物的大小和加载/预测耗时对比')
+    artifacts.add_argument('--model-dir', default='trained_models')
+    artifacts.add_argument('--repeat', type=int, default=20)
+    artifacts.add_argument('--steps', type=int, default=12)
+    artifacts.set_defaults(func=bench_model_artifacts)
+
+    scaling = subparsers.add_parser('serve-scaling', help='gunicorn 多工作进程部署的吞吐量随进程数的变化')
+    scaling.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    scaling.add_argument('--concurrency', type=int, default=16)
+    scaling.add_argument('--duration', type=float, default=10)
+    scaling.add_argument('--port', type=int, default=5057)
+    scaling.add_argument('--startup-timeout', type=float, default=120)
+    scaling.add_argument('--path', default='/api/get-actual-aggregated-data?start_year=2014&end_year=2024&resample_freq=ME')
+    scaling.set_defaults(func=bench_serve_scaling)
+
+    mixed = subparsers.add_parser('mixed-load', help='重负载下轻量接口的延迟分位数 (需先启动服务)')
+    mixed.add_argument('--url', default='http://127.0.0.1:5000')
+    mixed.add_argument('--heavy-concurrency', type=int, default=4)
+    mixed.add_argument('--duration', type=float, default=20)
+    mixed.add_argument('--probe-interval', type=float, default=0.05)
+    mixed.add_argument('--points', type=int, default=20000)
+    mixed.add_argument('--master-csv', default=os.path.join('processed_data', 'master_crime_data_2014-2024.csv'))
+    mixed.add_argument('--aggregate-path', default='/api/get-actual-aggregated-data?start_year=2014&end_year=2024&resample_freq=ME')
+    mixed.set_defaults(func=bench_mixed_load)
+
+    startup = subparsers.add_parser('startup', help='API 冷启动/缓存预热后的启动耗时 (导入、预热、首个请求)')
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.add_argument('--master-csv', default=None, help='覆盖 app.MASTER_CSV_PATH (默认使用应用配置)')
+    startup.add_argument('--target-ms', type=float, default=1000)
+    startup.set_defaults(func=bench_startup)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
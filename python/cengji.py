@@ -0,0 +1,208 @@
+import numpy as np
+import pandas as pd
+from logging_config import logger
+import qingxi
+import xunlian
+import jizhun
+from typing import TYPE_CHECKING
+
+# scipy 的稀疏矩阵与线性代数模块只在层级预测时导入，API 启动时不加载
+if TYPE_CHECKING:
+    import scipy.sparse as sp
+
+# 层级: 全市 -> 选区 (WARD) / 社区 (CLUSTER) -> 最底层的 选区×社区 单元
+# 社区并不完全嵌套在选区内，因此以两者的交集单元为底层，选区与社区都是底层单元的汇总 (分组层级)
+LEVEL_CITY = 'city'
+LEVEL_WARD = 'ward'
+LEVEL_CLUSTER = 'cluster'
+LEVEL_BOTTOM = 'ward_cluster'
+BOTTOM_KEY_SEPARATOR = '|'
+CITY_NODE_NAME = '全市'
+
+RECONCILIATION_METHODS = ('bottom_up', 'ols', 'wls', 'mint_shrink')
+
+
+def bottom_level_matrix(df: pd.DataFrame, resample_freq: str = 'ME') -> pd.DataFrame:
+    """按 "选区|社区" 组合键构建底层 (单元 × 周期) 计数矩阵；df 需已包含 WARD 与 CLUSTER 列。"""
+    df = df.dropna(subset=[qingxi.WARD_COLUMN_NAME, qingxi.CLUSTER_COLUMN_NAME])
+    wards = df[qingxi.WARD_COLUMN_NAME]
+    if pd.api.types.is_float_dtype(wards):
+        wards = wards.astype('int64') # WARD 读入为 1.0 时仍记为 "1"
+    key_column = 'WARD_CLUSTER'
+    keyed = df.assign(**{key_column: wards.astype(str) + BOTTOM_KEY_SEPARATOR + df[qingxi.CLUSTER_COLUMN_NAME].astype(str)})
+    return xunlian.build_group_series_matrix(keyed, key_column, resample_freq)
+
+
+def build_summing_matrix(bottom_keys: list) -> tuple:
+    """
+    由底层单元键 ("选区|社区") 构建稀疏汇总矩阵 S (节点数 × 底层单元数)，
+    行顺序为: 全市、各选区、各社区、各底层单元。返回 (S, 节点列表)。
+    """
+    import scipy.sparse as sp
+    split_keys = [key.split(BOTTOM_KEY_SEPARATOR, 1) for key in bottom_keys]
+    wards = sorted({ward for ward, _ in split_keys}, key=lambda w: (len(w), w))
+    clusters = sorted({cluster for _, cluster in split_keys}, key=lambda c: (len(c), c))
+    ward_row = {ward: 1 + i for i, ward in enumerate(wards)}
+    cluster_row = {cluster: 1 + len(wards) + i for i, cluster in enumerate(clusters)}
+    bottom_offset = 1 + len(wards) + len(clusters)
+
+    num_bottom = len(bottom_keys)
+    columns = np.arange(num_bottom)
+    rows = np.concatenate([
+        np.zeros(num_bottom, dtype=int),
+        [ward_row[ward] for ward, _ in split_keys],
+        [cluster_row[cluster] for _, cluster in split_keys],
+        bottom_offset + columns,
+    ])
+    summing = sp.csr_matrix((np.ones(len(rows)), (rows, np.tile(columns, 4))),
+                            shape=(bottom_offset + num_bottom, num_bottom))
+    nodes = ([{'level': LEVEL_CITY, 'name': CITY_NODE_NAME}]
+             + [{'level': LEVEL_WARD, 'name': ward} for ward in wards]
+             + [{'level': LEVEL_CLUSTER, 'name': cluster} for cluster in clusters]
+             + [{'level': LEVEL_BOTTOM, 'name': key} for key in bottom_keys])
+    return summing, nodes
+
+
+def shrunk_residual_covariance(residuals: np.ndarray) -> tuple:
+    """
+    MinT-shrink 使用的协方差估计：样本协方差向其对角线收缩，收缩强度按 Schäfer-Strimmer 方法估计。
+    residuals 形状为 (节点数 × 周期数)。返回 (收缩后的协方差, 收缩强度 lambda)。
+    """
+    x = residuals.T
+    num_obs = x.shape[0]
+    covariance = x.T @ x / num_obs
+    variances = np.maximum(np.diag(covariance), 1e-8) # 全零序列的残差方差为 0，加下限避免除零
+    std = np.sqrt(variances)
+    correlation = covariance / np.outer(std, std)
+    xs = x / std
+    v = (xs ** 2).T @ (xs ** 2) - (xs.T @ xs) ** 2 / num_obs
+    v /= num_obs * (num_obs - 1)
+    np.fill_diagonal(v, 0)
+    d = correlation ** 2
+    np.fill_diagonal(d, 0)
+    shrinkage = float(np.clip(v.sum() / d.sum(), 0, 1)) if d.sum() > 0 else 1.0
+    shrunk = shrinkage * np.diag(variances) + (1 - shrinkage) * covariance
+    np.fill_diagonal(shrunk, variances)
+    return shrunk, shrinkage
+
+
+def reconciliation_matrix(summing: 'sp.csr_matrix', method: str, residuals: np.ndarray = None) -> tuple:
+    """
+    返回调和矩阵 G (底层单元数 × 节点数)，使调和后的预测 = S @ G @ 基础预测，以及 MinT 的收缩强度。
+    bottom_up / ols / wls 全程使用稀疏矩阵；mint_shrink 的协方差是稠密矩阵，用 Cholesky 分解求解。
+    """
+    import scipy.sparse as sp
+    from scipy.linalg import cho_factor, cho_solve
+    from scipy.sparse.linalg import spsolve
+    num_nodes, num_bottom = summing.shape
+    st = summing.T.tocsc()
+    if method == 'bottom_up':
+        selector = sp.hstack([sp.csr_matrix((num_bottom, num_nodes - num_bottom)), sp.identity(num_bottom, format='csr')])
+        return selector.toarray(), None
+    if method == 'ols':
+        return spsolve((st @ summing).tocsc(), st.toarray()), None
+    if residuals is None:
+        raise ValueError(f"{method} 调和需要样本内残差。")
+    if method == 'wls':
+        inv_var = sp.diags(1.0 / np.maximum(np.mean(residuals ** 2, axis=1), 1e-8))
+        weighted = (st @ inv_var).tocsc()
+        return spsolve((weighted @ summing).tocsc(), weighted.toarray()), None
+    if method == 'mint_shrink':
+        covariance, shrinkage = shrunk_residual_covariance(residuals)
+        factor = cho_factor(covariance)
+        winv_s = cho_solve(factor, summing.toarray()) # W^-1 S
+        g = np.linalg.solve(summing.T @ winv_s, winv_s.T) # (S' W^-1 S)^-1 S' W^-1
+        return g, shrinkage
+    raise ValueError(f"不支持的调和方法 '{method}'。可选: {', '.join(RECONCILIATION_METHODS)}")
+
+
+def hierarchical_forecast(bottom_matrix: pd.DataFrame, steps: int, base_method: str = 'ses',
+                          reconciliation: str = 'mint_shrink', confidence_level: float = 0.95,
+                          model_params: dict = None, order: tuple = None, seasonal_order: tuple = (0, 0, 0, 0),
+                          max_workers: int = None) -> dict:
+    """
+    层级预测：用汇总矩阵一次性得到所有层级的历史序列，生成基础预测后调和为一致的预测
+    (任一层级的预测都等于其下层预测之和)。
+    base_method 为向量化基准方法时所有节点在一次数组运算中拟合；为 'arima' 时在进程池中并行拟合
+    (bottom_up 只拟合底层单元)。
+    """
+    if reconciliation not in RECONCILIATION_METHODS:
+        raise ValueError(f"不支持的调和方法 '{reconciliation}'。可选: {', '.join(RECONCILIATION_METHODS)}")
+    if base_method != 'arima' and base_method not in jizhun.BASELINE_METHODS:
+        raise ValueError(f"不支持的基础预测方法 '{base_method}'。")
+    if bottom_matrix.empty:
+        raise ValueError("没有可用于层级预测的数据。")
+
+    summing, nodes = build_summing_matrix([str(key) for key in bottom_matrix.index])
+    all_values = summing @ bottom_matrix.values # 所有节点的历史序列
+    num_nodes, num_bottom = summing.shape
+    logger.info(f"层级预测: {num_nodes} 个节点 ({num_bottom} 个底层单元)，基础方法 {base_method}，调和 {reconciliation}。")
+
+    failed = []
+    has_base_forecast = np.ones(num_nodes, dtype=bool)
+    if base_method == 'arima':
+        if order is None:
+            raise ValueError("base_method 为 'arima' 时需要 arima_order。")
+        fit_rows = np.arange(num_nodes - num_bottom, num_nodes) if reconciliation == 'bottom_up' else np.arange(num_nodes)
+        fit_frame = pd.DataFrame(all_values[fit_rows], index=[nodes[i]['name'] for i in fit_rows],
+                                 columns=bottom_matrix.columns)
+        arima = xunlian.forecast_arima_matrix(fit_frame, order, seasonal_order, steps, max_workers)
+        base_mean = np.zeros((num_nodes, steps))
+        base_se = np.zeros((num_nodes, steps))
+        residuals = np.zeros((num_nodes, all_values.shape[1]))
+        base_mean[fit_rows], base_se[fit_rows], residuals[fit_rows] = arima['mean'], arima['se'], arima['residuals']
+        # 丢弃状态空间扩散初始化阶段的残差
+        residuals = residuals[:, 1 + order[1] + seasonal_order[1] * seasonal_order[3]:]
+        failed = [nodes[fit_rows[i]]['name'] for i in arima['failed']]
+        has_base_forecast[:] = False
+        has_base_forecast[fit_rows] = True
+    else:
+        state = jizhun.fit_baselines(all_values, base_method, model_params, keep_residuals=True)
+        base_mean, base_se = jizhun.forecast_baselines(state, steps)
+        residuals = state['residuals']
+
+    g, shrinkage = reconciliation_matrix(summing, reconciliation, residuals)
+    sg = np.asarray(summing @ g) # (节点数 × 节点数)
+    reconciled = sg @ base_mean
+
+    # 调和后的预测方差 diag(SG Σ_h G'S')，Σ_h 取基础预测方差；mint_shrink 另外保留残差中的相关结构
+    if reconciliation == 'mint_shrink':
+        covariance, _ = shrunk_residual_covariance(residuals)
+        std = np.sqrt(np.diag(covariance))
+        correlation = covariance / np.outer(std, std)
+        variances = np.empty_like(base_se)
+        for h in range(steps):
+            scaled = sg * base_se[:, h]
+            variances[:, h] = np.einsum('ij,jk,ik->i', scaled, correlation, scaled)
+    else:
+        variances = (sg ** 2) @ (base_se ** 2)
+    from scipy.stats import norm # scipy.stats 导入较慢，只在生成区间时导入
+    z = norm.ppf(0.5 + confidence_level / 2.0)
+    spread = z * np.sqrt(np.maximum(variances, 0))
+
+    # 一致性检查: 每个节点的预测与其底层单元预测之和的最大偏差 (应为浮点误差量级)
+    coherence_error = float(np.max(np.abs(reconciled - summing @ reconciled[num_nodes - num_bottom:]))) if steps else 0.0
+    index = pd.date_range(bottom_matrix.columns[-1], periods=steps + 1, freq=bottom_matrix.columns.freq)[1:]
+    results = []
+    for i, node in enumerate(nodes):
+        results.append({
+            **node,
+            'base_forecast': base_mean[i].tolist() if has_base_forecast[i] else None,
+            'forecast': reconciled[i].tolist(),
+            'lower_ci': np.maximum(reconciled[i] - spread[i], 0).tolist(),
+            'upper_ci': (reconciled[i] + spread[i]).tolist(),
+        })
+    return {
+        'timestamps': [ts.isoformat() for ts in index],
+        'base_method': base_method,
+        'reconciliation': reconciliation,
+        'mint_shrinkage': shrinkage,
+        'confidence_level': confidence_level,
+        'num_nodes': num_nodes,
+        'num_bottom_series': num_bottom,
+        'series_start': bottom_matrix.columns[0].isoformat(),
+        'series_end': bottom_matrix.columns[-1].isoformat(),
+        'coherence_max_error': coherence_error,
+        'failed_series': failed,
+        'nodes': results,
+    }
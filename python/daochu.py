@@ -0,0 +1,318 @@
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+import importlib.util
+import numpy as np
+import pandas as pd
+from logging_config import logger
+import qingxi
+import dili
+from typing import Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+# 优先使用 pyogrio (可配合 Arrow 批量写入)，未安装时退回 fiona
+# 只检查是否安装而不导入，geopandas 及写入引擎在第一次导出时才加载 (见 dili.load_geopandas)
+VECTOR_WRITE_ENGINE = 'pyogrio' if importlib.util.find_spec('pyogrio') is not None else 'fiona'
+ARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+EXPORT_CRS = 'EPSG:4326' # WGS84 坐标系
+EXPORT_LAYER_NAME = 'crime_data'
+ZIP_STREAM_CHUNK_SIZE = 1024 * 1024 # 流式打包时每次读取的字节数
+EXPORT_JOB_CHUNK_ROWS = 50000 # 后台导出任务每批写入的记录数 (用于汇报进度)
+DEFAULT_SHP_SCHEMA_PROPERTIES = {'ID': 'str:20', 'Name': 'str:255'}
+
+# 按筛选条件导出时支持的格式 (Shapefile 会被打包为 zip)
+EXPORT_FORMATS = {
+    'gpkg': {'driver': 'GPKG', 'extension': '.gpkg', 'mimetype': 'application/geopackage+sqlite3'},
+    'fgb': {'driver': 'FlatGeobuf', 'extension': '.fgb', 'mimetype': 'application/octet-stream'},
+    'parquet': {'driver': None, 'extension': '.parquet', 'mimetype': 'application/vnd.apache.parquet'},
+    'shp': {'driver': 'ESRI Shapefile', 'extension': '.zip', 'mimetype': 'application/zip'},
+}
+EXPORT_FORMAT_ALIASES = {
+    'geopackage': 'gpkg', 'flatgeobuf': 'fgb', 'geoparquet': 'parquet', 'shapefile': 'shp', 'zip': 'shp',
+}
+
+
+def infer_shp_schema(features: list) -> dict:
+    """根据第一个 feature 的属性推断 Shapefile 属性字段类型 (str/int/float)。"""
+    if not features:
+        logger.warning("No features provided for SHP generation, using default minimal schema.")
+        return dict(DEFAULT_SHP_SCHEMA_PROPERTIES)
+
+    schema_properties = {}
+    for key, value in (features[0].get('properties') or {}).items():
+        if isinstance(value, int):
+            schema_properties[key] = 'int'
+        elif isinstance(value, float):
+            schema_properties[key] = 'float'
+        else:
+            schema_properties[key] = 'str:255' # 默认转换为字符串，并指定长度
+    logger.info(f"Inferred SHP schema properties: {schema_properties}")
+    return schema_properties
+
+
+def coerce_column(column: pd.Series, prop_type_str: str) -> pd.Series:
+    """
+    按 schema 对整列做类型转换：缺失值 -> '' 或 0；数值转换失败 -> 空值。
+    与原先逐 feature 的 str()/int()/float() 转换规则一致，只是以列为单位批量完成：
+    int 列的数值向零截断 (2.7 -> 2)，字符串只接受整数写法 ("3.5" -> 空值)。
+    """
+    target_type = prop_type_str.split(':')[0]
+    if target_type == 'str':
+        return column.where(column.notna(), '').astype(str)
+
+    missing = column.isna()
+    numeric = pd.to_numeric(column, errors='coerce')
+    if target_type == 'int' and column.dtype == object:
+        is_text = column.map(lambda value: isinstance(value, str), na_action='ignore').fillna(False).astype(bool)
+        integer_text = column.where(is_text).str.strip().str.fullmatch(r'[+-]?\d+', na=False)
+        numeric = numeric.mask(is_text & ~integer_text.astype(bool))
+    failed = numeric.isna() & ~missing
+    if failed.any():
+        logger.warning(f"Warning: {int(failed.sum())} value(s) in property '{column.name}' could not be converted to '{target_type}'. Setting to empty.")
+    numeric = numeric.mask(missing, 0)
+    if target_type == 'int':
+        return np.trunc(numeric).astype('Int64')
+    return numeric.astype(float)
+
+
+def features_to_geodataframe(features: list, schema_properties: dict) -> 'gpd.GeoDataFrame':
+    """将 GeoJSON 点 features 批量转换为 GeoDataFrame (坐标与属性均按列构建)，非 Point 几何体被跳过。"""
+    point_features = [f for f in features if (f.get('geometry') or {}).get('type') == 'Point']
+    skipped = len(features) - len(point_features)
+    if skipped:
+        logger.warning(f"Skipping {skipped} non-Point geometries.")
+
+    coords = np.array([f['geometry']['coordinates'][:2] for f in point_features], dtype=float).reshape(-1, 2)
+    props_df = pd.DataFrame.from_records(
+        [f.get('properties') or {} for f in point_features],
+        columns=list(schema_properties.keys())
+    )
+    columns = {name: coerce_column(props_df[name], type_str) for name, type_str in schema_properties.items()}
+    gpd = dili.load_geopandas()
+    return gpd.GeoDataFrame(
+        columns,
+        geometry=gpd.points_from_xy(coords[:, 0], coords[:, 1]),
+        crs=EXPORT_CRS
+    )
+
+
+def write_vector_file(gdf: 'gpd.GeoDataFrame', file_path: str, driver: str = 'ESRI Shapefile'):
+    """使用批量写入引擎将 GeoDataFrame 写出到矢量文件。"""
+    write_kwargs = {'driver': driver, 'engine': VECTOR_WRITE_ENGINE}
+    if driver == 'ESRI Shapefile':
+        write_kwargs['encoding'] = 'utf-8' # 使用UTF-8编码，支持中文属性
+    if VECTOR_WRITE_ENGINE == 'pyogrio' and ARROW_AVAILABLE:
+        write_kwargs['use_arrow'] = True
+    gdf.to_file(file_path, **write_kwargs)
+
+
+def write_vector_file_in_chunks(gdf: 'gpd.GeoDataFrame', file_path: str, driver: str = 'ESRI Shapefile',
+                                chunk_rows: int = EXPORT_JOB_CHUNK_ROWS, progress=None):
+    """分批写出 GeoDataFrame (首批创建文件，后续追加)，每批完成后调用 progress(已写行数, 总行数)。"""
+    total = len(gdf)
+    if progress:
+        progress(0, total)
+    if total == 0:
+        write_vector_file(gdf, file_path, driver=driver)
+        return
+    for start in range(0, total, chunk_rows):
+        chunk = gdf.iloc[start:start + chunk_rows]
+        if start == 0:
+            write_vector_file(chunk, file_path, driver=driver)
+        else:
+            append_kwargs = {'driver': driver, 'engine': VECTOR_WRITE_ENGINE, 'mode': 'a'}
+            if driver == 'ESRI Shapefile':
+                append_kwargs['encoding'] = 'utf-8'
+            chunk.to_file(file_path, **append_kwargs)
+        if progress:
+            progress(min(start + chunk_rows, total), total)
+
+
+def make_private_temp_dir(base_dir: str, prefix: str = 'export_') -> str:
+    """在 base_dir 下为单个请求创建一个独占的临时目录，避免同名导出互相覆盖。"""
+    os.makedirs(base_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix=prefix, dir=base_dir)
+
+
+def safe_file_stem(filename_base: str, default: str = 'crime_data') -> str:
+    """去掉路径分隔符等字符，得到可以安全用作文件名的基础名。"""
+    stem = os.path.basename(str(filename_base or '')).strip()
+    stem = ''.join(ch for ch in stem if ch not in '\\/:*?"<>|\0').strip('. ')
+    return stem or default
+
+
+class _ZipStreamBuffer:
+    """只追加的写缓冲区，供 ZipFile 写入；每次 drain() 取走已写入的字节。"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip_directory(directory: str, chunk_size: int = ZIP_STREAM_CHUNK_SIZE):
+    """
+    将目录中的文件边压缩边产出 zip 字节块，内存占用与 chunk_size 同量级，
+    而不是先在内存中构建完整的 zip。
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for file_name in sorted(os.listdir(directory)):
+            file_path = os.path.join(directory, file_name)
+            with open(file_path, 'rb') as src, zf.open(file_name, 'w', force_zip64=True) as dest:
+                while True:
+                    block = src.read(chunk_size)
+                    if not block:
+                        break
+                    dest.write(block)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+def remove_dir_quietly(directory: Union[str, None]):
+    """删除临时目录；可重复调用，失败只记录日志。"""
+    if directory and os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+        logger.debug(f"已清理临时目录: {directory}")
+
+
+def stream_zip_and_cleanup(directory: str, chunk_size: int = ZIP_STREAM_CHUNK_SIZE):
+    """流式产出目录的 zip 内容，结束 (包括客户端中途断开) 后删除该目录。"""
+    try:
+        yield from iter_zip_directory(directory, chunk_size)
+    finally:
+        remove_dir_quietly(directory)
+
+
+# --- 按筛选条件从主数据导出 (带磁盘缓存) ---
+def resolve_export_format(fmt: str) -> str:
+    """将请求的格式名规范化为 EXPORT_FORMATS 的键；不支持时抛出 ValueError。"""
+    key = str(fmt or 'gpkg').lower().lstrip('.')
+    key = EXPORT_FORMAT_ALIASES.get(key, key)
+    if key not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式 '{fmt}'。可选: {', '.join(EXPORT_FORMATS)}")
+    return key
+
+def dataframe_to_export_gdf(df: pd.DataFrame, fmt: str) -> 'gpd.GeoDataFrame':
+    """将筛选后的主数据 (含经纬度列) 按列转换为点 GeoDataFrame；缺少坐标的记录被跳过。"""
+    df = df.dropna(subset=['longitude', 'latitude'])
+    if fmt == 'shp':
+        # Shapefile 字段名最多 10 字节且不支持日期时间字段：中文时间列改回原始列名，日期转为 ISO 字符串
+        df = df.rename(columns={qingxi.TIME_COLUMN_NAME: 'START_DATE'})
+        for col in df.columns:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                df[col] = df[col].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    gpd = dili.load_geopandas()
+    return gpd.GeoDataFrame(
+        df.reset_index(drop=True),
+        geometry=gpd.points_from_xy(df['longitude'].values, df['latitude'].values),
+        crs=EXPORT_CRS
+    )
+
+def export_cache_path(cache_dir: str, spec_hash: str, fmt: str, data_version: str) -> str:
+    """缓存文件名由 (筛选条件哈希, 格式, 数据版本) 唯一确定。"""
+    return os.path.join(cache_dir, f"export_{data_version}_{spec_hash}_{fmt}{EXPORT_FORMATS[fmt]['extension']}")
+
+def write_export_file(gdf: 'gpd.GeoDataFrame', fmt: str, output_path: str, work_dir: str):
+    """在 work_dir 中写出导出文件 (Shapefile 额外打包为 zip)，完成后原子地移动到 output_path。"""
+    fmt_info = EXPORT_FORMATS[fmt]
+    staged_path = os.path.join(work_dir, EXPORT_LAYER_NAME + fmt_info['extension'])
+    if fmt == 'parquet':
+        gdf.to_parquet(staged_path, index=False)
+    elif fmt == 'shp':
+        shp_dir = os.path.join(work_dir, 'shp')
+        os.makedirs(shp_dir)
+        write_vector_file(gdf, os.path.join(shp_dir, EXPORT_LAYER_NAME + '.shp'), driver='ESRI Shapefile')
+        with open(staged_path, 'wb') as zip_out:
+            for block in iter_zip_directory(shp_dir):
+                zip_out.write(block)
+    else:
+        write_vector_file(gdf, staged_path, driver=fmt_info['driver'])
+    os.replace(staged_path, output_path)
+
+def prune_export_cache(cache_dir: str, current_data_version: str):
+    """删除属于旧数据版本的缓存导出文件。"""
+    prefix = f"export_{current_data_version}_"
+    for file_name in os.listdir(cache_dir):
+        if file_name.startswith('export_') and not file_name.startswith(prefix):
+            try:
+                os.remove(os.path.join(cache_dir, file_name))
+                logger.info(f"已删除过期的导出缓存: {file_name}")
+            except OSError as e:
+                logger.warning(f"删除过期导出缓存 {file_name} 失败: {e}")
+
+def get_or_create_filtered_export(load_master, normalized_spec: dict, spec_hash: str,
+                                  fmt: str, data_version: str, cache_dir: str) -> tuple[str, bool]:
+    """
+    返回 (导出文件路径, 是否命中缓存)。相同 (筛选条件, 格式, 数据版本) 的导出只生成一次，
+    之后直接从磁盘返回；未命中时才调用 load_master() 取得主数据，筛选、写出并放入缓存。
+    缓存键只依赖筛选条件的哈希和主数据文件的版本号 (文件元数据)，命中时完全不加载主数据。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    output_path = export_cache_path(cache_dir, spec_hash, fmt, data_version)
+    if os.path.exists(output_path):
+        logger.info(f"导出缓存命中: {os.path.basename(output_path)}")
+        return output_path, True
+
+    df_filtered = qingxi.filter_master_data(load_master(), normalized_spec)
+    export_gdf = dataframe_to_export_gdf(df_filtered, fmt)
+    work_dir = make_private_temp_dir(cache_dir, prefix='tmp_export_')
+    try:
+        write_export_file(export_gdf, fmt, output_path, work_dir)
+    finally:
+        remove_dir_quietly(work_dir)
+    logger.info(f"已生成导出文件 {os.path.basename(output_path)}，共 {len(export_gdf)} 条记录。")
+    prune_export_cache(cache_dir, data_version)
+    return output_path, False
+
+
+# --- 后台 Shapefile 导出任务 ---
+def run_shp_export_job(features: list, filename_base: str, output_dir: str, work_base_dir: str, progress=None) -> str:
+    """
+    后台任务：沿用 /generate_shp 的 schema 推断，将 features 分批写为 Shapefile 并在 output_dir 中打包为 zip。
+    progress 汇报已写入的记录数；返回 zip 文件路径。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"{uuid.uuid4().hex}.zip")
+    schema_properties = infer_shp_schema(features)
+    export_gdf = features_to_geodataframe(features, schema_properties)
+    work_dir = make_private_temp_dir(work_base_dir, prefix='job_')
+    try:
+        shp_file_path = os.path.join(work_dir, filename_base + '.shp')
+        write_vector_file_in_chunks(export_gdf, shp_file_path, driver='ESRI Shapefile', progress=progress)
+        staged_zip = output_path + '.part'
+        with open(staged_zip, 'wb') as zip_out:
+            for block in iter_zip_directory(work_dir):
+                zip_out.write(block)
+        os.replace(staged_zip, output_path)
+    finally:
+        remove_dir_quietly(work_dir)
+    logger.info(f"后台导出完成: {output_path} ({len(export_gdf)} 条记录)")
+    return output_path
@@ -0,0 +1,23 @@
+import os
+import threading
+
+# 地理空间库 (pyproj、shapely、geopandas 以及 fiona/pyogrio 背后的 GDAL) 导入较慢，
+# 只在第一次需要时通过 load_geopandas() 导入，API 启动和不涉及地理数据的请求不必加载它们
+_geopandas = None
+_import_lock = threading.Lock()
+
+
+def load_geopandas():
+    """
+    返回 geopandas 模块，首次调用时导入。
+    导入前按 pyproj 的数据目录设置 PROJ_LIB，保证 GDAL (fiona/pyogrio) 能找到 proj.db。
+    """
+    global _geopandas
+    if _geopandas is None:
+        with _import_lock:
+            if _geopandas is None:
+                import pyproj
+                os.environ['PROJ_LIB'] = pyproj.datadir.get_data_dir()
+                import geopandas
+                _geopandas = geopandas
+    return _geopandas
@@ -0,0 +1,219 @@
+import os
+import time
+import contextlib
+import pickle
+import hashlib
+import threading
+from concurrent.futures import Future
+from logging_config import logger
+
+# 文件锁：POSIX 使用 fcntl.flock，Windows 使用 msvcrt.locking
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# 跨进程共享的结果文件保留时间 (秒)：只用于把结果交给同时在等待锁的其他进程，过期后清理
+RESULT_TTL_SECONDS = int(os.environ.get('SINGLE_FLIGHT_RESULT_TTL_SECONDS', 60))
+# 等待其他进程中相同计算的最长时间 (秒)：超时后不再等待，在本进程中自行计算
+LOCK_TIMEOUT_SECONDS = float(os.environ.get('SINGLE_FLIGHT_LOCK_TIMEOUT_SECONDS', 30))
+# 等待文件锁时的轮询间隔 (秒)，逐次加倍直到上限
+LOCK_POLL_INITIAL_SECONDS = 0.02
+LOCK_POLL_MAX_SECONDS = 0.5
+
+_instances = {} # 名称 -> SingleFlight，用于状态统计
+
+
+def _try_lock_file(fh) -> bool:
+    """非阻塞地尝试取得文件锁，成功返回 True。"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError: # 锁被其他进程持有 (BlockingIOError 等)
+        return False
+    return True
+
+
+def _unlock_file(fh):
+    if fcntl is not None:
+        fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+    else:
+        fh.seek(0)
+        msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def make_key(*parts) -> str:
+    """由若干部分 (数据版本、规范化参数等) 组成的合并键。"""
+    raw = "|".join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    """
+    合并相同的并发调用 (single-flight)：同一个键同时只执行一次计算。
+    - 进程内：第一个调用者执行 func，同时到达的相同调用等待其 Future，得到同一个结果 (或同一个异常)。
+    - 跨进程 (指定 lock_dir 时)：每个键一个锁文件，执行前先取得该键的文件锁；等待期间另一个进程已完成
+      同一计算时，直接读取它留下的结果文件 (pickle)，不再重复计算。结果必须可以 pickle。
+      等待超过 lock_timeout 秒仍未取得锁时不再等待，在本进程中自行计算。
+    计算失败时不共享结果，等待锁的其他进程会自行重新计算。
+    """
+
+    def __init__(self, name: str, lock_dir: str = None, lock_timeout: float = None):
+        self.name = name
+        self.lock_dir = lock_dir
+        self.lock_timeout = LOCK_TIMEOUT_SECONDS if lock_timeout is None else lock_timeout
+        self._lock = threading.Lock()
+        self._in_flight = {} # key -> Future
+        self._stats = {'executed': 0, 'coalesced': 0, 'shared_across_processes': 0, 'failed': 0,
+                       'lock_timeouts': 0}
+        _instances[name] = self
+
+    def do(self, key: str, func, *args, lock_dir: str = None, admit=None, **kwargs):
+        """
+        执行 (或等待正在进行的相同) 调用 func(*args, **kwargs) 并返回结果。
+        key 应由 make_key 生成；lock_dir 覆盖构造时指定的跨进程锁目录 (例如按调用方的输出目录放置锁文件)。
+        admit 为可选的上下文管理器工厂 (例如 AdmissionController.admit)：只有本进程中执行计算的调用者进入它，
+        并且在等待其他进程的文件锁之前进入，因此文件锁不会在准入排队期间被占用，
+        跨进程等待的请求同样受准入队列的约束；它抛出的异常 (例如 AdmissionRejected) 同样传给进程内合并的调用者。
+        """
+        lock_dir = lock_dir or self.lock_dir
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self._stats['coalesced'] += 1
+        if not leader:
+            logger.info(f"[{self.name}] 相同请求正在计算中，等待其结果 (键 {key[:12]})。")
+            return future.result()
+
+        try:
+            with (admit() if admit is not None else contextlib.nullcontext()):
+                if lock_dir:
+                    result = self._run_with_file_lock(lock_dir, key, func, args, kwargs)
+                else:
+                    result = self._execute(func, args, kwargs)
+        except BaseException as e:
+            with self._lock:
+                self._stats['failed'] += 1
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+        future.set_result(result)
+        return result
+
+    def _execute(self, func, args, kwargs):
+        with self._lock:
+            self._stats['executed'] += 1
+        return func(*args, **kwargs)
+
+    def _share_result(self, shared, key: str):
+        with self._lock:
+            self._stats['shared_across_processes'] += 1
+        logger.info(f"[{self.name}] 使用其他进程刚完成的相同计算结果 (键 {key[:12]})。")
+        return shared[0]
+
+    def _run_with_file_lock(self, lock_dir: str, key: str, func, args, kwargs):
+        os.makedirs(lock_dir, exist_ok=True)
+        # 每个键单独一个锁文件，不同的计算不会互相等待；过期的锁文件与结果文件一起清理
+        lock_path = os.path.join(lock_dir, f"{self.name}_{key}.lock")
+        result_path = os.path.join(lock_dir, f"{self.name}_{key}.pickle")
+        wait_started = time.time()
+        deadline = time.monotonic() + self.lock_timeout
+        poll_seconds = LOCK_POLL_INITIAL_SECONDS
+        with open(lock_path, 'a+b') as lock_fh:
+            while not _try_lock_file(lock_fh):
+                # 持锁的进程完成后会先写结果文件再释放锁：结果一出现就直接使用，不必再等锁
+                shared = self._load_fresh_result(result_path, wait_started)
+                if shared is not None:
+                    return self._share_result(shared, key)
+                if time.monotonic() >= deadline:
+                    with self._lock:
+                        self._stats['lock_timeouts'] += 1
+                    logger.warning(f"[{self.name}] 等待其他进程的相同计算超过 {self.lock_timeout:g} 秒，"
+                                   f"改为在本进程中计算 (键 {key[:12]})。")
+                    result = self._execute(func, args, kwargs)
+                    self._store_result(result_path, result)
+                    return result
+                time.sleep(poll_seconds)
+                poll_seconds = min(poll_seconds * 2, LOCK_POLL_MAX_SECONDS)
+            try:
+                # 等待锁期间其他进程已经完成了同一计算：直接使用它的结果
+                shared = self._load_fresh_result(result_path, wait_started)
+                if shared is not None:
+                    return self._share_result(shared, key)
+                result = self._execute(func, args, kwargs)
+                self._store_result(result_path, result)
+                return result
+            finally:
+                _unlock_file(lock_fh)
+
+    @staticmethod
+    def _load_fresh_result(result_path: str, not_before: float):
+        try:
+            if os.path.getmtime(result_path) < not_before:
+                return None
+            with open(result_path, 'rb') as fh:
+                return (pickle.load(fh),)
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def _store_result(self, result_path: str, result):
+        tmp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as fh:
+                pickle.dump(result, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, result_path) # 原子替换，其他进程不会读到写了一半的文件
+        except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning(f"[{self.name}] 无法保存共享结果，其他进程将自行计算: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._remove_expired_results(os.path.dirname(result_path))
+
+    def _remove_expired_results(self, lock_dir: str):
+        cutoff = time.time() - RESULT_TTL_SECONDS
+        try:
+            entries = list(os.scandir(lock_dir))
+        except OSError:
+            return
+        for entry in entries:
+            if not entry.name.startswith(f"{self.name}_"):
+                continue
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if entry.name.endswith('.pickle'):
+                    os.remove(entry.path)
+                elif entry.name.endswith('.lock'):
+                    self._remove_idle_lock_file(entry.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _remove_idle_lock_file(lock_path: str):
+        """只删除当前没有进程持有的锁文件 (计算可能比 RESULT_TTL_SECONDS 更久)。"""
+        with open(lock_path, 'a+b') as lock_fh:
+            if not _try_lock_file(lock_fh):
+                return
+            try:
+                os.remove(lock_path)
+            finally:
+                _unlock_file(lock_fh)
+
+    def stats(self) -> dict:
+        """实际执行次数、进程内合并次数、跨进程复用次数、失败次数与等锁超时次数，以及当前进行中的键数。"""
+        with self._lock:
+            return {**self._stats, 'in_flight': len(self._in_flight)}
+
+
+def get_stats() -> dict:
+    """所有合并器的统计 (见 SingleFlight.stats)。"""
+    return {name: flight.stats() for name, flight in list(_instances.items())}
@@ -0,0 +1,246 @@
+import time
+import itertools
+import numpy as np
+import pandas as pd
+from logging_config import logger
+import moxing
+from typing import Union
+
+# 基准预测模型的产物格式标识 (与精简 ARIMA 产物一样保存为 joblib 序列化的字典)
+BASELINE_ARTIFACT_FORMAT = 'baseline-v1'
+
+# 可选的基准方法及默认参数
+BASELINE_METHODS = ('seasonal_naive', 'moving_average', 'ses', 'holt_winters')
+BASELINE_DEFAULT_PARAMS = {
+    'season_length': 12, # 季节周期 (月度数据为 12)
+    'window': 12, # 移动平均窗口
+}
+# 指数平滑参数的候选网格；所有序列与所有候选参数在同一组数组运算中一起评估
+SES_ALPHA_GRID = np.array([0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
+HW_ALPHA_GRID = (0.05, 0.1, 0.2, 0.3, 0.5, 0.7)
+HW_BETA_GRID = (0.0, 0.01, 0.05, 0.1)
+HW_GAMMA_GRID = (0.0, 0.05, 0.1, 0.2, 0.3)
+
+
+def validate_baseline_params(params: dict = None) -> dict:
+    """
+    合并默认参数并校验 season_length 与 window：必须是正整数 (JSON 的 true/false 不算)。
+    返回合并后的参数字典；参数无效时抛出 ValueError。
+    """
+    params = {**BASELINE_DEFAULT_PARAMS, **(params or {})}
+    for key in ('season_length', 'window'):
+        value = params[key]
+        if isinstance(value, (bool, np.bool_)) or not isinstance(value, (int, np.integer)) or value <= 0:
+            raise ValueError(f"{key} 必须是正整数 (收到 {value!r})。")
+    return params
+
+
+def _holt_winters_grid() -> np.ndarray:
+    """满足 ETS(A,A,A) 常用约束 (beta <= alpha, gamma <= 1 - alpha) 的 (alpha, beta, gamma) 组合。"""
+    return np.array([(a, b, g) for a, b, g in itertools.product(HW_ALPHA_GRID, HW_BETA_GRID, HW_GAMMA_GRID)
+                     if b <= a and g <= 1 - a])
+
+
+def _ses_pass(y: np.ndarray, alphas: np.ndarray, keep_errors: bool = False) -> tuple:
+    """
+    简单指数平滑递推；alphas 形状为 (1, 候选数) 或 (序列数, 1)，与序列广播。
+    返回 (最终水平, 一步误差平方和, 一步误差矩阵或 None)；keep_errors 只适用于每个序列一组参数的情况。
+    """
+    level = np.broadcast_to(y[:, :1], np.broadcast_shapes(y[:, :1].shape, alphas.shape)).copy()
+    sse = np.zeros_like(level)
+    errors = np.empty((len(y), y.shape[1] - 1)) if keep_errors else None
+    for t in range(1, y.shape[1]):
+        error = y[:, t:t + 1] - level
+        sse += error ** 2
+        if keep_errors:
+            errors[:, t - 1] = error[:, 0]
+        level = level + alphas * error
+    return level, sse, errors
+
+
+def _holt_winters_pass(y: np.ndarray, m: int, alpha: np.ndarray, beta: np.ndarray, gamma: np.ndarray,
+                       keep_errors: bool = False) -> tuple:
+    """
+    加法 Holt-Winters (ETS(A,A,A)) 误差修正形式的递推，参数广播方式同 _ses_pass。
+    用前两个季节初始化水平、趋势和季节项，返回 (水平, 趋势, 季节项, 误差平方和, 一步误差矩阵或 None)。
+    """
+    shape = np.broadcast_shapes(y[:, :1].shape, alpha.shape)
+    first_mean = y[:, :m].mean(axis=1)
+    level = np.broadcast_to(first_mean[:, np.newaxis], shape).copy()
+    trend = np.broadcast_to(((y[:, m:2 * m].mean(axis=1) - first_mean) / m)[:, np.newaxis], shape).copy()
+    season = np.broadcast_to((y[:, :m] - first_mean[:, np.newaxis])[:, np.newaxis, :], shape + (m,)).copy()
+    # 初始水平对应第 m-1 期，从第 m 期开始递推
+    level = level + trend * (m - 1) / 2.0
+    sse = np.zeros(shape)
+    errors = np.empty((len(y), y.shape[1] - m)) if keep_errors else None
+    for t in range(m, y.shape[1]):
+        k = t % m
+        error = y[:, t:t + 1] - (level + trend + season[:, :, k])
+        sse += error ** 2
+        if keep_errors:
+            errors[:, t - m] = error[:, 0]
+        level = level + trend + alpha * error
+        trend = trend + beta * error
+        season[:, :, k] += gamma * error
+    return level, trend, season, sse, errors
+
+
+def fit_baselines(matrix: np.ndarray, method: str, params: dict = None, keep_residuals: bool = False) -> dict:
+    """
+    对 (序列数 × 周期数) 矩阵中的所有序列一次性拟合同一种基准方法。
+    返回的状态全部是按序列排列的数组：level、trend、season (已按预测第 1 步对齐)、sigma2 与平滑参数；
+    keep_residuals=True 时另含样本内一步预测误差 residuals。
+    """
+    if method not in BASELINE_METHODS:
+        raise ValueError(f"不支持的基准方法 '{method}'。可选: {', '.join(BASELINE_METHODS)}")
+    params = validate_baseline_params(params)
+    y = np.asarray(matrix, dtype=float)
+    num_series, num_periods = y.shape
+    m = int(params['season_length'])
+    window = int(params['window'])
+    zeros = np.zeros(num_series)
+    state = {'level': zeros.copy(), 'trend': zeros.copy(), 'season': np.zeros((num_series, 1)),
+             'alpha': zeros.copy(), 'beta': zeros.copy(), 'gamma': zeros.copy()}
+
+    if method == 'seasonal_naive':
+        if num_periods < 2 * m:
+            raise ValueError(f"季节性朴素法至少需要 {2 * m} 个周期的数据。")
+        errors = y[:, m:] - y[:, :-m]
+        state['season'] = y[:, -m:].copy() # 第 h 步预测取上一季同期: season[(h-1) % m]
+        state['sigma2'] = np.mean(errors ** 2, axis=1)
+
+    elif method == 'moving_average':
+        if num_periods <= window:
+            raise ValueError(f"移动平均法至少需要 {window + 1} 个周期的数据。")
+        cumsum = np.concatenate([np.zeros((num_series, 1)), np.cumsum(y, axis=1)], axis=1)
+        trailing_means = (cumsum[:, window:-1] - cumsum[:, :-window - 1]) / window # 预测 y[window:] 的一步均值
+        errors = y[:, window:] - trailing_means
+        state['level'] = (cumsum[:, -1] - cumsum[:, -window - 1]) / window
+        state['sigma2'] = np.mean(errors ** 2, axis=1)
+
+    elif method == 'ses':
+        if num_periods < 3:
+            raise ValueError("简单指数平滑至少需要 3 个周期的数据。")
+        level, sse, _ = _ses_pass(y, SES_ALPHA_GRID[np.newaxis, :])
+        best = np.argmin(sse, axis=1)
+        rows = np.arange(num_series)
+        state['level'] = level[rows, best]
+        state['alpha'] = SES_ALPHA_GRID[best]
+        state['sigma2'] = sse[rows, best] / (num_periods - 1)
+        if keep_residuals:
+            errors = _ses_pass(y, state['alpha'][:, np.newaxis], keep_errors=True)[2]
+
+    else: # holt_winters: 加法 ETS(A,A,A)，误差修正形式
+        if num_periods < 2 * m + 2:
+            raise ValueError(f"Holt-Winters 至少需要 {2 * m + 2} 个周期的数据。")
+        grid = _holt_winters_grid()
+        level, trend, season, sse, _ = _holt_winters_pass(y, m, grid[:, 0][np.newaxis, :], grid[:, 1][np.newaxis, :],
+                                                         grid[:, 2][np.newaxis, :])
+        best = np.argmin(sse, axis=1)
+        rows = np.arange(num_series)
+        # 旋转季节项，使 season[0] 对应预测第 1 步 (时间下标 num_periods)
+        state['season'] = np.roll(season[rows, best], -(num_periods % m), axis=1)
+        state['level'] = level[rows, best]
+        state['trend'] = trend[rows, best]
+        state['alpha'], state['beta'], state['gamma'] = grid[best, 0], grid[best, 1], grid[best, 2]
+        state['sigma2'] = sse[rows, best] / (num_periods - m)
+        if keep_residuals:
+            errors = _holt_winters_pass(y, m, state['alpha'][:, np.newaxis], state['beta'][:, np.newaxis],
+                                        state['gamma'][:, np.newaxis], keep_errors=True)[4]
+
+    if keep_residuals:
+        state['residuals'] = errors # 样本内一步预测误差 (序列数 × 可评估的周期数，对齐到序列末尾)
+    state.update(method=method, season_length=m, window=window)
+    return state
+
+
+def forecast_baselines(state: dict, steps: int) -> tuple:
+    """按拟合状态一次性预测所有序列，返回 (均值, 标准误)，形状均为 (序列数 × steps)。"""
+    h = np.arange(1, steps + 1)
+    season = state['season']
+    mean = (state['level'][:, np.newaxis] + state['trend'][:, np.newaxis] * h
+            + season[:, (h - 1) % season.shape[1]])
+
+    method = state['method']
+    if method == 'seasonal_naive':
+        multiplier = np.broadcast_to((h - 1) // state['season_length'] + 1.0, mean.shape)
+    elif method == 'moving_average':
+        # sigma2 取自移动平均的一步预测误差，已包含均值估计误差 (独立同分布时为 σ²(1 + 1/window))，
+        # 不能再乘 (1 + 1/window)；各步预测的都是同一个窗口均值，标准误不随步数变化
+        multiplier = np.ones(mean.shape)
+    else:
+        # ETS 预测方差: sigma2 * (1 + Σ_{j=1}^{h-1} c_j²)，c_j = alpha + beta*j + gamma*[j mod m == 0]
+        j = np.arange(1, steps)
+        c = (state['alpha'][:, np.newaxis] + state['beta'][:, np.newaxis] * j
+             + state['gamma'][:, np.newaxis] * (j % state['season_length'] == 0))
+        multiplier = 1.0 + np.concatenate([np.zeros((len(c), 1)), np.cumsum(c ** 2, axis=1)], axis=1)
+    se = np.sqrt(state['sigma2'][:, np.newaxis] * multiplier)
+    return mean, se
+
+
+class BaselineModel:
+    """从基准产物重建的单序列预测模型，get_forecast 与 ARIMA 结果用法一致。"""
+
+    def __init__(self, artifact: dict):
+        self.artifact = artifact
+        self.method = artifact['method']
+        self.params = pd.Series({k: artifact[k] for k in ('alpha', 'beta', 'gamma', 'season_length', 'window')})
+        self.nobs = artifact['nobs']
+        self.aic = None
+        self.bic = None
+        self.sigma2 = artifact['sigma2']
+
+    def get_forecast(self, steps: int) -> moxing.SlimForecast:
+        state = {key: np.atleast_1d(np.asarray(self.artifact[key], dtype=float))
+                 for key in ('level', 'trend', 'alpha', 'beta', 'gamma', 'sigma2')}
+        state['season'] = np.asarray(self.artifact['season'], dtype=float)[np.newaxis, :]
+        state.update(method=self.method, season_length=self.artifact['season_length'], window=self.artifact['window'])
+        mean, se = forecast_baselines(state, steps)
+        index = moxing.forecast_index(self.artifact['freq'], self.artifact['last_timestamp'], self.nobs, steps)
+        return moxing.SlimForecast(pd.Series(mean[0], index=index, name='predicted_mean'), se[0])
+
+
+def is_baseline_artifact(obj) -> bool:
+    return isinstance(obj, dict) and obj.get('format') == BASELINE_ARTIFACT_FORMAT
+
+
+def build_baseline_artifacts(series_matrix: pd.DataFrame, method: str, params: dict = None,
+                             data_source: dict = None) -> list:
+    """
+    对 (分组 × 周期) 计数矩阵 (列为带频率的 DatetimeIndex) 一次性拟合，返回每个序列的基准产物字典，
+    顺序与矩阵的行一致。
+    """
+    started = time.perf_counter()
+    state = fit_baselines(series_matrix.values, method, params)
+    columns = series_matrix.columns
+    freq = columns.freqstr if isinstance(columns, pd.DatetimeIndex) and columns.freq is not None else None
+    is_dated = isinstance(columns, pd.DatetimeIndex) and len(columns) > 0
+    trained_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+    artifacts = []
+    for i in range(len(series_matrix)):
+        artifacts.append({
+            'format': BASELINE_ARTIFACT_FORMAT,
+            'method': method,
+            'level': float(state['level'][i]),
+            'trend': float(state['trend'][i]),
+            'season': state['season'][i].tolist(),
+            'alpha': float(state['alpha'][i]),
+            'beta': float(state['beta'][i]),
+            'gamma': float(state['gamma'][i]),
+            'sigma2': float(state['sigma2'][i]),
+            'season_length': state['season_length'],
+            'window': state['window'],
+            'nobs': len(columns),
+            'freq': freq,
+            'first_timestamp': columns[0].isoformat() if is_dated else None,
+            'last_timestamp': columns[-1].isoformat() if is_dated else None,
+            'data_source': data_source,
+            'trained_at': trained_at,
+        })
+    logger.info(f"基准方法 {method}: 已为 {len(artifacts)} 条序列拟合，用时 {time.perf_counter() - started:.3f}s。")
+    return artifacts
+
+
+def restore_baseline(obj) -> Union[BaselineModel, None]:
+    """joblib.load 的结果若为基准产物则重建 BaselineModel，否则返回 None。"""
+    return BaselineModel(obj) if is_baseline_artifact(obj) else None
@@ -0,0 +1,281 @@
+import os
+import glob
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from logging_config import logger
+from typing import Union
+
+# 精简模型产物的格式标识 (保存为 joblib 序列化的字典，文件名仍使用 .joblib 后缀)
+SLIM_ARTIFACT_FORMAT = 'slim-arima-v1'
+
+# 状态空间系统矩阵 (线性高斯、时不变)，从拟合结果的 filter_results 中提取
+SYSTEM_MATRIX_NAMES = ('design', 'obs_intercept', 'obs_cov', 'transition', 'state_intercept', 'selection', 'state_cov')
+
+
+def forecast_index(freq: Union[str, None], last_timestamp: Union[str, None], nobs: int, steps: int) -> pd.Index:
+    """数据边界之后 steps 个周期的预测索引；没有时间索引信息时退回整数索引。"""
+    if freq is not None and last_timestamp is not None:
+        offset = pd.tseries.frequencies.to_offset(freq)
+        return pd.date_range(start=pd.Timestamp(last_timestamp) + offset, periods=steps, freq=offset)
+    return pd.RangeIndex(nobs, nobs + steps)
+
+
+class SlimForecast:
+    """与 statsmodels PredictionResults 用法一致的最小预测结果：predicted_mean、se_mean 与 conf_int。"""
+
+    def __init__(self, predicted_mean: pd.Series, se_mean: np.ndarray):
+        self.predicted_mean = predicted_mean
+        self.se_mean = se_mean
+
+    def conf_int(self, alpha: float = 0.05) -> pd.DataFrame:
+        from scipy.stats import norm # scipy.stats 导入较慢，只在需要区间时导入
+        z = norm.ppf(1 - alpha / 2.0)
+        mean = self.predicted_mean.values
+        return pd.DataFrame({'lower': mean - z * self.se_mean, 'upper': mean + z * self.se_mean},
+                            index=self.predicted_mean.index)
+
+
+class SlimArimaResults:
+    """
+    从精简产物重建的可预测模型。只保存系统矩阵、最后一个观测之后的预测状态 a(n+1|n)
+    及其协方差 P(n+1|n) 和索引信息，预测时直接做卡尔曼递推，不需要训练数据，
+    与原拟合结果的 get_forecast 在数值上一致。
+    """
+
+    def __init__(self, artifact: dict):
+        self.artifact = artifact
+        self.matrices = artifact['matrices']
+        self.state = artifact['state']
+        self.state_cov = artifact['state_cov']
+        self.order = tuple(artifact['order'])
+        self.seasonal_order = tuple(artifact['seasonal_order'])
+        self.params = pd.Series(artifact['params'])
+        self.aic = artifact.get('aic')
+        self.bic = artifact.get('bic')
+        self.nobs = artifact['nobs']
+        self.freq = artifact['freq']
+        self.last_timestamp = artifact['last_timestamp']
+
+    def extend(self, values) -> 'SlimArimaResults':
+        """
+        在保持参数不变的情况下，用紧接在数据边界之后的新观测做卡尔曼滤波更新，返回新的模型对象。
+        与 statsmodels 的 append(refit=False) 得到的预测状态一致；缺失值 (NaN) 只做预测步。
+        """
+        m = self.matrices
+        design, transition = m['design'], m['transition']
+        selected_state_cov = m['selection'] @ m['state_cov'] @ m['selection'].T
+        state, state_cov = self.state, self.state_cov
+        values = np.asarray(values, dtype=float)
+        for y in values:
+            if not np.isnan(y):
+                forecast_error = y - (design @ state + m['obs_intercept'])[0]
+                forecast_var = (design @ state_cov @ design.T + m['obs_cov'])[0, 0]
+                gain = (state_cov @ design.T)[:, 0] / forecast_var
+                state = state + gain * forecast_error
+                state_cov = state_cov - np.outer(gain, gain) * forecast_var
+            state = transition @ state + m['state_intercept']
+            state_cov = transition @ state_cov @ transition.T + selected_state_cov
+
+        artifact = dict(self.artifact)
+        artifact.update(state=state, state_cov=state_cov, nobs=self.nobs + len(values),
+                        last_timestamp=self.forecast_index(len(values))[-1].isoformat() if len(values) else self.last_timestamp,
+                        periods_appended=self.artifact.get('periods_appended', 0) + len(values))
+        return SlimArimaResults(artifact)
+
+    def forecast_index(self, steps: int) -> pd.Index:
+        return forecast_index(self.freq, self.last_timestamp, self.nobs, steps)
+
+    def get_forecast(self, steps: int) -> SlimForecast:
+        m = self.matrices
+        design, transition = m['design'], m['transition']
+        obs_intercept, state_intercept = m['obs_intercept'], m['state_intercept']
+        selected_state_cov = m['selection'] @ m['state_cov'] @ m['selection'].T
+
+        state, state_cov = self.state, self.state_cov
+        means = np.empty(steps)
+        variances = np.empty(steps)
+        for h in range(steps):
+            means[h] = (design @ state + obs_intercept)[0]
+            variances[h] = (design @ state_cov @ design.T + m['obs_cov'])[0, 0]
+            state = transition @ state + state_intercept
+            state_cov = transition @ state_cov @ transition.T + selected_state_cov
+        return SlimForecast(pd.Series(means, index=self.forecast_index(steps), name='predicted_mean'),
+                            np.sqrt(np.maximum(variances, 0)))
+
+
+def _time_invariant_matrix(filter_results, name: str) -> Union[np.ndarray, None]:
+    """取出系统矩阵并去掉时间维度；若矩阵随时间变化 (例如线性趋势)，返回 None。"""
+    matrix = np.asarray(getattr(filter_results, name))
+    time_varying_ndim = 2 if name.endswith('intercept') else 3
+    if matrix.ndim == time_varying_ndim:
+        if matrix.shape[-1] > 1 and not np.allclose(matrix, matrix[..., -1:]):
+            return None
+        return matrix[..., -1].copy()
+    return matrix.copy()
+
+
+def build_slim_artifact(fitted_model, data_source: dict = None) -> Union[dict, None]:
+    """
+    从 statsmodels ARIMA 拟合结果提取精简产物字典。
+    模型含外生变量或时变系统矩阵时无法精简，返回 None (调用方应保存完整模型)。
+    """
+    model = fitted_model.model
+    if getattr(model, 'k_endog', 1) != 1 or (model.k_exog and model.exog_names != ['const']):
+        return None
+    filter_results = fitted_model.filter_results
+    matrices = {}
+    for name in SYSTEM_MATRIX_NAMES:
+        matrix = _time_invariant_matrix(filter_results, name)
+        if matrix is None:
+            return None
+        matrices[name] = matrix
+
+    index = model._index
+    freq = getattr(index, 'freqstr', None) if isinstance(index, pd.DatetimeIndex) else None
+    last_timestamp = index[-1].isoformat() if isinstance(index, pd.DatetimeIndex) and len(index) else None
+    return {
+        'format': SLIM_ARTIFACT_FORMAT,
+        'order': list(model.order),
+        'seasonal_order': list(model.seasonal_order),
+        'params': {str(k): float(v) for k, v in fitted_model.params.items()},
+        'aic': float(fitted_model.aic),
+        'bic': float(fitted_model.bic),
+        'nobs': int(fitted_model.nobs),
+        'freq': freq,
+        'first_timestamp': index[0].isoformat() if last_timestamp else None,
+        'last_timestamp': last_timestamp,
+        'matrices': matrices,
+        'state': np.asarray(filter_results.predicted_state[:, -1]).copy(),
+        'state_cov': np.asarray(filter_results.predicted_state_cov[:, :, -1]).copy(),
+        'data_source': data_source,
+        'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'periods_appended': 0, # 未重新估计参数、通过 extend 追加的周期数
+    }
+
+
+def is_slim_artifact(obj) -> bool:
+    return isinstance(obj, dict) and obj.get('format') == SLIM_ARTIFACT_FORMAT
+
+
+def atomic_dump(obj, path: str):
+    """先写临时文件再原子替换，避免并发读取到写了一半的文件。"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def save_model_artifact(fitted_model, full_model_path: str, data_source: dict = None) -> bool:
+    """
+    保存模型：能精简时写入精简产物，否则退回完整 joblib 序列化。
+    已是 SlimArimaResults 时直接保存其产物；data_source 记录训练数据来源 (筛选条件等)。
+    返回是否保存为精简格式。
+    """
+    if isinstance(fitted_model, SlimArimaResults):
+        artifact = dict(fitted_model.artifact)
+        if data_source is not None:
+            artifact['data_source'] = data_source
+    else:
+        artifact = build_slim_artifact(fitted_model, data_source)
+    atomic_dump(artifact if artifact is not None else fitted_model, full_model_path)
+    if artifact is None:
+        logger.warning(f"模型含时变系统矩阵或外生变量，已按完整格式保存: {full_model_path}")
+    return artifact is not None
+
+
+def restore_model(obj):
+    """joblib.load 的结果若为精简产物则重建 SlimArimaResults，否则原样返回 (兼容旧的完整模型)。"""
+    return SlimArimaResults(obj) if is_slim_artifact(obj) else obj
+
+
+def model_params(fitted_model) -> np.ndarray:
+    """按模型参数顺序返回已拟合参数，用作重新拟合时的热启动初值。"""
+    return np.asarray(fitted_model.params, dtype=float)
+
+
+def model_data_horizon(fitted_model) -> dict:
+    """返回模型的训练数据范围 (起止时间、频率、观测数) 及阶数；精简产物与完整模型均适用。"""
+    if isinstance(getattr(fitted_model, 'artifact', None), dict): # 精简 ARIMA 产物或基准模型产物
+        artifact = fitted_model.artifact
+        return {
+            'model_type': artifact.get('method', 'arima'),
+            'first_timestamp': artifact['first_timestamp'],
+            'last_timestamp': artifact['last_timestamp'],
+            'freq': artifact['freq'],
+            'nobs': artifact['nobs'],
+            'order': artifact.get('order'),
+            'seasonal_order': artifact.get('seasonal_order'),
+            'periods_appended': artifact.get('periods_appended', 0),
+            'data_source': artifact.get('data_source'),
+        }
+    index = fitted_model.model._index
+    is_dated = isinstance(index, pd.DatetimeIndex) and len(index) > 0
+    return {
+        'model_type': 'arima',
+        'first_timestamp': index[0].isoformat() if is_dated else None,
+        'last_timestamp': index[-1].isoformat() if is_dated else None,
+        'freq': index.freqstr if is_dated else None,
+        'nobs': int(fitted_model.nobs),
+        'order': list(fitted_model.model.order),
+        'seasonal_order': list(fitted_model.model.seasonal_order),
+        'periods_appended': 0,
+        'data_source': None,
+    }
+
+
+def extend_model(fitted_model, new_observations: pd.Series):
+    """用新观测扩展模型而不重新估计参数：精简产物走卡尔曼更新，完整模型用 statsmodels 的 append。"""
+    if isinstance(fitted_model, SlimArimaResults):
+        return fitted_model.extend(new_observations.values)
+    return fitted_model.append(new_observations, refit=False)
+
+
+def migrate_model_directory(model_dir: str, dry_run: bool = False) -> list:
+    """
+    把目录下完整格式的 .joblib 模型转换为精简产物，返回每个文件的迁移报告。
+    已是精简格式、无法精简或无法加载的文件保持不变。
+    """
+    reports = []
+    for path in sorted(glob.glob(os.path.join(model_dir, '*.joblib'))):
+        report = {'file': os.path.basename(path), 'bytes_before': os.path.getsize(path)}
+        try:
+            obj = joblib.load(path)
+        except Exception as e:
+            report.update(status='error', error=str(e))
+            reports.append(report)
+            continue
+        if is_slim_artifact(obj):
+            report['status'] = 'already_slim'
+        elif not hasattr(obj, 'filter_results'):
+            report['status'] = 'unsupported'
+        else:
+            artifact = build_slim_artifact(obj)
+            if artifact is None:
+                report['status'] = 'not_slimmable'
+            elif dry_run:
+                report['status'] = 'would_migrate'
+            else:
+                atomic_dump(artifact, path)
+                report.update(status='migrated', bytes_after=os.path.getsize(path))
+        reports.append(report)
+    return reports
+
+
+def migrate_cli(argv: list) -> int:
+    """命令行: python xunlian.py migrate [--model-dir DIR] [--dry-run]"""
+    import argparse
+    parser = argparse.ArgumentParser(prog='xunlian.py migrate', description='将已保存的完整 ARIMA 模型转换为精简产物。')
+    parser.add_argument('--model-dir', default='trained_models')
+    parser.add_argument('--dry-run', action='store_true', help='只报告，不修改文件')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    reports = migrate_model_directory(args.model_dir, dry_run=args.dry_run)
+    for report in reports:
+        after = f" -> {report['bytes_after']} 字节" if 'bytes_after' in report else ''
+        print(f"{report['file']}: {report['status']} ({report['bytes_before']} 字节{after})")
+    migrated = [r for r in reports if r['status'] == 'migrated']
+    saved = sum(r['bytes_before'] - r['bytes_after'] for r in migrated)
+    print(f"共 {len(reports)} 个模型，迁移 {len(migrated)} 个，节省 {saved} 字节，用时 {time.time() - start:.1f}s。")
+    return 1 if any(r['status'] == 'error' for r in reports) else 0
@@ -1,13 +1,22 @@
 import pandas as pd
+import numpy as np
 import os
 import json
 import uuid
+import time
+import hashlib
+import threading
 from logging_config import logger
+import hebing
+import dili
+import zhibiao
 from typing import Union # <--- ADDED THIS LINE
 
 # 一致的列名
 TIME_COLUMN_NAME = '发生时间' # 在 preprocess_crime_data 中重命名 'START_DATE' 后的名称
 OFFENSE_COLUMN_NAME = 'OFFENSE'
+WARD_COLUMN_NAME = 'WARD'
+CLUSTER_COLUMN_NAME = 'CLUSTER' # 由 assign_neighborhood_clusters 按社区边界空间连接得到
 
 def load_and_combine_yearly_data(data_folder_path: str, start_year: int, end_year: int) -> pd.DataFrame:
     """
@@ -169,26 +178,27 @@ def preprocess_crime_data(combined_df: pd.DataFrame) -> pd.DataFrame:
     logger.info(f"预处理完成。最终 DataFrame 包含 {len(processed_df)} 条记录和 {len(processed_df.columns)} 列。")
     return processed_df
 
+def normalize_offense_list(offenses: list = None) -> list:
+    """案件类型筛选的规范形式：去掉空值和 "ALL"，转为大写、去重并排序；空列表表示所有类型。"""
+    return sorted({str(o).upper() for o in (offenses or []) if o and str(o).upper() != "ALL"})
+
 def generate_temp_filtered_data_filename(start_year: int, end_year: int, offenses: list = None, suffix: str = "filtered") -> str:
-    """根据筛选条件生成一个标准化的临时文件名。"""
-    offense_str_list = []
-    if offenses and isinstance(offenses, list) and offenses[0] is not None and offenses[0].upper() != "ALL":
-        # 创建一个对文件名安全且唯一的案件类型字符串
-        # 确保 offenses 是字符串，并处理列表中可能的 None 值（如果不是按 "ALL" 筛选）
-        safe_offenses = [str(o).upper().replace('/', '_').replace(' ', '_') for o in offenses if o]
-        offense_str_list = sorted(list(set(safe_offenses))) # 使用 set 保证唯一性
-
-    offense_filename_part = "_".join(offense_str_list) if offense_str_list else "ALL_TYPES"
-    # 限制案件类型部分的长度，以避免文件名过长
-    offense_filename_part = offense_filename_part[:50]
-
-    # 如果所有其他参数都相同，但触发了新的“处理”操作，则添加一个短的唯一哈希值以区分文件。
-    # 但是，为了查找，确定性名称更好。
-    # 目前，我们依赖参数来实现确定性。如果前端总是在“train”或“get_actual”之前调用“process”，则此方法有效。
-    # unique_hash = uuid.uuid4().hex[:8]
-    # return f"temp_{suffix}_{start_year}_{end_year}_{offense_filename_part}_{unique_hash}.csv"
+    """根据筛选条件生成一个标准化的临时文件名 (案件类型按 normalize_offense_list 规范化)。"""
+    # 创建一个对文件名安全且唯一的案件类型字符串
+    offense_str_list = normalize_offense_list(offenses)
+    offense_filename_part = "_".join(o.replace('/', '_').replace(' ', '_') for o in offense_str_list) or "ALL_TYPES"
+    # 限制案件类型部分的长度，以避免文件名过长；截断时附加完整列表的哈希，不同的类型组合不会共用同一个文件
+    if len(offense_filename_part) > 50:
+        digest = hashlib.sha1("|".join(offense_str_list).encode('utf-8')).hexdigest()[:8]
+        offense_filename_part = f"{offense_filename_part[:41]}_{digest}"
+
+    # 为了查找，使用由参数确定的文件名 (不附加随机后缀)：
+    # 前端先调用 "准备已筛选数据" 再调用 "训练" 或 "获取实际数据" 时，能找到同一个文件。
     return f"temp_{suffix}_{start_year}_{end_year}_{offense_filename_part}.csv"
 
+# 相同筛选条件的临时CSV生成合并为一次 (多个分析人员同时打开同一视图时只筛选、写文件一次)
+_temp_csv_flight = hebing.SingleFlight('temp_csv')
+
 def filter_master_data_to_temp_csv(
     master_csv_path: str,
     temp_training_data_dir: str,
@@ -200,21 +210,44 @@ def filter_master_data_to_temp_csv(
     从主CSV文件加载数据，根据年份和案件类型筛选，
     并将结果保存到一个新的临时CSV文件中。
     返回 (临时文件的路径 | None, 消息, 记录数).
+    相同条件 (及相同主数据版本) 的并发调用只执行一次，在进程内与本机的多个工作进程之间
+    (临时目录下的文件锁) 共享同一结果，不会同时写同一个临时文件。
     """
+    if offenses is not None and not isinstance(offenses, list):
+        return None, "'offenses' 应该是列表或 null。", 0
+    # 合并键和临时文件名都由同一个规范化后的案件类型列表生成
+    normalized_offenses = normalize_offense_list(offenses)
+    key = hebing.make_key(os.path.abspath(master_csv_path), get_master_data_version(master_csv_path),
+                          os.path.abspath(temp_training_data_dir), start_year, end_year, normalized_offenses)
+    return _temp_csv_flight.do(
+        key, _filter_master_data_to_temp_csv,
+        master_csv_path, temp_training_data_dir, start_year, end_year, normalized_offenses,
+        lock_dir=os.path.join(temp_training_data_dir, '.single_flight')
+    )
+
+def _filter_master_data_to_temp_csv(
+    master_csv_path: str,
+    temp_training_data_dir: str,
+    start_year: int,
+    end_year: int,
+    offenses: list = None
+) -> tuple[Union[str, None], str, int]:
     if not os.path.exists(master_csv_path):
         msg = f"主CSV文件未找到: {master_csv_path}"
         logger.error(msg)
         return None, msg, 0
 
     try:
-        df_master = pd.read_csv(master_csv_path)
+        with zhibiao.stage_timer('csv_read'):
+            df_master = pd.read_csv(master_csv_path)
         logger.info(f"从 '{master_csv_path}' 加载了 {len(df_master)} 条主数据记录。")
 
         if TIME_COLUMN_NAME not in df_master.columns:
             msg = f"主CSV中未找到日期列 '{TIME_COLUMN_NAME}'。"
             logger.error(msg)
             return None, msg, 0
-        df_master[TIME_COLUMN_NAME] = pd.to_datetime(df_master[TIME_COLUMN_NAME], errors='coerce')
+        with zhibiao.stage_timer('date_parse'):
+            df_master[TIME_COLUMN_NAME] = pd.to_datetime(df_master[TIME_COLUMN_NAME], errors='coerce')
         df_master.dropna(subset=[TIME_COLUMN_NAME], inplace=True)
 
         # 1. 按年份筛选
@@ -224,34 +257,15 @@ def filter_master_data_to_temp_csv(
         ].copy() # 使用 .copy() 以避免稍后的 SettingWithCopyWarning
         logger.info(f"按年份 ({start_year}-{end_year}) 筛选后剩余: {len(df_filtered)} 条记录。")
 
-        # 2. 按案件类型筛选
-        # offenses: None 或空列表表示给定年份的所有类型。
-        # offenses: ["ALL"] 也表示所有类型。
-        # offenses: ["Type1", "Type2"] 表示按这些类型筛选。
-        process_offenses = False
-        if offenses and isinstance(offenses, list) and offenses[0] is not None:
-            if isinstance(offenses[0], str) and offenses[0].upper() != "ALL":
-                process_offenses = True
-            elif len(offenses) > 1 : # 例如 [Type1, Type2] vs 只有 [ALL] 或 [None]
-                    process_offenses = True
-
-
-        if process_offenses:
+        # 2. 按案件类型筛选 (offenses 已规范化，空列表表示所有类型)
+        if offenses:
             if OFFENSE_COLUMN_NAME not in df_filtered.columns:
                 msg = f"主CSV中未找到案件类型列 '{OFFENSE_COLUMN_NAME}'，无法按案件类型筛选。"
                 logger.error(msg)
                 return None, msg, 0
-
-            # 确保比较不区分大小写且类型为字符串
-            # 如果未选择特定案件类型，前端可能会发送 [null]，视为 "ALL"
-            valid_offenses = [str(o).upper() for o in offenses if o] # 过滤掉 None 并转换为大写字符串
-
-            if valid_offenses: # 仅当存在实际要筛选的案件类型时才继续
-                df_filtered = df_filtered[df_filtered[OFFENSE_COLUMN_NAME].astype(str).str.upper().isin(valid_offenses)]
-                logger.info(f"按案件类型 ({', '.join(valid_offenses)}) 筛选后剩余: {len(df_filtered)} 条记录。")
-            else:
-                logger.info("提供的案件类型列表解析后为空，视为选择所有类型。")
-
+            # 比较不区分大小写
+            df_filtered = df_filtered[df_filtered[OFFENSE_COLUMN_NAME].astype(str).str.upper().isin(offenses)]
+            logger.info(f"按案件类型 ({', '.join(offenses)}) 筛选后剩余: {len(df_filtered)} 条记录。")
 
         if df_filtered.empty:
             msg = f"筛选条件 {start_year}-{end_year}, 案件类型: {offenses if offenses else 'ALL'} 没有匹配的数据。"
@@ -260,10 +274,13 @@ def filter_master_data_to_temp_csv(
 
         os.makedirs(temp_training_data_dir, exist_ok=True)
 
-        temp_filename = generate_temp_filtered_data_filename(start_year, end_year, offenses if process_offenses else ["ALL"], suffix="for_processing")
+        temp_filename = generate_temp_filtered_data_filename(start_year, end_year, offenses, suffix="for_processing")
         temp_file_path = os.path.join(temp_training_data_dir, temp_filename)
 
-        df_filtered.to_csv(temp_file_path, index=False, encoding='utf-8')
+        # 先写临时文件再原子替换，正在读取旧文件的请求不会读到写了一半的内容
+        staged_path = f"{temp_file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df_filtered.to_csv(staged_path, index=False, encoding='utf-8')
+        os.replace(staged_path, temp_file_path)
         num_records = len(df_filtered)
         msg = f"数据已根据您的选择筛选完毕，共 {num_records} 条记录。临时文件: {temp_filename}"
         logger.info(msg)
@@ -275,6 +292,408 @@ def filter_master_data_to_temp_csv(
         return None, f"处理数据时发生服务器内部错误: {str(e)}", 0
 
 
+# --- 主数据内存缓存 (master store) ---
+# 主 CSV 只在文件变化 (mtime/size) 时重新读取和解析日期，其余请求直接复用内存中的 DataFrame。
+_master_data_cache = {}
+_master_data_lock = threading.Lock()
+
+def get_file_version(file_path: str) -> Union[str, None]:
+    """根据文件的路径、大小和修改时间生成版本号；文件不存在时返回 None。"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    raw = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+def get_master_data_version(master_csv_path: str) -> Union[str, None]:
+    """主CSV的数据版本号 (见 get_file_version)；重新导入数据后版本号随之改变。"""
+    return get_file_version(master_csv_path)
+
+def master_data_binary_cache_path(master_csv_path: str, version: str) -> str:
+    """主数据二进制缓存 (pickle) 的路径：与主CSV同目录的 .master_cache 下，按数据版本和 pandas 版本命名。"""
+    stem = os.path.splitext(os.path.basename(master_csv_path))[0]
+    pandas_tag = pd.__version__.replace('.', '_') # 不同 pandas 版本的 pickle 不一定兼容
+    return os.path.join(os.path.dirname(os.path.abspath(master_csv_path)), '.master_cache',
+                        f"{stem}_{version}_pd{pandas_tag}.pkl")
+
+def _read_master_binary_cache(cache_path: str) -> Union[pd.DataFrame, None]:
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        return pd.read_pickle(cache_path)
+    except Exception as e:
+        logger.warning(f"读取主数据二进制缓存失败，将重新解析CSV: {e}")
+        return None
+
+def _write_master_binary_cache(df_master: pd.DataFrame, master_csv_path: str, cache_path: str):
+    """原子地写入主数据二进制缓存，并删除同一主CSV的旧版本缓存；失败只记录警告。"""
+    cache_dir = os.path.dirname(cache_path)
+    stem_prefix = os.path.splitext(os.path.basename(master_csv_path))[0] + '_'
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        staged_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        df_master.to_pickle(staged_path)
+        os.replace(staged_path, cache_path)
+        for entry in os.scandir(cache_dir):
+            if entry.name.startswith(stem_prefix) and entry.name.endswith('.pkl') and entry.path != cache_path:
+                os.remove(entry.path)
+    except Exception as e:
+        logger.warning(f"写入主数据二进制缓存失败: {e}")
+
+def load_master_data(master_csv_path: str) -> pd.DataFrame:
+    """
+    加载主CSV (日期列已解析、无效日期已删除) 并缓存在内存中。
+    返回的 DataFrame 为共享对象，调用方不得原地修改。
+    解析结果同时保存为二进制缓存 (见 master_data_binary_cache_path)，主CSV未变化时
+    进程重启后直接读取缓存 (毫秒级)，不再重新解析CSV和日期。
+    """
+    version = get_master_data_version(master_csv_path)
+    if version is None:
+        raise FileNotFoundError(f"主CSV文件未找到: {master_csv_path}")
+
+    with _master_data_lock:
+        cached = _master_data_cache.get(master_csv_path)
+        zhibiao.record_cache('master_data', cached is not None and cached[0] == version)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        cache_path = master_data_binary_cache_path(master_csv_path, version)
+        with zhibiao.stage_timer('store_read'):
+            df_master = _read_master_binary_cache(cache_path)
+        zhibiao.record_cache('master_binary', df_master is not None)
+        if df_master is not None:
+            _master_data_cache[master_csv_path] = (version, df_master)
+            logger.info(f"主数据已从二进制缓存加载到内存: {len(df_master)} 条记录 (版本 {version})。")
+            return df_master
+
+        with zhibiao.stage_timer('csv_read'):
+            df_master = pd.read_csv(master_csv_path)
+        if TIME_COLUMN_NAME not in df_master.columns:
+            raise ValueError(f"主CSV中未找到日期列 '{TIME_COLUMN_NAME}'。")
+        with zhibiao.stage_timer('date_parse'):
+            df_master[TIME_COLUMN_NAME] = pd.to_datetime(df_master[TIME_COLUMN_NAME], errors='coerce')
+        df_master.dropna(subset=[TIME_COLUMN_NAME], inplace=True)
+        df_master.reset_index(drop=True, inplace=True)
+        _write_master_binary_cache(df_master, master_csv_path, cache_path)
+        _master_data_cache[master_csv_path] = (version, df_master)
+        logger.info(f"主数据已加载到内存: {len(df_master)} 条记录 (版本 {version})。")
+        return df_master
+
+
+# --- 主数据的派生结构：索引与计数立方体 ---
+# 与内存中的主数据对象一一对应 (按版本号)，主CSV重新导入后随新主数据惰性重建，
+# 也可以由预热 (app.py 的 warm_up_scheduler) 提前构建。
+# 索引: 时间列的整数刻度 (是否有序) 与大写案件类型的整数编码，筛选时不再逐行做字符串转换；
+# 计数立方体: 日 x 案件类型 的记录数，只按时间和案件类型筛选的聚合直接由它求和，不再扫描记录。
+_master_derived_cache = {} # 主CSV路径 -> (版本, 主数据对象, {结构名: 结构})
+_master_derived_lock = threading.Lock()
+
+def build_master_indexes(df_master: pd.DataFrame) -> dict:
+    """为主数据构建筛选索引: 时间刻度 (整数，单位见 'time_unit') 与案件类型编码 (-1 表示缺失)。"""
+    times = pd.DatetimeIndex(df_master[TIME_COLUMN_NAME])
+    time_ticks = times.asi8
+    indexes = {
+        'time_ticks': time_ticks,
+        'time_unit': times.unit,
+        'time_sorted': bool(times.is_monotonic_increasing),
+        'offense_codes': None,
+        'offense_categories': None,
+    }
+    if OFFENSE_COLUMN_NAME in df_master.columns:
+        # 与 filter_master_data 的逐行比较保持一致: 先转为字符串再转大写
+        codes, categories = pd.factorize(df_master[OFFENSE_COLUMN_NAME].astype(str).str.upper())
+        indexes['offense_codes'] = codes.astype(np.int32)
+        indexes['offense_categories'] = categories
+    indexes['memory_bytes'] = int(time_ticks.nbytes + (indexes['offense_codes'].nbytes if indexes['offense_codes'] is not None else 0))
+    return indexes
+
+def build_master_count_cube(indexes: dict) -> dict:
+    """
+    由主数据索引构建 日 x 案件类型 的计数立方体 (int32)。
+    最后一列对应缺失的案件类型；没有案件类型列时只有这一列。
+    """
+    ticks_per_day = np.timedelta64(1, 'D') // np.timedelta64(1, indexes['time_unit'])
+    record_days = indexes['time_ticks'] // ticks_per_day
+    if indexes['offense_codes'] is not None:
+        num_columns = len(indexes['offense_categories']) + 1
+        columns = np.where(indexes['offense_codes'] >= 0, indexes['offense_codes'], num_columns - 1)
+    else:
+        num_columns = 1
+        columns = np.zeros(len(record_days), dtype=np.int32)
+    if len(record_days) == 0:
+        first_day, counts = 0, np.zeros((0, num_columns), dtype=np.int32)
+    else:
+        first_day = int(record_days.min())
+        num_days = int(record_days.max()) - first_day + 1
+        flat = (record_days - first_day) * num_columns + columns
+        counts = np.bincount(flat, minlength=num_days * num_columns).astype(np.int32).reshape(num_days, num_columns)
+    return {
+        'first_day': first_day, # 第一行对应的日编号 (距 1970-01-01 的天数)
+        'counts': counts,
+        'totals': counts.sum(axis=1),
+        'offense_categories': indexes['offense_categories'],
+        'time_unit': indexes['time_unit'],
+        'memory_bytes': int(counts.nbytes * 2),
+    }
+
+def _cached_master_entry(df_master: pd.DataFrame) -> Union[tuple, None]:
+    """df_master 是内存中缓存的主数据对象时返回 (主CSV路径, 版本)，否则返回 None。"""
+    for master_csv_path, (version, cached_df) in list(_master_data_cache.items()):
+        if cached_df is df_master:
+            return master_csv_path, version
+    return None
+
+def _get_derived(master_csv_path: str, version: str, df_master: pd.DataFrame, name: str) -> dict:
+    with _master_derived_lock:
+        entry = _master_derived_cache.get(master_csv_path)
+        if entry is None or entry[0] != version or entry[1] is not df_master:
+            entry = (version, df_master, {})
+            _master_derived_cache[master_csv_path] = entry # 旧版本的派生结构随之释放
+        structures = entry[2]
+        zhibiao.record_cache(f"master_{name}", name in structures)
+        if name not in structures:
+            started = time.perf_counter()
+            if name == 'indexes':
+                structures[name] = build_master_indexes(df_master)
+            else:
+                indexes = structures.get('indexes') or build_master_indexes(df_master)
+                structures['indexes'] = indexes
+                structures[name] = build_master_count_cube(indexes)
+            logger.info(f"已构建主数据的{'索引' if name == 'indexes' else '计数立方体'} "
+                        f"(版本 {version}，耗时 {(time.perf_counter() - started) * 1000:.1f} ms)。")
+        return structures[name]
+
+def _get_current_derived(master_csv_path: str, name: str) -> dict:
+    df_master = load_master_data(master_csv_path)
+    # 加载后主数据可能已被其他线程替换为新版本，此时按本次拿到的对象构建，下次调用再重建
+    entry = _cached_master_entry(df_master) or (master_csv_path, None)
+    return _get_derived(entry[0], entry[1], df_master, name)
+
+def get_master_indexes(master_csv_path: str) -> dict:
+    """当前主数据的筛选索引 (见 build_master_indexes)，按主数据版本缓存。"""
+    return _get_current_derived(master_csv_path, 'indexes')
+
+def get_master_count_cube(master_csv_path: str) -> dict:
+    """当前主数据的计数立方体 (见 build_master_count_cube)，按主数据版本缓存。"""
+    return _get_current_derived(master_csv_path, 'count_cube')
+
+def count_master_days(master_csv_path: str, normalized_spec: dict) -> Union[tuple, None]:
+    """
+    由计数立方体得到按时间和案件类型筛选后的逐日记录数: (第一天的日编号, 逐日计数 (float), 时间单位)。
+    首尾没有记录的日子已去掉，与直接对筛选结果逐日计数一致；没有匹配记录时逐日计数为空数组。
+    筛选条件含 bbox/多边形时立方体无法回答，返回 None (调用方退回逐条筛选)。
+    """
+    if normalized_spec.get('bbox') or normalized_spec.get('polygon'):
+        return None
+    cube = get_master_count_cube(master_csv_path)
+    counts = cube['counts']
+    first_day = cube['first_day']
+    start_row, end_row = 0, len(counts)
+    if normalized_spec.get('start_date'):
+        start_row = max(start_row, int(np.datetime64(normalized_spec['start_date'], 'D').astype(np.int64)) - first_day)
+    if normalized_spec.get('end_date'):
+        end_row = min(end_row, int(np.datetime64(normalized_spec['end_date'], 'D').astype(np.int64)) - first_day + 1)
+    start_row = min(max(start_row, 0), len(counts))
+    end_row = max(end_row, start_row)
+
+    if normalized_spec.get('offenses'):
+        if cube['offense_categories'] is None:
+            raise ValueError(f"主CSV中未找到案件类型列 '{OFFENSE_COLUMN_NAME}'，无法按案件类型筛选。")
+        columns = cube['offense_categories'].get_indexer(normalized_spec['offenses'])
+        columns = columns[columns >= 0]
+        daily = counts[start_row:end_row, columns].sum(axis=1)
+    else:
+        daily = cube['totals'][start_row:end_row]
+
+    nonzero = np.flatnonzero(daily)
+    if len(nonzero) == 0:
+        return first_day + start_row, np.zeros(0, dtype=float), cube['time_unit']
+    return first_day + start_row + int(nonzero[0]), daily[nonzero[0]:nonzero[-1] + 1].astype(float), cube['time_unit']
+
+def normalize_filter_spec(spec: dict) -> dict:
+    """
+    将筛选条件规范化为统一结构，便于筛选和计算缓存键：
+    {"start_date", "end_date" (ISO 日期，包含当天), "offenses" (大写、去重、排序或 None),
+     "bbox" ([minLng, minLat, maxLng, maxLat] 或 None), "polygon" (GeoJSON 几何或 None)}。
+    年份 (start_year/end_year) 与日期 (start_date/end_date) 二选一；参数无效时抛出 ValueError。
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("筛选条件必须是 JSON 对象。")
+
+    start_date, end_date = spec.get('start_date'), spec.get('end_date')
+    start_year, end_year = spec.get('start_year'), spec.get('end_year')
+    if start_date or end_date:
+        try:
+            start = pd.Timestamp(start_date).normalize() if start_date else None
+            end = pd.Timestamp(end_date).normalize() if end_date else None
+        except (ValueError, TypeError):
+            raise ValueError("日期格式无效。请使用 YYYY-MM-DD。")
+    elif start_year is not None or end_year is not None:
+        if not all(isinstance(y, int) for y in [start_year, end_year] if y is not None):
+            raise ValueError("start_year 和 end_year 必须是整数。")
+        start = pd.Timestamp(year=start_year, month=1, day=1) if start_year is not None else None
+        end = pd.Timestamp(year=end_year, month=12, day=31) if end_year is not None else None
+    else:
+        start, end = None, None
+    if start is not None and end is not None and start > end:
+        raise ValueError("开始时间不能晚于结束时间。")
+
+    offenses = spec.get('offenses')
+    if offenses is not None and not isinstance(offenses, list):
+        raise ValueError("'offenses' 应该是列表或 null。")
+    valid_offenses = normalize_offense_list(offenses)
+
+    bbox = spec.get('bbox')
+    if bbox is not None:
+        if not isinstance(bbox, list) or len(bbox) != 4 or \
+           not all(isinstance(c, (int, float)) for c in bbox):
+            raise ValueError("'bbox' 格式无效。应为 [minLng, minLat, maxLng, maxLat]。")
+        bbox = [float(c) for c in bbox]
+
+    polygon = spec.get('polygon')
+    if polygon is not None:
+        if isinstance(polygon, dict) and polygon.get('type') == 'Feature':
+            polygon = polygon.get('geometry')
+        if not isinstance(polygon, dict) or polygon.get('type') not in ('Polygon', 'MultiPolygon'):
+            raise ValueError("'polygon' 必须是 GeoJSON Polygon 或 MultiPolygon。")
+
+    return {
+        "start_date": start.strftime('%Y-%m-%d') if start is not None else None,
+        "end_date": end.strftime('%Y-%m-%d') if end is not None else None,
+        "offenses": valid_offenses or None,
+        "bbox": bbox,
+        "polygon": polygon,
+    }
+
+def filter_spec_hash(normalized_spec: dict) -> str:
+    """规范化筛选条件的稳定哈希，用作缓存键的一部分。"""
+    canonical = json.dumps(normalized_spec, sort_keys=True, ensure_ascii=True, separators=(',', ':'))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:16]
+
+@zhibiao.timed_stage('filter')
+def filter_master_data(df_master: pd.DataFrame, normalized_spec: dict) -> pd.DataFrame:
+    """
+    按规范化后的筛选条件 (时间、案件类型、bbox、多边形) 筛选主数据，返回新的 DataFrame。
+    df_master 是内存中缓存的主数据时使用其索引 (见 build_master_indexes)，不再逐行比较时间和转换案件类型字符串。
+    """
+    cached_entry = _cached_master_entry(df_master)
+    indexes = _get_derived(cached_entry[0], cached_entry[1], df_master, 'indexes') if cached_entry else None
+    mask = np.ones(len(df_master), dtype=bool)
+    start = pd.Timestamp(normalized_spec['start_date']) if normalized_spec.get('start_date') else None
+    # 包含 end_date 当天
+    end = pd.Timestamp(normalized_spec['end_date']) + pd.Timedelta(days=1) if normalized_spec.get('end_date') else None
+    if indexes is not None:
+        ticks = indexes['time_ticks']
+        tick_dtype = f"datetime64[{indexes['time_unit']}]"
+        start_tick = start.to_datetime64().astype(tick_dtype).astype(np.int64) if start is not None else None
+        end_tick = end.to_datetime64().astype(tick_dtype).astype(np.int64) if end is not None else None
+        if indexes['time_sorted']:
+            # 时间有序: 二分查找得到时间范围对应的行区间
+            if start_tick is not None:
+                mask[:np.searchsorted(ticks, start_tick, side='left')] = False
+            if end_tick is not None:
+                mask[np.searchsorted(ticks, end_tick, side='left'):] = False
+        else:
+            if start_tick is not None:
+                mask &= ticks >= start_tick
+            if end_tick is not None:
+                mask &= ticks < end_tick
+    else:
+        times = df_master[TIME_COLUMN_NAME]
+        if start is not None:
+            mask &= (times >= start).values
+        if end is not None:
+            mask &= (times < end).values
+
+    if normalized_spec.get('offenses'):
+        if OFFENSE_COLUMN_NAME not in df_master.columns:
+            raise ValueError(f"主CSV中未找到案件类型列 '{OFFENSE_COLUMN_NAME}'，无法按案件类型筛选。")
+        if indexes is not None:
+            # 按编码查表: allowed[-1] (缺失值) 恒为 False
+            allowed = np.zeros(len(indexes['offense_categories']) + 1, dtype=bool)
+            positions = indexes['offense_categories'].get_indexer(normalized_spec['offenses'])
+            allowed[positions[positions >= 0]] = True
+            mask &= allowed[indexes['offense_codes']]
+        else:
+            mask &= df_master[OFFENSE_COLUMN_NAME].astype(str).str.upper().isin(normalized_spec['offenses']).values
+
+    if normalized_spec.get('bbox') or normalized_spec.get('polygon'):
+        if 'longitude' not in df_master.columns or 'latitude' not in df_master.columns:
+            raise ValueError("主CSV中缺少经纬度列，无法按地理范围筛选。")
+        lons = df_master['longitude'].values.astype(float)
+        lats = df_master['latitude'].values.astype(float)
+        if normalized_spec.get('bbox'):
+            min_lon, min_lat, max_lon, max_lat = normalized_spec['bbox']
+            mask &= (lons >= min_lon) & (lons <= max_lon) & (lats >= min_lat) & (lats <= max_lat)
+        if normalized_spec.get('polygon'):
+            # 仅在需要多边形筛选时才导入 shapely
+            import shapely
+            from shapely.geometry import shape
+            polygon = shape(normalized_spec['polygon'])
+            candidates = np.flatnonzero(mask)
+            inside = shapely.intersects_xy(polygon, lons[candidates], lats[candidates])
+            mask[candidates[~inside]] = False
+
+    df_filtered = df_master[mask]
+    logger.info(f"按筛选条件筛选后剩余: {len(df_filtered)} 条记录。")
+    return df_filtered
+
+
+# 按路径读取的社区边界 (EPSG:4326，已去除无效几何体) 的进程内缓存: 绝对路径 -> (文件版本, GeoDataFrame)
+_boundaries_cache = {}
+_boundaries_lock = threading.Lock()
+
+def load_neighborhood_boundaries(boundaries_path: str):
+    """读取并缓存社区边界；文件版本变化后重新读取。供没有 app 中已加载边界的调用方 (命令行批量训练) 使用。"""
+    gpd = dili.load_geopandas() # 仅在需要按社区分组时才导入
+    path = os.path.abspath(boundaries_path)
+    version = get_file_version(path)
+    with _boundaries_lock:
+        cached = _boundaries_cache.get(path)
+        if cached is not None and cached[0] == version:
+            zhibiao.record_cache('neighborhood_boundaries', True)
+            return cached[1]
+    zhibiao.record_cache('neighborhood_boundaries', False)
+    boundaries = gpd.read_file(path)
+    if boundaries.crs is None:
+        boundaries = boundaries.set_crs("EPSG:4326")
+    elif boundaries.crs != "EPSG:4326":
+        boundaries = boundaries.to_crs("EPSG:4326")
+    boundaries = boundaries[boundaries.geometry.is_valid & ~boundaries.geometry.is_empty]
+    with _boundaries_lock:
+        _boundaries_cache[path] = (version, boundaries)
+    return boundaries
+
+def assign_neighborhood_clusters(df: pd.DataFrame, boundaries, name_column: str = 'NAME') -> pd.Series:
+    """
+    将每条记录的经纬度与社区边界做点面空间连接，返回与 df 索引对齐的社区名称 Series；
+    不在任何社区内或缺少坐标的记录为 NaN。
+    boundaries 为已处理的社区边界 GeoDataFrame (例如 app 中已加载并投影的 community_gdf)，
+    或边界文件 (Neighborhood_Clusters.json) 的路径 (按文件版本缓存，见 load_neighborhood_boundaries)。
+    边界不是 EPSG:4326 时把记录的坐标投影到边界的坐标系，而不是每次重投影边界。
+    """
+    gpd = dili.load_geopandas() # 仅在需要按社区分组时才导入
+
+    if isinstance(boundaries, (str, os.PathLike)):
+        boundaries = load_neighborhood_boundaries(boundaries)
+    boundaries = boundaries[[name_column, 'geometry']]
+
+    with_coords = df[['longitude', 'latitude']].dropna()
+    points = gpd.GeoDataFrame(
+        index=with_coords.index,
+        geometry=gpd.points_from_xy(with_coords['longitude'].values, with_coords['latitude'].values),
+        crs="EPSG:4326"
+    )
+    if boundaries.crs is not None and boundaries.crs != points.crs:
+        points = points.to_crs(boundaries.crs)
+    with zhibiao.stage_timer('sjoin'):
+        joined = gpd.sjoin(points, boundaries, how='left', predicate='within')
+    joined = joined[~joined.index.duplicated(keep='first')] # 落在边界上的点只计入一个社区
+    clusters = joined[name_column].reindex(df.index)
+    logger.info(f"已为 {int(clusters.notna().sum())}/{len(df)} 条记录分配社区 (聚类)。")
+    return clusters.rename(CLUSTER_COLUMN_NAME)
+
 if __name__ == '__main__':
     RAW_DATA_FOLDER = 'raw_data' # 相对于此脚本的位置
     # 此输出路径应与 app.py 期望的 MASTER_CSV_PATH 一致
@@ -0,0 +1,171 @@
+import numpy as np
+from logging_config import logger
+from typing import Union
+
+# 距离带扫描的默认阈值个数
+DEFAULT_SWEEP_STEPS = 20
+# Gi* 置换检验的随机种子：相同输入得到相同的 p 值，响应可以按数据版本缓存 (ETag)
+PERMUTATION_SEED = 12345
+
+
+def build_sorted_distance_pairs(coords: np.ndarray) -> dict:
+    """
+    对所有区域质心两两计算距离，并按距离升序排列 (只保留 i < j 的无序对)。
+    返回的结构在距离阈值扫描中复用：阈值 t 对应的邻居对就是排序后前 searchsorted(t) 个。
+    """
+    coords = np.asarray(coords, dtype=float)
+    n = len(coords)
+    i_idx, j_idx = np.triu_indices(n, k=1)
+    distances = np.hypot(coords[i_idx, 0] - coords[j_idx, 0], coords[i_idx, 1] - coords[j_idx, 1])
+
+    order = np.argsort(distances, kind='stable')
+    i_idx, j_idx, distances = i_idx[order], j_idx[order], distances[order]
+    num_pairs = len(distances)
+
+    # 每个端点在排序后的邻居对序列中第几次出现 (即加入该对之前的度数)，用于增量计算 Σk²
+    endpoints = np.concatenate([i_idx, j_idx])
+    pair_pos = np.concatenate([np.arange(num_pairs), np.arange(num_pairs)])
+    by_node = np.lexsort((pair_pos, endpoints))
+    sorted_nodes = endpoints[by_node]
+    group_start = np.searchsorted(sorted_nodes, sorted_nodes, side='left')
+    degree_before = np.empty_like(by_node)
+    degree_before[by_node] = np.arange(len(by_node)) - group_start
+    # 加入一对 (i, j) 后 Σk² 的增量 = (2k_i + 1) + (2k_j + 1)
+    degree_sq_increment = np.bincount(pair_pos, weights=2 * degree_before + 1, minlength=num_pairs)
+
+    # 每个区域第一次获得邻居时所在的位置，用于统计各阈值下的孤立区域数
+    first_neighbor_pos = np.full(n, num_pairs, dtype=np.int64)
+    np.minimum.at(first_neighbor_pos, endpoints, pair_pos)
+
+    logger.debug(f"已为 {n} 个区域构建 {num_pairs} 个排序后的邻居对。")
+    return {
+        "n": n,
+        "i": i_idx,
+        "j": j_idx,
+        "distances": distances,
+        "cum_degree_sq": np.cumsum(degree_sq_increment),
+        "first_neighbor_pos_sorted": np.sort(first_neighbor_pos),
+    }
+
+
+def default_sweep_thresholds(pairs: dict, num_steps: int = DEFAULT_SWEEP_STEPS) -> np.ndarray:
+    """
+    默认扫描区间：从保证每个区域至少有一个邻居的最小距离开始，
+    到全部质心对距离中位数为止，等间距取 num_steps 个阈值。
+    """
+    distances = pairs["distances"]
+    if len(distances) == 0:
+        return np.array([], dtype=float)
+    first_pos = pairs["first_neighbor_pos_sorted"]
+    start = distances[min(first_pos[-1], len(distances) - 1)]
+    end = max(float(np.median(distances)), start)
+    if num_steps <= 1 or end == start:
+        return np.array([start], dtype=float)
+    return np.linspace(start, end, num_steps)
+
+
+def distance_band_sweep(values: np.ndarray, pairs: dict, thresholds: np.ndarray) -> dict:
+    """
+    在一组距离阈值上计算全局 Moran's I 与 Getis-Ord General G 及其 z 得分 (正态假设，二元权重)。
+    所有阈值在一次向量化计算中完成：阈值 t 的权重即排序距离中前 m(t) 个邻居对，
+    各统计量通过前缀和增量得到，而不是为每个阈值重新构建权重矩阵。
+    """
+    x = np.asarray(values, dtype=float)
+    n = pairs["n"]
+    if len(x) != n:
+        raise ValueError(f"观测值数量 ({len(x)}) 与区域数量 ({n}) 不一致。")
+    if n < 4:
+        raise ValueError("至少需要 4 个区域才能计算全局空间自相关统计量。")
+
+    thresholds = np.asarray(thresholds, dtype=float)
+    i_idx, j_idx = pairs["i"], pairs["j"]
+    m = np.searchsorted(pairs["distances"], thresholds, side='right')  # 每个阈值下的邻居对数
+    last = np.maximum(m - 1, 0)
+    has_pairs = m > 0
+
+    def prefix(cumulative):
+        return np.where(has_pairs, cumulative[last] if len(cumulative) else 0.0, 0.0)
+
+    # 二元对称权重: S0 = 2m, S1 = 4m, S2 = 4Σk²
+    s0 = 2.0 * m
+    s1 = 4.0 * m
+    s2 = 4.0 * prefix(pairs["cum_degree_sq"])
+    n2 = float(n * n)
+
+    # --- Moran's I ---
+    zc = x - x.mean()
+    zc_sq_sum = float(np.sum(zc * zc))
+    cross_moran = 2.0 * prefix(np.cumsum(zc[i_idx] * zc[j_idx]))
+    expected_i = -1.0 / (n - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        moran_i = (n / s0) * cross_moran / zc_sq_sum
+        var_i = (n2 * s1 - n * s2 + 3.0 * s0 ** 2) / ((n2 - 1.0) * s0 ** 2) - expected_i ** 2
+        moran_z = (moran_i - expected_i) / np.sqrt(var_i)
+
+    # --- Getis-Ord General G (方差公式与 esda.getisord.G 一致) ---
+    sum_y, sum_y2 = x.sum(), np.sum(x ** 2)
+    sum_y3, sum_y4 = np.sum(x ** 3), np.sum(x ** 4)
+    g_den = sum_y ** 2 - sum_y2
+    cross_g = 2.0 * prefix(np.cumsum(x[i_idx] * x[j_idx]))
+    s02 = s0 ** 2
+    b0 = (n2 - 3 * n + 3) * s1 - n * s2 + 3 * s02
+    b1 = -((n2 - n) * s1 - 2 * n * s2 + 6 * s02)
+    b2 = -(2 * n * s1 - (n + 3) * s2 + 6 * s02)
+    b3 = 4 * (n - 1) * s1 - 2 * (n + 1) * s2 + 8 * s02
+    b4 = s1 - s2 + s02
+    expected_g = s0 / (n * (n - 1))
+    eg2 = (b0 * sum_y2 ** 2 + b1 * sum_y4 + b2 * sum_y ** 2 * sum_y2 + b3 * sum_y * sum_y3 + b4 * sum_y ** 4)
+    eg2 /= (g_den ** 2) * n * (n - 1) * (n - 2) * (n - 3)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        general_g = cross_g / g_den
+        general_g_z = (general_g - expected_g) / np.sqrt(eg2 - expected_g ** 2)
+
+    # 无邻居对的阈值上统计量没有定义
+    moran_i = np.where(has_pairs, moran_i, np.nan)
+    moran_z = np.where(has_pairs, moran_z, np.nan)
+    general_g = np.where(has_pairs, general_g, np.nan)
+    general_g_z = np.where(has_pairs, general_g_z, np.nan)
+
+    isolated = n - np.searchsorted(pairs["first_neighbor_pos_sorted"], m, side='left')
+    mean_neighbors = s0 / n
+
+    return {
+        "distances": thresholds,
+        "num_neighbor_pairs": m,
+        "mean_neighbors": mean_neighbors,
+        "isolated_regions": isolated,
+        "moran_i": moran_i,
+        "moran_z": moran_z,
+        "general_g": general_g,
+        "general_g_z": general_g_z,
+        "peak_distance": find_peak_distance(thresholds, moran_z),
+        "first_peak_distance": find_first_peak_distance(thresholds, moran_z),
+    }
+
+
+def find_peak_distance(distances: np.ndarray, z_scores: np.ndarray) -> Union[float, None]:
+    """返回 z 得分最大的距离阈值；全部为 NaN 时返回 None。"""
+    if len(z_scores) == 0 or np.all(np.isnan(z_scores)):
+        return None
+    return float(distances[int(np.nanargmax(z_scores))])
+
+
+def find_first_peak_distance(distances: np.ndarray, z_scores: np.ndarray) -> Union[float, None]:
+    """返回 z 得分曲线上第一个局部峰值对应的距离阈值；没有局部峰值时退回全局最大值。"""
+    z = np.where(np.isnan(z_scores), -np.inf, z_scores)
+    if len(z) >= 3:
+        peaks = np.flatnonzero((z[1:-1] > z[:-2]) & (z[1:-1] >= z[2:])) + 1
+        if len(peaks):
+            return float(distances[peaks[0]])
+    return find_peak_distance(distances, z_scores)
+
+
+def local_g_star(values: np.ndarray, weights, seed: Union[int, None] = PERMUTATION_SEED) -> tuple:
+    """
+    计算 Getis-Ord Gi* (含置换检验)，返回 (Gs, p_sim) 两个数组。
+    置换检验是热点分析中最耗 CPU 的步骤，接口通过 zhixing 在进程池中调用本函数，
+    因此只返回可序列化的数组而不是 G_Local 对象。seed=None 时每次使用不同的随机置换。
+    """
+    from esda.getisord import G_Local # 仅在计算时导入，进程池工作进程不必加载 esda 之外的依赖
+    gi_star = G_Local(np.asarray(values, dtype=float), weights, star=True, seed=seed)
+    return np.asarray(gi_star.Gs), np.asarray(gi_star.p_sim)
@@ -0,0 +1,449 @@
+import os
+import re
+import json
+import time
+import signal
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from logging_config import logger
+from typing import Union
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_EXPIRED = 'expired'
+JOB_CANCELLED = 'cancelled'
+ACTIVE_JOB_STATES = (JOB_QUEUED, JOB_RUNNING)
+FINISHED_JOB_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_EXPIRED, JOB_CANCELLED)
+
+
+class JobQueueFull(RuntimeError):
+    """等待中的任务数已达上限，新任务被拒绝。"""
+
+
+class JobCancelled(RuntimeError):
+    """任务在运行中被取消。"""
+
+
+_JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class _CancelEvent(threading.Event):
+    """取消信号：本进程内调用 set()，或其他工作进程写入了取消标记文件，is_set() 都返回 True。"""
+
+    def __init__(self, marker_path: str = None):
+        super().__init__()
+        self.marker_path = marker_path
+
+    def is_set(self) -> bool:
+        if super().is_set():
+            return True
+        if self.marker_path is not None and os.path.exists(self.marker_path):
+            self.set()
+            return True
+        return False
+
+
+def _process_alive(pid) -> bool:
+    if not isinstance(pid, int) or pid <= 0:
+        return False
+    if os.name == 'nt': # Windows 上 os.kill 会直接结束进程，无法用来探测
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # 进程存在但属于其他用户
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def _subprocess_entry(conn, func, args, kwargs, forward_progress):
+    if hasattr(os, 'setpgid'):
+        # 自成一个进程组，取消时连同 func 内部启动的进程池 (例如自动定阶的拟合进程) 一起终止
+        os.setpgid(0, 0)
+    if forward_progress:
+        kwargs['progress'] = lambda done, total=None, stage=None: conn.send(('progress', (done, total, stage)))
+    try:
+        result = (True, func(*args, **kwargs))
+    except Exception as e:
+        result = (False, e)
+    try:
+        conn.send(('result', result))
+    except Exception as e: # 结果或异常无法序列化
+        conn.send(('result', (False, RuntimeError(f"{type(e).__name__}: {e}"))))
+    finally:
+        conn.close()
+
+
+def _terminate_process_group(process, grace_seconds: float = 5):
+    """终止子进程及其进程组中的所有进程 (先 SIGTERM，宽限期后 SIGKILL)；不支持进程组的平台只终止子进程。"""
+    if not hasattr(os, 'killpg'):
+        process.terminate()
+        process.join(timeout=grace_seconds)
+        return
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except OSError: # 子进程尚未建立进程组
+        process.terminate()
+    process.join(timeout=grace_seconds)
+    try:
+        os.killpg(process.pid, signal.SIGKILL) # 忽略 SIGTERM 或仍在退出中的进程
+    except OSError:
+        pass
+    if process.is_alive():
+        process.kill()
+
+
+def run_in_subprocess(func, *args, cancel_event: threading.Event = None, progress=None,
+                      poll_interval: float = 0.2, **kwargs):
+    """
+    在独立的子进程 (spawn) 中运行 func(*args, **kwargs) 并返回其结果，func 抛出的异常会在此处重新抛出。
+    cancel_event 被设置时终止子进程所在的整个进程组并抛出 JobCancelled，
+    因此运行中的 CPU 密集任务 (包括它启动的嵌套进程池) 也能真正取消。
+    给出 progress 时 func 以 progress=<回调> 调用，子进程中的进度通过管道转发给 progress。
+    func 及其参数、返回值都必须可以 pickle。
+    """
+    context = multiprocessing.get_context('spawn') # 避免在多线程的 Web 进程中 fork
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_subprocess_entry, args=(sender, func, args, kwargs, progress is not None))
+    process.start()
+    sender.close()
+    try:
+        while True:
+            # 每轮都先检查取消：子进程频繁汇报进度时 poll 总是立即返回
+            if cancel_event is not None and cancel_event.is_set():
+                _terminate_process_group(process)
+                raise JobCancelled("任务已取消。")
+            if receiver.poll(poll_interval):
+                kind, payload = receiver.recv()
+                if kind == 'result':
+                    succeeded, payload = payload
+                    break
+                progress(*payload)
+                continue
+            if not process.is_alive() and not receiver.poll():
+                raise RuntimeError(f"子进程异常退出 (exitcode={process.exitcode})。")
+    finally:
+        receiver.close()
+        process.join(timeout=5)
+    if succeeded:
+        return payload
+    raise payload
+
+
+class JobManager:
+    """
+    有界的本地后台任务管理器：任务提交到固定大小的线程池，等待队列长度有上限。
+    每个任务通过 progress(done, total, stage) 回调汇报进度；成功的任务可以返回一个产物文件路径，
+    产物按存活时间 (TTL) 和总大小上限自动清理。
+    提交时给出 dedup_key 的任务，若已有相同 key 的等待中/运行中任务，则直接复用该任务。
+    给出 state_dir 时，任务记录同时以 <job_id>.json 写入该目录 (多个工作进程共用同一目录)：
+    其他工作进程可以查询状态、下载产物，取消则通过 <job_id>.cancel 标记文件通知任务所在的进程。
+    任务的执行、去重和队列上限仍然按单个进程计算；state_dir 只应由同一台主机上的工作进程共用
+    (通过进程号判断任务所属进程是否仍在运行)。
+    """
+
+    # 仅更新进度时，两次写盘之间的最小间隔 (秒)
+    PROGRESS_PERSIST_INTERVAL = 1.0
+
+    def __init__(self, name: str, max_workers: int = 2, max_pending: int = 16,
+                 artifact_ttl_seconds: float = 3600, max_artifact_bytes: int = 2 * 1024 ** 3,
+                 state_dir: str = None):
+        self.name = name
+        self.max_pending = max_pending
+        self.artifact_ttl_seconds = artifact_ttl_seconds
+        self.max_artifact_bytes = max_artifact_bytes
+        self.state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}_job")
+        self._jobs = {}
+        self._futures = {}
+        self._cancel_events = {}
+        self._persisted_at = {}
+        self._lock = threading.Lock()
+
+    # --- 任务记录的磁盘副本 ---
+    def _record_path(self, job_id: str, suffix: str = '.json') -> Union[str, None]:
+        if self.state_dir is None or not _JOB_ID_PATTERN.match(job_id or ''):
+            return None
+        return os.path.join(self.state_dir, job_id + suffix)
+
+    def _persist(self, job: dict):
+        """把任务记录原子地写入 state_dir (调用方持有 self._lock)。"""
+        path = self._record_path(job['job_id'])
+        if path is None:
+            return
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(job, f, ensure_ascii=False, default=str)
+            os.replace(temp_path, path)
+            self._persisted_at[job['job_id']] = time.time()
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"{self.name} 任务记录写盘失败: {job['job_id']}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _load(self, job_id: str) -> Union[dict, None]:
+        """读取其他工作进程写入的任务记录；所属进程已退出的活动任务按失败处理。"""
+        path = self._record_path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if job['status'] in ACTIVE_JOB_STATES:
+            if not _process_alive(job.get('owner_pid')):
+                job.update(status=JOB_FAILED, error="任务所在的工作进程已退出。",
+                           finished_at=job.get('finished_at') or job['created_at'])
+            elif self._cancel_marked(job_id):
+                job['cancel_requested'] = True
+        return job
+
+    def _cancel_marked(self, job_id: str) -> bool:
+        marker = self._record_path(job_id, '.cancel')
+        return marker is not None and os.path.exists(marker)
+
+    def _remove_record(self, job_id: str):
+        for suffix in ('.json', '.cancel'):
+            path = self._record_path(job_id, suffix)
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._persisted_at.pop(job_id, None)
+
+    def submit(self, kind: str, func, *args, params: dict = None, dedup_key: str = None,
+               cancellable: bool = False, **kwargs) -> str:
+        """
+        提交任务并返回任务 ID。func 以 func(*args, progress=<回调>, **kwargs) 调用，
+        cancellable=True 时另外传入 cancel_event (threading.Event)，func 应在其 is_set() 为真时尽快结束
+        (例如通过 run_in_subprocess 运行计算)。返回值 (通常是产物路径) 保存在任务的 result 中。
+        存在相同 dedup_key 的活动任务时返回该任务的 ID (其 submissions 加一)。队列已满时抛出 JobQueueFull。
+        """
+        self.expire_artifacts()
+        with self._lock:
+            if dedup_key is not None:
+                for job in self._jobs.values():
+                    if job['dedup_key'] == dedup_key and job['status'] in ACTIVE_JOB_STATES \
+                            and not job['cancel_requested'] and not self._cancel_marked(job['job_id']):
+                        job['submissions'] += 1
+                        self._persist(job)
+                        logger.info(f"{self.name} 任务去重: 复用 {job['job_id']} ({kind})")
+                        return job['job_id']
+            active = sum(1 for job in self._jobs.values() if job['status'] in ACTIVE_JOB_STATES)
+            if active >= self.max_pending:
+                raise JobQueueFull(f"{self.name} 任务队列已满 ({active}/{self.max_pending})。")
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'kind': kind,
+                'status': JOB_QUEUED,
+                'params': params or {},
+                'dedup_key': dedup_key,
+                'submissions': 1,
+                'cancellable': cancellable,
+                'cancel_requested': False,
+                'progress': {'done': 0, 'total': None, 'stage': None},
+                'result': None,
+                'error': None,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'owner_pid': os.getpid(),
+            }
+            self._persist(self._jobs[job_id])
+            cancel_event = _CancelEvent(self._record_path(job_id, '.cancel'))
+            self._cancel_events[job_id] = cancel_event
+            if cancellable:
+                kwargs['cancel_event'] = cancel_event
+            self._futures[job_id] = self._executor.submit(self._run, job_id, func, args, kwargs)
+        logger.info(f"{self.name} 任务已提交: {job_id} ({kind})")
+        return job_id
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+                self._persist(job)
+
+    def _run(self, job_id: str, func, args, kwargs):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and self._cancel_marked(job_id): # 其他工作进程请求了取消
+                job['cancel_requested'] = True
+            if job is None or job['cancel_requested']: # 排队期间已被取消
+                if job is not None:
+                    job.update(status=JOB_CANCELLED, finished_at=time.time())
+                    self._persist(job)
+                self._forget_handles(job_id)
+                return
+            job.update(status=JOB_RUNNING, started_at=time.time())
+            self._persist(job)
+
+        def progress(done: int, total: Union[int, None] = None, stage: str = None):
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    previous_stage = job['progress'].get('stage')
+                    job['progress'] = {'done': int(done), 'total': None if total is None else int(total),
+                                       'stage': stage if stage is not None else previous_stage}
+                    # 阶段变化立即写盘，单纯的计数更新按间隔节流
+                    if job['progress']['stage'] != previous_stage or \
+                            time.time() - self._persisted_at.get(job_id, 0) >= self.PROGRESS_PERSIST_INTERVAL:
+                        self._persist(job)
+
+        try:
+            result = func(*args, progress=progress, **kwargs)
+            self._update(job_id, status=JOB_SUCCEEDED, result=result, finished_at=time.time())
+            logger.info(f"{self.name} 任务完成: {job_id}")
+        except JobCancelled:
+            logger.info(f"{self.name} 任务已取消: {job_id}")
+            self._update(job_id, status=JOB_CANCELLED, cancel_requested=True, finished_at=time.time())
+        except Exception as e:
+            logger.error(f"{self.name} 任务失败: {job_id}: {e}", exc_info=True)
+            self._update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                self._forget_handles(job_id)
+
+    def _forget_handles(self, job_id: str):
+        self._futures.pop(job_id, None)
+        self._cancel_events.pop(job_id, None)
+
+    def cancel(self, job_id: str) -> Union[dict, None]:
+        """
+        请求取消任务并返回状态快照；任务不存在时返回 None。
+        排队中的任务立即标记为 cancelled；运行中的可取消任务通过 cancel_event 通知，
+        结束后变为 cancelled；不可取消的运行中任务和已结束的任务不受影响。
+        任务属于其他工作进程时写入取消标记文件，由所属进程在下次检查时终止任务。
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return self._cancel_remote(job_id)
+            if job['status'] == JOB_QUEUED or (job['status'] == JOB_RUNNING and job['cancellable']):
+                job['cancel_requested'] = True
+                event = self._cancel_events.get(job_id)
+                if event is not None:
+                    event.set()
+                future = self._futures.get(job_id)
+                if job['status'] == JOB_QUEUED and future is not None and future.cancel():
+                    job.update(status=JOB_CANCELLED, finished_at=time.time())
+                    self._forget_handles(job_id)
+                self._persist(job)
+                logger.info(f"{self.name} 请求取消任务: {job_id} ({job['status']})")
+        return self.get(job_id)
+
+    def _cancel_remote(self, job_id: str) -> Union[dict, None]:
+        job = self._load(job_id)
+        if job is None:
+            return None
+        if job['status'] == JOB_QUEUED or (job['status'] == JOB_RUNNING and job['cancellable']):
+            try:
+                with open(self._record_path(job_id, '.cancel'), 'w', encoding='utf-8') as f:
+                    f.write(str(os.getpid()))
+            except OSError as e:
+                logger.warning(f"{self.name} 写入取消标记失败: {job_id}: {e}")
+                return job
+            job['cancel_requested'] = True
+            logger.info(f"{self.name} 请求取消其他工作进程的任务: {job_id} (pid={job.get('owner_pid')})")
+        return job
+
+    def get(self, job_id: str) -> Union[dict, None]:
+        """返回任务状态的快照 (副本)；本进程没有该任务时读取 state_dir 中的记录，都不存在时返回 None。"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return self._load(job_id)
+            snapshot = dict(job)
+            snapshot['progress'] = dict(job['progress'])
+        if snapshot['status'] in ACTIVE_JOB_STATES and self._cancel_marked(job_id):
+            snapshot['cancel_requested'] = True
+        return snapshot
+
+    def expire_artifacts(self):
+        """
+        删除超过 TTL 的产物；若剩余产物总大小仍超过上限，则从最早完成的开始删除。
+        state_dir 中所属进程已退出的任务记录 (及其产物) 超过 TTL 后也由当前进程清理。
+        """
+        now = time.time()
+        with self._lock:
+            finished = [job for job in self._jobs.values()
+                        if job['status'] == JOB_SUCCEEDED and isinstance(job['result'], str)]
+            finished.sort(key=lambda job: job['finished_at'])
+            sizes = {}
+            for job in finished:
+                try:
+                    sizes[job['job_id']] = os.path.getsize(job['result'])
+                except OSError:
+                    sizes[job['job_id']] = 0
+            total_bytes = sum(sizes.values())
+            for job in finished:
+                too_old = now - job['finished_at'] > self.artifact_ttl_seconds
+                if too_old or total_bytes > self.max_artifact_bytes:
+                    total_bytes -= sizes[job['job_id']]
+                    self._expire(job)
+            # 已失败、已取消、已过期以及结果不是产物文件的任务记录同样只保留 TTL 时长
+            stale = [job_id for job_id, job in self._jobs.items()
+                     if (job['status'] in (JOB_FAILED, JOB_EXPIRED, JOB_CANCELLED)
+                         or (job['status'] == JOB_SUCCEEDED and not isinstance(job['result'], str)))
+                     and now - job['finished_at'] > self.artifact_ttl_seconds]
+            for job_id in stale:
+                del self._jobs[job_id]
+                self._remove_record(job_id)
+            self._expire_orphaned_records(now)
+
+    def _expire_orphaned_records(self, now: float):
+        if self.state_dir is None:
+            return
+        try:
+            filenames = os.listdir(self.state_dir)
+        except OSError:
+            return
+        for filename in filenames:
+            job_id, extension = os.path.splitext(filename)
+            if extension != '.json' or job_id in self._jobs:
+                continue
+            path = os.path.join(self.state_dir, filename)
+            try:
+                if now - os.path.getmtime(path) <= self.artifact_ttl_seconds:
+                    continue
+                with open(path, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if _process_alive(job.get('owner_pid')): # 仍由其他工作进程负责清理
+                continue
+            if job.get('status') == JOB_SUCCEEDED and isinstance(job.get('result'), str):
+                try:
+                    os.remove(job['result'])
+                except OSError:
+                    pass
+            self._remove_record(job_id)
+            logger.info(f"{self.name} 已清理退出进程遗留的任务记录: {job_id}")
+
+    def _expire(self, job: dict):
+        try:
+            os.remove(job['result'])
+        except OSError:
+            pass
+        logger.info(f"{self.name} 任务产物已过期并删除: {job['job_id']}")
+        job['status'] = JOB_EXPIRED
+        job['result'] = None
+        job['finished_at'] = time.time()
+        self._persist(job)
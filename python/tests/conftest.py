@@ -0,0 +1,60 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# 后端模块以平铺方式互相导入 (例如 from logging_config import logger)，测试时同样从 python/ 目录导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qingxi import TIME_COLUMN_NAME, OFFENSE_COLUMN_NAME  # noqa: E402
+
+OFFENSES = ['THEFT/OTHER', 'THEFT F/AUTO', 'ROBBERY', 'BURGLARY']
+
+
+def make_master_frame(num_records: int = 4000, seed: int = 0) -> pd.DataFrame:
+    """
+    合成的主数据：2019-11 至 2021-03 的随机时间 (含秒)，2020 年 6 月整月没有记录 (检验空周期补 0)，
+    少量记录缺少案件类型。
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2019-11-03 05:17:00')
+    seconds = rng.integers(0, int((pd.Timestamp('2021-03-20') - start).total_seconds()), num_records)
+    times = start + pd.to_timedelta(seconds, unit='s')
+    times = times[(times < pd.Timestamp('2020-06-01')) | (times >= pd.Timestamp('2020-07-01'))]
+    offenses = rng.choice(np.array(OFFENSES + [None], dtype=object), len(times), p=[0.4, 0.3, 0.15, 0.1, 0.05])
+    return pd.DataFrame({
+        TIME_COLUMN_NAME: times.strftime('%Y-%m-%d %H:%M:%S'),
+        OFFENSE_COLUMN_NAME: offenses,
+        'latitude': rng.uniform(38.8, 39.0, len(times)),
+        'longitude': rng.uniform(-77.1, -76.9, len(times)),
+    })
+
+
+@pytest.fixture
+def master_csv(tmp_path):
+    """写入临时目录的合成主CSV 的路径 (二进制缓存等派生文件也在该目录下)。"""
+    path = tmp_path / 'master_crime_data.csv'
+    make_master_frame().to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def backend(master_csv, tmp_path, monkeypatch):
+    """app 模块，主数据、临时文件、导出缓存与模型目录都指向本测试的临时目录。"""
+    import app as backend
+    for name, path in [('TEMP_DATA_DIR', 'temp'), ('SHP_TEMP_DIR', 'shp'), ('EXPORT_CACHE_DIR', 'export_cache'),
+                       ('MODEL_STORAGE_DIRECTORY', 'models')]:
+        os.makedirs(tmp_path / path)
+        monkeypatch.setattr(backend, name, str(tmp_path / path))
+    monkeypatch.setattr(backend, 'MASTER_CSV_PATH', master_csv)
+    # 不在后台线程中预热真实的数据文件
+    monkeypatch.setattr(backend.warm_up_scheduler, 'start', lambda: False)
+    return backend
+
+
+@pytest.fixture
+def client(backend):
+    # 合成数据不需要在第一个请求前预热
+    return backend.create_app({'TESTING': True, 'WARM_UP_ON_FIRST_REQUEST': False}).test_client()
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import qingxi
+import xunlian
+from conftest import make_master_frame
+from qingxi import TIME_COLUMN_NAME, OFFENSE_COLUMN_NAME
+
+FREQS = ['D', 'W', 'ME', 'MS', 'QE', 'YE', 'h']
+
+
+def expected_counts(timestamps, freq: str) -> pd.Series:
+    return pd.Series(1, index=pd.DatetimeIndex(timestamps)).sort_index().resample(freq).size().astype(float)
+
+
+def assert_counts_equal(result: pd.Series, expected: pd.Series):
+    pd.testing.assert_series_equal(result, expected, check_names=False, check_freq=False)
+    assert result.index.freq == expected.index.freq
+
+
+@pytest.fixture(scope='module')
+def timestamps():
+    return pd.to_datetime(make_master_frame()[TIME_COLUMN_NAME])
+
+
+@pytest.mark.parametrize('freq', FREQS)
+def test_aggregate_timestamps_matches_resample(timestamps, freq):
+    result = xunlian.aggregate_timestamps(timestamps, [freq])[freq]
+    assert_counts_equal(result, expected_counts(timestamps, freq))
+    if freq == 'ME':
+        assert result[pd.Timestamp('2020-06-30')] == 0 # 没有记录的月份补 0
+
+
+def test_aggregate_timestamps_multiple_freqs_in_one_pass(timestamps):
+    results = xunlian.aggregate_timestamps(timestamps, FREQS)
+    assert list(results) == FREQS
+    for freq in FREQS:
+        assert_counts_equal(results[freq], expected_counts(timestamps, freq))
+
+
+def test_aggregate_timestamps_ignores_missing_and_handles_empty():
+    timestamps = pd.Series(pd.to_datetime(['2020-01-01 10:00', None, '2020-01-03 09:00']))
+    result = xunlian.aggregate_timestamps(timestamps, ['D'])['D']
+    assert result.tolist() == [1.0, 0.0, 1.0]
+    assert xunlian.aggregate_timestamps(pd.Series([], dtype='datetime64[ns]'), ['ME'])['ME'].empty
+
+
+def test_aggregate_daily_counts_leaves_sub_daily_freqs_to_caller():
+    results = xunlian.aggregate_daily_counts(18262, np.array([2.0, 0.0, 1.0]), ['D', 'h', '2W'])
+    assert results['D'].tolist() == [2.0, 0.0, 1.0]
+    assert results['D'].index[0] == pd.Timestamp('2020-01-01')
+    assert results['h'] is None and results['2W'] is None
+
+
+def test_count_master_days_trims_to_matching_records(master_csv):
+    first_day, daily, _ = qingxi.count_master_days(master_csv, qingxi.normalize_filter_spec(
+        {'start_date': '2020-05-20', 'end_date': '2020-07-10', 'offenses': ['ROBBERY']}))
+    df = pd.read_csv(master_csv, parse_dates=[TIME_COLUMN_NAME])
+    times = df.loc[df[OFFENSE_COLUMN_NAME] == 'ROBBERY', TIME_COLUMN_NAME]
+    expected = expected_counts(times[(times >= '2020-05-20') & (times < '2020-07-11')], 'D')
+    assert pd.Timestamp(first_day, unit='D') == expected.index[0]
+    assert daily.tolist() == expected.tolist()
+    assert qingxi.count_master_days(master_csv, {'bbox': [-77.1, 38.8, -76.9, 39.0]}) is None # 立方体不含坐标
+
+
+def test_aggregate_master_series_uses_count_cube_for_daily_and_coarser(master_csv, monkeypatch):
+    scans = []
+    filter_master_data = qingxi.filter_master_data
+    monkeypatch.setattr(qingxi, 'filter_master_data', lambda *args: scans.append(1) or filter_master_data(*args))
+    timestamps = pd.to_datetime(pd.read_csv(master_csv)[TIME_COLUMN_NAME])
+    results = xunlian.aggregate_master_series(master_csv, {}, resample_freq=['D', 'W', 'ME', 'YE'])
+    assert scans == [] # 全部由计数立方体求和，不扫描记录
+    assert_counts_equal(results['W'], expected_counts(timestamps, 'W'))
+
+    hourly = xunlian.aggregate_master_series(master_csv, {}, resample_freq='h')
+    assert scans == [1] # 细于日的频率退回逐条筛选
+    assert_counts_equal(hourly, expected_counts(timestamps, 'h'))
+
+
+def test_aggregate_series_from_file_reads_once_for_all_freqs(master_csv):
+    timestamps = pd.to_datetime(pd.read_csv(master_csv)[TIME_COLUMN_NAME])
+    payload = xunlian.aggregate_series_from_file(master_csv, resample_freq=['W', 'ME'])
+    assert list(payload['series']) == ['W', 'ME']
+    expected = expected_counts(timestamps, 'ME')
+    assert payload['series']['ME']['timestamps'] == [ts.isoformat() for ts in expected.index]
+    assert payload['series']['ME']['values'].tolist() == expected.tolist()
+
+    single = xunlian.aggregate_series_from_file(master_csv, resample_freq='W', columnar=True)
+    np.testing.assert_array_equal(single['values'], payload['series']['W']['values'])
+    assert single['timestamps'][0] == expected_counts(timestamps, 'W').index[0].value // 10 ** 6 # 毫秒时间戳
+    assert xunlian.aggregate_series_from_file(master_csv + '.missing') is None
+
+
+@pytest.mark.parametrize('filter_spec', [
+    {},
+    {"start_year": 2020, "end_year": 2020},
+    {"start_year": 2019, "end_year": 2021, "offenses": ["theft/other", "ROBBERY"]},
+    {"start_year": 2020, "end_year": 2020, "offenses": ["NO SUCH OFFENSE"]},
+])
+def test_aggregate_master_series_matches_resample(master_csv, filter_spec):
+    # 只按时间和案件类型筛选时由计数立方体求和 ('h' 退回逐条筛选)，结果应与直接筛选后逐个 resample 一致
+    df = pd.read_csv(master_csv)
+    times = pd.to_datetime(df[TIME_COLUMN_NAME])
+    mask = pd.Series(True, index=df.index)
+    if filter_spec.get('start_year'):
+        mask &= times.dt.year.between(filter_spec['start_year'], filter_spec['end_year'])
+    if filter_spec.get('offenses'):
+        mask &= df[OFFENSE_COLUMN_NAME].str.upper().isin([o.upper() for o in filter_spec['offenses']])
+
+    results = xunlian.aggregate_master_series(master_csv, filter_spec, resample_freq=FREQS)
+    for freq in FREQS:
+        if not mask.any():
+            assert results[freq].sum() == 0
+            continue
+        assert_counts_equal(results[freq], expected_counts(times[mask], freq))
@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.fixture
+def warm_up_calls(backend, monkeypatch):
+    calls = []
+    monkeypatch.setattr(backend, 'shared_data_warmed_up', False)
+    monkeypatch.setattr(backend, 'warm_up_shared_data', lambda include_optional=True: calls.append(include_optional))
+    return calls
+
+
+def test_create_app_builds_independent_instances(backend):
+    first = backend.create_app({'TESTING': True, 'CORS_ORIGINS': 'https://a.example'})
+    second = backend.create_app()
+    assert first is not second and first is not backend.app
+    assert first.config['TESTING'] and not second.config['TESTING']
+    assert first.config['WARM_UP_ON_FIRST_REQUEST'] is True # 未覆盖的键取 DEFAULT_APP_CONFIG
+    rules = {rule.rule for rule in first.url_map.iter_rules()}
+    assert {'/api/status', '/api/ready', '/metrics', '/api/train-model', '/generate_shp'} <= rules
+    assert rules == {rule.rule for rule in second.url_map.iter_rules()}
+
+
+def test_cors_origin_comes_from_config(backend, warm_up_calls):
+    client = backend.create_app({'CORS_ORIGINS': 'https://a.example'}).test_client()
+    allowed = client.get('/api/status', headers={'Origin': 'https://a.example'})
+    assert allowed.headers['Access-Control-Allow-Origin'] == 'https://a.example'
+    assert 'ETag' in allowed.headers['Access-Control-Expose-Headers']
+    other = client.get('/api/status', headers={'Origin': 'http://localhost:5173'})
+    assert 'Access-Control-Allow-Origin' not in other.headers
+
+
+def test_first_request_warms_up_unless_disabled(backend, warm_up_calls):
+    client = backend.create_app().test_client()
+    client.get('/api/status') # 探测接口不等待预热
+    assert warm_up_calls == []
+    client.get('/api/train-batch/' + '0' * 32)
+    assert warm_up_calls == [False] # 只同步运行就绪所需的阶段
+
+    warm_up_calls.clear()
+    backend.create_app({'WARM_UP_ON_FIRST_REQUEST': False}).test_client().get('/api/train-batch/' + '0' * 32)
+    assert warm_up_calls == []
+
+
+def test_create_app_can_warm_up_before_serving(backend, warm_up_calls):
+    backend.create_app(warm_up=True)
+    assert warm_up_calls == [True]
+    backend.shared_data_warmed_up = True # 本进程已预热后，新的实例不再重复预热
+    backend.create_app(warm_up=True)
+    assert warm_up_calls == [True]
+
+
+def test_request_metrics_hooks_are_attached(backend, warm_up_calls):
+    client = backend.create_app().test_client()
+    client.get('/api/status')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'http_requests_total{route="/api/status",method="GET",status="200"}' in body
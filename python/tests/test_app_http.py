@@ -0,0 +1,105 @@
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import xiangying
+
+AGGREGATE_URL = '/api/get-actual-aggregated-data?start_year=2020&end_year=2020&resample_freq=D'
+
+
+def decode_json(response) -> dict:
+    body = response.get_data()
+    if response.headers.get('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+def test_dumps_serializes_numpy_and_pandas_values():
+    payload = {'values': np.array([1.5, 2.0]), 'ints': np.arange(3), 'count': np.int64(7),
+               'ts': pd.Timestamp('2020-01-31'), 'missing': pd.NaT, 'index': pd.Index([1, 2])}
+    assert json.loads(xiangying.dumps(payload)) == {'values': [1.5, 2.0], 'ints': [0, 1, 2], 'count': 7,
+                                                    'ts': '2020-01-31T00:00:00', 'missing': None, 'index': [1, 2]}
+    assert json.loads(xiangying.dumps({'中文': '犯罪'})) == {'中文': '犯罪'}
+    with pytest.raises(TypeError):
+        xiangying.dumps({'bad': object()})
+
+
+@pytest.mark.skipif(xiangying.orjson is None, reason='需要 orjson')
+def test_dumps_writes_nan_as_null():
+    assert json.loads(xiangying.dumps({'v': np.array([1.0, np.nan])})) == {'v': [1.0, None]}
+
+
+def test_large_response_is_gzipped_when_accepted(client):
+    response = client.get(AGGREGATE_URL, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    payload = decode_json(response)
+    assert payload['status'] == 'success'
+    assert len(payload['data']['values']) == 366
+
+    plain = client.get(AGGREGATE_URL)
+    assert 'Content-Encoding' not in plain.headers
+    assert json.loads(plain.get_data()) == payload
+
+
+def test_small_response_is_not_compressed(client):
+    response = client.get('/api/get-actual-aggregated-data?start_year=2020&end_year=2020&resample_freq=YE',
+                          headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_refused_encoding_is_not_used(client):
+    response = client.get(AGGREGATE_URL, headers={'Accept-Encoding': 'gzip;q=0, identity'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_columnar_response_uses_epoch_milliseconds(client):
+    rows = decode_json(client.get(AGGREGATE_URL))['data']
+    columnar = decode_json(client.get(AGGREGATE_URL + '&columnar=1'))['data']
+    assert columnar['values'] == rows['values']
+    assert columnar['timestamps'] == [pd.Timestamp(ts).value // 10 ** 6 for ts in rows['timestamps']]
+
+
+def test_matching_etag_returns_304(client):
+    first = client.get(AGGREGATE_URL, headers={'Accept-Encoding': 'gzip'})
+    etag = first.headers['ETag']
+    assert etag.endswith('-gzip"') # 压缩后的表示有自己的强 ETag
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    revalidated = client.get(AGGREGATE_URL, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+    assert revalidated.headers['ETag'] == etag
+
+    # 参数顺序不同但内容相同的请求得到同一个 ETag
+    reordered = client.get('/api/get-actual-aggregated-data?resample_freq=D&end_year=2020&start_year=2020',
+                           headers={'If-None-Match': etag})
+    assert reordered.status_code == 304
+
+
+def test_etag_changes_with_request_and_data_version(client, master_csv):
+    first = client.get(AGGREGATE_URL)
+    etag, before = first.headers['ETag'], json.loads(first.get_data())['data']
+    other_query = client.get('/api/get-actual-aggregated-data?start_year=2020&end_year=2020&resample_freq=W',
+                             headers={'If-None-Match': etag})
+    assert other_query.status_code == 200
+
+    with open(master_csv, 'a', encoding='utf-8') as f: # 重新导入数据后数据版本改变
+        f.write('2020-12-31 23:00:00,ROBBERY,38.9,-77.0\n')
+    changed = client.get(AGGREGATE_URL, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    after = json.loads(changed.get_data())['data']
+    assert after['timestamps'][-1] == before['timestamps'][-1] == '2020-12-31T00:00:00'
+    assert after['values'][-1] == before['values'][-1] + 1 # 返回的是新数据，而不是旧的缓存结果
+
+
+def test_error_response_has_no_etag(client):
+    response = client.get('/api/get-actual-aggregated-data?start_year=2020')
+    assert response.status_code == 400
+    assert 'ETag' not in response.headers
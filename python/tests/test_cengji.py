@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cengji
+import qingxi
+
+BOTTOM_KEYS = ['1|Cluster 1', '1|Cluster 2', '2|Cluster 2', '2|Cluster 10', '10|Cluster 10']
+
+
+def bottom_matrix(periods: int = 48, seed: int = 4) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2018-01-31', periods=periods, freq='ME')
+    t = np.arange(periods)
+    values = [rng.poisson(20 + 5 * k + 4 * np.sin(2 * np.pi * t / 12)) for k in range(len(BOTTOM_KEYS))]
+    return pd.DataFrame(np.array(values, dtype=float), index=BOTTOM_KEYS, columns=index)
+
+
+def test_summing_matrix_rows_follow_hierarchy():
+    summing, nodes = cengji.build_summing_matrix(BOTTOM_KEYS)
+    assert [node['name'] for node in nodes[:6]] == [cengji.CITY_NODE_NAME, '1', '2', '10', 'Cluster 1', 'Cluster 2']
+    assert [node['level'] for node in nodes[-5:]] == [cengji.LEVEL_BOTTOM] * 5
+    dense = summing.toarray()
+    assert dense.shape == (1 + 3 + 3 + 5, 5)
+    np.testing.assert_array_equal(dense[0], np.ones(5))
+    np.testing.assert_array_equal(dense[2], [0, 0, 1, 1, 0]) # 选区 2
+    np.testing.assert_array_equal(dense[6], [0, 0, 0, 1, 1]) # Cluster 10 跨两个选区
+    np.testing.assert_array_equal(dense[-5:], np.eye(5))
+
+
+@pytest.mark.parametrize('method', cengji.RECONCILIATION_METHODS)
+def test_reconciliation_matrix_preserves_coherent_forecasts(method):
+    summing, _ = cengji.build_summing_matrix(BOTTOM_KEYS)
+    residuals = np.random.default_rng(5).normal(size=(summing.shape[0], 36))
+    g, _ = cengji.reconciliation_matrix(summing, method, residuals)
+    dense = summing.toarray()
+    # 已经一致的基础预测 (S @ b) 调和后不变: S G S = S
+    np.testing.assert_allclose(dense @ g @ dense, dense, atol=1e-10)
+
+
+def test_ols_and_mint_match_closed_form():
+    summing, _ = cengji.build_summing_matrix(BOTTOM_KEYS)
+    dense = summing.toarray()
+    residuals = np.random.default_rng(6).normal(size=(dense.shape[0], 36))
+    g_ols, _ = cengji.reconciliation_matrix(summing, 'ols')
+    np.testing.assert_allclose(g_ols, np.linalg.inv(dense.T @ dense) @ dense.T, atol=1e-10)
+
+    g_mint, shrinkage = cengji.reconciliation_matrix(summing, 'mint_shrink', residuals)
+    covariance, expected_shrinkage = cengji.shrunk_residual_covariance(residuals)
+    winv = np.linalg.inv(covariance)
+    np.testing.assert_allclose(g_mint, np.linalg.inv(dense.T @ winv @ dense) @ dense.T @ winv, atol=1e-8)
+    assert shrinkage == expected_shrinkage and 0 <= shrinkage <= 1
+
+
+@pytest.mark.parametrize('method', cengji.RECONCILIATION_METHODS)
+@pytest.mark.parametrize('base_method', ['ses', 'holt_winters'])
+def test_hierarchical_forecast_is_coherent(method, base_method):
+    forecast = cengji.hierarchical_forecast(bottom_matrix(), 6, base_method=base_method, reconciliation=method)
+    assert forecast['coherence_max_error'] < 1e-8
+    nodes = {(node['level'], node['name']): node for node in forecast['nodes']}
+    bottom = {key: np.array(nodes[(cengji.LEVEL_BOTTOM, key)]['forecast']) for key in BOTTOM_KEYS}
+    np.testing.assert_allclose(nodes[(cengji.LEVEL_CITY, cengji.CITY_NODE_NAME)]['forecast'], sum(bottom.values()))
+    np.testing.assert_allclose(nodes[(cengji.LEVEL_WARD, '2')]['forecast'], bottom['2|Cluster 2'] + bottom['2|Cluster 10'])
+    np.testing.assert_allclose(nodes[(cengji.LEVEL_CLUSTER, 'Cluster 10')]['forecast'],
+                               bottom['2|Cluster 10'] + bottom['10|Cluster 10'])
+    for node in forecast['nodes']:
+        assert np.all(np.array(node['lower_ci']) <= np.array(node['forecast']))
+        assert np.all(np.array(node['forecast']) <= np.array(node['upper_ci']))
+    assert forecast['timestamps'][0] == '2022-01-31T00:00:00'
+
+
+def test_bottom_up_keeps_bottom_base_forecasts():
+    forecast = cengji.hierarchical_forecast(bottom_matrix(), 4, base_method='ses', reconciliation='bottom_up')
+    for node in forecast['nodes'][-5:]:
+        np.testing.assert_allclose(node['forecast'], node['base_forecast'])
+
+
+def test_bottom_level_matrix_keys_by_ward_and_cluster():
+    df = pd.DataFrame({
+        qingxi.TIME_COLUMN_NAME: pd.to_datetime(['2020-01-05', '2020-01-20', '2020-03-02', '2020-02-11', '2020-02-12']),
+        qingxi.WARD_COLUMN_NAME: [1.0, 1.0, 1.0, 2.0, None],
+        qingxi.CLUSTER_COLUMN_NAME: ['Cluster 1', 'Cluster 1', 'Cluster 1', 'Cluster 2', 'Cluster 2'],
+    })
+    matrix = cengji.bottom_level_matrix(df)
+    assert list(matrix.index) == ['1|Cluster 1', '2|Cluster 2']
+    assert matrix.loc['1|Cluster 1'].tolist() == [2.0, 0.0, 1.0] # 2 月没有记录时补 0
+    assert matrix.loc['2|Cluster 2'].tolist() == [0.0, 1.0, 0.0]
+
+
+# --- 社区空间连接 ---
+def square(x0, y0, size=0.1):
+    from shapely.geometry import box
+    return box(x0, y0, x0 + size, y0 + size)
+
+
+@pytest.fixture
+def boundaries_file(tmp_path):
+    gpd = pytest.importorskip('geopandas')
+    boundaries = gpd.GeoDataFrame({'NAME': ['Cluster 1', 'Cluster 2']},
+                                  geometry=[square(-77.1, 38.8), square(-77.0, 38.8)], crs='EPSG:4326')
+    path = tmp_path / 'clusters.json'
+    boundaries.to_file(path, driver='GeoJSON')
+    return str(path)
+
+
+POINTS = pd.DataFrame({'longitude': [-77.05, -76.95, -76.5, None], 'latitude': [38.85, 38.85, 38.85, 38.85]},
+                      index=[10, 11, 12, 13])
+
+
+def test_assign_clusters_reads_boundary_file_once(boundaries_file, monkeypatch):
+    import geopandas as gpd
+    reads = []
+    read_file = gpd.read_file
+    monkeypatch.setattr(gpd, 'read_file', lambda *args, **kwargs: reads.append(args) or read_file(*args, **kwargs))
+    monkeypatch.setattr(qingxi, '_boundaries_cache', {})
+    for _ in range(3):
+        clusters = qingxi.assign_neighborhood_clusters(POINTS, boundaries_file)
+    assert len(reads) == 1
+    assert clusters.name == qingxi.CLUSTER_COLUMN_NAME
+    assert clusters.tolist()[:2] == ['Cluster 1', 'Cluster 2'] and clusters.iloc[2:].isna().all()
+
+
+def test_assign_clusters_with_projected_boundaries(boundaries_file):
+    projected = qingxi.load_neighborhood_boundaries(boundaries_file).to_crs('EPSG:3857') # 与 app 中的 community_gdf 相同
+    clusters = qingxi.assign_neighborhood_clusters(POINTS, projected)
+    pd.testing.assert_series_equal(clusters, qingxi.assign_neighborhood_clusters(POINTS, boundaries_file))
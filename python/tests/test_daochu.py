@@ -0,0 +1,194 @@
+import io
+import os
+import zipfile
+
+import pandas as pd
+import pytest
+
+import daochu
+import qingxi
+
+pyogrio = pytest.importorskip('pyogrio')
+
+
+def python_conversion(value, target_type):
+    """原先逐 feature 的转换规则 (作为对照)。"""
+    if value is None:
+        return '' if target_type == 'str' else 0
+    try:
+        return {'str': str, 'int': int, 'float': float}[target_type](value)
+    except (ValueError, TypeError):
+        return None
+
+
+MIXED_VALUES = [2.7, -2.7, '3', ' 4 ', '3.5', 'abc', None, 5, True]
+
+
+@pytest.mark.parametrize('prop_type', ['int', 'float', 'str:255'])
+def test_coerce_column_matches_per_feature_conversion(prop_type):
+    target_type = prop_type.split(':')[0]
+    result = daochu.coerce_column(pd.Series(MIXED_VALUES, dtype=object, name='x'), prop_type)
+    expected = [python_conversion(value, target_type) for value in MIXED_VALUES]
+    assert [None if pd.isna(value) else value for value in result.tolist()] == expected
+
+
+def test_coerce_column_truncates_numeric_ints():
+    result = daochu.coerce_column(pd.Series([2.7, -1.2, None], name='x'), 'int')
+    assert str(result.dtype) == 'Int64'
+    assert result.tolist() == [2, -1, 0]
+
+
+def test_infer_shp_schema_uses_first_feature():
+    features = [{'properties': {'OFFENSE': 'THEFT', 'WARD': 3, 'SCORE': 1.5, 'FLAG': None}}]
+    assert daochu.infer_shp_schema(features) == {'OFFENSE': 'str:255', 'WARD': 'int', 'SCORE': 'float',
+                                                 'FLAG': 'str:255'}
+    assert daochu.infer_shp_schema([]) == daochu.DEFAULT_SHP_SCHEMA_PROPERTIES
+
+
+def make_features(num_features: int) -> list:
+    features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-77.0 + i * 0.001, 38.9]},
+                 'properties': {'OFFENSE': f'O{i}', 'WARD': i % 8, 'SCORE': i / 2}}
+                for i in range(num_features)]
+    features.append({'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]},
+                     'properties': {'OFFENSE': 'LINE', 'WARD': 1, 'SCORE': 0.0}})
+    return features
+
+
+def test_features_to_geodataframe_skips_non_points():
+    features = make_features(5)
+    gdf = daochu.features_to_geodataframe(features, daochu.infer_shp_schema(features))
+    assert len(gdf) == 5
+    assert gdf.crs.to_string() == daochu.EXPORT_CRS
+    assert gdf['WARD'].tolist() == [0, 1, 2, 3, 4]
+    assert gdf.geometry.x.tolist() == pytest.approx([-77.0 + i * 0.001 for i in range(5)])
+
+
+def test_chunked_write_appends_every_chunk(tmp_path):
+    features = make_features(23)
+    gdf = daochu.features_to_geodataframe(features, daochu.infer_shp_schema(features))
+    progress = []
+    path = str(tmp_path / 'out.shp')
+    daochu.write_vector_file_in_chunks(gdf, path, chunk_rows=5, progress=lambda done, total: progress.append(done))
+    assert progress == [0, 5, 10, 15, 20, 23]
+    written = pyogrio.read_dataframe(path)
+    assert written['OFFENSE'].tolist() == [f'O{i}' for i in range(23)]
+    assert written['SCORE'].tolist() == pytest.approx([i / 2 for i in range(23)])
+
+
+def test_stream_zip_contains_shapefile_parts_and_removes_directory(tmp_path):
+    features = make_features(3)
+    gdf = daochu.features_to_geodataframe(features, daochu.infer_shp_schema(features))
+    shp_dir = daochu.make_private_temp_dir(str(tmp_path), prefix='shp_')
+    daochu.write_vector_file(gdf, os.path.join(shp_dir, 'crime.shp'))
+    blocks = list(daochu.stream_zip_and_cleanup(shp_dir, chunk_size=64))
+    assert len(blocks) > 1 # 边压缩边产出，而不是一次性返回整个 zip
+    with zipfile.ZipFile(io.BytesIO(b''.join(blocks))) as zf:
+        assert {'crime.shp', 'crime.shx', 'crime.dbf', 'crime.prj'} <= set(zf.namelist())
+    assert not os.path.exists(shp_dir)
+
+
+def test_generate_shp_endpoint_streams_zip(client, backend):
+    features = make_features(4)
+    features[1]['properties']['WARD'] = 2.7 # schema 由第一个 feature 推断为 int，2.7 截断为 2
+    response = client.post('/generate_shp', json={'features': features, 'filename': '../crime export'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    assert "filename*=UTF-8''crime%20export.zip" in response.headers['Content-Disposition']
+    body = response.get_data()
+    response.close()
+    with zipfile.ZipFile(io.BytesIO(body)) as zf:
+        assert 'crime export.shp' in zf.namelist()
+        zf.extractall(backend.SHP_TEMP_DIR + '_check')
+    written = pyogrio.read_dataframe(os.path.join(backend.SHP_TEMP_DIR + '_check', 'crime export.shp'))
+    assert written['WARD'].tolist() == [0, 2, 2, 3]
+    assert os.listdir(backend.SHP_TEMP_DIR) == [] # 临时目录在发送完毕后删除
+
+
+def test_generate_shp_rejects_missing_features(client):
+    assert client.post('/generate_shp', json={'type': 'FeatureCollection'}).status_code == 400
+
+
+# --- 按筛选条件导出 ---
+EXPORT_SPEC = {"start_year": 2020, "end_year": 2020, "offenses": ["robbery"], "bbox": [-77.05, 38.82, -76.95, 38.98]}
+
+
+def expected_export_rows(master_csv) -> pd.DataFrame:
+    df = pd.read_csv(master_csv, parse_dates=[qingxi.TIME_COLUMN_NAME])
+    return df[(df[qingxi.TIME_COLUMN_NAME].dt.year == 2020) & (df['OFFENSE'] == 'ROBBERY') &
+              df['longitude'].between(-77.05, -76.95) & df['latitude'].between(38.82, 38.98)]
+
+
+def read_export(path: str, fmt: str, tmp_path) -> pd.DataFrame:
+    if fmt == 'parquet':
+        return pd.read_parquet(path)
+    if fmt == 'shp':
+        with zipfile.ZipFile(path) as zf:
+            zf.extractall(tmp_path / 'unzipped')
+        return pyogrio.read_dataframe(str(tmp_path / 'unzipped' / f'{daochu.EXPORT_LAYER_NAME}.shp'))
+    return pyogrio.read_dataframe(path)
+
+
+@pytest.mark.parametrize('fmt', list(daochu.EXPORT_FORMATS))
+def test_filtered_export_writes_matching_rows_and_caches(master_csv, tmp_path, fmt):
+    if fmt == 'parquet':
+        pytest.importorskip('pyarrow')
+    spec = qingxi.normalize_filter_spec(EXPORT_SPEC)
+    loads = []
+
+    def load_master():
+        loads.append(1)
+        return qingxi.load_master_data(master_csv)
+
+    version = qingxi.get_master_data_version(master_csv)
+    cache_dir = str(tmp_path / 'cache')
+    path, hit = daochu.get_or_create_filtered_export(load_master, spec, qingxi.filter_spec_hash(spec), fmt,
+                                                     version, cache_dir)
+    assert not hit and loads == [1]
+    exported = read_export(path, fmt, tmp_path)
+    expected = expected_export_rows(master_csv)
+    assert len(exported) == len(expected) > 0
+    if fmt == 'shp':
+        # Shapefile 没有日期时间字段：时间列以原始列名写为 ISO 字符串
+        assert exported['START_DATE'].tolist() == expected[qingxi.TIME_COLUMN_NAME].dt.strftime('%Y-%m-%dT%H:%M:%S').tolist()
+    else:
+        assert pd.api.types.is_datetime64_any_dtype(exported[qingxi.TIME_COLUMN_NAME])
+        # FlatGeobuf 按空间索引排列要素，按时间比较
+        assert sorted(exported[qingxi.TIME_COLUMN_NAME]) == sorted(expected[qingxi.TIME_COLUMN_NAME])
+
+    again, hit = daochu.get_or_create_filtered_export(load_master, spec, qingxi.filter_spec_hash(spec), fmt,
+                                                      version, cache_dir)
+    assert hit and again == path and loads == [1] # 命中缓存时不加载主数据
+    assert [name for name in os.listdir(cache_dir) if name.startswith('tmp_export_')] == []
+
+
+def test_new_data_version_prunes_old_exports(master_csv, tmp_path):
+    spec = qingxi.normalize_filter_spec(EXPORT_SPEC)
+    cache_dir = str(tmp_path / 'cache')
+    load_master = lambda: qingxi.load_master_data(master_csv)
+    old_path, _ = daochu.get_or_create_filtered_export(load_master, spec, 'h', 'gpkg', 'v1', cache_dir)
+    new_path, hit = daochu.get_or_create_filtered_export(load_master, spec, 'h', 'gpkg', 'v2', cache_dir)
+    assert not hit and os.path.exists(new_path) and not os.path.exists(old_path)
+
+
+def test_resolve_export_format_aliases():
+    assert daochu.resolve_export_format('GeoPackage') == 'gpkg'
+    assert daochu.resolve_export_format('.fgb') == 'fgb'
+    assert daochu.resolve_export_format(None) == 'gpkg'
+    with pytest.raises(ValueError):
+        daochu.resolve_export_format('csv')
+
+
+def test_export_endpoint_reports_cache_hits(client):
+    request_body = {**EXPORT_SPEC, "format": "flatgeobuf", "filename": "robbery"}
+    first = client.post('/api/export', json=request_body)
+    assert first.status_code == 200
+    assert first.headers['X-Export-Cache'] == 'MISS'
+    assert 'robbery.fgb' in first.headers['Content-Disposition']
+    first_body = first.get_data()
+    first.close()
+    second = client.post('/api/export', json=request_body)
+    assert second.headers['X-Export-Cache'] == 'HIT'
+    assert second.get_data() == first_body
+    second.close()
+    assert client.post('/api/export', json={**request_body, "format": "csv"}).status_code == 400
+    assert client.post('/api/export', json={**request_body, "bbox": [1, 2]}).status_code == 400
@@ -0,0 +1,151 @@
+import itertools
+import threading
+import time
+
+import pytest
+
+import hebing
+from hebing import SingleFlight
+
+_names = itertools.count()
+
+
+def new_flight(**kwargs) -> SingleFlight:
+    return SingleFlight(f"test_{next(_names)}", **kwargs)
+
+
+def wait_until(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.005)
+
+
+def run_concurrently(flight: SingleFlight, key: str, func, num_followers: int = 3) -> list:
+    """一个调用者开始执行 func 后，再发起 num_followers 个相同调用；返回各调用的 (结果或异常)。"""
+    outcomes = [None] * (num_followers + 1)
+
+    def call(i):
+        try:
+            outcomes[i] = ('result', flight.do(key, func))
+        except Exception as e:
+            outcomes[i] = ('error', e)
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(num_followers + 1)]
+    threads[0].start()
+    wait_until(lambda: flight.stats()['in_flight'] == 1)
+    for thread in threads[1:]:
+        thread.start()
+    wait_until(lambda: flight.stats()['coalesced'] == num_followers)
+    return threads, outcomes
+
+
+def test_concurrent_identical_calls_execute_once():
+    flight = new_flight()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {'value': 42}
+
+    threads, outcomes = run_concurrently(flight, hebing.make_key('a', 1), compute)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert all(outcome[0] == 'result' for outcome in outcomes)
+    assert all(outcome[1] is outcomes[0][1] for outcome in outcomes) # 同一个结果对象
+    stats = flight.stats()
+    assert stats['executed'] == 1 and stats['coalesced'] == 3 and stats['in_flight'] == 0
+
+
+def test_error_is_shared_with_waiters_and_not_cached():
+    flight = new_flight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise RuntimeError('boom')
+
+    key = hebing.make_key('b')
+    threads, outcomes = run_concurrently(flight, key, fail)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert all(outcome[0] == 'error' for outcome in outcomes)
+    assert all(outcome[1] is outcomes[0][1] for outcome in outcomes) # 同一个异常
+    stats = flight.stats()
+    assert stats['failed'] == 1 and stats['in_flight'] == 0
+
+    assert flight.do(key, lambda: 'ok') == 'ok' # 失败不被缓存，之后的调用重新执行
+    assert flight.stats()['executed'] == 2
+
+
+def test_admission_rejection_is_shared_and_compute_skipped():
+    flight = new_flight()
+
+    class Rejected(Exception):
+        pass
+
+    def admit():
+        raise Rejected()
+
+    calls = []
+    with pytest.raises(Rejected):
+        flight.do(hebing.make_key('c'), lambda: calls.append(1), admit=admit)
+    assert calls == [] and flight.stats()['failed'] == 1
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = new_flight()
+    release = threading.Event()
+    blocked = threading.Thread(target=flight.do, args=(hebing.make_key('slow'), release.wait, 5))
+    blocked.start()
+    wait_until(lambda: flight.stats()['in_flight'] == 1)
+    assert flight.do(hebing.make_key('fast'), lambda: 'fast') == 'fast'
+    release.set()
+    blocked.join(5)
+
+
+def test_waiter_reuses_result_of_lock_holder(tmp_path):
+    # 两个同名实例各自打开锁文件，等同于两个工作进程
+    name = f"test_{next(_names)}"
+    holder, waiter = SingleFlight(name, lock_dir=str(tmp_path)), SingleFlight(name, lock_dir=str(tmp_path))
+    key = hebing.make_key('shared')
+    release = threading.Event()
+    holder_thread = threading.Thread(target=holder.do, args=(key, lambda: release.wait(5) and 'computed'))
+    holder_thread.start()
+    wait_until(lambda: holder.stats()['executed'] == 1)
+
+    calls = []
+    result = []
+    waiter_thread = threading.Thread(target=lambda: result.append(waiter.do(key, lambda: calls.append(1))))
+    waiter_thread.start()
+    time.sleep(0.1)
+    release.set()
+    holder_thread.join(5)
+    waiter_thread.join(5)
+    assert result == ['computed'] and calls == []
+    assert waiter.stats()['shared_across_processes'] == 1
+
+
+def test_waiter_computes_locally_after_lock_timeout(tmp_path):
+    name = f"test_{next(_names)}"
+    holder = SingleFlight(name, lock_dir=str(tmp_path))
+    waiter = SingleFlight(name, lock_dir=str(tmp_path), lock_timeout=0.1)
+    key = hebing.make_key('stuck')
+    release = threading.Event()
+    holder_thread = threading.Thread(target=holder.do, args=(key, lambda: release.wait(5)))
+    holder_thread.start()
+    wait_until(lambda: holder.stats()['executed'] == 1)
+    try:
+        started = time.monotonic()
+        assert waiter.do(key, lambda: 'local') == 'local'
+        assert time.monotonic() - started < 2
+        stats = waiter.stats()
+        assert stats['lock_timeouts'] == 1 and stats['executed'] == 1
+    finally:
+        release.set()
+        holder_thread.join(5)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import jizhun
+
+
+def seasonal_matrix(num_series: int = 3, periods: int = 48, seed: int = 3) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    t = np.arange(periods)
+    base = 100 + 0.5 * t + 10 * np.sin(2 * np.pi * t / 12)
+    return base + rng.normal(0, 2, (num_series, periods))
+
+
+def test_seasonal_naive_repeats_last_season():
+    y = seasonal_matrix()
+    state = jizhun.fit_baselines(y, 'seasonal_naive')
+    mean, se = jizhun.forecast_baselines(state, 24)
+    np.testing.assert_allclose(mean[:, :12], y[:, -12:])
+    np.testing.assert_allclose(mean[:, 12:], y[:, -12:])
+    sigma = np.sqrt(np.mean((y[:, 12:] - y[:, :-12]) ** 2, axis=1))
+    np.testing.assert_allclose(se[:, 0], sigma)
+    np.testing.assert_allclose(se[:, 12], sigma * np.sqrt(2)) # 第二个季节的预测依赖两次季节差分
+
+
+def test_moving_average_matches_pandas_rolling_mean():
+    y = seasonal_matrix()
+    state = jizhun.fit_baselines(y, 'moving_average', {'window': 6})
+    mean, se = jizhun.forecast_baselines(state, 4)
+    np.testing.assert_allclose(mean, np.repeat(y[:, -6:].mean(axis=1)[:, np.newaxis], 4, axis=1))
+    rolling = pd.DataFrame(y.T).rolling(6).mean().shift(1).values.T[:, 6:]
+    np.testing.assert_allclose(se[:, 0], np.sqrt(np.mean((y[:, 6:] - rolling) ** 2, axis=1)))
+    np.testing.assert_allclose(se[:, 3], se[:, 0])
+
+
+def test_ses_selects_alpha_with_smallest_one_step_error():
+    y = seasonal_matrix()
+    state = jizhun.fit_baselines(y, 'ses', keep_residuals=True)
+    for i in range(len(y)):
+        sse = {}
+        for alpha in jizhun.SES_ALPHA_GRID:
+            level, total = y[i, 0], 0.0
+            for value in y[i, 1:]:
+                total += (value - level) ** 2
+                level += alpha * (value - level)
+            sse[alpha] = (total, level)
+        best = min(sse, key=lambda a: sse[a][0])
+        assert state['alpha'][i] == best
+        assert state['level'][i] == pytest.approx(sse[best][1])
+        assert state['sigma2'][i] == pytest.approx(sse[best][0] / (y.shape[1] - 1))
+    assert state['residuals'].shape == (len(y), y.shape[1] - 1)
+
+
+def test_holt_winters_tracks_trend_and_season():
+    t = np.arange(60)
+    y = (50 + 0.8 * t + 6 * np.sin(2 * np.pi * t / 12))[np.newaxis, :]
+    future = 50 + 0.8 * np.arange(60, 72) + 6 * np.sin(2 * np.pi * np.arange(60, 72) / 12)
+    errors = {}
+    for method in jizhun.BASELINE_METHODS:
+        mean, se = jizhun.forecast_baselines(jizhun.fit_baselines(y, method), 12)
+        errors[method] = np.sqrt(np.mean((mean[0] - future) ** 2))
+    assert errors['holt_winters'] == min(errors.values()) # 只有 Holt-Winters 同时刻画趋势与季节
+    assert np.all(np.diff(se[0]) >= 0)
+
+
+def test_fitting_many_series_matches_fitting_each_alone():
+    y = seasonal_matrix(num_series=4)
+    together = jizhun.fit_baselines(y, 'holt_winters')
+    for i in range(len(y)):
+        alone = jizhun.fit_baselines(y[i:i + 1], 'holt_winters')
+        for key in ('level', 'trend', 'alpha', 'beta', 'gamma', 'sigma2'):
+            assert together[key][i] == pytest.approx(alone[key][0])
+
+
+def test_baseline_artifact_round_trip():
+    index = pd.date_range('2018-01-31', periods=48, freq='ME')
+    matrix = pd.DataFrame(seasonal_matrix(num_series=2), columns=index, index=['a', 'b'])
+    artifacts = jizhun.build_baseline_artifacts(matrix, 'ses', data_source={'offenses': None})
+    model = jizhun.restore_baseline(artifacts[1])
+    forecast = model.get_forecast(6)
+    mean, se = jizhun.forecast_baselines(jizhun.fit_baselines(matrix.values, 'ses'), 6)
+    np.testing.assert_allclose(forecast.predicted_mean.values, mean[1])
+    np.testing.assert_allclose(forecast.se_mean, se[1])
+    assert forecast.predicted_mean.index[0] == pd.Timestamp('2022-01-31')
+    assert jizhun.restore_baseline({'format': 'other'}) is None
+
+
+@pytest.mark.parametrize('params', [{'window': 0}, {'window': -3}, {'window': True}, {'window': 2.5},
+                                    {'season_length': 0}, {'season_length': False}, {'season_length': '12'}])
+@pytest.mark.parametrize('method', jizhun.BASELINE_METHODS)
+def test_invalid_window_and_season_length_are_rejected(method, params):
+    with pytest.raises(ValueError, match='正整数'):
+        jizhun.fit_baselines(seasonal_matrix(), method, params)
+
+
+def test_too_short_series_are_rejected():
+    with pytest.raises(ValueError, match='24'):
+        jizhun.fit_baselines(seasonal_matrix(periods=20), 'seasonal_naive')
+    with pytest.raises(ValueError, match='不支持'):
+        jizhun.fit_baselines(seasonal_matrix(), 'naive')
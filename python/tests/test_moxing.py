@@ -0,0 +1,153 @@
+import os
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+import moxing
+import xunlian
+
+ARIMA = pytest.importorskip('statsmodels.tsa.arima.model').ARIMA
+
+
+def monthly_series(periods: int = 72, seed: int = 1) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2015-01-31', periods=periods, freq='ME')
+    seasonal = 10 * np.sin(np.arange(periods) * 2 * np.pi / 12)
+    return pd.Series(200 + np.cumsum(rng.normal(0, 3, periods)) + seasonal, index=index)
+
+
+def fit(series: pd.Series, order, seasonal_order=(0, 0, 0, 0), trend=None):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # 收敛警告与本测试无关
+        return ARIMA(series, order=order, seasonal_order=seasonal_order, trend=trend).fit()
+
+
+MODEL_SPECS = [
+    ((1, 1, 1), (0, 0, 0, 0), None),
+    ((1, 0, 0), (1, 0, 0, 12), 'c'),
+    ((2, 1, 0), (0, 1, 1, 12), None),
+]
+
+
+@pytest.mark.parametrize('order, seasonal_order, trend', MODEL_SPECS)
+def test_slim_artifact_forecast_matches_statsmodels(tmp_path, order, seasonal_order, trend):
+    fitted = fit(monthly_series(), order, seasonal_order, trend)
+    path = str(tmp_path / 'model.joblib')
+    assert moxing.save_model_artifact(fitted, path, data_source={'offenses': None})
+
+    loaded = joblib.load(path)
+    assert moxing.is_slim_artifact(loaded)
+    slim = moxing.restore_model(loaded)
+    expected, result = fitted.get_forecast(18), slim.get_forecast(18)
+    pd.testing.assert_index_equal(result.predicted_mean.index, expected.predicted_mean.index)
+    np.testing.assert_allclose(result.predicted_mean.values, expected.predicted_mean.values, rtol=1e-8)
+    np.testing.assert_allclose(result.se_mean, np.asarray(expected.se_mean), rtol=1e-6)
+    np.testing.assert_allclose(result.conf_int(alpha=0.2).values, expected.conf_int(alpha=0.2).values, rtol=1e-6)
+    assert slim.order == order and slim.seasonal_order == seasonal_order
+    assert slim.aic == pytest.approx(fitted.aic)
+
+
+def test_slim_artifact_is_smaller_than_full_model(tmp_path):
+    fitted = fit(monthly_series(240), (1, 1, 1))
+    slim_path, full_path = str(tmp_path / 'slim.joblib'), str(tmp_path / 'full.joblib')
+    moxing.save_model_artifact(fitted, slim_path)
+    joblib.dump(fitted, full_path)
+    assert os.path.getsize(slim_path) * 10 < os.path.getsize(full_path)
+
+
+def test_time_varying_model_is_saved_in_full(tmp_path):
+    fitted = fit(monthly_series(), (1, 0, 0), trend='t') # 线性趋势使截距随时间变化
+    path = str(tmp_path / 'model.joblib')
+    assert not moxing.save_model_artifact(fitted, path)
+    restored = moxing.restore_model(joblib.load(path))
+    np.testing.assert_allclose(restored.get_forecast(6).predicted_mean, fitted.get_forecast(6).predicted_mean)
+
+
+def test_model_data_horizon_of_slim_and_full_models(tmp_path):
+    series = monthly_series()
+    fitted = fit(series, (1, 1, 1))
+    path = str(tmp_path / 'model.joblib')
+    moxing.save_model_artifact(fitted, path, data_source={'resample_freq': 'ME'})
+    slim_horizon = moxing.model_data_horizon(moxing.restore_model(joblib.load(path)))
+    full_horizon = moxing.model_data_horizon(fitted)
+    for key in ('first_timestamp', 'last_timestamp', 'freq', 'nobs', 'order', 'seasonal_order'):
+        assert slim_horizon[key] == full_horizon[key]
+    assert slim_horizon['last_timestamp'] == series.index[-1].isoformat()
+    assert slim_horizon['data_source'] == {'resample_freq': 'ME'}
+
+
+def test_migrate_model_directory(tmp_path):
+    joblib.dump(fit(monthly_series(), (1, 1, 1)), tmp_path / 'full.joblib')
+    joblib.dump({'not': 'a model'}, tmp_path / 'other.joblib')
+    reports = {r['file']: r for r in moxing.migrate_model_directory(str(tmp_path), dry_run=True)}
+    assert reports['full.joblib']['status'] == 'would_migrate'
+    assert reports['other.joblib']['status'] == 'unsupported'
+
+    reports = {r['file']: r for r in moxing.migrate_model_directory(str(tmp_path))}
+    assert reports['full.joblib']['status'] == 'migrated'
+    assert reports['full.joblib']['bytes_after'] < reports['full.joblib']['bytes_before']
+    assert moxing.migrate_model_directory(str(tmp_path))[0]['status'] == 'already_slim'
+
+
+def test_load_arima_model_round_trip(tmp_path):
+    series = monthly_series()
+    fitted = xunlian.train_arima_model(series, (1, 1, 1), 'm.joblib', str(tmp_path))
+    loaded = xunlian.load_arima_model('m.joblib', str(tmp_path))
+    assert isinstance(loaded, moxing.SlimArimaResults)
+    assert xunlian.load_arima_model('m.joblib', str(tmp_path)) is loaded # 进程内缓存
+    np.testing.assert_allclose(loaded.get_forecast(6).predicted_mean.values,
+                               fitted.get_forecast(6).predicted_mean.values, rtol=1e-8)
+
+
+# --- 不重新拟合的增量更新 ---
+@pytest.mark.parametrize('order, seasonal_order, trend', MODEL_SPECS)
+def test_extend_matches_statsmodels_append_without_refit(tmp_path, order, seasonal_order, trend):
+    series = monthly_series(84)
+    history, new_data = series[:72], series[72:].copy()
+    new_data.iloc[3] = np.nan # 缺失周期只做预测步
+    fitted = fit(history, order, seasonal_order, trend)
+    path = str(tmp_path / 'model.joblib')
+    moxing.save_model_artifact(fitted, path)
+
+    expected = fitted.append(new_data, refit=False)
+    extended = moxing.extend_model(moxing.restore_model(joblib.load(path)), new_data)
+    assert extended.nobs == expected.nobs == 84
+    assert extended.artifact['periods_appended'] == 12
+    assert moxing.model_data_horizon(extended)['last_timestamp'] == series.index[-1].isoformat()
+    np.testing.assert_allclose(extended.get_forecast(12).predicted_mean.values,
+                               expected.get_forecast(12).predicted_mean.values, rtol=1e-7)
+    np.testing.assert_allclose(extended.get_forecast(12).se_mean,
+                               np.asarray(expected.get_forecast(12).se_mean), rtol=1e-6)
+    np.testing.assert_allclose(moxing.model_params(extended), fitted.params.values)
+
+
+def test_update_arima_model_without_refit(tmp_path):
+    series = monthly_series(84)
+    xunlian.train_arima_model(series[:72], (1, 1, 1), 'm.joblib', str(tmp_path), data_source={'offenses': None})
+    trained = xunlian.load_arima_model('m.joblib', str(tmp_path))
+
+    updated, info = xunlian.update_arima_model('m.joblib', series, str(tmp_path))
+    assert info['previous_horizon'] == series.index[71].isoformat()
+    assert info['new_horizon'] == series.index[-1].isoformat()
+    assert info['periods_added'] == 12 and info['refit'] is False
+    np.testing.assert_allclose(moxing.model_params(updated), moxing.model_params(trained))
+
+    reloaded = xunlian.load_arima_model('m.joblib', str(tmp_path)) # 保存后的文件替换了进程内缓存
+    assert reloaded.nobs == 84
+    assert moxing.model_data_horizon(reloaded)['data_source'] == {'offenses': None}
+    with pytest.raises(ValueError, match='没有晚于'):
+        xunlian.update_arima_model('m.joblib', series, str(tmp_path))
+
+
+def test_update_arima_model_rejects_gaps_and_baselines(tmp_path):
+    series = monthly_series(84)
+    xunlian.train_arima_model(series[:60], (1, 1, 1), 'm.joblib', str(tmp_path))
+    with pytest.raises(ValueError, match='缺口'):
+        xunlian.update_arima_model('m.joblib', series[66:], str(tmp_path))
+    xunlian.train_baseline_model(series[:60], 'seasonal_naive', 'b.joblib', str(tmp_path))
+    with pytest.raises(ValueError, match='基准模型'):
+        xunlian.update_arima_model('b.joblib', series, str(tmp_path))
+    assert xunlian.update_arima_model('missing.joblib', series, str(tmp_path)) == (None, None)
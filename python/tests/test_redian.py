@@ -0,0 +1,77 @@
+import warnings
+
+import numpy as np
+import pytest
+
+import redian
+
+esda = pytest.importorskip('esda')
+libpysal = pytest.importorskip('libpysal')
+
+
+@pytest.fixture(scope='module')
+def regions():
+    rng = np.random.default_rng(7)
+    coords = rng.uniform(0, 10, size=(40, 2))
+    values = rng.poisson(5, size=40).astype(float) + coords[:, 0] # 带空间趋势的计数
+    return coords, values
+
+
+def reference_statistics(coords, values, threshold):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # 孤立区域的警告
+        weights = libpysal.weights.DistanceBand(coords, threshold=threshold, binary=True, silence_warnings=True)
+        moran = esda.Moran(values, weights, transformation='B', permutations=0)
+        general_g = esda.getisord.G(values, weights, permutations=0)
+    return weights, moran, general_g
+
+
+def test_sweep_matches_esda_at_each_threshold(regions):
+    coords, values = regions
+    pairs = redian.build_sorted_distance_pairs(coords)
+    thresholds = redian.default_sweep_thresholds(pairs, num_steps=6)
+    sweep = redian.distance_band_sweep(values, pairs, thresholds)
+
+    for k, threshold in enumerate(thresholds):
+        weights, moran, general_g = reference_statistics(coords, values, threshold)
+        assert sweep['num_neighbor_pairs'][k] * 2 == weights.s0
+        assert sweep['isolated_regions'][k] == len(weights.islands)
+        assert sweep['moran_i'][k] == pytest.approx(moran.I)
+        assert sweep['moran_z'][k] == pytest.approx(moran.z_norm)
+        assert sweep['general_g'][k] == pytest.approx(general_g.G)
+        assert sweep['general_g_z'][k] == pytest.approx(general_g.z_norm)
+
+
+def test_default_thresholds_start_where_no_region_is_isolated(regions):
+    coords, values = regions
+    pairs = redian.build_sorted_distance_pairs(coords)
+    thresholds = redian.default_sweep_thresholds(pairs, num_steps=5)
+    assert len(thresholds) == 5 and np.all(np.diff(thresholds) > 0)
+    sweep = redian.distance_band_sweep(values, pairs, thresholds)
+    assert np.all(sweep['isolated_regions'] == 0)
+    assert sweep['peak_distance'] == thresholds[int(np.nanargmax(sweep['moran_z']))]
+
+
+def test_thresholds_without_neighbors_are_undefined(regions):
+    coords, values = regions
+    pairs = redian.build_sorted_distance_pairs(coords)
+    sweep = redian.distance_band_sweep(values, pairs, [0.0, pairs['distances'][-1]])
+    assert np.isnan(sweep['moran_z'][0]) and np.isnan(sweep['general_g_z'][0])
+    assert sweep['isolated_regions'][0] == len(coords)
+    assert sweep['num_neighbor_pairs'][1] == len(coords) * (len(coords) - 1) // 2
+
+
+def test_sweep_rejects_mismatched_or_too_few_values(regions):
+    coords, values = regions
+    pairs = redian.build_sorted_distance_pairs(coords)
+    with pytest.raises(ValueError):
+        redian.distance_band_sweep(values[:-1], pairs, [1.0])
+    with pytest.raises(ValueError):
+        redian.distance_band_sweep(values[:3], redian.build_sorted_distance_pairs(coords[:3]), [1.0])
+
+
+def test_find_first_peak_distance():
+    distances = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    assert redian.find_first_peak_distance(distances, np.array([1.0, 3.0, 2.0, 4.0, 5.0])) == 2.0
+    assert redian.find_first_peak_distance(distances, np.array([1.0, 2.0, 3.0, 4.0, 5.0])) == 5.0
+    assert redian.find_peak_distance(distances, np.full(5, np.nan)) is None
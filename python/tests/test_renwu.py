@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+
+import pytest
+
+import renwu
+from renwu import JobManager
+
+
+def wait_for_status(manager: JobManager, job_id: str, statuses, timeout: float = 10) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        job = manager.get(job_id)
+        if job is not None and job['status'] in statuses:
+            return job
+        assert time.monotonic() < deadline, f"任务状态停留在 {job and job['status']}"
+        time.sleep(0.02)
+
+
+def write_artifact(path: str, num_bytes: int, progress=None) -> str:
+    for done in range(num_bytes):
+        progress(done, num_bytes, stage='writing')
+    with open(path, 'wb') as f:
+        f.write(b'x' * num_bytes)
+    return path
+
+
+def blocking(release: threading.Event, progress=None, cancel_event=None):
+    while not release.wait(0.01):
+        if cancel_event is not None and cancel_event.is_set():
+            raise renwu.JobCancelled()
+    return 'done'
+
+
+@pytest.fixture
+def managers(tmp_path):
+    """共用同一个 state_dir 的两个任务管理器，相当于同一台主机上的两个工作进程。"""
+    state_dir = str(tmp_path / 'state')
+    owner = JobManager('t', max_workers=1, max_pending=2, state_dir=state_dir)
+    other = JobManager('t', max_workers=1, max_pending=2, state_dir=state_dir)
+    return owner, other
+
+
+def test_job_reports_progress_and_result(managers, tmp_path):
+    owner, _ = managers
+    job_id = owner.submit('write', write_artifact, str(tmp_path / 'a.bin'), 5, params={'name': 'a'})
+    job = wait_for_status(owner, job_id, renwu.FINISHED_JOB_STATES)
+    assert job['status'] == renwu.JOB_SUCCEEDED
+    assert job['result'] == str(tmp_path / 'a.bin')
+    assert job['progress'] == {'done': 4, 'total': 5, 'stage': 'writing'}
+    assert job['params'] == {'name': 'a'}
+
+
+def test_other_worker_sees_status_of_finished_job(managers, tmp_path):
+    owner, other = managers
+    job_id = owner.submit('write', write_artifact, str(tmp_path / 'a.bin'), 3)
+    wait_for_status(owner, job_id, renwu.FINISHED_JOB_STATES)
+    job = other.get(job_id)
+    assert job['status'] == renwu.JOB_SUCCEEDED and job['result'] == str(tmp_path / 'a.bin')
+    assert other.get('0' * 32) is None
+    assert other.get('../../etc/passwd') is None # 任务 ID 不能用来访问 state_dir 之外的文件
+
+
+def test_queued_job_is_cancelled_immediately(managers):
+    owner, _ = managers
+    release = threading.Event()
+    running = owner.submit('block', blocking, release)
+    queued = owner.submit('block', blocking, release)
+    assert owner.cancel(queued)['status'] == renwu.JOB_CANCELLED
+    release.set()
+    assert wait_for_status(owner, running, renwu.FINISHED_JOB_STATES)['status'] == renwu.JOB_SUCCEEDED
+
+
+def test_queue_full_rejects_new_jobs(managers):
+    owner, _ = managers
+    release = threading.Event()
+    try:
+        owner.submit('block', blocking, release)
+        owner.submit('block', blocking, release)
+        with pytest.raises(renwu.JobQueueFull):
+            owner.submit('block', blocking, release)
+    finally:
+        release.set()
+
+
+def test_other_worker_can_cancel_running_job(managers):
+    owner, other = managers
+    release = threading.Event()
+    job_id = owner.submit('block', blocking, release, cancellable=True)
+    wait_for_status(owner, job_id, [renwu.JOB_RUNNING])
+    assert other.cancel(job_id)['cancel_requested'] # 写入取消标记，由任务所在的进程终止任务
+    job = wait_for_status(owner, job_id, renwu.FINISHED_JOB_STATES)
+    assert job['status'] == renwu.JOB_CANCELLED
+    assert other.get(job_id)['status'] == renwu.JOB_CANCELLED
+
+
+def test_job_of_exited_worker_is_reported_failed(managers):
+    owner, other = managers
+    release = threading.Event()
+    job_id = owner.submit('block', blocking, release)
+    wait_for_status(owner, job_id, [renwu.JOB_RUNNING])
+    path = os.path.join(owner.state_dir, job_id + '.json')
+    with open(path, encoding='utf-8') as f:
+        record = f.read()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(record.replace(f'"owner_pid": {os.getpid()}', '"owner_pid": 999999999'))
+    assert other.get(job_id)['status'] == renwu.JOB_FAILED
+    release.set()
+
+
+def test_expired_artifacts_are_deleted(tmp_path):
+    manager = JobManager('t', max_workers=1, artifact_ttl_seconds=0.05, state_dir=str(tmp_path / 'state'))
+    path = str(tmp_path / 'a.bin')
+    job_id = manager.submit('write', write_artifact, path, 3)
+    wait_for_status(manager, job_id, renwu.FINISHED_JOB_STATES)
+    time.sleep(0.1)
+    manager.expire_artifacts()
+    assert manager.get(job_id)['status'] == renwu.JOB_EXPIRED
+    assert not os.path.exists(path)
+
+
+def test_export_job_download_supports_range(client, backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(backend, 'EXPORT_JOB_DIR', str(tmp_path / 'export_jobs'))
+    monkeypatch.setattr(backend, 'export_job_manager', JobManager('export', state_dir=str(tmp_path / 'state')))
+    features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [-77.0, 38.9 + i * 0.001]},
+                 'properties': {'OFFENSE': 'THEFT', 'WARD': i}} for i in range(50)]
+    submitted = client.post('/api/export-jobs', json={'features': features, 'filename': 'jobs'})
+    assert submitted.status_code == 202
+    job_id = submitted.get_json()['data']['job_id']
+    assert client.get(f'/api/export-jobs/{job_id}/download').status_code in (200, 409)
+
+    deadline = time.monotonic() + 10
+    while (status := client.get(f'/api/export-jobs/{job_id}').get_json()['data'])['status'] != renwu.JOB_SUCCEEDED:
+        assert status['status'] in renwu.ACTIVE_JOB_STATES and time.monotonic() < deadline
+        time.sleep(0.05)
+    assert status['rows_written'] == status['rows_total'] == 50
+
+    full = client.get(status['download_url'])
+    body = full.get_data()
+    full.close()
+    partial = client.get(status['download_url'], headers={'Range': 'bytes=10-'})
+    assert partial.status_code == 206
+    assert partial.get_data() == body[10:]
+    partial.close()
+    assert client.get('/api/export-jobs/' + '0' * 32).status_code == 404
+
+
+# --- 任务去重与子进程取消 ---
+def test_same_dedup_key_reuses_active_job(managers):
+    owner, _ = managers
+    release = threading.Event()
+    try:
+        first = owner.submit('block', blocking, release, dedup_key='k', cancellable=True)
+        assert owner.submit('block', blocking, release, dedup_key='k') == first
+        assert owner.get(first)['submissions'] == 2
+        other = owner.submit('block', blocking, release, dedup_key='other')
+        assert other != first
+        owner.cancel(first)
+        wait_for_status(owner, first, [renwu.JOB_CANCELLED])
+        assert owner.submit('block', blocking, release, dedup_key='k') != first # 已取消的任务不再复用
+    finally:
+        release.set()
+
+
+def report_and_return(value, progress=None):
+    for done in range(3):
+        progress(done + 1, 3, 'step')
+    return value * 2
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def spawn_sleeper_and_wait(pid_path, progress=None):
+    import subprocess
+    child = subprocess.Popen(['sleep', '60'])
+    with open(pid_path, 'w') as f:
+        f.write(str(child.pid))
+    while True:
+        time.sleep(0.05)
+
+
+def pid_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_run_in_subprocess_forwards_progress_and_result():
+    progress = []
+    assert renwu.run_in_subprocess(report_and_return, 21, progress=lambda *args: progress.append(args)) == 42
+    assert progress == [(1, 3, 'step'), (2, 3, 'step'), (3, 3, 'step')]
+
+
+def test_run_in_subprocess_reraises_exceptions():
+    with pytest.raises(ValueError, match='boom'):
+        renwu.run_in_subprocess(fail, 'boom')
+
+
+@pytest.mark.skipif(not hasattr(os, 'killpg'), reason='需要进程组')
+def test_cancel_kills_subprocess_group(tmp_path):
+    pid_path = str(tmp_path / 'pid')
+    cancel_event = threading.Event()
+    outcome = []
+
+    def run():
+        try:
+            renwu.run_in_subprocess(spawn_sleeper_and_wait, pid_path, cancel_event=cancel_event, poll_interval=0.02)
+        except renwu.JobCancelled:
+            outcome.append('cancelled')
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    deadline = time.monotonic() + 20
+    while not (os.path.exists(pid_path) and open(pid_path).read()):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    grandchild = int(open(pid_path).read())
+    cancel_event.set()
+    thread.join(timeout=10)
+    assert outcome == ['cancelled']
+    while pid_exists(grandchild): # 子进程启动的进程也随进程组一起终止
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def fake_training(spec, progress=None, cancel_event=None):
+    while not cancel_event.wait(0.01):
+        pass
+    raise renwu.JobCancelled()
+
+
+def test_train_jobs_endpoint_deduplicates_and_cancels(client, backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(backend, 'train_job_manager', JobManager('train', state_dir=str(tmp_path / 'state')))
+    monkeypatch.setattr(backend, 'run_train_model', fake_training)
+    body = {'start_year': 2020, 'end_year': 2020, 'resample_freq': 'ME', 'arima_order': [1, 0, 0],
+            'model_filename': 'first'}
+    first = client.post('/api/train-jobs', json=body).get_json()['data']
+    again = client.post('/api/train-jobs', json={**body, 'model_filename': 'second'})
+    assert again.status_code == 202
+    assert again.get_json()['data']['job_id'] == first['job_id'] and again.get_json()['data']['deduplicated']
+    assert 'first.joblib' in again.get_json()['message'] # 复用的任务按最先提交的文件名保存
+    different = client.post('/api/train-jobs', json={**body, 'arima_order': [2, 0, 0]}).get_json()['data']
+    assert different['job_id'] != first['job_id']
+
+    cancelled = client.post(f"/api/train-jobs/{first['job_id']}/cancel")
+    assert cancelled.status_code in (200, 202)
+    wait_for_status(backend.train_job_manager, first['job_id'], [renwu.JOB_CANCELLED])
+    resubmitted = client.post('/api/train-jobs', json=body).get_json()['data']
+    assert resubmitted['job_id'] != first['job_id'] and not resubmitted['deduplicated']
+    client.post(f"/api/train-jobs/{different['job_id']}/cancel")
+    client.post(f"/api/train-jobs/{resubmitted['job_id']}/cancel")
+    assert client.post('/api/train-jobs/' + '0' * 32 + '/cancel').status_code == 404
@@ -0,0 +1,108 @@
+import pandas as pd
+import pytest
+
+import qingxi
+
+
+@pytest.fixture
+def batch_submissions(backend, monkeypatch):
+    submitted = []
+
+    def submit(*args, **kwargs):
+        submitted.append(kwargs)
+        return '0' * 32
+
+    monkeypatch.setattr(backend.batch_train_job_manager, 'submit', submit)
+    return submitted
+
+
+@pytest.mark.parametrize('max_workers', [True, False, 0, -1, 2.5, '2'])
+def test_train_batch_rejects_invalid_max_workers(client, batch_submissions, max_workers):
+    response = client.post('/api/train-batch', json={'group_by': 'offense', 'model_type': 'seasonal_naive',
+                                                     'max_workers': max_workers})
+    assert response.status_code == 400
+    assert 'max_workers' in response.get_json()['message']
+    assert batch_submissions == []
+
+
+def test_train_batch_accepts_positive_max_workers(client, batch_submissions):
+    response = client.post('/api/train-batch', json={'group_by': 'offense', 'model_type': 'seasonal_naive',
+                                                     'max_workers': 1})
+    assert response.status_code == 202
+    assert batch_submissions[0]['max_workers'] == 1
+
+
+@pytest.mark.parametrize('model_params', [{'window': 0}, {'season_length': 0}, {'season_length': True},
+                                          {'window': 1.5}])
+def test_train_model_rejects_invalid_baseline_params(client, model_params):
+    response = client.post('/api/train-model', json={'start_year': 2020, 'end_year': 2020, 'resample_freq': 'ME',
+                                                     'model_type': 'moving_average', 'model_params': model_params})
+    assert response.status_code == 400
+    assert '正整数' in response.get_json()['message']
+
+
+def test_train_batch_rejects_invalid_baseline_params(client, batch_submissions):
+    response = client.post('/api/train-batch', json={'group_by': 'offense', 'model_type': 'seasonal_naive',
+                                                     'model_params': {'season_length': 0}})
+    assert response.status_code == 400
+    assert batch_submissions == []
+
+
+def test_train_model_fits_baseline(client, backend):
+    response = client.post('/api/train-model', json={'start_year': 2020, 'end_year': 2020, 'resample_freq': 'W',
+                                                     'model_type': 'moving_average', 'model_params': {'window': 4},
+                                                     'model_filename': 'ma'})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['data']['model_type'] == 'moving_average'
+    model = backend.xunlian.load_arima_model('ma.joblib', backend.MODEL_STORAGE_DIRECTORY)
+    assert model.method == 'moving_average' and model.artifact['window'] == 4
+
+
+# --- 训练与增量更新使用完整的筛选条件 ---
+BBOX = [-77.05, 38.85, -76.95, 38.95]
+
+
+def expected_monthly_counts(master_csv, start, end=None) -> pd.Series:
+    df = pd.read_csv(master_csv, parse_dates=[qingxi.TIME_COLUMN_NAME])
+    times = df[qingxi.TIME_COLUMN_NAME]
+    mask = (times >= start) & df['longitude'].between(BBOX[0], BBOX[2]) & df['latitude'].between(BBOX[1], BBOX[3])
+    if end is not None:
+        mask &= times < pd.Timestamp(end) + pd.Timedelta(days=1)
+    return pd.Series(1, index=pd.DatetimeIndex(times[mask])).sort_index().resample('ME').size().astype(float)
+
+
+def test_train_model_uses_dates_and_bbox(client, backend, master_csv):
+    response = client.post('/api/train-model', json={'start_date': '2020-02-01', 'end_date': '2020-12-31', 'bbox': BBOX,
+                                                     'resample_freq': 'ME', 'model_type': 'ses', 'model_filename': 'f'})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['data']['time_series_length'] == 11
+    model = backend.xunlian.load_arima_model('f.joblib', backend.MODEL_STORAGE_DIRECTORY)
+    expected = expected_monthly_counts(master_csv, '2020-02-01', '2020-12-31')
+    assert model.nobs == len(expected) and model.artifact['last_timestamp'] == expected.index[-1].isoformat()
+    assert model.artifact['data_source'] == {'start_date': '2020-02-01', 'end_date': '2020-12-31', 'offenses': None,
+                                             'bbox': BBOX, 'polygon': None, 'resample_freq': 'ME'}
+
+
+def test_update_model_reuses_training_filter(client, backend, master_csv, monkeypatch):
+    response = client.post('/api/train-model', json={'start_date': '2019-12-01', 'end_date': '2020-12-31', 'bbox': BBOX,
+                                                     'resample_freq': 'ME', 'arima_order': [1, 0, 0],
+                                                     'model_filename': 'u'})
+    assert response.status_code == 200, response.get_json()
+    series_seen = []
+    update = backend.xunlian.update_arima_model
+    monkeypatch.setattr(backend.xunlian, 'update_arima_model',
+                        lambda name, ts_data, *args, **kwargs: series_seen.append(ts_data) or update(name, ts_data, *args, **kwargs))
+
+    response = client.post('/api/update-model', json={'model_filename': 'u'})
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['data']['periods_added'] == 3
+    pd.testing.assert_series_equal(series_seen[0], expected_monthly_counts(master_csv, '2019-12-01'),
+                                   check_names=False, check_freq=False)
+
+
+@pytest.mark.parametrize('body', [{'start_date': '2020-13-01'}, {'start_year': 2020, 'end_year': 2020, 'bbox': [1, 2]},
+                                  {'start_year': 2020, 'end_year': 2020, 'polygon': {'type': 'Point'}},
+                                  {'start_year': 2021, 'end_year': 2020}])
+def test_train_model_rejects_invalid_filters(client, body):
+    response = client.post('/api/train-model', json={**body, 'resample_freq': 'ME', 'model_type': 'ses'})
+    assert response.status_code == 400
@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from xianliu import AdmissionController, AdmissionRejected
+
+
+def test_admits_up_to_max_concurrent_without_queueing():
+    controller = AdmissionController('t', max_concurrent=2, max_queue=0, max_wait_seconds=1)
+    assert controller.acquire() == 0.0
+    assert controller.acquire() == 0.0
+    stats = controller.stats()
+    assert stats['running'] == 2 and stats['admitted'] == 2
+
+
+def test_rejects_with_429_when_queue_is_full():
+    controller = AdmissionController('t', max_concurrent=1, max_queue=0, max_wait_seconds=2)
+    controller.acquire()
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.acquire()
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.endpoint_class == 't'
+    assert excinfo.value.retry_after == 2 # 没有服务时间的历史数据时取 max_wait_seconds
+    stats = controller.stats()
+    assert stats['rejected_queue_full'] == 1 and stats['running'] == 1 and stats['queued'] == 0
+
+
+def test_rejects_with_503_after_waiting_too_long():
+    controller = AdmissionController('t', max_concurrent=1, max_queue=1, max_wait_seconds=0.2)
+    controller.acquire()
+    started = time.monotonic()
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.acquire()
+    assert excinfo.value.status_code == 503
+    assert time.monotonic() - started >= 0.2
+    stats = controller.stats()
+    assert stats['timed_out'] == 1 and stats['queued'] == 0 # 超时的请求已离开队列
+
+    controller.release()
+    assert controller.acquire() == 0.0 # 名额归还后新请求立即被接纳
+
+
+def test_rejects_with_503_when_estimated_wait_exceeds_limit():
+    controller = AdmissionController('t', max_concurrent=1, max_queue=5, max_wait_seconds=0.5)
+    controller.acquire()
+    controller.release(service_seconds=2.0)
+    controller.acquire()
+    with pytest.raises(AdmissionRejected) as excinfo:
+        controller.acquire()
+    assert excinfo.value.status_code == 503
+    assert excinfo.value.retry_after == 2 # 按平均服务时间估计的排队时间
+    assert controller.stats()['rejected_wait_estimate'] == 1
+
+
+def test_queued_request_is_admitted_when_slot_is_released():
+    controller = AdmissionController('t', max_concurrent=1, max_queue=1, max_wait_seconds=5)
+    controller.acquire()
+    waited = []
+    waiter = threading.Thread(target=lambda: waited.append(controller.acquire()))
+    waiter.start()
+    while controller.stats()['queued'] == 0:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    controller.release()
+    waiter.join(timeout=5)
+    assert waited and waited[0] >= 0.05
+    stats = controller.stats()
+    assert stats['running'] == 1 and stats['queued'] == 0 and stats['queued_total'] == 1
+
+
+def test_admit_context_releases_slot_on_error():
+    controller = AdmissionController('t', max_concurrent=1, max_queue=0, max_wait_seconds=1)
+    with pytest.raises(ValueError):
+        with controller.admit():
+            raise ValueError('boom')
+    stats = controller.stats()
+    assert stats['running'] == 0 and stats['service_seconds_avg'] is not None
+
+
+def test_full_queue_returns_429_with_retry_after(client, backend, monkeypatch):
+    controller = backend.admission_controllers['training']
+    monkeypatch.setattr(controller, 'max_queue', 0)
+    for _ in range(controller.max_concurrent): # 占满所有执行名额
+        controller.acquire()
+    try:
+        response = client.post('/api/train-model', json={'start_year': 2020, 'end_year': 2020})
+    finally:
+        for _ in range(controller.max_concurrent):
+            controller.release()
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['data']['endpoint_class'] == 'training'
@@ -0,0 +1,106 @@
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import xunlian
+
+ARIMA = pytest.importorskip('statsmodels.tsa.arima.model').ARIMA
+
+
+def monthly_series(periods: int = 60, seed: int = 2) -> pd.Series:
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2016-01-31', periods=periods, freq='ME')
+    return pd.Series(150 + np.cumsum(rng.normal(0, 4, periods)), index=index)
+
+
+@pytest.fixture
+def fold_cache(monkeypatch):
+    cache = OrderedDict()
+    monkeypatch.setattr(xunlian, '_backtest_fold_cache', cache)
+    return cache
+
+
+# --- 滚动起点回测 ---
+BACKTEST_CONFIG = {'num_folds': 6, 'step': 2, 'horizon': 3, 'min_folds': 1, 'max_workers': 2,
+                   'confidence_levels': [0.8]}
+CANDIDATES = [((1, 1, 0), (0, 0, 0, 0)), ((0, 1, 1), (0, 0, 0, 0))]
+
+
+def test_fold_origins_are_independent_of_horizon():
+    config = {**xunlian.BACKTEST_DEFAULTS, 'num_folds': 4, 'step': 3}
+    assert xunlian.backtest_fold_origins(40, config) == [(0, 28), (0, 31), (0, 34), (0, 37)]
+    assert xunlian.backtest_fold_origins(40, {**config, 'horizon': 1}) == xunlian.backtest_fold_origins(40, config)
+    sliding = {**config, 'window': 'sliding', 'window_size': 30}
+    assert xunlian.backtest_fold_origins(40, sliding) == [(1, 31), (4, 34), (7, 37)] # 窗口起点不能早于序列起点
+
+
+def test_backtest_errors_match_direct_fits(fold_cache):
+    series = monthly_series()
+    result = xunlian.rolling_origin_backtest(series, CANDIDATES[:1], BACKTEST_CONFIG)
+    folds = xunlian.backtest_fold_origins(len(series), {**xunlian.BACKTEST_DEFAULTS, **BACKTEST_CONFIG})
+    assert result['fits_computed'] == len(folds) == 6
+    assert result['folds'][0]['train_end'] == series.index[folds[0][1] - 1].isoformat()
+
+    errors = []
+    for start, origin in folds:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            fitted = ARIMA(series.iloc[start:origin], order=(1, 1, 0),
+                           enforce_stationarity=False, enforce_invertibility=False).fit()
+        forecast = fitted.get_forecast(3).predicted_mean.values
+        actual = series.values[origin:origin + 3]
+        errors.append(forecast[:len(actual)] - actual)
+    first_step = np.array([e[0] for e in errors])
+    metrics = result['results'][0]
+    assert metrics['per_horizon']['num_folds'] == [6, 6, 5] # 最后一折的第 3 步超出序列末尾
+    assert metrics['per_horizon']['mae'][0] == pytest.approx(np.abs(first_step).mean(), rel=1e-5)
+    assert metrics['overall']['rmse'] == pytest.approx(np.sqrt(np.mean(np.concatenate(errors) ** 2)), rel=1e-5)
+
+
+def test_backtest_reuses_cached_folds(fold_cache):
+    series = monthly_series()
+    first = xunlian.rolling_origin_backtest(series, CANDIDATES, BACKTEST_CONFIG)
+    assert first['fits_computed'] == 12 and len(fold_cache) == 12
+
+    # 更换预测步长、置信水平与候选顺序不需要重新拟合，第 1 步的指标不变
+    longer = xunlian.rolling_origin_backtest(series, CANDIDATES[::-1], {**BACKTEST_CONFIG, 'horizon': 6,
+                                                                         'confidence_levels': [0.5, 0.95]})
+    assert longer['fits_computed'] == 0
+    first_by_order = {tuple(r['order']): r for r in first['results']}
+    for r in longer['results']:
+        assert r['per_horizon']['mae'][0] == first_by_order[tuple(r['order'])]['per_horizon']['mae'][0]
+        assert set(r['overall']['coverage']) == {'0.5', '0.95'}
+
+    # 序列取值变化后指纹不同，全部重新拟合
+    changed = series.copy()
+    changed.iloc[-1] += 1
+    assert xunlian.rolling_origin_backtest(changed, CANDIDATES[:1], BACKTEST_CONFIG)['fits_computed'] == 6
+
+
+def test_backtest_cache_is_bounded(fold_cache, monkeypatch):
+    monkeypatch.setattr(xunlian, 'BACKTEST_CACHE_MAX_ENTRIES', 4)
+    xunlian.rolling_origin_backtest(monthly_series(), CANDIDATES[:1], BACKTEST_CONFIG)
+    assert len(fold_cache) == 4
+    assert [key[4] for key in fold_cache] == [52, 54, 56, 58] # 淘汰最早插入的折
+
+
+def test_backtest_metrics_hides_horizons_with_few_folds():
+    actuals = np.array([[1.0, 2.0], [3.0, np.nan]])
+    bands = [{'mean': np.array([2.0, 2.0]), 'lower': np.array([[0.0, 0.0]]), 'upper': np.array([[5.0, 5.0]])},
+             {'mean': np.array([1.0, 1.0]), 'lower': np.array([[0.0, 0.0]]), 'upper': np.array([[2.0, 2.0]])}]
+    metrics = xunlian.backtest_metrics(actuals, bands, [0.8], min_folds=2)
+    assert metrics['per_horizon']['num_folds'] == [2, 1]
+    assert metrics['per_horizon']['mae'] == [1.5, None]
+    assert metrics['per_horizon']['coverage']['0.8'] == [0.5, None]
+    assert metrics['overall']['rmse'] == pytest.approx(np.sqrt((1 + 4) / 2))
+
+
+@pytest.mark.parametrize('config', [{'num_folds': 0}, {'horizon': True}, {'window': 'rolling'},
+                                    {'confidence_levels': [1.5]}, {'max_workers': 0}])
+def test_backtest_rejects_invalid_config(fold_cache, config):
+    with pytest.raises(ValueError):
+        xunlian.rolling_origin_backtest(monthly_series(), CANDIDATES, config)
+    assert not fold_cache
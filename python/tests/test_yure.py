@@ -0,0 +1,136 @@
+import pytest
+
+import yure
+
+
+class FlakyStage:
+    """前 failures 次调用抛出异常，之后成功。"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError(f"第 {self.calls} 次失败")
+        return {'memory_bytes': 64, 'rows': 3}
+
+
+def stage_states(scheduler) -> dict:
+    return {stage['name']: stage for stage in scheduler.report()['stages']}
+
+
+def test_retry_delay_backs_off_exponentially(monkeypatch):
+    monkeypatch.setattr(yure, 'STAGE_RETRY_BASE_SECONDS', 5)
+    monkeypatch.setattr(yure, 'STAGE_RETRY_MAX_SECONDS', 60)
+    delays = [yure.WarmUpScheduler.retry_delay(n) for n in range(1, 7)]
+    assert delays == [5, 10, 20, 40, 60, 60]
+    assert yure.WarmUpScheduler.retry_delay(10 ** 6) == 60 # 指数受限，不溢出
+
+
+def test_failed_stage_skips_dependents_and_waits_for_retry():
+    scheduler = yure.WarmUpScheduler('test')
+    data, index = FlakyStage(failures=1), FlakyStage()
+    scheduler.add_stage('data', data)
+    scheduler.add_stage('index', index, depends_on=('data',))
+    scheduler.run()
+
+    stages = stage_states(scheduler)
+    assert stages['data']['state'] == yure.STAGE_FAILED and stages['data']['error'] == '第 1 次失败'
+    assert stages['data']['consecutive_failures'] == 1
+    assert stages['data']['retry_at'] >= stages['data']['finished_at'] + yure.STAGE_RETRY_BASE_SECONDS - 1
+    assert stages['index']['state'] == yure.STAGE_SKIPPED and index.calls == 0
+    assert not scheduler.is_ready()
+
+    # 未到重试时间: 不重新排入，也不再运行
+    assert not scheduler.refresh()
+    scheduler.run()
+    assert data.calls == 1
+
+
+def test_due_retry_requeues_stage_and_skipped_dependents(monkeypatch):
+    monkeypatch.setattr(yure, 'STAGE_RETRY_BASE_SECONDS', 0) # 失败后立即到重试时间
+    scheduler = yure.WarmUpScheduler('test')
+    data, index = FlakyStage(failures=2), FlakyStage()
+    scheduler.add_stage('data', data)
+    scheduler.add_stage('index', index, depends_on=('data',))
+    scheduler.run()
+    scheduler.run()
+    assert stage_states(scheduler)['data']['consecutive_failures'] == 2
+
+    assert scheduler.refresh()
+    assert {name: stage['state'] for name, stage in stage_states(scheduler).items()} == \
+        {'data': yure.STAGE_PENDING, 'index': yure.STAGE_PENDING}
+    scheduler.run()
+    stages = stage_states(scheduler)
+    assert stages['data']['state'] == stages['index']['state'] == yure.STAGE_DONE
+    assert stages['data']['consecutive_failures'] == 0 and stages['data']['retry_at'] is None
+    assert stages['data']['memory_bytes'] == 64 and stages['data']['details'] == {'rows': 3}
+    assert scheduler.is_ready() and (data.calls, index.calls) == (3, 1)
+
+
+def test_version_change_reruns_only_stale_stages():
+    versions = {'data': 1, 'boundaries': 1}
+    scheduler = yure.WarmUpScheduler('test')
+    data, boundaries = FlakyStage(), FlakyStage()
+    scheduler.add_stage('data', data, version_func=lambda: versions['data'])
+    scheduler.add_stage('boundaries', boundaries, version_func=lambda: versions['boundaries'])
+    scheduler.run()
+    assert scheduler.is_ready() and not scheduler.refresh()
+
+    versions['data'] = 2 # 主数据重新导入
+    assert not scheduler.is_ready()
+    scheduler.run()
+    assert scheduler.is_ready() and (data.calls, boundaries.calls) == (2, 1)
+    assert stage_states(scheduler)['data']['version'] == 2
+
+
+def test_optional_stage_does_not_block_readiness():
+    scheduler = yure.WarmUpScheduler('test')
+    models = FlakyStage(failures=1)
+    scheduler.add_stage('data', FlakyStage())
+    scheduler.add_stage('models', models, required=False)
+    scheduler.run(required_only=True)
+    assert scheduler.is_ready() and models.calls == 0
+    scheduler.run()
+    assert stage_states(scheduler)['models']['state'] == yure.STAGE_FAILED
+    assert scheduler.is_ready()
+
+
+@pytest.fixture
+def ready_scheduler(backend, monkeypatch):
+    """只含主数据阶段与一个先失败一次的阶段的调度器，替换 app 模块的 warm_up_scheduler。"""
+    monkeypatch.setattr(yure, 'STAGE_RETRY_BASE_SECONDS', 0)
+    monkeypatch.setattr(backend, 'shared_data_warmed_up', False)
+    scheduler = yure.WarmUpScheduler('test')
+    scheduler.add_stage('master_data', backend.warm_up_master_data, version_func=backend.master_data_version)
+    scheduler.add_stage('community_weights', FlakyStage(failures=1))
+    monkeypatch.setattr(scheduler, 'start', lambda: False)
+    monkeypatch.setattr(backend, 'warm_up_scheduler', scheduler)
+    return scheduler
+
+
+def test_ready_endpoint_reports_warm_up_progress(client, backend, ready_scheduler):
+    response = client.get('/api/ready')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(yure.READY_RETRY_AFTER_SECONDS)
+    payload = response.get_json()
+    assert 'master_data, community_weights' in payload['message']
+    assert payload['data']['ready'] is False
+
+    backend.warm_up_shared_data()
+    response = client.get('/api/ready')
+    assert response.status_code == 503
+    stages = {stage['name']: stage for stage in response.get_json()['data']['stages']}
+    assert stages['master_data']['state'] == yure.STAGE_DONE and stages['master_data']['memory_bytes'] > 0
+    # 退避为 0 时报告前已重新排入 (pending)，失败次数与原因仍然可见
+    assert stages['community_weights']['consecutive_failures'] == 1
+    assert stages['community_weights']['error'] == '第 1 次失败'
+
+    backend.warm_up_shared_data() # 已到重试时间，失败的阶段重新运行
+    response = client.get('/api/ready')
+    assert response.status_code == 200
+    assert response.get_json()['data']['ready'] is True
+    assert client.get('/api/status').get_json()['data']['warm_up'] == {'master_data': yure.STAGE_DONE,
+                                                                       'community_weights': yure.STAGE_DONE}
@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import zhibiao
+
+fork = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+requires_fork = pytest.mark.skipif(fork is None, reason='需要 fork')
+
+
+def new_registry(multiprocess_dir=None):
+    registry = zhibiao.Registry(multiprocess_dir=multiprocess_dir)
+    counter = registry.register(zhibiao.Counter('jobs_total', '任务数。', ('kind',)))
+    gauge = registry.register(zhibiao.Gauge('jobs_running', '进行中的任务数。'))
+    histogram = registry.register(zhibiao.Histogram('job_seconds', '任务耗时。', buckets=(0.1, 1)))
+    return registry, counter, gauge, histogram
+
+
+def samples(body: str) -> dict:
+    return dict(line.rsplit(' ', 1) for line in body.splitlines() if not line.startswith('#'))
+
+
+def test_render_prometheus_text_format():
+    registry, counter, gauge, histogram = new_registry()
+    counter.inc(kind='a "quoted"\nname')
+    counter.inc(2, kind='b')
+    gauge.set(3)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+    registry.register_collector(lambda: [('pool_size', 'gauge', '池大小。', [({'pool': 'x'}, 4), ({'pool': 'y'}, None)])])
+
+    body = registry.render()
+    assert '# TYPE crime_api_jobs_total counter' in body
+    assert samples(body) == {
+        'crime_api_jobs_total{kind="a \\"quoted\\"\\nname"}': '1',
+        'crime_api_jobs_total{kind="b"}': '2',
+        'crime_api_jobs_running': '3',
+        'crime_api_job_seconds_bucket{le="0.1"}': '1',
+        'crime_api_job_seconds_bucket{le="1"}': '2', # 累计计数
+        'crime_api_job_seconds_bucket{le="+Inf"}': '3',
+        'crime_api_job_seconds_sum': '5.55',
+        'crime_api_job_seconds_count': '3',
+        'crime_api_pool_size{pool="x"}': '4', # 空值不输出
+    }
+    with pytest.raises(ValueError):
+        counter.inc(other='x')
+
+
+def test_flush_is_a_no_op_without_multiprocess_dir():
+    registry, counter, _, _ = new_registry()
+    counter.inc(kind='a')
+    registry.flush()
+    assert 'pid=' not in registry.render()
+
+
+def wait_until(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.005)
+
+
+def test_scheduled_flushes_are_coalesced(tmp_path, monkeypatch):
+    registry, counter, _, _ = new_registry(str(tmp_path))
+    registry.flush_interval = 0.2
+    flushes = []
+    flush = registry.flush
+    monkeypatch.setattr(registry, 'flush', lambda: flushes.append(1) or flush())
+    for _ in range(50): # 间隔内的多次请求只安排一次写出
+        counter.inc(kind='a')
+        registry.schedule_flush()
+    assert not os.listdir(tmp_path)
+    wait_until(lambda: flushes)
+    time.sleep(0.3)
+    assert flushes == [1]
+    assert os.listdir(tmp_path) == [f'metrics_{os.getpid()}.json']
+
+    counter.inc(kind='a')
+    registry.schedule_flush() # 写出之后的更新安排新的写出
+    wait_until(lambda: len(flushes) == 2)
+
+
+def record_and_flush(registry, counter, gauge, histogram, done=None, release=None):
+    counter.inc(kind='a')
+    gauge.set(2)
+    histogram.observe(0.5)
+    registry.flush()
+    if done is not None:
+        done.set()
+        release.wait(10)
+
+
+@requires_fork
+def test_render_merges_other_processes(tmp_path):
+    registry, counter, gauge, histogram = new_registry(str(tmp_path))
+    counter.inc(5, kind='a') # fork 之前的值只属于父进程
+    gauge.set(1)
+    histogram.observe(0.05)
+    registry.flush()
+
+    done, release = fork.Event(), fork.Event()
+    child = fork.Process(target=record_and_flush, args=(registry, counter, gauge, histogram, done, release))
+    child.start()
+    try:
+        assert done.wait(10)
+        live = samples(registry.render())
+        assert live['crime_api_jobs_total{kind="a"}'] == '6' # 子进程从 0 开始统计，不重复计入父进程的 5
+        assert live[f'crime_api_jobs_running{{pid="{os.getpid()}"}}'] == '1'
+        assert live[f'crime_api_jobs_running{{pid="{child.pid}"}}'] == '2' # 仪表按进程输出
+        assert live['crime_api_job_seconds_bucket{le="0.1"}'] == '1'
+        assert live['crime_api_job_seconds_bucket{le="1"}'] == '2'
+        assert live['crime_api_job_seconds_count'] == '2'
+    finally:
+        release.set()
+        child.join(10)
+
+    exited = samples(registry.render())
+    assert exited['crime_api_jobs_total{kind="a"}'] == '6' # 已退出进程的计数保留
+    assert f'crime_api_jobs_running{{pid="{child.pid}"}}' not in exited
+    assert sorted(os.listdir(tmp_path)) == sorted([f'metrics_{os.getpid()}.json', f'metrics_{child.pid}.json'])
+
+
+def test_unreadable_snapshot_files_are_ignored(tmp_path):
+    registry, counter, _, _ = new_registry(str(tmp_path))
+    counter.inc(kind='a')
+    (tmp_path / 'metrics_1.json').write_text('{not json')
+    (tmp_path / 'other.json').write_text('[]')
+    assert samples(registry.render())['crime_api_jobs_total{kind="a"}'] == '1'
+
+
+def serve_one_request(backend, metrics_dir):
+    response = backend.create_app({'TESTING': True, 'WARM_UP_ON_FIRST_REQUEST': False}).test_client().get('/api/status')
+    path = os.path.join(metrics_dir, f'metrics_{os.getpid()}.json')
+
+    def request_flushed():
+        if not os.path.exists(path):
+            return False
+        with open(path, encoding='utf-8') as f:
+            return '["status", "200"]' in f.read() # 请求结束后的值已由请求钩子安排写出
+    wait_until(request_flushed)
+    os._exit(0 if response.status_code == 200 else 1)
+
+
+@requires_fork
+def test_metrics_endpoint_aggregates_workers(client, backend, monkeypatch, tmp_path):
+    monkeypatch.setattr(zhibiao.REGISTRY, 'multiprocess_dir', str(tmp_path / 'metrics'))
+    monkeypatch.setattr(zhibiao.REGISTRY, 'flush_interval', 0.01)
+    line = 'crime_api_http_requests_total{route="/api/status",method="GET",status="200"}'
+    before = int(samples(client.get('/metrics').get_data(as_text=True)).get(line, 0))
+    client.get('/api/status')
+
+    worker = fork.Process(target=serve_one_request, args=(backend, zhibiao.REGISTRY.multiprocess_dir)) # 另一个工作进程
+    worker.start()
+    worker.join(30)
+    assert worker.exitcode == 0
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert int(samples(body)[line]) == before + 2
+    assert f'crime_api_process_resident_memory_bytes{{pid="{os.getpid()}"}}' in body
+    assert f'pid="{worker.pid}"' not in body # 已退出的工作进程的仪表不再输出
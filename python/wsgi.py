@@ -0,0 +1,29 @@
+"""
+多进程部署入口 (WSGI)。
+
+在 python/ 目录下运行，例如 4 个工作进程:
+    gunicorn --preload --workers 4 --bind 0.0.0.0:5000 wsgi:application
+
+--preload 让主进程先导入本模块、由 create_app 创建应用并完成预热 (主数据、筛选索引、计数立方体、社区边界与距离权重、常用模型)，
+之后 fork 出的工作进程以写时复制方式共享这些只读对象，不必各自再加载一遍。
+负载均衡器的健康检查请使用 GET /api/ready：预热完成前返回 503 (附 Retry-After)。
+工作进程数一般取 CPU 核心数；训练、导出等后台任务的线程池在每个工作进程内独立存在，
+相关上限 (TRAIN_JOB_WORKERS、EXPORT_JOB_WORKERS 等) 按单个进程计算。
+任务记录写在 processed_data/job_state/ 下，状态查询、下载和取消请求落到任一工作进程都能处理，
+不需要粘性会话；但该目录只能由同一台主机上的工作进程共用。
+GET /metrics 每次只落到一个工作进程；要让抓取结果汇总所有工作进程，启动前设置并清空 PROMETHEUS_MULTIPROC_DIR:
+    rm -rf /tmp/crime_api_metrics && mkdir /tmp/crime_api_metrics
+    PROMETHEUS_MULTIPROC_DIR=/tmp/crime_api_metrics gunicorn --preload --workers 4 ... wsgi:application
+开发调试仍可直接运行 python app.py。
+"""
+import gc
+import zhibiao
+from app import create_app
+
+application = create_app(warm_up=True)
+# 主进程中预热产生的指标 (加载耗时、缓存未命中等) 在 fork 前写出；工作进程从 0 开始统计，不重复计入
+zhibiao.REGISTRY.flush()
+
+# 预热得到的对象移入永久代：工作进程中的垃圾回收不再遍历它们，
+# 避免改写对象头导致共享的内存页被复制
+gc.freeze()
@@ -0,0 +1,154 @@
+import os
+import gzip
+import json
+import hashlib
+import datetime
+import numpy as np
+import pandas as pd
+from flask import Response, request, has_request_context, g
+from typing import Union
+import zhibiao
+
+# 可选依赖: orjson 直接序列化 numpy 数组 (比逐元素 tolist + json 快得多)，brotli 用于 br 压缩
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小于该字节数的响应不压缩 (压缩收益抵不过开销)
+COMPRESS_MIN_BYTES = int(os.environ.get('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('RESPONSE_BROTLI_QUALITY', 5))
+JSON_MIMETYPE = 'application/json'
+
+
+def _default(obj):
+    """orjson / json 不能直接处理的对象: pandas 时间、Series/Index、numpy 标量与数组。"""
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, (pd.Timestamp, datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return obj.to_numpy()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"无法序列化为 JSON 的类型: {type(obj).__name__}")
+
+
+@zhibiao.timed_stage('serialization')
+def dumps(payload) -> bytes:
+    """
+    把响应数据序列化为 UTF-8 JSON 字节串。numpy 数组直接序列化，不再逐元素转换为 Python 列表；
+    orjson 把 NaN/Inf 输出为 null。未安装 orjson 时退回标准库 json (数组先转换为列表)。
+    """
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_default, ensure_ascii=False).encode('utf-8')
+
+
+def wants_columnar() -> bool:
+    """请求是否要求列式结果 (?columnar=1)：时间轴为毫秒时间戳数组，数值为数组而非逐点对象。"""
+    return has_request_context() and request.args.get('columnar', '').lower() in ('1', 'true', 'yes')
+
+
+def negotiate_encoding() -> Union[str, None]:
+    """根据 Accept-Encoding 选择压缩方式: br (需安装 brotli) 或 gzip，同等权重时优先 br。"""
+    if not has_request_context():
+        return None
+    accepted = request.accept_encodings
+    candidates = [(accepted.quality('gzip'), 0, 'gzip')]
+    if brotli is not None:
+        candidates.append((accepted.quality('br'), 1, 'br'))
+    quality, _, encoding = max(candidates)
+    return encoding if quality > 0 else None
+
+
+def json_bytes_response(body: Union[bytes, str], status_code: int = 200) -> Response:
+    """把已序列化的 JSON 包装为响应，按 Accept-Encoding 压缩较大的响应体。"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    response = Response(body, status=status_code, mimetype=JSON_MIMETYPE)
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encoding = negotiate_encoding()
+        if encoding is not None:
+            with zhibiao.stage_timer('compression'):
+                if encoding == 'br':
+                    response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+                else:
+                    response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0))
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def json_response(payload, status_code: int = 200) -> Response:
+    """序列化 payload 并返回 (可能经过压缩的) JSON 响应。"""
+    return json_bytes_response(dumps(payload), status_code)
+
+
+# --- 条件请求 (ETag / If-None-Match) ---
+# 响应的 ETag = 数据版本 + 规范化请求的哈希；压缩后的表示在 ETag 后附加编码名，
+# 以区分同一内容的不同表示 (强 ETag 要求逐字节相同)。
+NOT_MODIFIED_CACHE_CONTROL = 'private, no-cache' # 浏览器可以缓存，但每次使用前都要用 ETag 重新验证
+
+
+def make_etag(*parts) -> str:
+    """由若干部分 (数据版本、请求哈希等) 组成的 ETag 值 (不含引号)。"""
+    raw = "|".join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def request_fingerprint() -> str:
+    """
+    当前请求的规范化哈希：方法、路径、查询参数 (按名称和取值排序) 与 JSON 请求体 (键排序)。
+    参数顺序或 JSON 键顺序不同但内容相同的请求得到相同的哈希。同一请求内只计算一次。
+    """
+    if 'request_fingerprint' in g:
+        return g.request_fingerprint
+    args = sorted(request.args.items(multi=True))
+    body = request.get_json(silent=True) if request.method in ('POST', 'PUT', 'PATCH') else None
+    if orjson is not None:
+        canonical = orjson.dumps([request.method, request.path, args, body],
+                                 option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    else:
+        canonical = json.dumps([request.method, request.path, args, body],
+                               sort_keys=True, ensure_ascii=True, separators=(',', ':')).encode('utf-8')
+    g.request_fingerprint = hashlib.sha1(canonical).hexdigest()
+    return g.request_fingerprint
+
+
+def matching_etag(etag: str) -> Union[str, None]:
+    """返回请求的 If-None-Match 中与该 ETag (或其任一压缩表示) 相同的标签；没有匹配时返回 None。"""
+    if not has_request_context():
+        return None
+    if_none_match = request.if_none_match
+    for tag in (etag, f"{etag}-gzip", f"{etag}-br"):
+        if if_none_match.contains(tag):
+            return tag
+    return None
+
+
+def set_response_etag(response: Response, etag: str) -> Response:
+    """为响应设置强 ETag (按实际的 Content-Encoding 区分表示) 与重新验证的缓存策略。"""
+    encoding = response.headers.get('Content-Encoding')
+    response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    response.headers['Cache-Control'] = NOT_MODIFIED_CACHE_CONTROL
+    return response
+
+
+def not_modified_response(etag: str) -> Response:
+    """304 响应：客户端缓存的表示 (etag 为 matching_etag 的返回值) 仍然有效，不返回响应体。"""
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = NOT_MODIFIED_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,132 @@
+import math
+import time
+import threading
+import contextlib
+from collections import deque
+from logging_config import logger
+
+SERVICE_TIME_SMOOTHING = 0.2 # 服务时间指数移动平均的权重 (新样本所占比例)
+
+
+class AdmissionRejected(RuntimeError):
+    """
+    请求未被接纳。status_code 为 429 (等待队列已满) 或 503 (预计或实际等待时间超过上限)，
+    retry_after 为建议客户端重试前等待的秒数。
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int, endpoint_class: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.endpoint_class = endpoint_class
+
+
+class AdmissionController:
+    """
+    一类接口的准入控制：最多 max_concurrent 个请求同时执行，其余按到达顺序在有界队列中等待。
+    - 队列已满 (max_queue 个请求在等待) 时立即拒绝 (429)；
+    - 按最近请求的平均服务时间估计排队时间，预计超过 max_wait_seconds 时立即拒绝 (503)，不让请求白等；
+    - 排队超过 max_wait_seconds 仍未轮到时放弃等待 (503)。
+    拒绝时的 Retry-After 取估计的排队时间 (没有历史数据时取 max_wait_seconds)。
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait_seconds: float):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.max_wait_seconds = max_wait_seconds
+        self._cond = threading.Condition()
+        self._waiters = deque() # 等待中的请求 (先到先得)
+        self._running = 0
+        self._service_seconds = None # 服务时间的指数移动平均
+        self._stats = {'admitted': 0, 'rejected_queue_full': 0, 'rejected_wait_estimate': 0,
+                       'timed_out': 0, 'queued_total': 0, 'queue_wait_seconds_total': 0.0,
+                       'queue_wait_seconds_max': 0.0}
+
+    def _estimate_wait(self, position: int):
+        # 粗略估计：排在第 position 位的请求需要等待 ceil(position / 并发上限) 个平均服务时间
+        if self._service_seconds is None:
+            return None
+        return self._service_seconds * math.ceil(position / self.max_concurrent)
+
+    def _retry_after(self, position: int) -> int:
+        estimate = self._estimate_wait(position)
+        return max(1, math.ceil(estimate if estimate is not None else self.max_wait_seconds))
+
+    def _reject(self, message: str, status_code: int, counter: str, position: int):
+        self._stats[counter] += 1
+        retry_after = self._retry_after(position)
+        logger.warning(f"[准入控制 {self.name}] {message} (执行中 {self._running}，等待 {len(self._waiters)}，"
+                       f"建议 {retry_after} 秒后重试)")
+        raise AdmissionRejected(message, status_code, retry_after, self.name)
+
+    def acquire(self) -> float:
+        """取得执行名额并返回排队时间 (秒)；未被接纳时抛出 AdmissionRejected。"""
+        enqueued = time.monotonic()
+        with self._cond:
+            if self._running < self.max_concurrent and not self._waiters:
+                self._running += 1
+                self._stats['admitted'] += 1
+                return 0.0
+            position = len(self._waiters) + 1
+            if position > self.max_queue:
+                self._reject("请求过多，等待队列已满，请稍后重试。", 429, 'rejected_queue_full', position)
+            estimate = self._estimate_wait(position)
+            if estimate is not None and estimate > self.max_wait_seconds:
+                self._reject(f"服务繁忙，预计排队 {estimate:.1f} 秒，超过上限 {self.max_wait_seconds:g} 秒。",
+                             503, 'rejected_wait_estimate', position)
+
+            ticket = object()
+            self._waiters.append(ticket)
+            self._stats['queued_total'] += 1
+            deadline = enqueued + self.max_wait_seconds
+            try:
+                while self._waiters[0] is not ticket or self._running >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject(f"服务繁忙，排队超过 {self.max_wait_seconds:g} 秒仍未轮到。",
+                                     503, 'timed_out', len(self._waiters))
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._waiters.remove(ticket)
+                self._cond.notify_all() # 队首可能已变化
+                raise
+            self._waiters.popleft()
+            self._running += 1
+            waited = time.monotonic() - enqueued
+            self._stats['admitted'] += 1
+            self._stats['queue_wait_seconds_total'] += waited
+            self._stats['queue_wait_seconds_max'] = max(self._stats['queue_wait_seconds_max'], waited)
+            self._cond.notify_all() # 还有空闲名额时下一个等待者也可以继续
+            return waited
+
+    def release(self, service_seconds: float = None):
+        """归还执行名额；service_seconds 为本次执行耗时，用于估计后续请求的排队时间。"""
+        with self._cond:
+            self._running -= 1
+            if service_seconds is not None:
+                if self._service_seconds is None:
+                    self._service_seconds = service_seconds
+                else:
+                    self._service_seconds += SERVICE_TIME_SMOOTHING * (service_seconds - self._service_seconds)
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def admit(self):
+        """with controller.admit(): ... —— 在执行名额内运行代码块，结束时归还名额并记录服务时间。"""
+        self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        """配置、当前执行与等待的请求数、接纳与各类拒绝次数、排队时间与平均服务时间。"""
+        with self._cond:
+            return {
+                'max_concurrent': self.max_concurrent, 'max_queue': self.max_queue,
+                'max_wait_seconds': self.max_wait_seconds,
+                'running': self._running, 'queued': len(self._waiters), **self._stats,
+                'service_seconds_avg': self._service_seconds,
+            }
@@ -1,13 +1,29 @@
 import pandas as pd
-from statsmodels.tsa.arima.model import ARIMA
-from statsmodels.tools.sm_exceptions import ConvergenceWarning, ValueWarning
 import joblib
 import os
+import time
 import warnings
+import itertools
+import multiprocessing
+import multiprocessing.util
+import concurrent.futures
+import json
+import threading
+import contextlib
+from collections import OrderedDict, Counter
 import numpy as np
 from logging_config import logger
+import qingxi
+import moxing
+import jizhun
+import zhibiao
 import uuid
-from typing import Union # <--- This was already added, good!
+from typing import Union, TYPE_CHECKING # <--- This was already added, good!
+
+# statsmodels 导入较慢 (连同 scipy/sklearn 约 0.2 秒)，只在真正拟合模型的函数中导入，
+# 使导入本模块 (以及 API 启动) 不必加载它
+if TYPE_CHECKING:
+    from statsmodels.tsa.arima.model import ARIMA
 
 # --- 配置常量 ---
 # 此路径主要用于此脚本的 __main__ 块
@@ -16,10 +32,58 @@ MODEL_SAVE_DIR = 'trained_models' # app.py 也将使用此目录名
 DEFAULT_MODEL_FILENAME = 'arima_crime_model_default.joblib' # app.py 可以将其用作后备
 os.makedirs(MODEL_SAVE_DIR, exist_ok=True)
 
+# 自动定阶 (auto ARIMA) 的默认搜索范围和并行参数
+AUTO_ARIMA_DEFAULTS = {
+    'max_p': 3, 'max_d': 2, 'max_q': 3,
+    'seasonal': False, 'seasonal_period': 12,
+    'max_P': 1, 'max_D': 1, 'max_Q': 1,
+    'criterion': 'aic', # 'aic' 或 'bic'
+    'stepwise': True, # True: 逐步搜索并按信息准则剪枝；False: 完整网格
+    'max_workers': None, # None 表示使用全部 CPU 核心
+    'fit_timeout': 60.0, # 单个候选模型的最长拟合时间 (秒)
+    'max_candidates': 64, # 最多拟合的候选模型数量
+}
+
 # 一致的列名 (必须与 qingxi.py 输出和 app.py 用法匹配)
 TIME_COLUMN_NAME = '发生时间'
 OFFENSE_COLUMN_NAME = 'OFFENSE'
 
+# 批量训练支持的分组方式 -> 分组列
+BATCH_GROUP_COLUMNS = {
+    'offense': qingxi.OFFENSE_COLUMN_NAME,
+    'ward': qingxi.WARD_COLUMN_NAME,
+    'cluster': qingxi.CLUSTER_COLUMN_NAME,
+    'cluster_offense': 'CLUSTER_OFFENSE', # 社区 × 犯罪类型组合，由 batch_train_from_master 生成
+}
+# 批量训练支持的模型类型: ARIMA (逐序列在进程池中拟合) 或向量化基准方法 (所有序列一次拟合)
+MODEL_TYPES = ('arima',) + jizhun.BASELINE_METHODS
+BATCH_MIN_TOTAL_COUNT = 30 # 总记录数低于此值的分组不训练
+DEFAULT_BOUNDARIES_PATH = 'Neighborhood_Clusters.json'
+
+# 滚动起点回测的默认参数
+BACKTEST_DEFAULTS = {
+    'window': 'expanding', # 'expanding': 训练窗口从序列起点开始；'sliding': 固定长度窗口
+    'window_size': 60, # sliding 模式下训练窗口长度 (周期数)
+    'num_folds': 12, # 预测起点个数
+    'step': 1, # 相邻起点间隔 (周期数)
+    'horizon': 12, # 最大预测步长
+    'confidence_levels': [0.8, 0.95], # 计算覆盖率的置信水平
+    'max_workers': None, # None 表示使用全部 CPU 核心
+    'min_folds': 3, # 某预测步长有实际值的折数少于该值时，不报告该步长的指标 (也不计入总体指标)
+}
+BACKTEST_CACHE_MAX_ENTRIES = 4096 # 回测折缓存的条目上限 (每条为一个精简模型产物，约 2KB)
+
+# 已加载模型的进程内 LRU 缓存上限 (数量与内存预算，内存按模型文件大小估算)
+MODEL_CACHE_MAX_COUNT = int(os.environ.get('MODEL_CACHE_MAX_COUNT', 32))
+MODEL_CACHE_MAX_BYTES = int(os.environ.get('MODEL_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+
+# 预测结果缓存: 每个模型只按最大请求步长计算一次预测均值与标准误
+FORECAST_CACHE_MAX_ENTRIES = int(os.environ.get('FORECAST_CACHE_MAX_ENTRIES', 128))
+FORECAST_CACHE_MIN_STEPS = 24 # 首次计算时至少预测这么多步，避免步长小幅增加就重新计算
+
+# 预热时预先加载的模型数 (按本进程内的使用次数、默认模型、最近训练时间排序，不超过模型缓存上限)
+WARM_UP_MODEL_COUNT = int(os.environ.get('WARM_UP_MODEL_COUNT', 4))
+
 
 def load_and_prepare_data(file_path: str,
                           time_column: str = TIME_COLUMN_NAME, # 使用一致的默认值
@@ -27,7 +91,8 @@ def load_and_prepare_data(file_path: str,
                           value_column: str = OFFENSE_COLUMN_NAME) -> pd.Series: # value_column 用于上下文（如果需要），实际使用 .size()
     logger.info(f"开始从 '{file_path}' 加载并准备时间序列数据，时间列: '{time_column}', 重采样频率: {resample_freq}...")
     try:
-        df = pd.read_csv(file_path) # parse_dates 在检查列存在后处理
+        with zhibiao.stage_timer('csv_read'):
+            df = pd.read_csv(file_path) # parse_dates 在检查列存在后处理
         if df.empty:
             logger.warning(f"文件 '{file_path}' 为空。返回空时间序列。")
             return pd.Series(dtype='float64')
@@ -36,7 +101,8 @@ def load_and_prepare_data(file_path: str,
             logger.error(f"时间列 '{time_column}' 在文件 '{file_path}' 中未找到。返回空时间序列。")
             return pd.Series(dtype='float64')
 
-        df[time_column] = pd.to_datetime(df[time_column], errors='coerce')
+        with zhibiao.stage_timer('date_parse'):
+            df[time_column] = pd.to_datetime(df[time_column], errors='coerce')
         df.dropna(subset=[time_column], inplace=True) # 删除日期转换失败的行
 
         if df.empty: # 日期转换和 dropna 后再次检查
@@ -48,7 +114,8 @@ def load_and_prepare_data(file_path: str,
         df.sort_index(inplace=True)
 
         # 通过计算每个周期的记录数来进行聚合
-        time_series = df.resample(resample_freq).size()
+        with zhibiao.stage_timer('resample'):
+            time_series = df.resample(resample_freq).size()
         time_series = time_series.astype(float).fillna(0.0) # 确保为 float 类型并填充重采样可能产生的 NaN
 
         if time_series.empty:
@@ -68,7 +135,10 @@ def load_and_prepare_data(file_path: str,
 def train_arima_model(ts_data: pd.Series,
                       order: tuple,
                       model_filename: str, # 仅文件名，例如 "my_model.joblib"
-                      model_save_dir: str = MODEL_SAVE_DIR) -> Union[ARIMA, None]:
+                      model_save_dir: str = MODEL_SAVE_DIR,
+                      seasonal_order: tuple = (0, 0, 0, 0),
+                      start_params=None, # 热启动: 上一次拟合的参数
+                      data_source: dict = None) -> Union['ARIMA', None]: # 记录在模型产物中的训练数据来源 (筛选条件等)
     if ts_data.empty:
         logger.error("输入的时间序列为空，无法训练模型。")
         return None
@@ -78,6 +148,8 @@ def train_arima_model(ts_data: pd.Series,
 
     # 检查是否有足够的数据点
     min_required_length = sum(order) + order[1] + 5 # 一个启发式规则
+    if seasonal_order and seasonal_order[3] > 1:
+        min_required_length += (seasonal_order[0] + seasonal_order[1] + seasonal_order[2]) * seasonal_order[3]
     if len(ts_data) < min_required_length:
         logger.error(f"数据点过少 ({len(ts_data)})，不足以稳定地以阶数 {order} 训练ARIMA模型。至少需要约 {min_required_length} 个点。")
         return None
@@ -86,7 +158,7 @@ def train_arima_model(ts_data: pd.Series,
     os.makedirs(model_save_dir, exist_ok=True)
     full_model_path = os.path.join(model_save_dir, model_filename)
 
-    logger.info(f"开始训练ARIMA模型，阶数: {order}，数据点: {len(ts_data)}。模型将保存至: {full_model_path}")
+    logger.info(f"开始训练ARIMA模型，阶数: {order}，季节阶数: {seasonal_order}，数据点: {len(ts_data)}。模型将保存至: {full_model_path}")
 
     try:
         # 如果可能，确保序列设置了频率
@@ -102,6 +174,9 @@ def train_arima_model(ts_data: pd.Series,
                     logger.warning("时间序列索引中存在重复项。可能导致无法推断频率或影响模型。")
                 logger.warning("无法推断时间序列频率。模型训练可能失败或结果不准确。请确保数据已正确按频率聚合。")
 
+        from statsmodels.tsa.arima.model import ARIMA
+        from statsmodels.tools.sm_exceptions import ConvergenceWarning, ValueWarning
+
         # 抑制 ARIMA 拟合过程中的常见警告
         with warnings.catch_warnings():
             warnings.simplefilter('ignore', ConvergenceWarning)
@@ -109,9 +184,10 @@ def train_arima_model(ts_data: pd.Series,
             warnings.simplefilter('ignore', FutureWarning)
             warnings.simplefilter('ignore', ValueWarning) # 捕获 "A date index has been provided, but it has no associated frequency"
 
-            model = ARIMA(ts_data, order=order, missing='drop', # 'drop' NaNs（如果还有的话）
+            model = ARIMA(ts_data, order=order, seasonal_order=seasonal_order, missing='drop', # 'drop' NaNs（如果还有的话）
                           enforce_stationarity=False, enforce_invertibility=False)
-            fitted_model = model.fit()
+            with zhibiao.stage_timer('arima_fit'):
+                fitted_model = model.fit(start_params=start_params)
 
         logger.info(f"ARIMA模型训练完成。")
         try: # 如果可用，尝试记录摘要
@@ -122,7 +198,8 @@ def train_arima_model(ts_data: pd.Series,
             logger.debug(f"无法获取完整模型摘要: {summary_ex}")
 
 
-        joblib.dump(fitted_model, full_model_path)
+        moxing.save_model_artifact(fitted_model, full_model_path, data_source) # 精简产物，无法精简时保存完整模型
+        invalidate_model_cache(full_model_path)
         logger.info(f"模型已成功保存至: {full_model_path}")
         return fitted_model
 
@@ -130,21 +207,1069 @@ def train_arima_model(ts_data: pd.Series,
         logger.error(f"训练ARIMA模型 (阶数={order}, 数据点={len(ts_data)}, 频率={current_freq}) 时发生错误: {e}", exc_info=True)
         return None
 
-def load_arima_model(model_filename: str, model_save_dir: str = MODEL_SAVE_DIR):
+# --- 自动定阶 (auto ARIMA) ---
+def _with_inferred_freq(ts_data: pd.Series) -> pd.Series:
+    """与 train_arima_model 相同的频率处理：索引没有频率时尝试推断并设置。"""
+    if ts_data.index.freq is None:
+        inferred_freq = pd.infer_freq(ts_data.index)
+        if inferred_freq:
+            ts_data = ts_data.asfreq(inferred_freq)
+    return ts_data
+
+def _fit_candidate(ts_data: pd.Series, order: tuple, seasonal_order: tuple) -> dict:
+    """在工作进程中拟合单个候选模型，只返回信息准则等统计量 (不返回模型对象以减少进程间传输)。"""
+    from statsmodels.tsa.arima.model import ARIMA
+    started = time.perf_counter()
+    result = {'order': list(order), 'seasonal_order': list(seasonal_order), 'aic': None, 'bic': None,
+              'status': 'ok', 'error': None}
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            model = ARIMA(ts_data, order=order, seasonal_order=seasonal_order, missing='drop',
+                          enforce_stationarity=False, enforce_invertibility=False)
+            fitted = model.fit()
+        if not np.isfinite(fitted.aic):
+            raise ValueError("信息准则不是有限值")
+        result['aic'] = float(fitted.aic)
+        result['bic'] = float(fitted.bic)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    result['fit_seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+def select_differencing_order(ts_data: pd.Series, max_d: int = 2, alpha: float = 0.05) -> int:
+    """用 KPSS 检验逐次差分，返回使序列平稳所需的最小差分阶数 (不超过 max_d)。"""
+    from statsmodels.tsa.stattools import kpss
+    values = ts_data.dropna().values.astype(float)
+    for d in range(max_d + 1):
+        if len(values) < 8 or np.all(values == values[0]):
+            return d
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            p_value = kpss(values, regression='c', nlags='auto')[1]
+        if p_value >= alpha:
+            return d
+        values = np.diff(values)
+    return max_d
+
+def _worker_ready(_=None) -> int:
+    return os.getpid()
+
+def resolve_max_workers(max_workers=None) -> int:
+    """
+    请求的并行进程数: None 表示全部 CPU 核心；必须是正整数 (布尔值不算)，且不超过 CPU 核心数，
+    避免单个请求启动大量进程。参数无效时抛出 ValueError。
+    拟合进程池在请求之间复用 (见 _lease_fit_pool)，进程数因此不随单次请求的任务数变化。
+    """
+    if max_workers is not None and (isinstance(max_workers, bool) or not isinstance(max_workers, int) or max_workers <= 0):
+        raise ValueError("max_workers 必须是正整数。")
+    cpu_count = os.cpu_count() or 1
+    return max(1, min(max_workers or cpu_count, cpu_count))
+
+def _new_fit_pool(max_workers: int):
+    """
+    创建拟合用的进程池；使用 spawn 启动工作进程，避免在多线程的 Web 进程中 fork。
+    创建后先等待所有工作进程启动完毕，使拟合超时只计算拟合本身的时间。
+    """
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+    list(executor.map(_worker_ready, range(max_workers)))
+    return executor
+
+def _fit_candidates_in_pool(executor, ts_data: pd.Series, candidates: list, fit_timeout: float) -> tuple:
+    """
+    并行拟合一批候选模型 (批大小不超过进程数，因此每个拟合都立即开始计时)。
+    超过 fit_timeout 仍未完成的候选记为 timeout。返回 (结果列表, 是否有超时)。
+    """
+    futures = {executor.submit(_fit_candidate, ts_data, order, seasonal_order): (order, seasonal_order)
+               for order, seasonal_order in candidates}
+    done, not_done = concurrent.futures.wait(futures, timeout=fit_timeout)
+    results = []
+    for future in done:
+        try:
+            results.append(future.result())
+        except Exception as e: # 例如工作进程异常退出 (BrokenProcessPool)
+            order, seasonal_order = futures[future]
+            results.append({'order': list(order), 'seasonal_order': list(seasonal_order), 'aic': None, 'bic': None,
+                            'status': 'failed', 'error': str(e), 'fit_seconds': None})
+    for future in not_done:
+        future.cancel()
+        order, seasonal_order = futures[future]
+        results.append({'order': list(order), 'seasonal_order': list(seasonal_order), 'aic': None, 'bic': None,
+                        'status': 'timeout', 'error': f"拟合超过 {fit_timeout} 秒", 'fit_seconds': fit_timeout})
+    return results, bool(not_done)
+
+def _stop_pool(executor, force: bool):
+    """关闭进程池；若有超时的拟合仍在运行则强制终止工作进程。"""
+    # ProcessPoolExecutor 没有公开的终止接口；shutdown() 会清空 _processes，须在此之前取出工作进程
+    processes = list((getattr(executor, '_processes', None) or {}).values())
+    executor.shutdown(wait=not force, cancel_futures=True)
+    if force:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+# 拟合进程池在请求之间复用 (见 _lease_fit_pool)，省去每次 spawn 工作进程并重新导入 statsmodels 的开销
+_shared_fit_pool = {'executor': None, 'max_workers': 0, 'finalizer_registered': False}
+_shared_fit_pool_lock = threading.Lock()
+
+class _FitPoolLease:
+    """_lease_fit_pool 借出的进程池；recycle() 强制终止当前进程池 (例如有超时的拟合仍在运行) 并换一个新池。"""
+
+    def __init__(self, executor, max_workers: int):
+        self.executor = executor
+        self.max_workers = max_workers
+
+    def recycle(self):
+        _stop_pool(self.executor, force=True)
+        self.executor = _new_fit_pool(self.max_workers)
+
+@contextlib.contextmanager
+def _lease_fit_pool(max_workers: int):
+    """
+    借用 max_workers 个进程的拟合进程池。模块级的共享池同一时间只借给一个调用方，
+    因此拟合超时只计算拟合本身的时间，超时后也可以直接终止并重建，不会影响其他请求；
+    共享池正被占用时临时新建一个独占池，用完关闭。进程数与共享池不同时按新的进程数重建共享池。
+    """
+    if not _shared_fit_pool_lock.acquire(blocking=False):
+        lease = _FitPoolLease(_new_fit_pool(max_workers), max_workers)
+        try:
+            yield lease
+        finally:
+            _stop_pool(lease.executor, force=False)
+        return
+    try:
+        executor = _shared_fit_pool['executor']
+        if executor is not None and _shared_fit_pool['max_workers'] != max_workers:
+            _stop_pool(executor, force=False)
+            executor = None
+        _shared_fit_pool['executor'] = None # 借出期间出错时不放回状态不明的池
+        if not _shared_fit_pool['finalizer_registered']:
+            # 本函数也会在卸载池或后台任务的子进程中调用：子进程退出时不执行 atexit，
+            # 而是先运行 exitpriority >= 0 的 Finalize 再等待全部子进程，不先关闭进程池就会一直等待空闲的工作进程
+            multiprocessing.util.Finalize(None, shutdown_fit_pool, exitpriority=10)
+            _shared_fit_pool['finalizer_registered'] = True
+        lease = _FitPoolLease(executor or _new_fit_pool(max_workers), max_workers)
+        try:
+            yield lease
+        except BaseException:
+            _stop_pool(lease.executor, force=True)
+            raise
+        if getattr(lease.executor, '_broken', False): # 工作进程异常退出，池不可再用
+            _stop_pool(lease.executor, force=True)
+        else:
+            _shared_fit_pool.update(executor=lease.executor, max_workers=max_workers)
+    finally:
+        _shared_fit_pool_lock.release()
+
+def shutdown_fit_pool():
+    """关闭共享的拟合进程池 (应用退出时调用；正借出的池由借用方在用完时关闭)。"""
+    if not _shared_fit_pool_lock.acquire(timeout=5):
+        return
+    try:
+        executor = _shared_fit_pool['executor']
+        _shared_fit_pool.update(executor=None, max_workers=0)
+    finally:
+        _shared_fit_pool_lock.release()
+    if executor is not None:
+        _stop_pool(executor, force=True)
+
+def validate_auto_config(config: dict = None) -> dict:
+    """
+    合并 AUTO_ARIMA_DEFAULTS 与请求的 auto_config (忽略未知键和 null) 并校验取值，返回完整配置。
+    阶数上限须为非负整数，max_candidates 与 seasonal_period 须为正整数，fit_timeout 须为正数；无效时抛出 ValueError。
+    """
+    if config is not None and not isinstance(config, dict):
+        raise ValueError("auto_config 必须是 JSON 对象。")
+    cfg = dict(AUTO_ARIMA_DEFAULTS)
+    cfg.update({k: v for k, v in (config or {}).items() if k in AUTO_ARIMA_DEFAULTS and v is not None})
+
+    def is_int(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    for key in ('max_p', 'max_d', 'max_q', 'max_P', 'max_D', 'max_Q'):
+        if not is_int(cfg[key]) or cfg[key] < 0:
+            raise ValueError(f"{key} 必须是非负整数。")
+    for key in ('max_candidates', 'seasonal_period'):
+        if not is_int(cfg[key]) or cfg[key] <= 0:
+            raise ValueError(f"{key} 必须是正整数。")
+    if isinstance(cfg['fit_timeout'], bool) or not isinstance(cfg['fit_timeout'], (int, float)) \
+            or not cfg['fit_timeout'] > 0:
+        raise ValueError("fit_timeout 必须是正数 (秒)。")
+    if not isinstance(cfg['seasonal'], bool) or not isinstance(cfg['stepwise'], bool):
+        raise ValueError("seasonal 和 stepwise 必须是布尔值。")
+    cfg['criterion'] = str(cfg['criterion']).lower()
+    if cfg['criterion'] not in ('aic', 'bic'):
+        raise ValueError("criterion 必须是 'aic' 或 'bic'。")
+    resolve_max_workers(cfg['max_workers'])
+    return cfg
+
+def auto_arima_search(ts_data: pd.Series, config: dict = None) -> dict:
+    """
+    在有界的 (p,d,q) 与可选季节 (P,D,Q,m) 网格中搜索 ARIMA 阶数。
+    候选模型在进程池中并行拟合，每个拟合有超时限制；stepwise=True 时从几个初始模型出发，
+    每轮只扩展当前最优模型的相邻阶数，信息准则不再改善即停止 (剪枝)。
+    返回 {"best": {...} | None, "leaderboard": [...按准则升序], "config": {...}}。
+    """
+    cfg = validate_auto_config(config)
+    criterion = cfg['criterion']
+
+    ts_data = _with_inferred_freq(ts_data)
+    d = select_differencing_order(ts_data, max_d=int(cfg['max_d']))
+    seasonal = bool(cfg['seasonal']) and int(cfg['seasonal_period']) > 1
+    m = int(cfg['seasonal_period']) if seasonal else 0
+    D = min(int(cfg['max_D']), 1) if seasonal and len(ts_data) >= 3 * m else 0
+    max_p, max_q = int(cfg['max_p']), int(cfg['max_q'])
+    max_P, max_Q = (int(cfg['max_P']), int(cfg['max_Q'])) if seasonal else (0, 0)
+    logger.info(f"自动定阶: d={d}, 季节性={seasonal} (m={m}, D={D}), 准则={criterion}, 逐步={cfg['stepwise']}")
+
+    def clip(p, q, P, Q):
+        return (min(max(p, 0), max_p), d, min(max(q, 0), max_q)), \
+               ((min(max(P, 0), max_P), D, min(max(Q, 0), max_Q), m) if seasonal else (0, 0, 0, 0))
+
+    if cfg['stepwise']:
+        initial = [(2, 2, 1, 1), (0, 0, 0, 0), (1, 0, 1, 0), (0, 1, 0, 1)]
+        pending = list(dict.fromkeys(clip(*c) for c in initial))
+    else:
+        pending = [clip(p, q, P, Q) for p, q, P, Q in itertools.product(
+            range(max_p + 1), range(max_q + 1), range(max_P + 1), range(max_Q + 1))]
+
+    max_workers = resolve_max_workers(cfg['max_workers'])
+    fit_timeout = float(cfg['fit_timeout'])
+    max_candidates = int(cfg['max_candidates'])
+    results, tried = [], set()
+    with _lease_fit_pool(max_workers) as pool:
+        best_score = np.inf
+        while pending and len(tried) < max_candidates:
+            batch = [c for c in pending if c not in tried][:max_candidates - len(tried)]
+            if not batch:
+                break
+            tried.update(batch)
+            for start in range(0, len(batch), max_workers):
+                wave_results, timed_out = _fit_candidates_in_pool(
+                    pool.executor, ts_data, batch[start:start + max_workers], fit_timeout)
+                results.extend(wave_results)
+                if timed_out:
+                    # 超时的拟合仍占用工作进程，终止并重建进程池
+                    pool.recycle()
+            if not cfg['stepwise']:
+                pending = [c for c in pending if c not in tried]
+                continue
+
+            scored = [r for r in results if r[criterion] is not None]
+            if not scored:
+                break
+            current = min(scored, key=lambda r: r[criterion])
+            if current[criterion] >= best_score:
+                break # 本轮没有改进，停止扩展
+            best_score = current[criterion]
+            (p, _, q), (P, _, Q, _) = current['order'], current['seasonal_order']
+            neighbours = [(p + dp, q + dq, P, Q) for dp, dq in
+                          [(-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, 1), (-1, 1), (1, -1)]]
+            if seasonal:
+                neighbours += [(p, q, P + dP, Q + dQ) for dP, dQ in [(-1, 0), (1, 0), (0, -1), (0, 1)]]
+            pending = list(dict.fromkeys(clip(*c) for c in neighbours))
+
+    ranked = sorted(results, key=lambda r: (r[criterion] is None, r[criterion] if r[criterion] is not None else 0.0))
+    best = ranked[0] if ranked and ranked[0][criterion] is not None else None
+    logger.info(f"自动定阶完成: 共拟合 {len(results)} 个候选模型，最优: {best['order'] if best else None} "
+                f"{best['seasonal_order'] if best else ''}")
+    return {"best": best, "leaderboard": ranked, "config": {**cfg, 'criterion': criterion, 'd': d, 'D': D}}
+
+def train_baseline_model(ts_data: pd.Series, method: str, model_filename: str, model_save_dir: str = MODEL_SAVE_DIR,
+                         params: dict = None, data_source: dict = None):
+    """用向量化基准方法拟合单条序列并保存产物，返回 jizhun.BaselineModel；数据不足等问题抛出 ValueError。"""
+    ts_data = _with_inferred_freq(ts_data.astype(float))
+    artifact = jizhun.build_baseline_artifacts(ts_data.to_frame().T, method, params, data_source)[0]
+    os.makedirs(model_save_dir, exist_ok=True)
     full_model_path = os.path.join(model_save_dir, model_filename)
+    moxing.atomic_dump(artifact, full_model_path)
+    invalidate_model_cache(full_model_path)
+    logger.info(f"基准模型 ({method}) 已保存至: {full_model_path}")
+    return jizhun.BaselineModel(artifact)
+
+FIT_PROGRESS_STEPS = 4 # 训练进度的总步数: 聚合 (调用方)、定阶、拟合与保存、生成摘要
+
+def fit_and_save_model(ts_data: pd.Series, model_type: str, model_filename: str, model_save_dir: str = MODEL_SAVE_DIR,
+                       order: tuple = None, auto_config: dict = None, model_params: dict = None,
+                       data_source: dict = None, progress=None) -> dict:
+    """
+    按 model_type 训练并保存模型 (order 为 None 时自动定阶)，只返回可序列化的摘要，
+    因此可以放在子进程中运行 (见 renwu.run_in_subprocess)。
+    progress(done, FIT_PROGRESS_STEPS, stage) 依次汇报 'order_search' (仅自动定阶)、'fitting'、'summarizing'。
+    参数无效时抛出 ValueError / TypeError，训练失败时抛出 RuntimeError。
+    """
+    report = progress or (lambda done, total=None, stage=None: None)
+    auto_search = None
+    if model_type != 'arima':
+        report(2, FIT_PROGRESS_STEPS, 'fitting')
+        logger.info(f"训练基准模型 ({model_type})，文件名: {model_filename}，参数: {model_params}")
+        trained_model = train_baseline_model(ts_data, model_type, model_filename, model_save_dir,
+                                             params=model_params, data_source=data_source)
+        summary_preview = f"基准模型 {model_type}: " + ", ".join(
+            f"{key}={value}" for key, value in trained_model.params.items()) + f", sigma2={trained_model.sigma2:.4g}"
+        return {"model_summary_preview": summary_preview, "auto_search": None}
+
+    if order is None:
+        logger.info(f"自动定阶训练 ARIMA 模型，文件名: {model_filename}，配置: {auto_config}")
+        report(1, FIT_PROGRESS_STEPS, 'order_search')
+        auto_search = auto_arima_search(ts_data, auto_config)
+        if auto_search['best'] is None:
+            raise RuntimeError("自动定阶未找到可用的候选模型。")
+        report(2, FIT_PROGRESS_STEPS, 'fitting')
+        trained_model = train_arima_model(ts_data, tuple(auto_search['best']['order']), model_filename, model_save_dir,
+                                          seasonal_order=tuple(auto_search['best']['seasonal_order']),
+                                          data_source=data_source)
+    else:
+        logger.info(f"使用阶数 {order} 训练 ARIMA 模型，文件名: {model_filename}")
+        report(2, FIT_PROGRESS_STEPS, 'fitting')
+        trained_model = train_arima_model(ts_data, order, model_filename, model_save_dir, data_source=data_source)
+    if trained_model is None:
+        raise RuntimeError("模型训练失败。请检查服务器日志以获取详细信息。")
+    report(3, FIT_PROGRESS_STEPS, 'summarizing')
+
+    summary_preview = "模型摘要不可用。"
+    if hasattr(trained_model, 'summary'):
+        try:
+            summary_preview = str(trained_model.summary())
+            if len(summary_preview) > 2000: summary_preview = summary_preview[:2000] + "\n... (摘要已截断)"
+        except Exception as e:
+            logger.warning(f"无法检索模型摘要: {e}")
+    return {"model_summary_preview": summary_preview, "auto_search": auto_search}
+
+# --- 用新观测增量更新模型 ---
+def aggregate_master_series(master_csv_path: str, filter_spec: dict = None, resample_freq: Union[str, list] = 'ME',
+                            time_column: str = TIME_COLUMN_NAME) -> Union[pd.Series, dict]:
+    """
+    从主数据 (内存缓存) 按筛选条件取数并按频率计数，空周期补 0。
+    resample_freq 为列表时一次扫描返回 {频率: 序列}。
+    只按时间和案件类型筛选、且频率不细于日时直接由计数立方体求和 (见 qingxi.count_master_days)，不扫描记录。
+    """
+    normalized_spec = qingxi.normalize_filter_spec(filter_spec or {})
+    freqs = resample_freq if isinstance(resample_freq, list) else [resample_freq]
+    aggregated = None
+    if time_column == TIME_COLUMN_NAME:
+        daily = qingxi.count_master_days(master_csv_path, normalized_spec)
+        if daily is not None:
+            with zhibiao.stage_timer('resample'):
+                aggregated = aggregate_daily_counts(daily[0], daily[1], freqs, daily[2])
+            if any(series is None for series in aggregated.values()):
+                aggregated = None
+    if aggregated is None:
+        df = qingxi.filter_master_data(qingxi.load_master_data(master_csv_path), normalized_spec)
+        aggregated = aggregate_timestamps(df[time_column], freqs)
+    return aggregated if isinstance(resample_freq, list) else aggregated[resample_freq]
+
+def update_arima_model(model_filename: str, ts_data: pd.Series, model_save_dir: str = MODEL_SAVE_DIR,
+                       refit: bool = False) -> tuple:
+    """
+    用截至最新的聚合序列 ts_data 更新已保存的模型并覆盖保存。
+    refit=False: 保持已拟合参数不变，只把模型数据边界之后的新周期通过状态空间滤波追加进模型，不重新估计；
+    refit=True: 用模型数据起点之后的完整序列重新拟合，以上一次的参数作为热启动初值。
+    返回 (更新后的模型, 说明字典)。新数据与模型边界不衔接等问题抛出 ValueError；模型不存在时返回 (None, None)。
+    """
+    start = time.time()
+    fitted_model = load_arima_model(model_filename, model_save_dir)
+    if fitted_model is None:
+        return None, None
+    horizon = moxing.model_data_horizon(fitted_model)
+    if horizon['model_type'] != 'arima':
+        raise ValueError(f"基准模型 ({horizon['model_type']}) 不支持增量更新，请直接重新训练 (拟合开销很小)。")
+    if horizon['last_timestamp'] is None or horizon['freq'] is None:
+        raise ValueError("模型没有记录带频率的时间索引，无法增量更新。")
+
+    offset = pd.tseries.frequencies.to_offset(horizon['freq'])
+    ts_data = ts_data.asfreq(offset) if ts_data.index.freq is None else ts_data
+    last_timestamp = pd.Timestamp(horizon['last_timestamp'])
+    new_observations = ts_data[ts_data.index > last_timestamp]
+    if new_observations.empty:
+        raise ValueError(f"没有晚于模型数据边界 {last_timestamp.date()} 的新周期。")
+    if new_observations.index[0] != last_timestamp + offset:
+        raise ValueError(f"新数据从 {new_observations.index[0].date()} 开始，与模型数据边界 {last_timestamp.date()} 之间存在缺口。")
+
+    full_model_path = os.path.join(model_save_dir, model_filename)
+    data_source = horizon.get('data_source')
+    if refit:
+        history = ts_data[ts_data.index >= pd.Timestamp(horizon['first_timestamp'])]
+        updated_model = train_arima_model(history, tuple(horizon['order']), model_filename, model_save_dir,
+                                          seasonal_order=tuple(horizon['seasonal_order']),
+                                          start_params=moxing.model_params(fitted_model), data_source=data_source)
+        if updated_model is None:
+            raise ValueError("热启动重新拟合失败，详见服务器日志。")
+    else:
+        with zhibiao.stage_timer('arima_update'):
+            updated_model = moxing.extend_model(fitted_model, new_observations)
+        moxing.save_model_artifact(updated_model, full_model_path, data_source)
+        invalidate_model_cache(full_model_path)
+
+    info = {
+        'previous_horizon': last_timestamp.isoformat(),
+        'new_horizon': new_observations.index[-1].isoformat(),
+        'periods_added': len(new_observations),
+        'refit': refit,
+        'seconds': round(time.time() - start, 3),
+    }
+    logger.info(f"模型 '{model_filename}' 已更新: {info}")
+    return updated_model, info
+
+# --- 按分组批量训练 ---
+def build_group_series_matrix(df: pd.DataFrame, group_column: str, resample_freq: str = 'ME',
+                              time_column: str = TIME_COLUMN_NAME) -> pd.DataFrame:
+    """
+    一次 groupby 同时按分组和时间周期计数，返回 (分组 × 周期) 的计数矩阵；
+    所有分组共享同一个完整的周期索引，缺失周期补 0。
+    """
+    df = df.dropna(subset=[group_column, time_column])
+    if df.empty:
+        return pd.DataFrame(dtype=float)
+    group_keys = df[group_column]
+    if pd.api.types.is_float_dtype(group_keys) and np.all(np.mod(group_keys.values, 1) == 0):
+        group_keys = group_keys.astype('int64') # 例如 WARD 读入为 1.0 时仍按 "1" 分组
+    counts = df.groupby([group_keys.astype(str), pd.Grouper(key=time_column, freq=resample_freq)]).size()
+    matrix = counts.unstack(fill_value=0)
+    full_index = pd.date_range(matrix.columns.min(), matrix.columns.max(), freq=resample_freq)
+    matrix = matrix.reindex(columns=full_index, fill_value=0).astype(float)
+    logger.info(f"已构建 {matrix.shape[0]} 个分组 × {matrix.shape[1]} 个周期的计数矩阵 (频率: {resample_freq})。")
+    return matrix
+
+def group_model_filename(filename_prefix: str, group_by: str, group_value) -> str:
+    """批量训练中单个分组模型的文件名。"""
+    safe_value = str(group_value).upper().replace('/', '_').replace(' ', '_').replace('\\', '_').replace('|', '__')
+    return f"{filename_prefix}_{group_by}_{safe_value}.joblib"
+
+def _train_group_model(group_value, ts_data: pd.Series, order: tuple, seasonal_order: tuple,
+                       model_filename: str, model_save_dir: str) -> dict:
+    """在工作进程中训练并保存单个分组的模型，只返回拟合统计量。"""
+    started = time.perf_counter()
+    fitted = train_arima_model(ts_data, order, model_filename, model_save_dir, seasonal_order=seasonal_order)
+    entry = {
+        'group': str(group_value),
+        'model_filename': model_filename,
+        'status': 'ok' if fitted is not None else 'failed',
+        'nobs': int(len(ts_data)),
+        'total_count': float(ts_data.sum()),
+        'aic': None, 'bic': None,
+    }
+    if fitted is not None:
+        entry['aic'] = float(fitted.aic) if np.isfinite(fitted.aic) else None
+        entry['bic'] = float(fitted.bic) if np.isfinite(fitted.bic) else None
+    entry['fit_seconds'] = round(time.perf_counter() - started, 3)
+    return entry
+
+def _batch_fit_baselines(matrix: pd.DataFrame, tasks: list, method: str, model_params: dict,
+                         model_save_dir: str) -> list:
+    """对所有待训练分组一次性向量化拟合基准方法并逐个保存产物，返回清单条目。"""
+    started = time.perf_counter()
+    group_values = [group_value for group_value, _, _ in tasks]
+    artifacts = jizhun.build_baseline_artifacts(matrix.loc[group_values], method, model_params)
+    fit_seconds = round((time.perf_counter() - started) / len(tasks), 6)
+    entries = []
+    for (group_value, ts_data, filename), artifact in zip(tasks, artifacts):
+        full_model_path = os.path.join(model_save_dir, filename)
+        moxing.atomic_dump(artifact, full_model_path)
+        invalidate_model_cache(full_model_path)
+        entries.append({'group': str(group_value), 'model_filename': filename, 'status': 'ok',
+                        'nobs': int(len(ts_data)), 'total_count': float(ts_data.sum()),
+                        'aic': None, 'bic': None, 'sigma2': artifact['sigma2'], 'fit_seconds': fit_seconds})
+    return entries
+
+def batch_train_models(df: pd.DataFrame, group_by: str, order: tuple, resample_freq: str = 'ME',
+                       seasonal_order: tuple = (0, 0, 0, 0), model_save_dir: str = MODEL_SAVE_DIR,
+                       filename_prefix: str = 'batch', max_workers: int = None,
+                       min_total_count: int = BATCH_MIN_TOTAL_COUNT, progress=None,
+                       model_type: str = 'arima', model_params: dict = None) -> dict:
+    """
+    按分组 (offense / ward / cluster / cluster_offense) 批量训练模型：先一次性构建所有分组的时间序列，
+    ARIMA 在进程池中逐序列并行拟合 (进程数不超过 CPU 核心数)；基准方法对整个矩阵一次拟合。
+    结束后在 model_save_dir 写出清单 (manifest)。
+    df 需已包含分组列 (cluster 分组需先调用 qingxi.assign_neighborhood_clusters)。
+    """
+    if group_by not in BATCH_GROUP_COLUMNS:
+        raise ValueError(f"不支持的分组方式 '{group_by}'。可选: {', '.join(BATCH_GROUP_COLUMNS)}")
+    if model_type not in MODEL_TYPES:
+        raise ValueError(f"不支持的模型类型 '{model_type}'。可选: {', '.join(MODEL_TYPES)}")
+    group_column = BATCH_GROUP_COLUMNS[group_by]
+    if group_column not in df.columns:
+        raise ValueError(f"数据中缺少分组列 '{group_column}'。")
+
+    matrix = build_group_series_matrix(df, group_column, resample_freq)
+    os.makedirs(model_save_dir, exist_ok=True)
+    entries = []
+    tasks = []
+    for group_value, row in matrix.iterrows():
+        if row.sum() < min_total_count:
+            entries.append({'group': str(group_value), 'model_filename': None, 'status': 'skipped',
+                            'nobs': int(len(row)), 'total_count': float(row.sum()),
+                            'aic': None, 'bic': None, 'fit_seconds': 0.0})
+            continue
+        ts_data = row.copy()
+        ts_data.index.freq = matrix.columns.freq
+        tasks.append((group_value, ts_data, group_model_filename(filename_prefix, group_by, group_value)))
+
+    total = len(tasks)
+    if progress:
+        progress(0, total)
+    started = time.perf_counter()
+    if model_type != 'arima' and tasks:
+        entries.extend(_batch_fit_baselines(matrix, tasks, model_type, model_params, model_save_dir))
+        if progress:
+            progress(total, total)
+        tasks = []
+    max_workers = max(1, min(int(max_workers or os.cpu_count() or 1), os.cpu_count() or 1, max(total, 1)))
+    if tasks:
+        logger.info(f"批量训练: {total} 个分组待训练，跳过 {len(entries)} 个，使用 {max_workers} 个进程。")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                    mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(_train_group_model, group_value, ts_data, tuple(order), tuple(seasonal_order),
+                                       filename, model_save_dir): group_value
+                       for group_value, ts_data, filename in tasks}
+            for done_count, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                try:
+                    entries.append(future.result())
+                except Exception as e:
+                    entries.append({'group': str(futures[future]), 'model_filename': None, 'status': 'failed',
+                                    'error': str(e), 'aic': None, 'bic': None})
+                if progress:
+                    progress(done_count, total)
+
+    entries.sort(key=lambda e: e['group'])
+    manifest = {
+        'group_by': group_by,
+        'resample_freq': resample_freq,
+        'model_type': model_type,
+        'model_params': {**jizhun.BASELINE_DEFAULT_PARAMS, **(model_params or {})} if model_type != 'arima' else None,
+        'order': list(order) if model_type == 'arima' else None,
+        'seasonal_order': list(seasonal_order) if model_type == 'arima' else None,
+        'series_start': matrix.columns.min().isoformat() if len(matrix.columns) else None,
+        'series_end': matrix.columns.max().isoformat() if len(matrix.columns) else None,
+        'created_at': pd.Timestamp.now().isoformat(),
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+        'num_trained': sum(1 for e in entries if e['status'] == 'ok'),
+        'num_failed': sum(1 for e in entries if e['status'] == 'failed'),
+        'num_skipped': sum(1 for e in entries if e['status'] == 'skipped'),
+        'models': entries,
+    }
+    manifest_path = os.path.join(model_save_dir, f"{filename_prefix}_{group_by}_manifest.json")
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    manifest['manifest_path'] = manifest_path
+    logger.info(f"批量训练完成: 成功 {manifest['num_trained']}，失败 {manifest['num_failed']}，"
+                f"跳过 {manifest['num_skipped']}。清单: {manifest_path}")
+    return manifest
+
+def batch_train_from_master(master_csv_path: str, group_by: str, order: tuple, filter_spec: dict = None,
+                            boundaries=DEFAULT_BOUNDARIES_PATH, **kwargs) -> dict:
+    """
+    从主数据 (内存缓存) 按筛选条件取数后调用 batch_train_models；cluster 分组时先做社区空间连接。
+    boundaries 为已加载的社区边界 GeoDataFrame 或边界文件路径 (见 qingxi.assign_neighborhood_clusters)。
+    """
+    df_master = qingxi.load_master_data(master_csv_path)
+    df = qingxi.filter_master_data(df_master, qingxi.normalize_filter_spec(filter_spec or {}))
+    if group_by in ('cluster', 'cluster_offense'):
+        df = df.assign(**{qingxi.CLUSTER_COLUMN_NAME: qingxi.assign_neighborhood_clusters(df, boundaries)})
+    if group_by == 'cluster_offense':
+        combined = df[qingxi.CLUSTER_COLUMN_NAME].astype(str) + '|' + df[qingxi.OFFENSE_COLUMN_NAME].astype(str)
+        combined[df[qingxi.CLUSTER_COLUMN_NAME].isna()] = None
+        df = df.assign(**{BATCH_GROUP_COLUMNS['cluster_offense']: combined})
+    return batch_train_models(df, group_by, order, **kwargs)
+
+def batch_cli(argv: list) -> int:
+    """命令行批量训练: python xunlian.py batch --group-by offense --order 1 1 1 [...]"""
+    import argparse
+    parser = argparse.ArgumentParser(prog='xunlian.py batch', description='按分组批量训练 ARIMA 或基准模型')
+    parser.add_argument('--group-by', required=True, choices=sorted(BATCH_GROUP_COLUMNS))
+    parser.add_argument('--model-type', default='arima', choices=MODEL_TYPES)
+    parser.add_argument('--season-length', type=int, default=jizhun.BASELINE_DEFAULT_PARAMS['season_length'])
+    parser.add_argument('--window', type=int, default=jizhun.BASELINE_DEFAULT_PARAMS['window'], help='移动平均窗口')
+    parser.add_argument('--order', type=int, nargs=3, default=[1, 1, 1], metavar=('P', 'D', 'Q'))
+    parser.add_argument('--seasonal-order', type=int, nargs=4, default=[0, 0, 0, 0], metavar=('SP', 'SD', 'SQ', 'M'))
+    parser.add_argument('--freq', default='ME', help='重采样频率，例如 ME / W / D')
+    parser.add_argument('--start-year', type=int)
+    parser.add_argument('--end-year', type=int)
+    parser.add_argument('--offenses', nargs='*')
+    parser.add_argument('--prefix', default='batch', help='模型文件名前缀')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数 (默认: CPU 核心数)')
+    parser.add_argument('--min-count', type=int, default=BATCH_MIN_TOTAL_COUNT)
+    parser.add_argument('--master-csv', default=XUNLIAN_DEFAULT_MASTER_DATA_PATH)
+    parser.add_argument('--boundaries', default=DEFAULT_BOUNDARIES_PATH)
+    parser.add_argument('--model-dir', default=MODEL_SAVE_DIR)
+    args = parser.parse_args(argv)
+
+    filter_spec = {'start_year': args.start_year, 'end_year': args.end_year, 'offenses': args.offenses}
+    try:
+        manifest = batch_train_from_master(
+            args.master_csv, args.group_by, tuple(args.order), filter_spec=filter_spec,
+            boundaries=args.boundaries, resample_freq=args.freq,
+            seasonal_order=tuple(args.seasonal_order), model_save_dir=args.model_dir,
+            filename_prefix=args.prefix, max_workers=args.workers, min_total_count=args.min_count,
+            model_type=args.model_type, model_params={'season_length': args.season_length, 'window': args.window}
+        )
+    except (ValueError, FileNotFoundError) as e:
+        logger.error(f"批量训练失败: {e}")
+        return 1
+    return 0 if manifest['num_failed'] == 0 else 2
+
+# --- 对序列矩阵并行做 ARIMA 预测 (层级预测等使用) ---
+def _forecast_series(ts_data: pd.Series, order: tuple, seasonal_order: tuple, steps: int) -> dict:
+    """在工作进程中拟合单条序列并预测，返回均值、标准误与样本内残差；失败时返回错误信息。"""
+    from statsmodels.tsa.arima.model import ARIMA
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            fitted = ARIMA(ts_data, order=order, seasonal_order=seasonal_order, missing='drop',
+                           enforce_stationarity=False, enforce_invertibility=False).fit()
+            forecast = fitted.get_forecast(steps=steps)
+        return {'mean': np.asarray(forecast.predicted_mean, dtype=float),
+                'se': np.asarray(forecast.se_mean, dtype=float),
+                'resid': np.asarray(fitted.resid, dtype=float)}
+    except Exception as e:
+        return {'error': str(e)}
+
+FALLBACK_MEAN_WINDOW = 12 # ARIMA 拟合失败时退回的近期均值预测所用的期数
+
+def trailing_mean_residuals(values: np.ndarray, window: int = FALLBACK_MEAN_WINDOW) -> np.ndarray:
+    """
+    近期均值预测的样本内一步误差: 第 t 期的误差为 values[t] 减去前 window 期 (不足时取已有各期) 的均值；
+    第 0 期没有可用的历史，误差记为 0。
+    """
+    values = np.asarray(values, dtype=float)
+    residuals = np.zeros(len(values))
+    if len(values) < 2:
+        return residuals
+    cumulative = np.concatenate([[0.0], np.cumsum(values)])
+    t = np.arange(1, len(values))
+    start = np.maximum(t - window, 0)
+    residuals[1:] = values[1:] - (cumulative[t] - cumulative[start]) / (t - start)
+    return residuals
+
+def forecast_arima_matrix(series_matrix: pd.DataFrame, order: tuple, seasonal_order: tuple = (0, 0, 0, 0),
+                          steps: int = 12, max_workers: int = None) -> dict:
+    """
+    对 (序列数 × 周期数) 矩阵的每一行拟合 ARIMA 并预测 steps 步，拟合在进程池中并行执行。
+    返回 {'mean', 'se' (序列数 × steps), 'residuals' (序列数 × 周期数), 'failed' [行号]}；
+    拟合失败的序列退回为最近 FALLBACK_MEAN_WINDOW 期均值，记录在 failed 中。
+    退回序列的残差与标准误取该均值方法本身的样本内一步误差 (见 trailing_mean_residuals)，
+    不用全零残差，以免调和时把退回预测当作几乎没有误差的预测。
+    """
+    num_series, num_periods = series_matrix.shape
+    mean = np.empty((num_series, steps))
+    se = np.empty((num_series, steps))
+    residuals = np.zeros((num_series, num_periods))
+    failed = []
+    max_workers = resolve_max_workers(max_workers)
+    with _lease_fit_pool(max_workers) as pool:
+        futures = {}
+        for i in range(num_series):
+            ts_data = series_matrix.iloc[i].copy()
+            ts_data.index.freq = series_matrix.columns.freq
+            futures[pool.executor.submit(_forecast_series, ts_data, tuple(order), tuple(seasonal_order), steps)] = i
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                result = future.result()
+            except Exception as e: # 例如工作进程异常退出 (BrokenProcessPool)
+                result = {'error': str(e)}
+            if 'error' in result:
+                values = series_matrix.iloc[i].values.astype(float)
+                mean[i] = values[-FALLBACK_MEAN_WINDOW:].mean()
+                residuals[i] = trailing_mean_residuals(values)
+                se[i] = max(float(np.sqrt(np.mean(residuals[i] ** 2))), float(values[-FALLBACK_MEAN_WINDOW:].std()), 1e-6)
+                failed.append(i)
+                logger.warning(f"序列 '{series_matrix.index[i]}' ARIMA 拟合失败，退回均值预测: {result['error']}")
+            else:
+                mean[i], se[i], residuals[i] = result['mean'], result['se'], result['resid']
+    return {'mean': mean, 'se': se, 'residuals': residuals, 'failed': sorted(failed)}
+
+# --- 滚动起点回测 ---
+# 回测折缓存: (序列指纹, 阶数, 季节阶数, 训练起点, 预测起点) -> 精简模型产物 (拟合失败时为错误信息)
+_backtest_fold_cache = OrderedDict()
+_backtest_fold_cache_lock = threading.Lock()
+
+def _series_fingerprint(ts_data: pd.Series) -> str:
+    import hashlib
+    digest = hashlib.sha1(np.asarray(ts_data.index.asi8 if isinstance(ts_data.index, pd.DatetimeIndex)
+                                     else ts_data.index, dtype=np.int64).tobytes())
+    digest.update(np.asarray(ts_data.values, dtype=float).tobytes())
+    return digest.hexdigest()
+
+def _fit_backtest_fold(train_data: pd.Series, order: tuple, seasonal_order: tuple) -> dict:
+    """在工作进程中拟合一个回测折，返回精简模型产物 (只含最终状态，传回主进程的数据量很小)。"""
+    from statsmodels.tsa.arima.model import ARIMA
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            fitted = ARIMA(train_data, order=order, seasonal_order=seasonal_order, missing='drop',
+                           enforce_stationarity=False, enforce_invertibility=False).fit()
+        artifact = moxing.build_slim_artifact(fitted)
+        if artifact is None:
+            return {'error': '模型无法转换为精简产物'}
+        return artifact
+    except Exception as e:
+        return {'error': str(e)}
+
+def backtest_fold_origins(num_obs: int, config: dict) -> list:
+    """
+    返回每个回测折的 (训练起点, 预测起点) 下标。预测起点从序列末尾往前按 step 排列，与 horizon 无关，
+    因此增加预测步长时已拟合的折可以复用；末尾的折只评估有实际值的步长。
+    由此第 h 步只有 num_folds - ceil(h / step) + 1 个折有实际值 (步长越长折数越少)，
+    折数少于 min_folds 的步长不报告指标 (见 backtest_metrics)；需要长步长的指标时增加 num_folds。
+    """
+    origins = [num_obs - k * config['step'] for k in range(config['num_folds'], 0, -1)]
+    if config['window'] == 'sliding':
+        folds = [(origin - config['window_size'], origin) for origin in origins]
+    else:
+        folds = [(0, origin) for origin in origins]
+    return [(start, origin) for start, origin in folds if start >= 0 and origin - start >= 8]
+
+def backtest_metrics(actuals: np.ndarray, bands: list, confidence_levels: list, min_folds: int = 1) -> dict:
+    """
+    一次性向量化计算每个预测步长的 MAE、RMSE、MAPE(%) 与各置信水平的区间覆盖率。
+    actuals 为 (折数 x 步长) 矩阵 (无实际值处为 NaN)，bands 为每折 forecast_bands_from_moments 的结果 (失败折为 None)。
+    有效折数少于 min_folds 的步长只报告折数，指标为 None，也不计入总体指标。
+    """
+    num_folds, horizon = actuals.shape
+    means = np.full((num_folds, horizon), np.nan)
+    lowers = np.full((len(confidence_levels), num_folds, horizon), np.nan)
+    uppers = np.full((len(confidence_levels), num_folds, horizon), np.nan)
+    for k, band in enumerate(bands):
+        if band is not None:
+            means[k] = band['mean']
+            lowers[:, k, :] = band['lower']
+            uppers[:, k, :] = band['upper']
+
+    valid = ~np.isnan(actuals) & ~np.isnan(means)
+    folds_per_horizon = valid.sum(axis=0)
+    valid[:, folds_per_horizon < min_folds] = False
+    errors = np.where(valid, means - actuals, np.nan)
+    abs_errors = np.abs(errors)
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # 某步长全部为 NaN 时 nanmean 的警告
+        ape = np.where(valid & (actuals != 0), abs_errors / np.abs(actuals), np.nan)
+        covered = np.where(valid, (actuals >= lowers) & (actuals <= uppers), np.nan)
+        per_horizon = {
+            'num_folds': folds_per_horizon,
+            'mae': np.nanmean(abs_errors, axis=0),
+            'rmse': np.sqrt(np.nanmean(errors ** 2, axis=0)),
+            'mape': 100 * np.nanmean(ape, axis=0),
+            'coverage': np.nanmean(covered, axis=1),
+        }
+        overall = {
+            'mae': float(np.nanmean(abs_errors)) if valid.any() else None,
+            'rmse': float(np.sqrt(np.nanmean(errors ** 2))) if valid.any() else None,
+            'mape': float(100 * np.nanmean(ape)) if np.any(~np.isnan(ape)) else None,
+            'coverage': [float(np.nanmean(c)) if valid.any() else None for c in covered],
+        }
+
+    def to_list(values):
+        return [None if not np.isfinite(v) else float(v) for v in values]
+
+    return {
+        'per_horizon': {
+            'num_folds': per_horizon['num_folds'].tolist(),
+            'mae': to_list(per_horizon['mae']),
+            'rmse': to_list(per_horizon['rmse']),
+            'mape': to_list(per_horizon['mape']),
+            'coverage': {str(level): to_list(per_horizon['coverage'][i]) for i, level in enumerate(confidence_levels)},
+        },
+        'overall': {
+            'mae': overall['mae'],
+            'rmse': overall['rmse'],
+            'mape': overall['mape'],
+            'coverage': {str(level): overall['coverage'][i] for i, level in enumerate(confidence_levels)},
+        },
+    }
+
+def rolling_origin_backtest(ts_data: pd.Series, candidates: list, config: dict = None) -> dict:
+    """
+    对每个候选 (order, seasonal_order) 做滚动起点回测 (expanding 或 sliding 窗口)。
+    所有 (候选, 折) 的拟合在进程池中并行执行；每折只保存拟合后的最终状态 (精简产物) 并缓存，
+    更换预测步长、置信水平或指标时直接从缓存状态递推预测，不再重新拟合。
+    返回 {"config", "folds": [...预测起点], "results": [...按总体 RMSE 升序]}。
+    """
+    config = {**BACKTEST_DEFAULTS, **(config or {})}
+    if config['window'] not in ('expanding', 'sliding'):
+        raise ValueError("window 必须是 'expanding' 或 'sliding'。")
+    for key in ('window_size', 'num_folds', 'step', 'horizon', 'min_folds'):
+        if isinstance(config[key], bool) or not isinstance(config[key], int) or config[key] <= 0:
+            raise ValueError(f"{key} 必须是正整数。")
+    if any(isinstance(level, bool) for level in config['confidence_levels']):
+        raise ValueError("confidence_levels 必须是 (0, 1) 之间的小数列表。")
+    confidence_levels = [float(level) for level in config['confidence_levels']]
+    if not confidence_levels or not all(0 < level < 1 for level in confidence_levels):
+        raise ValueError("confidence_levels 必须是 (0, 1) 之间的小数列表。")
+    resolve_max_workers(config['max_workers']) # 先校验，避免在查询缓存之后才报错
+    candidates = [(tuple(map(int, order)), tuple(map(int, seasonal_order))) for order, seasonal_order in candidates]
+    if not candidates:
+        raise ValueError("至少需要一个候选模型。")
+
+    ts_data = _with_inferred_freq(ts_data.astype(float))
+    values = ts_data.values
+    folds = backtest_fold_origins(len(ts_data), config)
+    if not folds:
+        raise ValueError(f"序列长度 ({len(ts_data)}) 不足以按当前窗口设置构造回测折。")
+    horizon = config['horizon']
+    fingerprint = _series_fingerprint(ts_data)
+
+    # 先查缓存，只把缺失的 (候选, 折) 提交到进程池
+    artifacts = {}
+    missing = []
+    with _backtest_fold_cache_lock:
+        for candidate in candidates:
+            for start, origin in folds:
+                key = (fingerprint, candidate[0], candidate[1], start, origin)
+                if key in _backtest_fold_cache:
+                    _backtest_fold_cache.move_to_end(key)
+                    artifacts[key] = _backtest_fold_cache[key]
+                else:
+                    missing.append(key)
+    zhibiao.CACHE_REQUESTS.inc(len(artifacts), cache='backtest_fold', result='hit')
+    zhibiao.CACHE_REQUESTS.inc(len(missing), cache='backtest_fold', result='miss')
+
+    started = time.time()
+    if missing:
+        max_workers = resolve_max_workers(config['max_workers'])
+        logger.info(f"回测: {len(candidates)} 个候选 x {len(folds)} 折，需拟合 {len(missing)} 个 (进程数 {max_workers})。")
+        with _lease_fit_pool(max_workers) as pool:
+            futures = {}
+            for key in missing:
+                _, order, seasonal_order, start, origin = key
+                futures[pool.executor.submit(_fit_backtest_fold, ts_data.iloc[start:origin], order, seasonal_order)] = key
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    artifacts[futures[future]] = future.result()
+                except Exception as e: # 例如工作进程异常退出 (BrokenProcessPool)
+                    artifacts[futures[future]] = {'error': str(e)}
+        with _backtest_fold_cache_lock:
+            for key in missing:
+                _backtest_fold_cache[key] = artifacts[key]
+            while len(_backtest_fold_cache) > BACKTEST_CACHE_MAX_ENTRIES:
+                _backtest_fold_cache.popitem(last=False)
+
+    # 实际值矩阵: 第 k 折的第 h 步对应 values[origin + h]，超出序列末尾为 NaN
+    positions = np.array([origin for _, origin in folds])[:, np.newaxis] + np.arange(horizon)
+    padded = np.concatenate([values, np.full(horizon, np.nan)])
+    actuals = padded[positions]
+
+    results = []
+    for order, seasonal_order in candidates:
+        bands = []
+        failed = 0
+        for start, origin in folds:
+            artifact = artifacts[(fingerprint, order, seasonal_order, start, origin)]
+            if not moxing.is_slim_artifact(artifact):
+                bands.append(None)
+                failed += 1
+                continue
+            moments = compute_forecast_moments(moxing.SlimArimaResults(artifact), horizon)
+            bands.append(forecast_bands_from_moments(moments, horizon, confidence_levels))
+        metrics = backtest_metrics(actuals, bands, confidence_levels, config['min_folds'])
+        results.append({'order': list(order), 'seasonal_order': list(seasonal_order),
+                        'failed_folds': failed, **metrics})
+    results.sort(key=lambda r: (r['overall']['rmse'] is None, r['overall']['rmse'] or 0))
+
+    logger.info(f"回测完成: 拟合 {len(missing)} 个，缓存命中 {len(candidates) * len(folds) - len(missing)} 个，"
+                f"用时 {time.time() - started:.1f}s。")
+    return {
+        'config': {**config, 'confidence_levels': confidence_levels},
+        'folds': [{'train_start': ts_data.index[start].isoformat(), 'train_end': ts_data.index[origin - 1].isoformat()}
+                  for start, origin in folds],
+        'fits_computed': len(missing),
+        'results': results,
+    }
+
+# 进程内模型缓存: 绝对路径 -> (文件指纹, 模型对象, 估算字节数)，按最近使用顺序排列
+_model_cache = OrderedDict()
+_model_cache_lock = threading.Lock()
+_model_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+_model_usage = Counter() # 绝对路径 -> 本进程内的使用次数 (加载或命中预测缓存)，预热时据此选择模型
+
+def _model_file_fingerprint(full_model_path: str) -> Union[tuple, None]:
+    """模型文件的 (mtime_ns, size)；同名文件被重新训练覆盖后指纹随之变化。文件不存在时返回 None。"""
+    try:
+        stat = os.stat(full_model_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def invalidate_model_cache(full_model_path: str = None):
+    """从缓存中移除指定模型 (传入 None 时清空整个缓存)。"""
+    with _model_cache_lock:
+        if full_model_path is None:
+            _model_cache.clear()
+        else:
+            _model_cache.pop(os.path.abspath(full_model_path), None)
+
+def get_model_cache_stats() -> dict:
+    """返回模型缓存的当前条目数、估算字节数与命中/未命中/淘汰计数。"""
+    with _model_cache_lock:
+        stats = dict(_model_cache_stats)
+        stats['entries'] = len(_model_cache)
+        stats['bytes'] = sum(entry[2] for entry in _model_cache.values())
+    stats['max_entries'] = MODEL_CACHE_MAX_COUNT
+    stats['max_bytes'] = MODEL_CACHE_MAX_BYTES
+    return stats
+
+def _store_in_model_cache(cache_key: str, fingerprint: tuple, model):
+    size_bytes = fingerprint[1]
+    if MODEL_CACHE_MAX_COUNT <= 0 or size_bytes > MODEL_CACHE_MAX_BYTES:
+        return # 缓存被禁用或单个模型已超出预算时不缓存
+    with _model_cache_lock:
+        _model_cache[cache_key] = (fingerprint, model, size_bytes)
+        _model_cache.move_to_end(cache_key)
+        total_bytes = sum(entry[2] for entry in _model_cache.values())
+        while len(_model_cache) > MODEL_CACHE_MAX_COUNT or total_bytes > MODEL_CACHE_MAX_BYTES:
+            evicted_key, evicted = _model_cache.popitem(last=False)
+            total_bytes -= evicted[2]
+            _model_cache_stats['evictions'] += 1
+            logger.debug(f"模型缓存淘汰: {evicted_key}")
+
+def load_arima_model(model_filename: str, model_save_dir: str = MODEL_SAVE_DIR, record_use: bool = True):
+    """
+    加载已保存的模型。结果按 (路径, mtime, 文件大小) 缓存在进程内 LRU 中，
+    重复加载同一模型不再读盘和反序列化；文件被覆盖后自动重新加载。
+    返回的模型对象在请求间共享，调用方不得修改它。
+    record_use=False 时不计入使用次数 (预热加载)。
+    """
+    full_model_path = os.path.join(model_save_dir, model_filename)
+    cache_key = os.path.abspath(full_model_path)
+    fingerprint = _model_file_fingerprint(full_model_path)
+    if fingerprint is None:
+        logger.error(f"模型文件未找到: {full_model_path}")
+        invalidate_model_cache(full_model_path)
+        return None
+
+    with _model_cache_lock:
+        if record_use:
+            _model_usage[cache_key] += 1
+        entry = _model_cache.get(cache_key)
+        if entry is not None and entry[0] == fingerprint:
+            _model_cache.move_to_end(cache_key)
+            _model_cache_stats['hits'] += 1
+            zhibiao.record_cache('model', True)
+            logger.debug(f"模型缓存命中: {full_model_path}")
+            return entry[1]
+        _model_cache_stats['misses'] += 1
+        zhibiao.record_cache('model', False)
+
     logger.info(f"开始从 '{full_model_path}' 加载模型...")
     try:
-        if not os.path.exists(full_model_path):
-            logger.error(f"模型文件未找到: {full_model_path}")
-            return None
-        loaded_model = joblib.load(full_model_path)
+        loaded_object = joblib.load(full_model_path)
+        loaded_model = jizhun.restore_baseline(loaded_object) or moxing.restore_model(loaded_object)
         logger.info(f"模型 '{full_model_path}' 加载成功。")
-        return loaded_model
     except Exception as e:
         logger.error(f"加载模型 '{full_model_path}' 时发生错误: {e}", exc_info=True)
         return None
+    # 以加载前的指纹入缓存：若加载期间文件被覆盖，下次请求会因指纹不符而重新加载
+    _store_in_model_cache(cache_key, fingerprint, loaded_model)
+    return loaded_model
+
+def rank_models_for_warm_up(model_save_dir: str = MODEL_SAVE_DIR) -> list:
+    """
+    目录中模型文件的预热顺序：本进程内使用次数多的在前，其次是默认模型，再按最近训练 (修改) 时间排序。
+    进程刚启动时没有使用记录，即为默认模型加最近训练的模型。
+    """
+    try:
+        entries = [entry for entry in os.scandir(model_save_dir)
+                   if entry.is_file() and not entry.name.startswith('.') and not entry.name.endswith('.tmp')]
+    except OSError:
+        return []
+    with _model_cache_lock:
+        usage = dict(_model_usage)
+    entries.sort(key=lambda entry: (-usage.get(os.path.abspath(entry.path), 0),
+                                    entry.name != DEFAULT_MODEL_FILENAME,
+                                    -entry.stat().st_mtime_ns))
+    return [entry.name for entry in entries]
+
+def warm_model_cache(model_save_dir: str = MODEL_SAVE_DIR, limit: int = None) -> dict:
+    """按 rank_models_for_warm_up 的顺序把前 limit 个模型加载进模型缓存，返回加载结果。"""
+    limit = min(WARM_UP_MODEL_COUNT if limit is None else limit, MODEL_CACHE_MAX_COUNT)
+    loaded, failed = [], []
+    for model_filename in rank_models_for_warm_up(model_save_dir)[:max(limit, 0)]:
+        if load_arima_model(model_filename, model_save_dir, record_use=False) is None:
+            failed.append(model_filename)
+        else:
+            loaded.append(model_filename)
+    return {'loaded': loaded, 'failed': failed, 'memory_bytes': get_model_cache_stats()['bytes']}
+
+# 预测缓存: 模型指纹 -> {'index', 'mean', 'se'}，按最近使用顺序排列
+_forecast_cache = OrderedDict()
+_forecast_cache_lock = threading.Lock()
+
+@zhibiao.timed_stage('forecast')
+def compute_forecast_moments(fitted_model, steps: int) -> dict:
+    """调用一次 get_forecast，返回预测索引、均值和标准误 (numpy 数组)。"""
+    forecast_results = fitted_model.get_forecast(steps=steps)
+    predicted_mean = forecast_results.predicted_mean
+    index = predicted_mean.index if isinstance(predicted_mean, pd.Series) else pd.RangeIndex(len(predicted_mean))
+    return {
+        'index': index,
+        'mean': np.asarray(predicted_mean, dtype=float),
+        'se': np.asarray(forecast_results.se_mean, dtype=float),
+    }
+
+def forecast_bands_from_moments(moments: dict, steps: int, confidence_levels: list) -> dict:
+    """
+    从缓存的均值与标准误一次性向量化地得到任意步长前缀和任意多个置信水平的区间。
+    与 conf_int 一样使用正态分位数；预测值和区间下限截断为非负，上限不低于下限。
+    返回 {'index', 'mean', 'lower' (水平数 x 步长), 'upper'}。
+    """
+    from scipy.stats import norm
+
+    mean = moments['mean'][:steps]
+    se = moments['se'][:steps]
+    levels = np.asarray(confidence_levels, dtype=float)
+    z = norm.ppf(0.5 + levels / 2.0)[:, np.newaxis]
+    lower = np.maximum(mean - z * se, 0)
+    upper = np.maximum(np.maximum(mean + z * se, 0), lower)
+    return {
+        'index': moments['index'][:steps],
+        'mean': np.maximum(mean, 0),
+        'lower': lower,
+        'upper': upper,
+    }
+
+def forecast_saved_model(model_filename: str, steps: int, confidence_levels: list,
+                         model_save_dir: str = MODEL_SAVE_DIR) -> Union[dict, None]:
+    """
+    使用已保存的模型预测 steps 步，并给出多个置信水平 (0~1 之间的小数) 的区间。
+    预测均值与标准误按模型文件指纹缓存；请求步长不超过已缓存步长时不再调用模型。
+    模型文件不存在或加载失败时返回 None。
+    """
+    full_model_path = os.path.join(model_save_dir, model_filename)
+    fingerprint = _model_file_fingerprint(full_model_path)
+    if fingerprint is None:
+        logger.error(f"模型文件未找到: {full_model_path}")
+        return None
+    cache_key = (os.path.abspath(full_model_path),) + fingerprint
+
+    with _forecast_cache_lock:
+        moments = _forecast_cache.get(cache_key)
+        zhibiao.record_cache('forecast', moments is not None and len(moments['mean']) >= steps)
+        if moments is not None and len(moments['mean']) >= steps:
+            _forecast_cache.move_to_end(cache_key)
+            with _model_cache_lock:
+                _model_usage[cache_key[0]] += 1
+            logger.debug(f"预测缓存命中: {full_model_path} ({steps} 步)")
+            return forecast_bands_from_moments(moments, steps, confidence_levels)
+
+    fitted_model = load_arima_model(model_filename, model_save_dir)
+    if fitted_model is None:
+        return None
+    cached_steps = len(moments['mean']) if moments is not None else 0
+    horizon = max(steps, FORECAST_CACHE_MIN_STEPS, 2 * cached_steps)
+    logger.info(f"计算模型 '{model_filename}' 的 {horizon} 步预测并缓存。")
+    moments = compute_forecast_moments(fitted_model, horizon)
+
+    # 计算期间模型文件被覆盖时不缓存，避免旧模型的结果挂在新指纹下
+    if _model_file_fingerprint(full_model_path) == fingerprint and FORECAST_CACHE_MAX_ENTRIES > 0:
+        with _forecast_cache_lock:
+            _forecast_cache[cache_key] = moments
+            _forecast_cache.move_to_end(cache_key)
+            while len(_forecast_cache) > FORECAST_CACHE_MAX_ENTRIES:
+                _forecast_cache.popitem(last=False)
+    return forecast_bands_from_moments(moments, steps, confidence_levels)
 
-# MODIFIED predict_with_model
 def predict_with_model(fitted_model, steps: int, alpha: float = 0.05): # 新增 alpha 参数
     if fitted_model is None:
         logger.error("模型对象为空，无法进行预测。")
@@ -156,22 +1281,13 @@ def predict_with_model(fitted_model, steps: int, alpha: float = 0.05): # 新增
 
     logger.info(f"使用模型进行未来 {steps} 步的预测 (置信水平: {1-alpha:.0%})...") # 显示置信水平
     try:
-        forecast_results = fitted_model.get_forecast(steps=steps)
-        predictions = forecast_results.predicted_mean
-        conf_int_df = forecast_results.conf_int(alpha=alpha) # 获取置信区间 DataFrame
-
-        # 确保预测值和置信区间不为负
-        predictions[predictions < 0] = 0
-        lower_ci = conf_int_df.iloc[:, 0].copy() # 获取置信区间下限
-        upper_ci = conf_int_df.iloc[:, 1].copy() # 获取置信区间上限
-        lower_ci[lower_ci < 0] = 0
-        upper_ci[upper_ci < 0] = 0 # 上限也可能预测为负，尤其是数据稀疏时
-
-        # 确保上限不低于下限 (一个健全性检查)
-        upper_ci = np.maximum(upper_ci, lower_ci)
+        bands = forecast_bands_from_moments(compute_forecast_moments(fitted_model, steps), steps, [1 - alpha])
+        predictions = pd.Series(bands['mean'], index=bands['index'], name='predicted_mean')
+        lower_ci = pd.Series(bands['lower'][0], index=bands['index'])
+        upper_ci = pd.Series(bands['upper'][0], index=bands['index'])
 
         logger.info(f"成功生成预测结果及置信区间。")
-        if isinstance(predictions, pd.Series) and not predictions.empty:
+        if not predictions.empty:
             logger.debug(f"预测均值 (前5条):\n{predictions.head()}")
             logger.debug(f"置信区间下限 (前5条):\n{lower_ci.head()}")
             logger.debug(f"置信区间上限 (前5条):\n{upper_ci.head()}")
@@ -182,54 +1298,140 @@ def predict_with_model(fitted_model, steps: int, alpha: float = 0.05): # 新增
         logger.error(f"使用模型预测时发生错误: {e}", exc_info=True)
         return None, None, None # 返回三个值
 
+def _day_bin_period_codes(freq: str, day_numbers: np.ndarray) -> Union[tuple, None]:
+    """
+    把常用频率映射为每个日桶所属周期的整数编号，以及每个周期的标签 (datetime64[D])。
+    day_numbers 为连续的日编号 (距 1970-01-01 的天数)，编号单调不减。
+    不支持的频率 (倍数频率、非默认锚点、小时等) 返回 None，由调用方退回 resample。
+    """
+    offset = pd.tseries.frequencies.to_offset(freq)
+    if offset.n != 1:
+        return None
+    if isinstance(offset, pd.offsets.Day):
+        return day_numbers, day_numbers.astype('datetime64[D]'), offset
+    if isinstance(offset, pd.offsets.Week) and offset.weekday == 6:
+        # 1970-01-01 是星期四；(天数 + 3) // 7 把周一至周日归为同一周，标签为该周的星期日
+        week_codes = (day_numbers + 3) // 7
+        labels = np.arange(week_codes[0], week_codes[-1] + 1) * 7 + 3
+        return week_codes, labels.astype('datetime64[D]'), offset
+
+    is_period_end = isinstance(offset, (pd.offsets.MonthEnd, pd.offsets.QuarterEnd, pd.offsets.YearEnd))
+    if isinstance(offset, (pd.offsets.MonthEnd, pd.offsets.MonthBegin)):
+        months_per_period = 1
+    elif isinstance(offset, (pd.offsets.QuarterEnd, pd.offsets.QuarterBegin)) and \
+            offset.startingMonth == (12 if is_period_end else 1):
+        months_per_period = 3
+    elif isinstance(offset, (pd.offsets.YearEnd, pd.offsets.YearBegin)) and offset.month == (12 if is_period_end else 1):
+        months_per_period = 12
+    else:
+        return None
+    codes = day_numbers.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) // months_per_period
+    period_months = np.arange(codes[0], codes[-1] + 1) * months_per_period
+    if is_period_end: # 周期末标签 = 下一周期第一天的前一天
+        labels = (period_months + months_per_period).astype('datetime64[M]').astype('datetime64[D]') - np.timedelta64(1, 'D')
+    else:
+        labels = period_months.astype('datetime64[M]').astype('datetime64[D]')
+    return codes, labels, offset
+
+@zhibiao.timed_stage('resample')
+def aggregate_timestamps(timestamps, freqs: list) -> dict:
+    """
+    对同一组时间戳一次性按多个频率计数，返回 {频率: 计数序列 (float，空周期为 0，索引带频率)}。
+    只对全部记录做一次按日 np.bincount，周/月/季/年再由几千个日桶加权 bincount 得到；
+    结果与 resample(freq).size() 一致。
+    """
+    times = pd.DatetimeIndex(timestamps).dropna()
+    if len(times) == 0:
+        return {freq: pd.Series(dtype='float64') for freq in freqs}
+    ticks_per_day = np.timedelta64(1, 'D') // np.timedelta64(1, times.unit) # pandas 3 解析出的精度不一定是纳秒
+    record_days = times.asi8 // ticks_per_day
+    first_day = record_days.min()
+    daily_counts = np.bincount(record_days - first_day).astype(float)
+
+    results = aggregate_daily_counts(first_day, daily_counts, freqs, times.unit)
+    for freq in freqs:
+        if results[freq] is None:
+            results[freq] = pd.Series(1, index=times).resample(freq).size().astype(float)
+    return results
+
+def aggregate_daily_counts(first_day: int, daily_counts: np.ndarray, freqs: list, unit: str = 'ns') -> dict:
+    """
+    由连续的逐日计数 (第一天的日编号为 first_day，首尾日计数非零) 按多个频率汇总，
+    返回 {频率: 计数序列}；无法由日桶得到的频率 (小时、倍数频率等) 对应 None。
+    """
+    if len(daily_counts) == 0:
+        return {freq: pd.Series(dtype='float64') for freq in freqs}
+    day_numbers = first_day + np.arange(len(daily_counts))
+    results = {}
+    for freq in freqs:
+        spec = _day_bin_period_codes(freq, day_numbers)
+        if spec is None:
+            results[freq] = None
+            continue
+        codes, labels, offset = spec
+        counts = np.bincount(codes - codes[0], weights=daily_counts)
+        index = pd.DatetimeIndex(labels.astype(f'datetime64[{unit}]'), freq=offset)
+        results[freq] = pd.Series(counts, index=index)
+    return results
+
 def aggregate_series_from_file(
     filepath: str,
     date_column: str = TIME_COLUMN_NAME,
-    resample_freq: str = 'ME' # 月末 ('MonthEnd')
+    resample_freq: Union[str, list] = 'ME', # 月末 ('MonthEnd')；也可以是频率列表
+    columnar: bool = False
 ) -> Union[dict, None]: # <--- MODIFIED THIS LINE
     """
     从 CSV 文件加载数据，按时间聚合，并以适合图表的格式返回：
     {"timestamps": [...], "values": [...]}.
+    resample_freq 为列表时只读取并解析一次日期列，返回 {"series": {频率: {"timestamps", "values"}}}。
+    columnar=True 时 timestamps 为毫秒时间戳 (见 series_to_chart_payload)。
     """
     logger.info(f"从文件 '{filepath}' 加载并聚合实际数据，频率: {resample_freq}")
+    freqs = resample_freq if isinstance(resample_freq, list) else [resample_freq]
     try:
         if not os.path.exists(filepath):
             logger.error(f"聚合所需的数据文件未找到: {filepath}")
             return None
 
-        df = pd.read_csv(filepath)
-        if df.empty:
-            logger.warning(f"用于聚合的文件 '{filepath}' 为空。")
-            return {"timestamps": [], "values": []}
-
+        with zhibiao.stage_timer('csv_read'):
+            df = pd.read_csv(filepath, usecols=lambda column: column == date_column) # 聚合只需要日期列
         if date_column not in df.columns:
             logger.error(f"日期列 '{date_column}' 在文件 '{filepath}' 中未找到。")
             return None
 
-        df[date_column] = pd.to_datetime(df[date_column], errors='coerce')
-        df.dropna(subset=[date_column], inplace=True)
-
-        if df.empty: # 日期处理后检查
-            logger.warning(f"文件 '{filepath}' 在日期处理后为空 (用于聚合)。")
-            return {"timestamps": [], "values": []}
-
-        df.set_index(date_column, inplace=True)
-        df.sort_index(inplace=True)
-
-        aggregated_series = df.resample(resample_freq).size()
-        aggregated_series = aggregated_series.fillna(0.0) # 填充重采样产生的任何 NaN
-
-        # 准备 JSON 输出
-        timestamps = [ts.isoformat() for ts in aggregated_series.index.to_list()]
-        values = aggregated_series.values.tolist()
-
-        logger.info(f"成功聚合了 {len(timestamps)} 个时间点的实际数据从 '{filepath}'。")
-        return {"timestamps": timestamps, "values": values}
+        with zhibiao.stage_timer('date_parse'):
+            timestamps = pd.to_datetime(df[date_column], errors='coerce')
+        aggregated = aggregate_timestamps(timestamps, freqs)
+        series_payload = {freq: series_to_chart_payload(series, columnar) for freq, series in aggregated.items()}
+        logger.info(f"成功聚合了 {len(df)} 条记录 ({', '.join(freqs)}) 从 '{filepath}'。")
+        if isinstance(resample_freq, list):
+            return {"series": series_payload}
+        return series_payload[resample_freq]
 
     except Exception as e:
         logger.error(f"聚合文件 '{filepath}' 中的数据时出错: {e}", exc_info=True)
         return None
 
+def index_to_iso(index: pd.DatetimeIndex) -> list:
+    """时间索引转换为 ISO 字符串列表 (与 Timestamp.isoformat() 一致)；全为整秒时由 numpy 一次性格式化。"""
+    index = pd.DatetimeIndex(index)
+    ticks_per_second = np.timedelta64(1, 's') // np.timedelta64(1, index.unit)
+    if index.tz is None and not index.hasnans and not np.any(index.asi8 % ticks_per_second):
+        return np.datetime_as_string(index.values, unit='s').tolist()
+    return [ts.isoformat() if ts is not pd.NaT else None for ts in index]
+
+def index_to_epoch_ms(index: pd.DatetimeIndex) -> np.ndarray:
+    """时间索引转换为 Unix 毫秒时间戳 (int64 数组)；无时区的时间按 UTC 解释。"""
+    return pd.DatetimeIndex(index).as_unit('ms').asi8
+
+def series_to_chart_payload(series: pd.Series, columnar: bool = False) -> dict:
+    """
+    把计数序列转换为图表使用的 {"timestamps": [...], "values": [...]}。
+    values 为 numpy 数组，由响应层 (xiangying) 直接序列化；columnar=True 时 timestamps 为毫秒时间戳数组。
+    """
+    timestamps = index_to_epoch_ms(series.index) if columnar else index_to_iso(series.index)
+    return {"timestamps": timestamps, "values": series.to_numpy()}
+
 def evaluate_model(true_values: pd.Series, predictions: pd.Series) -> Union[float, None]:
     # (与您提供的代码相比没有更改，假设其工作正常)
     from sklearn.metrics import mean_squared_error
@@ -245,6 +1447,12 @@ def evaluate_model(true_values: pd.Series, predictions: pd.Series) -> Union[floa
         return None
 
 if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(batch_cli(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        sys.exit(moxing.migrate_cli(sys.argv[2:]))
+
     logger.info("--- 以测试/训练模式运行 xunlian.py ---")
     logger.info(f"独立测试：尝试从主数据文件 '{XUNLIAN_DEFAULT_MASTER_DATA_PATH}' 加载数据...")
 
@@ -0,0 +1,176 @@
+import os
+import time
+import threading
+import traceback
+from logging_config import logger
+from typing import Union
+
+# 预热阶段的状态
+STAGE_PENDING = 'pending'
+STAGE_RUNNING = 'running'
+STAGE_DONE = 'done'
+STAGE_FAILED = 'failed'
+STAGE_SKIPPED = 'skipped' # 依赖的阶段失败，本阶段未运行
+
+# 就绪检查未通过时建议客户端 (负载均衡器) 重试的间隔 (秒)
+READY_RETRY_AFTER_SECONDS = int(os.environ.get('WARM_UP_RETRY_AFTER_SECONDS', 5))
+# 失败阶段的重试退避 (秒)：第 n 次连续失败后等待 BASE * 2^(n-1)，最长 MAX
+STAGE_RETRY_BASE_SECONDS = float(os.environ.get('WARM_UP_STAGE_RETRY_BASE_SECONDS', 5))
+STAGE_RETRY_MAX_SECONDS = float(os.environ.get('WARM_UP_STAGE_RETRY_MAX_SECONDS', 300))
+
+
+def current_rss_bytes() -> Union[int, None]:
+    """当前进程的常驻内存 (字节)，读取 /proc/self/statm；其他平台返回 None。"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class WarmUpScheduler:
+    """
+    按优先级顺序运行的预热阶段。每个阶段记录状态、耗时、构建的数据结构大小与进程内存变化。
+    阶段可以提供 version_func (例如数据文件版本)：版本改变后阶段回到 pending，
+    下次运行只重建过期的阶段，已完成且版本未变的阶段不再重复 (数据重新导入后可继续预热)。
+    失败的阶段按指数退避重试 (见 STAGE_RETRY_BASE_SECONDS)，因依赖失败而跳过的阶段随依赖一起重新排入。
+    阶段函数返回 dict (可含 'memory_bytes')，作为该阶段的详细信息。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._stages = [] # 按优先级排列
+        self._lock = threading.Lock() # 保护阶段状态
+        self._run_lock = threading.Lock() # 同一时间只有一轮预热在运行
+        self._thread = None
+
+    def add_stage(self, name: str, func, version_func=None, required: bool = True, depends_on: tuple = ()):
+        """按优先级追加一个阶段；required=False 的阶段不影响就绪状态 (失败时只记录)。"""
+        self._stages.append({
+            'name': name, 'func': func, 'version_func': version_func,
+            'required': required, 'depends_on': tuple(depends_on),
+            'state': STAGE_PENDING, 'version': None, 'runs': 0,
+            'consecutive_failures': 0, 'retry_at': None,
+            'started_at': None, 'finished_at': None, 'duration_ms': None,
+            'memory_bytes': None, 'rss_bytes': None, 'rss_delta_bytes': None,
+            'details': None, 'error': None,
+        })
+
+    @staticmethod
+    def _current_version(stage: dict):
+        return stage['version_func']() if stage['version_func'] is not None else None
+
+    @staticmethod
+    def retry_delay(consecutive_failures: int) -> float:
+        """第 consecutive_failures 次连续失败后到下次重试的等待时间 (秒)。"""
+        exponent = min(max(consecutive_failures - 1, 0), 30) # 限制指数，避免浮点溢出
+        return min(STAGE_RETRY_BASE_SECONDS * 2 ** exponent, STAGE_RETRY_MAX_SECONDS)
+
+    def refresh(self) -> bool:
+        """
+        把版本已改变的已完成/失败/跳过阶段、已到重试时间的失败阶段，
+        以及依赖被重新排入的跳过阶段重新标记为 pending；返回是否有待运行的阶段。
+        """
+        pending = False
+        requeued = set()
+        now = time.time()
+        for stage in self._stages: # 依赖总是排在被依赖阶段之前 (add_stage 的顺序)
+            version = self._current_version(stage)
+            with self._lock:
+                if stage['state'] in (STAGE_DONE, STAGE_FAILED, STAGE_SKIPPED) and stage['version'] != version:
+                    logger.info(f"[{self.name}] 阶段 '{stage['name']}' 的数据版本已改变，重新排入预热。")
+                    stage.update(state=STAGE_PENDING, consecutive_failures=0, retry_at=None)
+                elif stage['state'] == STAGE_FAILED and stage['retry_at'] is not None and now >= stage['retry_at']:
+                    logger.info(f"[{self.name}] 阶段 '{stage['name']}' 已失败 {stage['consecutive_failures']} 次，重新尝试。")
+                    stage['state'] = STAGE_PENDING
+                elif stage['state'] == STAGE_SKIPPED and requeued.intersection(stage['depends_on']):
+                    stage['state'] = STAGE_PENDING
+                if stage['state'] == STAGE_PENDING:
+                    requeued.add(stage['name'])
+                pending = pending or stage['state'] in (STAGE_PENDING, STAGE_RUNNING)
+        return pending
+
+    def run(self, required_only: bool = False):
+        """
+        在当前线程中按顺序运行所有待运行的阶段；其他线程正在预热时等待其完成后再检查。
+        required_only=True 时只运行影响就绪状态的阶段，其余阶段留待之后 (例如 start() 在后台) 运行。
+        """
+        with self._run_lock:
+            self.refresh()
+            states = {}
+            for stage in self._stages:
+                if stage['state'] != STAGE_PENDING or (required_only and not stage['required']):
+                    states[stage['name']] = stage['state']
+                    continue
+                blocked = [dep for dep in stage['depends_on'] if states.get(dep) != STAGE_DONE]
+                if blocked:
+                    with self._lock:
+                        stage['state'] = STAGE_SKIPPED
+                        stage['version'] = self._current_version(stage)
+                        stage['error'] = f"依赖的阶段未完成: {', '.join(blocked)}"
+                    states[stage['name']] = STAGE_SKIPPED
+                    continue
+                states[stage['name']] = self._run_stage(stage)
+
+    def _run_stage(self, stage: dict) -> str:
+        version = self._current_version(stage) # 以开始前的版本记录：运行期间数据变化时下次会重新运行
+        rss_before = current_rss_bytes()
+        with self._lock:
+            stage.update(state=STAGE_RUNNING, started_at=time.time(), finished_at=None, error=None)
+            stage['runs'] += 1
+        started = time.perf_counter()
+        try:
+            details = stage['func']() or {}
+            state, error = STAGE_DONE, None
+        except Exception as e:
+            logger.error(f"[{self.name}] 预热阶段 '{stage['name']}' 失败: {e}\n{traceback.format_exc()}")
+            details, state, error = {}, STAGE_FAILED, str(e)
+        duration_ms = (time.perf_counter() - started) * 1000
+        rss_after = current_rss_bytes()
+        with self._lock:
+            if state == STAGE_FAILED:
+                stage['consecutive_failures'] += 1
+                stage['retry_at'] = time.time() + self.retry_delay(stage['consecutive_failures'])
+            else:
+                stage.update(consecutive_failures=0, retry_at=None)
+            stage.update(
+                state=state, version=version, finished_at=time.time(), duration_ms=round(duration_ms, 1),
+                memory_bytes=details.pop('memory_bytes', None), details=details or None, error=error,
+                rss_bytes=rss_after,
+                rss_delta_bytes=rss_after - rss_before if rss_after is not None and rss_before is not None else None,
+            )
+        if state == STAGE_DONE:
+            logger.info(f"[{self.name}] 预热阶段 '{stage['name']}' 完成，耗时 {duration_ms:.1f} ms。")
+        else:
+            logger.warning(f"[{self.name}] 预热阶段 '{stage['name']}' 将在 "
+                           f"{self.retry_delay(stage['consecutive_failures']):.1f} 秒后重试。")
+        return state
+
+    def start(self) -> bool:
+        """在后台线程中运行待运行的阶段 (已有预热线程在运行时不重复启动)；返回是否启动了新线程。"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+        if not self.refresh():
+            return False
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._thread = threading.Thread(target=self.run, name=f"{self.name}_warm_up", daemon=True)
+            self._thread.start()
+        return True
+
+    def is_ready(self) -> bool:
+        """所有 required 阶段都已按当前数据版本完成。"""
+        self.refresh()
+        with self._lock:
+            return all(stage['state'] == STAGE_DONE for stage in self._stages if stage['required'])
+
+    def report(self) -> dict:
+        """就绪状态与各阶段的状态、耗时、内存 (按优先级顺序)。"""
+        ready = self.is_ready()
+        with self._lock:
+            stages = [{key: value for key, value in stage.items() if key not in ('func', 'version_func')}
+                      for stage in self._stages]
+            running = self._thread is not None and self._thread.is_alive()
+        return {'ready': ready, 'running': running, 'rss_bytes': current_rss_bytes(), 'stages': stages}
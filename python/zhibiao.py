@@ -0,0 +1,347 @@
+import os
+import re
+import json
+import atexit
+import math
+import time
+import weakref
+import threading
+import functools
+import contextlib
+from logging_config import logger
+
+# 指标注册表，按 Prometheus 文本格式 (0.0.4) 输出 (见 app.py 的 /metrics)。
+# 指标在每个进程内各自统计。多进程部署 (gunicorn --preload --workers N) 时，每次抓取只落到其中一个工作进程，
+# Prometheus 无法分别抓取各工作进程，因此需设置环境变量 PROMETHEUS_MULTIPROC_DIR (与 prometheus_client 的约定相同)：
+# 各进程把自己的值写入该目录下的 metrics_<pid>.json，抓取时汇总目录中所有进程的文件 (见 Registry)。
+# 该目录由同一台主机上的所有工作进程共用，应在启动服务前清空。
+METRIC_PREFIX = 'crime_api_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+MULTIPROC_DIR_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+# 多进程模式下写出本进程指标的最短间隔 (秒)：文件最多每个间隔写一次，抓取到的其他进程的值最多落后这么久
+FLUSH_INTERVAL_SECONDS = float(os.environ.get('METRICS_FLUSH_INTERVAL_SECONDS', 1))
+_SNAPSHOT_FILE_PATTERN = re.compile(r'^metrics_(\d+)\.json$')
+
+# 请求延迟的桶上限 (秒)；热点分析和训练可达数十秒
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 请求内各阶段耗时的桶上限 (秒)；筛选、聚合等热点路径在毫秒以下
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == 'nt': # Windows 上 os.kill 会直接结束进程，无法用来探测
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # 进程存在但属于其他用户
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def _histogram_samples(buckets: list, state: list) -> list:
+    samples, cumulative = [], 0
+    for upper, count in zip(buckets, state):
+        cumulative += count
+        samples.append(('_bucket', {'le': _format_value(upper)}, cumulative))
+    samples.append(('_bucket', {'le': '+Inf'}, state[-1]))
+    samples.append(('_sum', {}, state[-2]))
+    samples.append(('_count', {}, state[-1]))
+    return samples
+
+
+def _render_family(family: dict) -> list:
+    lines = [f"# HELP {family['name']} {family['help']}", f"# TYPE {family['name']} {family['type']}"]
+    for labels, value in family['samples']:
+        labels = dict(labels)
+        if family['type'] == 'histogram':
+            expanded = _histogram_samples(family['buckets'], value)
+        else:
+            expanded = [('', {}, value)]
+        for suffix, extra_labels, sample in expanded:
+            lines.append(f"{family['name']}{suffix}{_format_labels({**labels, **extra_labels})} {_format_value(sample)}")
+    return lines
+
+
+def _merge_families(snapshots: list) -> list:
+    """
+    汇总各进程的指标快照 [(pid, 指标族列表), ...] (第一个为当前进程)：
+    计数与直方图按标签求和 (已退出进程的值保留，汇总后的计数不会回退)；
+    仪表是进程的当前状态，不能相加，按进程输出 (追加 pid 标签)，只含仍在运行的进程。
+    """
+    merged = {} # 指标名 -> 汇总后的指标族 (按第一次出现的顺序输出)
+    for pid, families in snapshots:
+        alive = None
+        for family in families:
+            target = merged.get(family['name'])
+            if target is None:
+                target = merged[family['name']] = {**family, 'samples': {}}
+            elif target['type'] != family['type']:
+                continue # 其他版本的代码写入的同名指标
+            if family['type'] == 'gauge':
+                alive = _process_alive(pid) if alive is None else alive
+                if not alive:
+                    continue
+                for labels, value in family['samples']:
+                    target['samples'][tuple(map(tuple, labels)) + (('pid', str(pid)),)] = value
+                continue
+            for labels, value in family['samples']:
+                key = tuple(map(tuple, labels))
+                previous = target['samples'].get(key)
+                if previous is None:
+                    target['samples'][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    if len(previous) == len(value): # 桶的划分不同时无法相加
+                        target['samples'][key] = [a + b for a, b in zip(previous, value)]
+                else:
+                    target['samples'][key] = previous + value
+    return [{**family, 'samples': sorted(family['samples'].items())} for family in merged.values()]
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {} # 标签取值元组 -> 数值 (直方图为 [各桶计数..., 总和, 总数])
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，收到 {tuple(labels)}。")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def family(self) -> dict:
+        """当前值的快照: {'name', 'type', 'help', 'samples': [(((标签名, 取值), ...), 数值), ...]}。"""
+        with self._lock:
+            items = sorted((key, list(value) if isinstance(value, list) else value) for key, value in self._values.items())
+        return {'name': self.name, 'type': self.metric_type, 'help': self.documentation,
+                'samples': [(tuple(zip(self.labelnames, key)), value) for key, value in items]}
+
+    def _reset(self):
+        # fork 出的子进程中调用：父进程的值已由父进程自己写出，子进程从 0 开始统计；
+        # fork 时其他线程可能正持有锁，子进程中换用新锁
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+class Counter(_Metric):
+    """只增不减的计数。"""
+    metric_type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的当前值 (例如进行中的请求数)。"""
+    metric_type = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """按固定桶统计观测值的分布 (累计桶计数、总和与总数)。"""
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def family(self) -> dict:
+        return {**super().family(), 'buckets': list(self.buckets)}
+
+
+class Registry:
+    """
+    指标集合。除了直接更新的指标，还可以注册收集函数，在抓取时读取已有的统计 (准入控制、模型缓存等)：
+    收集函数返回 [(名称, 类型, 说明, [(标签 dict, 数值), ...]), ...]，名称不含前缀。
+    指定 multiprocess_dir 时，flush() 把本进程的值 (包括收集函数的读数) 写入该目录下的 metrics_<pid>.json，
+    render() 汇总目录中所有进程的值 (见 _merge_families)；fork 出的子进程从 0 开始统计，不重复计入父进程的值。
+    """
+
+    def __init__(self, multiprocess_dir: str = None, flush_interval: float = FLUSH_INTERVAL_SECONDS):
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._flush_timer = None
+        registry = weakref.ref(self)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=lambda: registry() is not None and registry()._after_fork_in_child())
+        # 工作进程正常退出 (例如达到 max_requests 后重启) 时写出最后一个间隔内的更新
+        atexit.register(lambda: registry() is not None and registry()._scheduled_flush())
+
+    def _after_fork_in_child(self):
+        self._lock = threading.Lock()
+        self._flush_timer = None # 定时器线程不会被 fork 到子进程
+        if self.multiprocess_dir:
+            for metric in self._metrics:
+                metric._reset()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def collect(self) -> list:
+        """本进程所有指标族的当前值 (格式见 _Metric.family)，收集函数返回的空值不输出。"""
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        families = [metric.family() for metric in metrics]
+        for collector in collectors:
+            for name, metric_type, documentation, samples in collector():
+                families.append({'name': METRIC_PREFIX + name, 'type': metric_type, 'help': documentation,
+                                 'samples': [(tuple(labels.items()), value) for labels, value in samples
+                                             if value is not None]})
+        return families
+
+    def flush(self):
+        """多进程模式下把本进程的当前值写入共享目录 (原子替换)；未指定 multiprocess_dir 时什么也不做。"""
+        if not self.multiprocess_dir:
+            return
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+        path = os.path.join(self.multiprocess_dir, f"metrics_{os.getpid()}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.collect(), f, ensure_ascii=False)
+        os.replace(tmp_path, path) # 其他进程不会读到写了一半的文件
+
+    def schedule_flush(self):
+        """
+        多进程模式下安排在 flush_interval 秒后写出本进程的值 (已有待执行的写出时不重复安排)。
+        请求钩子每次都调用它 (见 app.py)：请求本身不写文件，本进程的更新最迟 flush_interval 秒后对其他进程可见。
+        """
+        if not self.multiprocess_dir:
+            return
+        with self._lock:
+            if self._flush_timer is not None:
+                return
+            timer = self._flush_timer = threading.Timer(self.flush_interval, self._scheduled_flush)
+            timer.daemon = True
+        timer.start()
+
+    def _scheduled_flush(self):
+        with self._lock:
+            self._flush_timer = None # 写出期间的更新安排下一次写出
+        try:
+            self.flush()
+        except OSError as e:
+            logger.warning(f"写出本进程的监控指标失败: {e}")
+
+    def _other_process_snapshots(self) -> list:
+        snapshots = []
+        try:
+            names = sorted(os.listdir(self.multiprocess_dir))
+        except FileNotFoundError:
+            return snapshots
+        for name in names:
+            match = _SNAPSHOT_FILE_PATTERN.match(name)
+            if match is None or int(match.group(1)) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self.multiprocess_dir, name), encoding='utf-8') as f:
+                    snapshots.append((int(match.group(1)), json.load(f)))
+            except (OSError, ValueError):
+                continue # 文件刚被删除或不是本模块写入的
+        return snapshots
+
+    def render(self) -> str:
+        families = self.collect()
+        if self.multiprocess_dir:
+            families = _merge_families([(os.getpid(), families)] + self._other_process_snapshots())
+        lines = []
+        for family in families:
+            lines.extend(_render_family(family))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry(multiprocess_dir=os.environ.get(MULTIPROC_DIR_ENV) or None)
+
+# 热点路径中的阶段耗时与缓存命中，由各模块直接记录
+STAGE_DURATION = REGISTRY.register(Histogram(
+    'stage_duration_seconds', '请求内各处理阶段的耗时 (秒)。', ('stage',), buckets=STAGE_BUCKETS))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    'cache_requests_total', '各缓存的查询次数，按命中 (hit) 与未命中 (miss) 区分。', ('cache', 'result')))
+
+
+@contextlib.contextmanager
+def stage_timer(stage: str):
+    """with stage_timer('filter'): ... —— 把代码块的耗时记入 stage_duration_seconds (异常时同样记录)。"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started, stage=stage)
+
+
+def timed_stage(stage: str):
+    """函数装饰器：把每次调用的耗时记入 stage_duration_seconds。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_cache(cache: str, hit: bool):
+    """记录一次缓存查询的结果。"""
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
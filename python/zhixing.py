@@ -0,0 +1,118 @@
+import os
+import asyncio
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from logging_config import logger
+
+# 重计算卸载池：
+# cpu - 进程池 (spawn)，用于 Gi* 置换检验、ARIMA 拟合等持有 GIL 的纯 Python/NumPy 计算，
+#       放到独立进程后不会拖慢同一 Web 进程中的其他请求
+# geo - 线程池，用于 sjoin、SHP 写出等大部分时间在 GEOS/GDAL 中释放 GIL 的步骤
+# 池的大小即该类步骤的并发上限，超出的任务在池内排队
+POOL_CPU = 'cpu'
+POOL_GEO = 'geo'
+POOL_LIMITS = {
+    POOL_CPU: int(os.environ.get('OFFLOAD_CPU_WORKERS', max(1, (os.cpu_count() or 2) - 1))),
+    POOL_GEO: int(os.environ.get('OFFLOAD_GEO_WORKERS', 4)),
+}
+# cpu 池工作进程的 nice 增量：降低后台计算的调度优先级，CPU 紧张时优先响应请求线程
+CPU_POOL_NICE = int(os.environ.get('OFFLOAD_CPU_NICE', 10))
+
+_executors = {}
+_executor_lock = threading.Lock()
+_pool_counters = {name: {'running': 0, 'submitted': 0, 'failed': 0} for name in POOL_LIMITS}
+
+
+def _lower_priority(increment: int):
+    try:
+        os.nice(increment)
+    except (AttributeError, OSError): # Windows 没有 os.nice
+        pass
+
+
+def get_executor(pool: str) -> concurrent.futures.Executor:
+    """
+    返回指定名称的执行器，首次使用时创建。
+    延迟创建使多进程部署时每个工作进程在 fork 之后才各自建池，不会继承主进程的池。
+    """
+    if pool not in POOL_LIMITS:
+        raise ValueError(f"未知的执行器 '{pool}'。可选: {', '.join(POOL_LIMITS)}")
+    with _executor_lock:
+        executor = _executors.get(pool)
+        if executor is None:
+            if pool == POOL_CPU:
+                executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=POOL_LIMITS[pool], mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_lower_priority, initargs=(CPU_POOL_NICE,))
+            else:
+                executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=POOL_LIMITS[pool], thread_name_prefix=f"offload_{pool}")
+            _executors[pool] = executor
+            logger.info(f"已创建卸载执行器 '{pool}' (并发上限 {POOL_LIMITS[pool]})。")
+        return executor
+
+
+def _discard_broken_executor(pool: str, executor):
+    # 工作进程异常退出后进程池不可再用，丢弃后下次调用重新创建
+    with _executor_lock:
+        if _executors.get(pool) is executor:
+            del _executors[pool]
+    executor.shutdown(wait=False, cancel_futures=True)
+    logger.error(f"卸载执行器 '{pool}' 的工作进程异常退出，已重建。")
+
+
+def submit(pool: str, func, *args, **kwargs) -> concurrent.futures.Future:
+    """把 func(*args, **kwargs) 提交到指定的卸载池，返回 Future；进程池要求 func 与参数可以 pickle。"""
+    executor = get_executor(pool)
+    counters = _pool_counters[pool]
+
+    def on_done(future):
+        with _executor_lock:
+            counters['running'] -= 1
+            if future.cancelled() or future.exception() is not None:
+                counters['failed'] += 1
+
+    try:
+        future = executor.submit(func, *args, **kwargs)
+    except BrokenProcessPool:
+        _discard_broken_executor(pool, executor)
+        future = get_executor(pool).submit(func, *args, **kwargs)
+    with _executor_lock:
+        counters['running'] += 1
+        counters['submitted'] += 1
+    future.add_done_callback(on_done)
+    return future
+
+
+def run_offloaded(pool: str, func, *args, **kwargs):
+    """在卸载池中运行 func 并等待结果 (用于同步的 Flask 视图)；func 抛出的异常原样抛出。"""
+    executor = get_executor(pool)
+    try:
+        return submit(pool, func, *args, **kwargs).result()
+    except BrokenProcessPool:
+        _discard_broken_executor(pool, executor)
+        raise
+
+
+async def run_offloaded_async(pool: str, func, *args, **kwargs):
+    """run_offloaded 的异步版本 (用于 ASGI)，等待期间不占用事件循环。"""
+    return await asyncio.wrap_future(submit(pool, func, *args, **kwargs))
+
+
+def get_pool_stats() -> dict:
+    """各卸载池的并发上限、进行中 (含排队) 的任务数、累计提交数与失败数。"""
+    with _executor_lock:
+        return {name: {'max_workers': POOL_LIMITS[name], 'created': name in _executors, **counters}
+                for name, counters in _pool_counters.items()}
+
+
+def shutdown_pools(wait: bool = True):
+    """关闭所有已创建的卸载池 (应用退出时调用)。"""
+    with _executor_lock:
+        executors = list(_executors.items())
+        _executors.clear()
+    for name, executor in executors:
+        executor.shutdown(wait=wait, cancel_futures=True)
+        logger.info(f"卸载执行器 '{name}' 已关闭。")